@@ -0,0 +1,277 @@
+"""
+Batch.py
+Command line renderer that applies an effect to a sequence of frames,
+spread across worker processes that each read ahead and write behind
+while they filter
+"""
+from multiprocessing import get_context
+from threading import Thread
+from os import cpu_count
+from queue import Queue, Empty
+import argparse
+import os
+import sys
+import time
+from .Headless import EFFECTS, PresetSettings, ReadPreset, WritePreset, CreateFilterWidget, RenderEffect, CompositeEffect
+from .ImageFiles import Image, RawFormat, ReadImage, WriteImage
+from .FilterJob import FilterJob
+from .ScratchBuffer import ScratchAllocator
+from .Tuning import Calibrate, DescribeTuning, SaveTuning
+from .Sweep import DEFAULT_PROXY_SIZE, ParseSweep, GetVariants, DescribeVariant, RenderSweep, BuildContactSheet
+
+# Frames each worker reads ahead of the one it's filtering
+DEFAULT_PREFETCH = 1
+
+# Marks the end of a worker's frames in its queues
+END_OF_FRAMES = None
+
+def ParseArguments(argv):
+    parser = argparse.ArgumentParser(prog="python -m VFX",
+                                     description="Apply a VFX effect to image files or frame sequences outside of Krita")
+    parser.add_argument("inputs", nargs="+", help="Frames to filter, PNG, PPM/PGM or raw")
+    parser.add_argument("-o", "--output", required=True, help="Folder to write the filtered frames to")
+    parser.add_argument("-e", "--effect", choices=sorted(EFFECTS), help="Effect to apply, overrides the preset's")
+    parser.add_argument("-p", "--preset", help="Preset json file with the effect and its settings")
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="KEY=VALUE", type=ParseOverride,
+                        help="Override one setting, using the same names Krita saves (B_thresh=200)")
+    parser.add_argument("--save-preset", metavar="PATH", help="Write the settings used to a preset file")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="Number of frames, or variants of a sweep, to filter at once")
+    parser.add_argument("-t", "--threads", type=int, help="Worker threads per process, defaults to sharing the CPU")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Time the kernels on this machine first and use the fastest settings for each stage")
+    parser.add_argument("--prefetch", type=int, default=DEFAULT_PREFETCH,
+                        help="Frames each process reads ahead, limits how many frames are held in memory")
+    parser.add_argument("--format", choices=["png", "ppm", "raw"], help="Output file format, defaults to the input's")
+    parser.add_argument("--layer-only", action="store_true",
+                        help="Write only the effect layer instead of blending it onto the frame")
+    parser.add_argument("--sweep", action="append", default=[], metavar="KEY=VALUE,VALUE,...", type=ParseSweepArgument,
+                        help="Render every combination of these values on a proxy of each frame and write a contact sheet")
+    parser.add_argument("--proxy-size", type=int, default=DEFAULT_PROXY_SIZE,
+                        help="Largest width or height of the proxy sweeps are rendered on")
+    parser.add_argument("--columns", type=int,
+                        help="Variants in each row of a contact sheet, defaults to the last swept setting's values")
+    parser.add_argument("--raw-size", metavar="WxH", type=ParseSize, help="Size of raw input frames")
+    parser.add_argument("--raw-model", default="RGBA", help="Color model of raw input frames (RGBA, GRAYA, ...)")
+    parser.add_argument("--raw-depth", default="U8", help="Color depth of raw input frames (U8, U16, F16, F32)")
+    return parser.parse_args(argv)
+
+# Settings can be numbers or text, Krita's config hands everything back as text anyway
+def ParseOverride(text):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError("settings are set as KEY=VALUE, got " + text)
+    key, value = text.split("=", 1)
+    return key.strip(), value.strip()
+
+def ParseSweepArgument(text):
+    try:
+        return ParseSweep(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+def ParseSize(text):
+    try:
+        width, height = text.lower().split("x")
+        size = (int(width), int(height))
+    except ValueError:
+        raise argparse.ArgumentTypeError("sizes are given as WxH, got " + text)
+    if size[0] <= 0 or size[1] <= 0:
+        raise argparse.ArgumentTypeError("sizes have to be at least 1x1, got " + text)
+    return size
+
+def GetOutputPath(inputPath, outputDir, outputFormat):
+    name = os.path.basename(inputPath)
+    if outputFormat:
+        name = os.path.splitext(name)[0] + "." + outputFormat
+    return os.path.join(outputDir, name)
+
+# Filter one frame, blending it onto the original unless only the layer was asked for
+def RenderFrame(filterWidget, image, settings, layerOnly):
+    job = FilterJob()
+    job.scratch = ScratchAllocator()
+    node = RenderEffect(filterWidget, image, settings, job)
+    if node is None:
+        raise RuntimeError("The filter failed")
+    if layerOnly:
+        outData = node.data
+    else:
+        outData = CompositeEffect(image, node, int(settings.value("G_numThreads", cpu_count())), job)
+    job.scratch.release()
+    return Image(outData, image.size, image.colorModel, image.colorDepth)
+
+# Reads frames on its own thread so the next one is ready when filtering finishes
+def ReadFrames(frames, rawFormat, readQueue):
+    for index, inputPath, outputPath in frames:
+        try:
+            readQueue.put((index, inputPath, outputPath, ReadImage(inputPath, rawFormat), None))
+        except Exception as error:
+            readQueue.put((index, inputPath, outputPath, None, str(error)))
+    readQueue.put(END_OF_FRAMES)
+
+def WriteFrames(writeQueue, resultQueue):
+    while True:
+        item = writeQueue.get()
+        if item is END_OF_FRAMES:
+            break
+        index, outputPath, image = item
+        try:
+            WriteImage(outputPath, image)
+            resultQueue.put((index, outputPath, None))
+        except Exception as error:
+            resultQueue.put((index, outputPath, str(error)))
+
+# Filters a share of the frames, with one frame being read and one being written at
+# the same time as filtering, so at most prefetch + 2 frames are in memory
+def RenderFrames(effect, values, frames, rawFormat, layerOnly, prefetch, resultQueue):
+    settings = PresetSettings(values)
+    try:
+        filterWidget = CreateFilterWidget(effect, settings)
+    except Exception as error:
+        # Most likely a setting that isn't a number, none of the frames can be filtered
+        for index, inputPath, outputPath in frames:
+            resultQueue.put((index, inputPath, "Couldn't set up the effect: " + str(error)))
+        return
+    readQueue = Queue(max(1, prefetch))
+    writeQueue = Queue(1)
+    reader = Thread(target=ReadFrames, args=(frames, rawFormat, readQueue), daemon=True)
+    writer = Thread(target=WriteFrames, args=(writeQueue, resultQueue), daemon=True)
+    reader.start()
+    writer.start()
+    while True:
+        item = readQueue.get()
+        if item is END_OF_FRAMES:
+            break
+        index, inputPath, outputPath, image, error = item
+        if error is not None:
+            resultQueue.put((index, inputPath, error))
+            continue
+        try:
+            writeQueue.put((index, outputPath, RenderFrame(filterWidget, image, settings, layerOnly)))
+        except Exception as error:
+            resultQueue.put((index, inputPath, str(error)))
+    writeQueue.put(END_OF_FRAMES)
+    writer.join()
+
+# Render every variant of each frame on a proxy and write them out as one contact sheet
+# Frames are done one at a time, with their variants spread across the workers
+# Returns the number of frames that couldn't be rendered
+def RenderContactSheets(effect, settings, frames, rawFormat, sweeps, numWorkers, args):
+    variants = GetVariants(sweeps)
+    columns = args.columns or len(sweeps[-1][1])
+    for row in range(0, len(variants), columns):
+        print("Row " + str(row // columns + 1) + ": " + " | ".join(DescribeVariant(variant)
+                                                               for variant in variants[row:row + columns]))
+    failed = 0
+    for index, inputPath, outputPath in frames:
+        try:
+            image = ReadImage(inputPath, rawFormat)
+            images, cache, errors = RenderSweep(effect, settings, image, variants, numWorkers, args.proxy_size,
+                                                args.layer_only)
+            for variant, error in zip(variants, errors):
+                if error is not None:
+                    print("  " + DescribeVariant(variant) + " FAILED: " + error)
+            rendered = [sheetImage for sheetImage in images if sheetImage is not None]
+            if not rendered:
+                raise RuntimeError("Every variant failed")
+            # Failed variants are left empty so the rest stay where they belong
+            blank = Image(bytearray(len(rendered[0].data)), rendered[0].size, image.colorModel, image.colorDepth)
+            WriteImage(outputPath, BuildContactSheet([sheetImage or blank for sheetImage in images], columns))
+            shared = sum(cache.shared.values())
+            print("[" + str(index + 1) + "/" + str(len(frames)) + "] " + outputPath + ", " + str(len(variants))
+                  + " variants, " + str(shared) + " of " + str(shared + sum(cache.runs.values())) + " shared stages reused")
+        except Exception as error:
+            failed += 1
+            print("[" + str(index + 1) + "/" + str(len(frames)) + "] " + inputPath + " FAILED: " + str(error))
+    return failed
+
+def Main(argv=None):
+    args = ParseArguments(sys.argv[1:] if argv is None else argv)
+    effect = None
+    settings = PresetSettings()
+    if args.preset:
+        effect, settings = ReadPreset(args.preset)
+    if args.effect:
+        effect = args.effect
+    if effect not in EFFECTS:
+        print("Pick an effect with --effect or a preset: " + ", ".join(sorted(EFFECTS)))
+        return 2
+    for key, value in args.set:
+        settings.setValue(key, value)
+    sweeps = args.sweep
+    if sweeps:
+        # Sweeps spread the variants of a frame across the workers instead of the frames
+        numProcesses = max(1, min(args.processes, len(GetVariants(sweeps))))
+    else:
+        numProcesses = max(1, min(args.processes, len(args.inputs)))
+    if args.threads:
+        settings.setValue("G_numThreads", args.threads)
+    elif settings.value("G_numThreads") is None:
+        settings.setValue("G_numThreads", max(1, cpu_count() // numProcesses))
+    # Filters only ever get whole frames here
+    settings.setValue("G_streaming", 0)
+    if args.calibrate:
+        # Every process gets its share of the CPU, so calibrate with only that many threads
+        print("Calibrating...")
+        tuning, timings = Calibrate(maxThreads=int(settings.value("G_numThreads")))
+        SaveTuning(settings, tuning)
+        for line in DescribeTuning(tuning):
+            print("  " + line)
+    if args.save_preset:
+        WritePreset(args.save_preset, effect, settings)
+    rawFormat = None
+    if args.raw_size:
+        rawFormat = RawFormat(args.raw_size, args.raw_model, args.raw_depth)
+    os.makedirs(args.output, exist_ok=True)
+    frames = [(index, path, GetOutputPath(path, args.output, args.format)) for index, path in enumerate(args.inputs)]
+
+    begin = time.perf_counter()
+    if sweeps:
+        failed = RenderContactSheets(effect, settings, frames, rawFormat, sweeps, numProcesses, args)
+        print("Rendered " + str(len(frames) - failed) + " of " + str(len(frames)) + " contact sheets in "
+              + format(time.perf_counter() - begin, ".2f") + "s")
+        if failed:
+            return 1
+        return 0
+    if numProcesses == 1:
+        resultQueue = Queue()
+        worker = Thread(target=RenderFrames, args=(effect, settings.values, frames, rawFormat, args.layer_only,
+                                                   args.prefetch, resultQueue))
+        workers = [worker]
+    else:
+        # Every process takes every n-th frame, so frames finish roughly in order
+        context = get_context("spawn")
+        resultQueue = context.Queue()
+        workers = [context.Process(target=RenderFrames, daemon=True,
+                                   args=(effect, settings.values, frames[i::numProcesses], rawFormat, args.layer_only,
+                                         args.prefetch, resultQueue))
+                   for i in range(numProcesses)]
+    for worker in workers:
+        worker.start()
+    failed = 0
+    done = 0
+    while done < len(frames):
+        try:
+            index, path, error = resultQueue.get(timeout=0.5)
+        except Empty:
+            # A worker that died takes its frames with it, don't wait on them forever
+            if any(worker.is_alive() for worker in workers):
+                continue
+            try:
+                index, path, error = resultQueue.get(timeout=0.5)
+            except Empty:
+                print("Workers stopped with " + str(len(frames) - done) + " frames left")
+                failed += len(frames) - done
+                break
+        done += 1
+        if error is not None:
+            failed += 1
+            print("[" + str(done) + "/" + str(len(frames)) + "] " + path + " FAILED: " + error)
+        else:
+            print("[" + str(done) + "/" + str(len(frames)) + "] " + path)
+    for worker in workers:
+        worker.join()
+    print("Filtered " + str(len(frames) - failed) + " of " + str(len(frames)) + " frames in "
+          + format(time.perf_counter() - begin, ".2f") + "s")
+    if failed:
+        return 1
+    return 0
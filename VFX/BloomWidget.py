@@ -4,10 +4,11 @@ Adds a widget and functionality for applying bloom
 to an image. A few properties can be configured.
 """
 from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QWidget, QLabel, QSlider, QVBoxLayout
+from PyQt5.QtWidgets import QWidget, QLabel, QRadioButton, QButtonGroup, QSlider, QVBoxLayout
 from ctypes import *
-from threading import Thread
-from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, BloomKernelData
+from .Streaming import WholeImage, StreamPixelKernel
+from .Convolution import ConvolveImage
 from os import cpu_count
 
 # Widget for bloom effect
@@ -18,7 +19,11 @@ class BloomWidget(QWidget):
         self.thresh = 240
         self.blurStrength = 0.05
         self.power = 2
+        self.kernel = 0        # 0 = Krita's blur, 1 = star burst, 2 = aperture
+        self.points = 6
+        self.kernelAngle = 0
         self.numThreads = cpu_count()
+        self.streaming = False
 
         self.threshInfo = QLabel("Threshold: 230", self)
         self.threshold = QSlider(Qt.Horizontal, self)
@@ -38,6 +43,31 @@ class BloomWidget(QWidget):
         self.powerSlide.setValue(2)
         self.powerSlide.valueChanged.connect(self.updatePower)
 
+        self.kernelInfo = QLabel("Kernel:", self)
+        self.kernelChoice = QButtonGroup(self)
+        self.kernelBtn1 = QRadioButton("Blur")
+        self.kernelBtn2 = QRadioButton("Star burst")
+        self.kernelBtn3 = QRadioButton("Aperture")
+        self.kernelChoice.addButton(self.kernelBtn1)
+        self.kernelChoice.addButton(self.kernelBtn2)
+        self.kernelChoice.addButton(self.kernelBtn3)
+        self.kernelBtn1.setChecked(True)
+        self.kernelBtn1.pressed.connect(self.changeKernel1)
+        self.kernelBtn2.pressed.connect(self.changeKernel2)
+        self.kernelBtn3.pressed.connect(self.changeKernel3)
+
+        self.pointsInfo = QLabel("Points/blades: 6", self)
+        self.pointsSlide = QSlider(Qt.Horizontal, self)
+        self.pointsSlide.setRange(3, 12)
+        self.pointsSlide.setValue(6)
+        self.pointsSlide.valueChanged.connect(self.updatePoints)
+
+        self.angleInfo = QLabel("Kernel angle: 0 degrees", self)
+        self.angleSlide = QSlider(Qt.Horizontal, self)
+        self.angleSlide.setRange(0, 180)
+        self.angleSlide.setValue(0)
+        self.angleSlide.valueChanged.connect(self.updateKernelAngle)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.threshInfo)
         vbox.addWidget(self.threshold)
@@ -45,6 +75,14 @@ class BloomWidget(QWidget):
         vbox.addWidget(self.blurSlide)
         vbox.addWidget(self.powerInfo)
         vbox.addWidget(self.powerSlide)
+        vbox.addWidget(self.kernelInfo)
+        vbox.addWidget(self.kernelBtn1)
+        vbox.addWidget(self.kernelBtn2)
+        vbox.addWidget(self.kernelBtn3)
+        vbox.addWidget(self.pointsInfo)
+        vbox.addWidget(self.pointsSlide)
+        vbox.addWidget(self.angleInfo)
+        vbox.addWidget(self.angleSlide)
 
         self.setLayout(vbox)
         self.show()
@@ -62,6 +100,23 @@ class BloomWidget(QWidget):
         self.powerInfo.setText("Power: " + str(value))
         self.power = value
 
+    def updatePoints(self, value):
+        self.pointsInfo.setText("Points/blades: " + str(value))
+        self.points = value
+
+    def updateKernelAngle(self, value):
+        self.angleInfo.setText("Kernel angle: " + str(value) + " degrees")
+        self.kernelAngle = value
+
+    def changeKernel1(self):
+        self.kernel = 0
+
+    def changeKernel2(self):
+        self.kernel = 1
+
+    def changeKernel3(self):
+        self.kernel = 2
+
     # Required for main window to call into
     def getWindowName(self):
         return "Bloom"
@@ -76,76 +131,120 @@ Blur Strength (0.1-50%)
     How far to blur the bright pixels, as a percentage of the
     image's width
 Power (1-25)
-    Multiply the result by X to strengthen the effect"""
+    Multiply the result by X to strengthen the effect
+Kernel (Blur/Star burst/Aperture)
+    The shape bright pixels are spread into. Blur uses Krita's
+    blur filter. Star burst spreads them into a glow with spikes
+    and aperture into a polygon like out of focus highlights,
+    both reaching as far as the blur strength. These are done
+    with FFTs and always process the whole image at once
+Points/Blades (3-12)
+    [Star burst and aperture only!] Number of spikes in the star,
+    or sides of the aperture
+Kernel Angle (0-180 degrees)
+    [Star burst and aperture only!] Rotation of the spikes or
+    aperture"""
 
     def saveSettings(self, settings):
         settings.setValue("B_thresh", self.thresh)
         settings.setValue("B_blurStrength", self.blurStrength * 1000)
         settings.setValue("B_power", self.power)
+        settings.setValue("B_kernel", self.kernel)
+        settings.setValue("B_points", self.points)
+        settings.setValue("B_kernelAngle", self.kernelAngle)
 
     def readSettings(self, settings):
         self.updateThresh(int(settings.value("B_thresh", 230)))
         self.updateBlur(int(settings.value("B_blurStrength", 50)))
         self.updatePower(int(settings.value("B_power", 2)))
+        self.updatePoints(int(settings.value("B_points", 6)))
+        self.updateKernelAngle(int(settings.value("B_kernelAngle", 0)))
         self.numThreads = int(settings.value("G_numThreads", cpu_count()))
+        self.streaming = int(settings.value("G_streaming", 0)) == 1
         # Update interactable UI elements
+        kernel = int(settings.value("B_kernel", 0))
+        if kernel == 1:
+            self.changeKernel2()
+            self.kernelBtn2.setChecked(True)
+        elif kernel == 2:
+            self.changeKernel3()
+            self.kernelBtn3.setChecked(True)
+        else:
+            self.changeKernel1()
+            self.kernelBtn1.setChecked(True)
         self.threshold.setValue(self.thresh)
         self.blurSlide.setValue(int(self.blurStrength * 1000))
         self.powerSlide.setValue(self.power)
+        self.pointsSlide.setValue(self.points)
+        self.angleSlide.setValue(self.kernelAngle)
 
     def getBlendMode(self):
         return "add"
 
     # Call into C library to process the image
-    def applyFilter(self, imgData, imgSize, colorData):
-        # Bloom is in 2 steps: threshold, then blur
-        newData = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        # Bloom is in 2 steps: threshold, then blur or convolve with a kernel
+        if band is None:
+            band = WholeImage(imgSize)
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
         dll = GetSharedLibrary()
         imgCoords = Coords(imgSize[0], imgSize[1])
         # python makes it hard to get a pointer to existing buffers for some reason
         cimgData = c_char * len(imgData)
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXHighPass, args=(idx, numPixels, self.thresh,
-                                    imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        # Join threads to finish
-        # If a crash happens, it would freeze here. User can still cancel tho
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        return bytes(newData)
+        if not job.run(dll.VFXHighPass, band.numPixels(imgSize[0]), self.numThreads,
+                        (self.thresh, imgCoords, band.inputPointer(cimgData.from_buffer(imgData), imgSize[0], colorData),
+                         band.outputPointer(newData, imgSize[0], colorData), colorData), band.start(imgSize[0])):
+            return None
+        if self.kernel == 0:
+            return newData
+        # Spread the highlights into the kernel's shape here instead of blurring afterwards
+        return self.convolveHighlights(cimgData.from_buffer(imgData), newData, imgSize, colorData, job)
+
+    # Convolve highpassed pixels with the star burst or aperture kernel and apply power
+    # The original image is only read for its alpha. Returns None if cancelled
+    def convolveHighlights(self, imgData, highData, imgSize, colorData, job):
+        dll = GetSharedLibrary()
+        kernelData = BloomKernelData(self.kernel - 1, max(1, int(self.blurStrength * imgSize[0])),
+                                     self.points, self.kernelAngle)
+        sumData = ConvolveImage(kernelData, highData, imgSize, colorData, job, self.numThreads)
+        if sumData is None:
+            return None
+        outData = job.allocate(len(highData))
+        if not job.run(dll.VFXFinishConvolution, imgSize[0] * imgSize[1], self.numThreads,
+                        (float(self.power), Coords(imgSize[0], imgSize[1]), imgData, sumData, outData, colorData)):
+            return None
+        return outData
+
+    # Thresholding only looks at one pixel at a time, kernels reach across the whole image
+    def getBandOverlap(self, imgSize):
+        if self.kernel != 0:
+            return None
+        return 0
+
+    # Highpass, then power after the blur
+    # Kernels also keep 4 floats of sums per pixel
+    def getNumStages(self):
+        if self.kernel != 0:
+            return 6
+        return 2
+
+    # Krita's blur mixes the layer's alpha in with its colors, so empty pixels have to keep theirs
+    def blursLayer(self):
+        return self.kernel == 0
 
     # Use Krita's built-in filters after everything else
-    def postFilter(self, app, doc, node, colorData):
+    def postFilter(self, app, doc, node, colorData, job):
+        # Kernels were already finished in applyFilter
+        if self.kernel != 0:
+            return
         blurFilter = app.filter("blur")
         blurConfig = blurFilter.configuration()
         blurConfig.setProperty("halfHeight", self.blurStrength * doc.width())
         blurConfig.setProperty("halfWidth", self.blurStrength * doc.width())
         blurFilter.setConfiguration(blurConfig)
-        blurFilter.apply(node, 0, 0, doc.width(), doc.height())
+        with job.profiler.phase("blur"):
+            blurFilter.apply(node, 0, 0, doc.width(), doc.height())
         # need to remake stuff again for one last filter
         dll = GetSharedLibrary()
-        imgData = node.projectionPixelData(0, 0, doc.width(), doc.height())
-        imgSize = Coords(doc.width(), doc.height())
-        cimgData = c_char * len(imgData)
-        newData = create_string_buffer(imgSize.x * imgSize.y * GetBytesPerPixel(colorData))
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize.x * imgSize.y) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize.x * imgSize.y) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXPower, args=(idx, numPixels, self.power,
-                                    imgSize, cimgData.from_buffer(imgData), byref(newData), colorData))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        node.setPixelData(bytes(newData), 0, 0, doc.width(), doc.height())
+        StreamPixelKernel(node, (doc.width(), doc.height()), colorData, job, self.numThreads, self.streaming,
+                            dll.VFXPower, self.power)
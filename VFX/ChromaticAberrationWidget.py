@@ -6,9 +6,29 @@ to an image. A few properties can be configured.
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QLabel, QRadioButton, QButtonGroup, QDial, QSlider, QCheckBox, QVBoxLayout
 from ctypes import *
-from threading import Thread
-from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, RadialFilterData, LinearFilterData
+from .LibHandler import (GetSharedLibrary, GetBytesPerPixel, Coords, RadialFilterData, LinearFilterData, ResampleTaps,
+                         SpectralSample, SPECTRUM_CHANNELS)
+from .Streaming import WholeImage
 from os import cpu_count
+import math
+
+# Range of the number of wavelengths a spectral aberration blends
+# With fewer than 3 none of them are green, so the colors can't be balanced
+MIN_SPECTRAL_SAMPLES = 3
+MAX_SPECTRAL_SAMPLES = 16
+
+# Wavelengths from red to blue, red is spread out the most and blue pulled in the most
+# Each one is the image scaled around its center, so the displacement grows in a straight
+# line from nothing at the center to power pixels at the corners
+# With 3 samples it's the same split as the classic aberration, red out, green still, blue in
+def GetSpectralSamples(numSamples, power, imgSize):
+    spread = power / max(1.0, math.hypot((imgSize[0] - 1) / 2, (imgSize[1] - 1) / 2))
+    samples = []
+    for k in range(numSamples):
+        t = k / (numSamples - 1)
+        samples.append(SpectralSample(1 + ((1 - 2 * t) * spread), max(0.0, 1 - 2 * t), 1 - abs(2 * t - 1),
+                                      max(0.0, 2 * t - 1)))
+    return samples
 
 # Widget for chromatic aberration effect
 class ChromAbWidget(QWidget):
@@ -21,6 +41,8 @@ class ChromAbWidget(QWidget):
         self.isFalloffExp = True
         self.direction = 100
         self.interpolate = False
+        self.spectral = False
+        self.spectralSamples = 8
         self.numThreads = cpu_count()
 
         self.shapeInfo = QLabel("Shape and Direction:", self)
@@ -63,9 +85,19 @@ class ChromAbWidget(QWidget):
         self.deadzone.setValue(5)
         self.deadzone.valueChanged.connect(self.updateDead)
         
-        self.biFilter = QCheckBox("Bilinear Interpolation (slow, but smooths colors)", self)
+        self.biFilter = QCheckBox("Bilinear Interpolation (smooths colors)", self)
         self.biFilter.stateChanged.connect(self.updateInterp)
 
+        self.spectralBox = QCheckBox("Spectral Fringes (smooth rainbow edges)", self)
+        self.spectralBox.stateChanged.connect(self.updateSpectral)
+
+        self.samplesInfo = QLabel("Spectral Samples: 8", self)
+        self.samples = QSlider(Qt.Horizontal, self)
+        self.samples.setRange(MIN_SPECTRAL_SAMPLES, MAX_SPECTRAL_SAMPLES)
+        self.samples.setValue(8)
+        self.samples.setEnabled(False)
+        self.samples.valueChanged.connect(self.updateSamples)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.shapeInfo)
         vbox.addWidget(self.shapeBtn1)
@@ -79,6 +111,9 @@ class ChromAbWidget(QWidget):
         vbox.addWidget(self.deadInfo)
         vbox.addWidget(self.deadzone)
         vbox.addWidget(self.biFilter)
+        vbox.addWidget(self.spectralBox)
+        vbox.addWidget(self.samplesInfo)
+        vbox.addWidget(self.samples)
 
         self.setLayout(vbox)
         self.show()
@@ -92,17 +127,31 @@ class ChromAbWidget(QWidget):
         self.deadInfo.setText("Deadzone: " + str(value) + "%")
         self.deadZ = value
 
+    def updateSamples(self, value):
+        self.samplesInfo.setText("Spectral Samples: " + str(value))
+        self.spectralSamples = value
+
     def changeShape1(self):
         self.isShapeRadial = True
         # Change UI so only valid options can be changed
         self.theDial.setEnabled(False)
         self.theDial.repaint()
-        self.foBtn1.setEnabled(True)
+        self.spectralBox.setEnabled(True)
+        self.spectralBox.repaint()
+        self.enableRadialOptions()
+
+    # Spectral fringes always fall off linearly with no deadzone
+    def enableRadialOptions(self):
+        self.foBtn1.setEnabled(not self.spectral)
         self.foBtn1.repaint()
-        self.foBtn2.setEnabled(True)
+        self.foBtn2.setEnabled(not self.spectral)
         self.foBtn2.repaint()
-        self.deadzone.setEnabled(True)
+        self.deadzone.setEnabled(not self.spectral)
         self.deadzone.repaint()
+        self.biFilter.setEnabled(not self.spectral)
+        self.biFilter.repaint()
+        self.samples.setEnabled(self.spectral)
+        self.samples.repaint()
 
     def changeShape2(self):
         self.isShapeRadial = False
@@ -115,6 +164,12 @@ class ChromAbWidget(QWidget):
         self.foBtn2.repaint()
         self.deadzone.setEnabled(False)
         self.deadzone.repaint()
+        self.biFilter.setEnabled(True)
+        self.biFilter.repaint()
+        self.spectralBox.setEnabled(False)
+        self.spectralBox.repaint()
+        self.samples.setEnabled(False)
+        self.samples.repaint()
 
     def changeFalloff1(self):
         self.isFalloffExp = True
@@ -131,6 +186,14 @@ class ChromAbWidget(QWidget):
         else:
             self.interpolate = False
 
+    def updateSpectral(self, state):
+        if state == Qt.Checked:
+            self.spectral = True
+        else:
+            self.spectral = False
+        if self.isShapeRadial:
+            self.enableRadialOptions()
+
     # Required for main window to call into
     def getWindowName(self):
         return "Chromatic Aberration"
@@ -150,8 +213,16 @@ Deadzone (0-100%)
     [Radial shape only!] How far from the center of the screen should there be no
     distortion, as a percent of image width
 Bilinear Interpolation
-    Using bilinear interpolation while sampling will yield smoother results, but take
-    slightly more time to calculate"""
+    Using bilinear interpolation while sampling will yield smoother results. It costs
+    little extra time, except with linear light blending turned on
+Spectral Fringes
+    [Radial shape only!] Blends many wavelengths from red to blue instead of just
+    shifting red and blue, for smooth rainbow fringes. The distortion grows in a
+    straight line from the center, so falloff and deadzone are not used, and colors
+    are always smoothed
+Spectral Samples (3-16)
+    How many wavelengths are blended, more gives smoother fringes. 3 looks like the
+    normal aberration"""
 
     def saveSettings(self, settings):
         settings.setValue("CA_maxD", self.maxD * 1000)
@@ -172,6 +243,12 @@ Bilinear Interpolation
         else:
             interp = 0
         settings.setValue("CA_interpolate", interp)
+        if self.spectral:
+            spectral = 1
+        else:
+            spectral = 0
+        settings.setValue("CA_spectral", spectral)
+        settings.setValue("CA_spectralSamples", self.spectralSamples)
 
     def readSettings(self, settings):
         self.updateMax(int(settings.value("CA_maxD", 10)))
@@ -192,6 +269,13 @@ Bilinear Interpolation
             self.interpolate = True
         else:
             self.interpolate = False
+        spectral = int(settings.value("CA_spectral", 0))
+        if spectral == 1:
+            self.spectral = True
+        else:
+            self.spectral = False
+        self.updateSamples(min(max(int(settings.value("CA_spectralSamples", 8)), MIN_SPECTRAL_SAMPLES),
+                               MAX_SPECTRAL_SAMPLES))
         self.numThreads = int(settings.value("G_numThreads", cpu_count()))
         # Update interactable UI elements
         self.theDial.setValue(self.direction)
@@ -202,6 +286,8 @@ Bilinear Interpolation
         self.foBtn2.setChecked(not self.isFalloffExp)
         self.deadzone.setValue(self.deadZ)
         self.biFilter.setChecked(self.interpolate)
+        self.spectralBox.setChecked(self.spectral)
+        self.samples.setValue(self.spectralSamples)
         if self.isShapeRadial:
             self.changeShape1()
         else:
@@ -211,13 +297,16 @@ Bilinear Interpolation
         return "normal"
 
     # Call into C library to process the image
-    def applyFilter(self, imgData, imgSize, colorData):
-        newData = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        if self.isShapeRadial and self.spectral:
+            return self.applySpectral(imgData, imgSize, colorData, job)
+        if band is None:
+            band = WholeImage(imgSize)
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
         dll = GetSharedLibrary()
         imgCoords = Coords(imgSize[0], imgSize[1])
         # python makes it hard to get a pointer to existing buffers for some reason
         cimgData = c_char * len(imgData)
-        threadPool = []
         interp = 0
         if self.interpolate:
                 interp = 1
@@ -228,25 +317,68 @@ Bilinear Interpolation
             filterSettings = RadialFilterData(int(self.maxD * imgSize[0]), self.deadZ, falloff, interp)
         else:
             filterSettings = LinearFilterData(int(self.maxD * imgSize[0]), self.direction, interp)
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            if self.isShapeRadial:
-                workerThread = Thread(target=dll.VFXRadialAberration, args=(idx, numPixels, filterSettings,
-                                        imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData,))
-            else:
-                workerThread = Thread(target=dll.VFXLinearAberration, args=(idx, numPixels, filterSettings,
-                                        imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        # Join threads to finish
-        # If a crash happens, it would freeze here. User can still cancel though
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        return bytes(newData)
-
-    def postFilter(self, app, doc, node, colorData):
+        if self.isShapeRadial:
+            kernel = dll.VFXRadialAberration
+        else:
+            kernel = dll.VFXLinearAberration
+        if not job.run(kernel, band.numPixels(imgSize[0]), self.numThreads,
+                        (filterSettings, imgCoords, band.inputPointer(cimgData.from_buffer(imgData), imgSize[0], colorData),
+                         band.outputPointer(newData, imgSize[0], colorData), colorData), band.start(imgSize[0])):
+            return None
+        return newData
+
+    # Blend every wavelength, each one is the image scaled in two separable passes, one along
+    # the rows then one along the columns, with the filter taps for every row and column
+    # worked out once per wavelength instead of for every pixel
+    def applySpectral(self, imgData, imgSize, colorData, job):
+        dll = GetSharedLibrary()
+        imgCoords = Coords(imgSize[0], imgSize[1])
+        numPixels = imgSize[0] * imgSize[1]
+        floatSize = numPixels * SPECTRUM_CHANNELS * sizeof(c_float)
+        cimgData = c_char * len(imgData)
+        loadData = job.allocate(floatSize)
+        if not job.run(dll.VFXLoadSpectrumPixels, numPixels, self.numThreads,
+                        (imgCoords, cimgData.from_buffer(imgData), loadData, colorData)):
+            return None
+        rowData = job.allocate(floatSize)
+        sumData = job.allocate(floatSize)
+        samples = GetSpectralSamples(self.spectralSamples, self.maxD * imgSize[0], imgSize)
+        for sample in samples:
+            rowTaps = (ResampleTaps * imgSize[0])()
+            columnTaps = (ResampleTaps * imgSize[1])()
+            if not job.run(dll.VFXBuildResampleTaps, imgSize[0], 1, (sample.scale, imgSize[0], byref(rowTaps))):
+                return None
+            if not job.run(dll.VFXBuildResampleTaps, imgSize[1], 1, (sample.scale, imgSize[1], byref(columnTaps))):
+                return None
+            if not job.run(dll.VFXResampleRows, imgSize[1], self.numThreads,
+                            (sample, imgCoords, byref(rowTaps), loadData, rowData, colorData)):
+                return None
+            if not job.run(dll.VFXAccumulateSpectralSample, imgSize[1], self.numThreads,
+                            (sample, imgCoords, byref(columnTaps), rowData, sumData, colorData)):
+                return None
+        totals = SpectralSample(0, sum(sample.red for sample in samples), sum(sample.green for sample in samples),
+                                sum(sample.blue for sample in samples))
+        newData = job.allocate(numPixels * GetBytesPerPixel(colorData))
+        if not job.run(dll.VFXFinishSpectrum, numPixels, self.numThreads,
+                        (totals, len(samples), imgCoords, sumData, newData, colorData)):
+            return None
+        return newData
+
+    # Channels are sampled at most max displacement away, plus one for interpolation
+    # Spectral fringes scale the whole image, so it can't be split up
+    def getBandOverlap(self, imgSize):
+        if self.isShapeRadial and self.spectral:
+            return None
+        return int(self.maxD * imgSize[0]) + 2
+
+    # Spectral fringes keep three buffers of 5 floats per pixel
+    def getNumStages(self):
+        if self.isShapeRadial and self.spectral:
+            return 12
+        return 1
+
+    def blursLayer(self):
+        return False
+
+    def postFilter(self, app, doc, node, colorData, job):
         pass
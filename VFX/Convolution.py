@@ -0,0 +1,76 @@
+"""
+Convolution.py
+Convolves an image with a large kernel using FFTs in the C library,
+splitting it into tiles so the transforms stay a manageable size
+"""
+from .LibHandler import GetSharedLibrary, Coords, ConvolutionTile
+from math import log2
+
+# Smallest FFT worth using, anything less is mostly kernel and padding
+MIN_FFT_SIZE = 64
+
+def NextPowerOf2(value):
+    size = 1
+    while size < value:
+        size *= 2
+    return size
+
+# Pick the FFT size that takes the least work to cover the image
+# Each tile of an N x N FFT covers N - 2 * radius pixels square, bigger tiles waste less
+# on padding but every tile costs about N * N * log(N)
+def PlanTiles(imgSize, radius):
+    smallest = max(MIN_FFT_SIZE, NextPowerOf2((2 * radius) + 2))
+    largest = max(smallest, NextPowerOf2(max(imgSize[0], imgSize[1]) + (2 * radius)))
+    bestSize = smallest
+    bestCost = None
+    fftSize = smallest
+    while fftSize <= largest:
+        tileSize = fftSize - (2 * radius)
+        numTiles = (-(-imgSize[0] // tileSize)) * (-(-imgSize[1] // tileSize))
+        cost = numTiles * fftSize * fftSize * log2(fftSize)
+        if bestCost is None or cost < bestCost:
+            bestSize = fftSize
+            bestCost = cost
+        fftSize *= 2
+    return bestSize, bestSize - (2 * radius)
+
+# Which channel pairs have anything in them, see ConvolutionTile
+def GetChannelPairs(colorData):
+    if colorData.colorModel == 0: # A, nothing to blur but alpha
+        return []
+    if colorData.colorModel == 5: # GRAYA, only the l channel
+        return [1]
+    return [0, 1]
+
+# Convolve imgData with a generated kernel, returning a buffer of 4 floats per pixel
+# holding the r, b, o and l sums, or None if the job was cancelled
+def ConvolveImage(kernelData, imgData, imgSize, colorData, job, numThreads):
+    dll = GetSharedLibrary()
+    imgCoords = Coords(imgSize[0], imgSize[1])
+    radius = kernelData.radius
+    fftSize, tileSize = PlanTiles(imgSize, radius)
+    # Spectra are fftSize x fftSize complex floats
+    spectrumBytes = fftSize * fftSize * 8
+    kernelSpectrum = job.allocate(spectrumBytes)
+    with job.profiler.phase("kernel"):
+        if not job.run(dll.VFXMakeBloomKernel, fftSize, numThreads, (kernelData, fftSize, kernelSpectrum)):
+            return None
+        if not job.run(dll.VFXTransformColumns, fftSize, numThreads, (fftSize, kernelSpectrum)):
+            return None
+    tileSpectrum = job.allocate(spectrumBytes)
+    sumData = job.allocate(imgSize[0] * imgSize[1] * 16)
+    # Tiles go one at a time with the threads splitting up its rows and columns
+    for pair in GetChannelPairs(colorData):
+        for tileY in range(0, imgSize[1], tileSize):
+            for tileX in range(0, imgSize[0], tileSize):
+                tile = ConvolutionTile(Coords(tileX, tileY), tileSize, fftSize, radius, pair)
+                if not job.run(dll.VFXLoadTileRows, fftSize, numThreads,
+                                (tile, imgCoords, imgData, tileSpectrum, colorData)):
+                    return None
+                if not job.run(dll.VFXConvolveTileColumns, fftSize, numThreads,
+                                (tile, tileSpectrum, kernelSpectrum)):
+                    return None
+                if not job.run(dll.VFXAccumulateTileRows, fftSize, numThreads,
+                                (tile, imgCoords, tileSpectrum, sumData)):
+                    return None
+    return sumData
@@ -0,0 +1,121 @@
+"""
+DirtCache.py
+Keeps generated lens dirt on disk so applying the same pattern again
+is just a load instead of a render, dropping the least recently used
+patterns once the cache grows too big
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from PyQt5.QtCore import QStandardPaths
+
+# Total size of the cache before old patterns get deleted, in megabytes
+DEFAULT_CACHE_MB = 256
+
+# Bumped whenever the file layout or the way dirt is rendered changes
+CACHE_VERSION = 2
+HEADER = struct.Struct("<4sIQQ")
+MAGIC = b"VFXD"
+
+# Where the cache lives unless told otherwise, the user's cache folder so patterns survive
+# between sessions, or the temporary folder if there isn't one
+def GetDefaultCacheDir():
+    cacheDir = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+    if not cacheDir:
+        cacheDir = tempfile.gettempdir()
+    return os.path.join(cacheDir, "vfx_dirt_cache")
+
+# One folder of cached patterns, each file holds the shape list and optionally the mask
+class DirtCache(object):
+    def __init__(self, directory="", maxMB=DEFAULT_CACHE_MB):
+        self.directory = directory if directory else GetDefaultCacheDir()
+        self.maxBytes = maxMB * 1024 * 1024
+
+    # Everything that changes what the dirt looks like has to be part of the key, including
+    # the kernels that made it since the library and NumPy place shapes differently for one seed
+    def makeKey(self, backend, seed, imgSize, numShapes, filterData):
+        fields = (CACHE_VERSION, backend, seed, imgSize[0], imgSize[1], numShapes,
+                  tuple(getattr(filterData, name) for name, fieldType in filterData._fields_))
+        return hashlib.sha1(repr(fields).encode("utf-8")).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + ".dirt")
+
+    # Returns (shapes, mask) as bytes, mask being None if it wasn't stored
+    # Returns None if there's nothing usable cached
+    def load(self, key):
+        path = self.getPath(key)
+        try:
+            with open(path, "rb") as cacheFile:
+                data = cacheFile.read()
+        except OSError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, version, shapesSize, maskSize = HEADER.unpack_from(data)
+        if magic != MAGIC or version != CACHE_VERSION or HEADER.size + shapesSize + maskSize != len(data):
+            return None
+        shapes = data[HEADER.size:HEADER.size + shapesSize]
+        mask = None
+        if maskSize > 0:
+            try:
+                mask = zlib.decompress(data[HEADER.size + shapesSize:])
+            except zlib.error:
+                return None
+        # Mark it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return (shapes, mask)
+
+    # Save a pattern, the mask is compressed since most of it is usually empty
+    def store(self, key, shapes, mask=None):
+        packedMask = b""
+        if mask is not None:
+            packedMask = zlib.compress(mask, 1)
+        # Never fill the whole cache with one pattern
+        if HEADER.size + len(shapes) + len(packedMask) > self.maxBytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to the side then swap it in so a half written file is never loaded
+            path = self.getPath(key)
+            tempPath = path + ".tmp"
+            with open(tempPath, "wb") as cacheFile:
+                cacheFile.write(HEADER.pack(MAGIC, CACHE_VERSION, len(shapes), len(packedMask)))
+                cacheFile.write(shapes)
+                cacheFile.write(packedMask)
+            os.replace(tempPath, path)
+        except OSError:
+            return
+        self.evict()
+
+    # Delete the least recently used patterns until the cache fits
+    def evict(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        total = 0
+        for name in names:
+            if not name.endswith(".dirt"):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, name))
+            total += info.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
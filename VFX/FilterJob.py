@@ -0,0 +1,154 @@
+"""
+FilterJob.py
+Runs C library kernels across worker threads while keeping track of
+their progress, and lets the UI cancel them part way through
+"""
+from ctypes import *
+from threading import Thread, Lock, current_thread, main_thread, get_ident
+from time import perf_counter, thread_time
+from .LibHandler import JobControl
+from .ScratchBuffer import ScratchAllocator
+from .Profiler import Profiler
+
+# One apply of a filter, may be made of several stages run one after another
+class FilterJob(object):
+    def __init__(self):
+        self.cancelled = False
+        self.stage = 0
+        self.stageSize = 0
+        self.controls = []
+        # Items finished by each worker in chunks it has already moved on from
+        self.finished = []
+        # Kernel name to [threads, chunk size] from calibrating, overrides what the filter asks for
+        self.tuning = {}
+        # Called while waiting on the main thread, used to keep the UI alive
+        self.waitCallback = None
+        # Where buffers between stages come from, memory unless told otherwise
+        self.scratch = ScratchAllocator()
+        # Off unless profiling was turned on in the settings
+        self.profiler = Profiler()
+        # First exception raised by a kernel or the filter, the job is cancelled when there is one
+        self.error = None
+
+    # Split numItems across numThreads workers and run the kernel on each chunk
+    # If the kernel was calibrated its thread count and chunk size are used instead, with
+    # workers taking the next chunk as they finish so uneven work evens out
+    # The kernel is called as kernel(start, n, *args, JobControl*) like every VFX function
+    # start is the index of the first item, for when only part of an image is being run
+    # Returns False if the job was cancelled
+    def run(self, kernel, numItems, numThreads, args, start=0):
+        if self.cancelled:
+            return False
+        self.stage += 1
+        self.stageSize = numItems
+        chunkSize = 0
+        tuned = self.tuning.get(getattr(kernel, "__name__", ""))
+        if tuned:
+            numThreads, chunkSize = tuned
+        self.controls = [JobControl(0, 0) for i in range(numThreads)]
+        self.finished = [0] * numThreads
+        workerTimes = [None] * numThreads
+        stageBegin = perf_counter()
+        threadPool = []
+        if chunkSize > 0 and numItems > chunkSize:
+            chunks = iter(range(start, start + numItems, chunkSize))
+            chunkLock = Lock()
+            for i in range(numThreads):
+                workerThread = Thread(target=self.runChunks, args=(kernel, chunks, chunkLock, start + numItems, chunkSize,
+                                                                    tuple(args), workerTimes, i))
+                threadPool.append(workerThread)
+                workerThread.start()
+        else:
+            idx = start
+            chunk = numItems // numThreads
+            for i in range(numThreads):
+                if i == numThreads - 1:
+                    chunk = (start + numItems) - idx # Give the last thread the remainder
+                workerThread = Thread(target=self.runWorker, args=(kernel, (idx, chunk) + tuple(args) + (byref(self.controls[i]),),
+                                        workerTimes, i))
+                threadPool.append(workerThread)
+                threadPool[i].start()
+                idx += chunk
+        # Catch a cancel that happened while the threads were starting
+        if self.cancelled:
+            self.cancel()
+        # Join threads to finish, if this is the UI thread let it handle events in the meantime
+        isMainThread = current_thread() is main_thread()
+        for workerThread in threadPool:
+            while workerThread.is_alive():
+                workerThread.join(0.05)
+                if self.waitCallback and isMainThread:
+                    self.waitCallback()
+        # Kernels cancel themselves when they can't get the memory they need
+        if not self.cancelled and any(ord(control.cancel) for control in self.controls):
+            self.fail(MemoryError(getattr(kernel, "__name__", "kernel") + " couldn't allocate its working memory"))
+        self.profiler.addStage(getattr(kernel, "__name__", "kernel"), stageBegin, perf_counter() - stageBegin,
+                                workerTimes, self.completed())
+        return not self.cancelled
+
+    # Runs on each worker thread, timing the kernel in case the job is being profiled
+    def runWorker(self, kernel, args, workerTimes, index):
+        begin = perf_counter()
+        cpuBegin = thread_time()
+        try:
+            kernel(*args)
+        except Exception as error:
+            self.fail(error)
+        workerTimes[index] = (get_ident(), begin, perf_counter() - begin, thread_time() - cpuBegin)
+
+    # Same as runWorker, but keeps taking chunks until there are none left or the job is cancelled
+    def runChunks(self, kernel, chunks, chunkLock, end, chunkSize, args, workerTimes, index):
+        begin = perf_counter()
+        cpuBegin = thread_time()
+        control = self.controls[index]
+        while not self.cancelled:
+            with chunkLock:
+                chunkStart = next(chunks, None)
+            if chunkStart is None:
+                break
+            n = min(chunkSize, end - chunkStart)
+            try:
+                kernel(chunkStart, n, *(args + (byref(control),)))
+            except Exception as error:
+                self.fail(error)
+                break
+            # Kernels report progress from the start of their chunk
+            self.finished[index] += n
+            control.progress = 0
+        workerTimes[index] = (get_ident(), begin, perf_counter() - begin, thread_time() - cpuBegin)
+
+    # Follow a job running somewhere else, like a worker process, as if it were this one
+    def track(self, stage, done, total):
+        self.stage = stage
+        self.stageSize = total
+        self.controls = [JobControl(done, 0)]
+        self.finished = []
+
+    # Get a buffer for a stage to write into
+    def allocate(self, size):
+        return self.scratch.allocate(size)
+
+    # Keep the first error and stop the rest of the job
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.cancel()
+
+    # Ask every running worker to stop as soon as possible
+    def cancel(self):
+        self.cancelled = True
+        for control in self.controls:
+            control.cancel = 1
+
+    # Fraction of the current stage that has been completed
+    def progress(self):
+        if self.stageSize <= 0:
+            return 0
+        return min(self.completed() / self.stageSize, 1.0)
+
+    # Items of the current stage that have been completed
+    def completed(self):
+        done = sum(self.finished)
+        for control in self.controls:
+            done += control.progress
+        return done
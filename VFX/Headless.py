@@ -0,0 +1,213 @@
+"""
+Headless.py
+Runs the filter widgets outside of Krita, with small stand-ins for the
+document, layer and blur filter they use, and settings from a preset
+instead of Krita's config file
+"""
+from ctypes import *
+from os import cpu_count
+import json
+import os
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, TranslateColorData
+from .FilterJob import FilterJob
+from .ScratchBuffer import ScratchAllocator
+from .Tuning import ReadTuning
+
+# Names the effects go by outside of Krita, and the module and class of their widget
+EFFECTS = {
+    "chromatic-aberration": ("ChromaticAberrationWidget", "ChromAbWidget"),
+    "bloom": ("BloomWidget", "BloomWidget"),
+    "pseudo-flare": ("LensFlareWidget", "PseudoLensFlareWidget"),
+    "anamorphic-flare": ("LensFlareWidget", "AnamorphicLensFlareWidget"),
+    "lens-dirt": ("LensDirtWidget", "LensDirtWidget"),
+    "lens-stack": ("LensStackWidget", "LensStackWidget"),
+}
+
+# Same as CompositeLayer's blend modes in the C library
+BLEND_MODES = {"normal": 0, "add": 1, "subtract": 2}
+
+# Box blur passes standing in for Krita's blur, three in each direction come out close
+BLUR_PASSES = 3
+
+# Settings read from a preset file, looked up the same way as Krita's QSettings
+# Keys are the ones the widgets save, like B_thresh or G_numThreads
+class PresetSettings(object):
+    def __init__(self, values=None):
+        self.values = dict(values) if values else {}
+
+    def value(self, key, default=None):
+        return self.values.get(key, default)
+
+    def setValue(self, key, value):
+        self.values[key] = value
+
+    def sync(self):
+        pass
+
+# A preset file is json with the effect's name and its settings
+# {"effect": "bloom", "settings": {"B_thresh": 230, "B_power": 2}}
+def ReadPreset(path):
+    with open(path, "r") as presetFile:
+        preset = json.load(presetFile)
+    return preset.get("effect"), PresetSettings(preset.get("settings", {}))
+
+def WritePreset(path, effect, settings):
+    with open(path, "w") as presetFile:
+        json.dump({"effect": effect, "settings": settings.values}, presetFile, indent=4, sort_keys=True)
+
+# Qt needs an application before any widget can be made, one without a window system will do
+qtApp = None
+
+def CreateFilterWidget(effect, settings):
+    global qtApp
+    if effect not in EFFECTS:
+        raise ValueError("Unknown effect " + str(effect) + ", pick from " + ", ".join(sorted(EFFECTS)))
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    if QApplication.instance() is None:
+        qtApp = QApplication([])
+    from importlib import import_module
+    moduleName, className = EFFECTS[effect]
+    widgetClass = getattr(import_module("." + moduleName, __package__), className)
+    widget = widgetClass()
+    widget.readSettings(settings)
+    return widget
+
+# Pixels of a layer, with the parts of Krita's Node API the filters use
+class HeadlessNode(object):
+    def __init__(self, data, size, colorModel, colorDepth):
+        self.data = bytearray(data)
+        self.size = size
+        self.model = colorModel
+        self.depth = colorDepth
+        self.blendMode = "normal"
+
+    def colorModel(self):
+        return self.model
+
+    def colorDepth(self):
+        return self.depth
+
+    # Profiles aren't tracked, files are assumed to be sRGB
+    def colorProfile(self):
+        return "sRGB"
+
+    def getBytesPerPixel(self):
+        return GetBytesPerPixel(TranslateColorData(self.model, self.depth))
+
+    # Only whole rows are ever asked for
+    def projectionPixelData(self, x, y, w, h):
+        rowBytes = self.size[0] * self.getBytesPerPixel()
+        return bytearray(self.data[y * rowBytes:(y + h) * rowBytes])
+
+    def pixelData(self, x, y, w, h):
+        return self.projectionPixelData(x, y, w, h)
+
+    def setPixelData(self, data, x, y, w, h):
+        rowBytes = self.size[0] * self.getBytesPerPixel()
+        self.data[y * rowBytes:(y + h) * rowBytes] = data
+
+    def setBlendingMode(self, blendMode):
+        self.blendMode = blendMode
+
+class HeadlessDocument(object):
+    def __init__(self, size):
+        self.size = size
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+class HeadlessConfiguration(object):
+    def __init__(self):
+        self.properties = {}
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def property(self, name):
+        return self.properties.get(name)
+
+# Krita's blur filter, done as box blurs in the C library
+class HeadlessBlurFilter(object):
+    def __init__(self, numThreads, job):
+        self.config = HeadlessConfiguration()
+        self.numThreads = numThreads
+        self.job = job
+
+    def configuration(self):
+        return self.config
+
+    def setConfiguration(self, config):
+        self.config = config
+
+    def apply(self, node, x, y, w, h):
+        dll = GetSharedLibrary()
+        # Krita blurs the stored values, not linear light
+        colorData = TranslateColorData(node.model, node.depth)
+        imgCoords = Coords(node.size[0], node.size[1])
+        imgData = (c_char * len(node.data)).from_buffer(node.data)
+        blurData = create_string_buffer(len(node.data))
+        passes = ((self.config.property("halfWidth"), 0, node.size[1]), (self.config.property("halfHeight"), 1, node.size[0]))
+        for halfSize, vertical, numLines in passes:
+            if not halfSize or halfSize <= 0:
+                continue
+            radius = max(1, round(halfSize / BLUR_PASSES))
+            for i in range(BLUR_PASSES):
+                if not self.job.run(dll.VFXBoxBlurLines, numLines, self.numThreads,
+                                    (radius, vertical, imgCoords, imgData, blurData, colorData)):
+                    return
+                memmove(imgData, blurData, len(node.data))
+
+class HeadlessApp(object):
+    def __init__(self, numThreads, job):
+        self.numThreads = numThreads
+        self.job = job
+
+    def filter(self, name):
+        if name == "blur":
+            return HeadlessBlurFilter(self.numThreads, self.job)
+        raise ValueError("Krita filter " + name + " isn't available outside of Krita")
+
+# Apply a filter widget to an image the way UIController does inside Krita
+# Returns the effect layer's node, or None if the filter failed or was cancelled
+def RenderEffect(filterWidget, image, settings, job=None):
+    if job is None:
+        job = FilterJob()
+        job.scratch = ScratchAllocator()
+    # Calibrated in Krita and saved to a preset, or left out to use G_numThreads for every stage
+    job.tuning = ReadTuning(settings)
+    numThreads = int(settings.value("G_numThreads", cpu_count()))
+    linearLight = int(settings.value("G_linearLight", 0)) == 1
+    colorData = TranslateColorData(image.colorModel, image.colorDepth, linearLight)
+    if colorData is None:
+        raise ValueError("Unsupported color model or depth " + image.colorModel + " " + image.colorDepth)
+    # Same as creating an empty layer for the effect
+    node = HeadlessNode(bytes(len(image.data)), image.size, image.colorModel, image.colorDepth)
+    result = filterWidget.applyFilter(bytearray(image.data), image.size, colorData, job)
+    if result is None or job.cancelled:
+        return None
+    node.setPixelData(result, 0, 0, image.size[0], image.size[1])
+    blendMode = filterWidget.getBlendMode()
+    if blendMode == "add" and image.colorModel == "CMYKA":
+        blendMode = "subtract" # CMYKA is special, lower = darker
+    node.setBlendingMode(blendMode)
+    filterWidget.postFilter(HeadlessApp(numThreads, job), HeadlessDocument(image.size), node, colorData, job)
+    if job.cancelled:
+        return None
+    return node
+
+# Blend the effect layer onto the image like Krita's layer stack would
+def CompositeEffect(image, node, numThreads, job):
+    dll = GetSharedLibrary()
+    colorData = TranslateColorData(image.colorModel, image.colorDepth)
+    baseData = (c_char * len(image.data)).from_buffer(image.data)
+    layerData = (c_char * len(node.data)).from_buffer(node.data)
+    outData = bytearray(len(image.data))
+    if not job.run(dll.VFXCompositeLayer, image.size[0] * image.size[1], numThreads,
+                    (BLEND_MODES.get(node.blendMode, 0), Coords(image.size[0], image.size[1]), baseData, layerData,
+                     (c_char * len(outData)).from_buffer(outData), colorData)):
+        return None
+    return outData
@@ -0,0 +1,256 @@
+"""
+ImageFiles.py
+Reads and writes PNG, PPM/PGM and raw frames in the same pixel layout
+Krita hands to the filters, without needing anything outside python
+"""
+from ctypes import *
+from array import array
+import os
+import struct
+import sys
+import zlib
+from .LibHandler import GetSharedLibrary
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Formats picked by file extension, anything else is treated as raw
+FORMAT_PNG = "png"
+FORMAT_PPM = "ppm"
+FORMAT_RAW = "raw"
+
+# An image in Krita's layout: RGBA is stored BGRA for integer depths, gray is
+# gray then alpha, and 16 bit values are in the machine's byte order
+class Image(object):
+    def __init__(self, data, size, colorModel, colorDepth):
+        self.data = data
+        self.size = size
+        self.colorModel = colorModel
+        self.colorDepth = colorDepth
+
+# Settings needed to read raw frames, which have no header to say what they are
+class RawFormat(object):
+    def __init__(self, size, colorModel="RGBA", colorDepth="U8"):
+        self.size = size
+        self.colorModel = colorModel
+        self.colorDepth = colorDepth
+
+def GetFormat(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".png":
+        return FORMAT_PNG
+    if extension in (".ppm", ".pgm", ".pnm"):
+        return FORMAT_PPM
+    return FORMAT_RAW
+
+def GetChannelCount(colorModel):
+    if colorModel == "GRAYA":
+        return 2
+    return 4
+
+def GetSampleSize(colorDepth):
+    if colorDepth in ("U16", "F16"):
+        return 2
+    if colorDepth == "F32":
+        return 4
+    return 1
+
+# Files store 16 bit values big endian
+def SwapBigEndian(samples):
+    if sys.byteorder == "little":
+        samples.byteswap()
+
+# Spread color samples into Krita's layout with opaque alpha, or drop alpha again
+# Samples are arrays of one value per channel, so this works for any depth
+def AddAlpha(samples, numChannels, reverse, maxValue):
+    numPixels = len(samples) // numChannels
+    out = array(samples.typecode, bytes(numPixels * (numChannels + 1) * samples.itemsize))
+    for channel in range(numChannels):
+        source = (numChannels - 1 - channel) if reverse else channel
+        out[channel::numChannels + 1] = samples[source::numChannels]
+    out[numChannels::numChannels + 1] = array(samples.typecode, [maxValue]) * numPixels
+    return out
+
+def DropAlpha(samples, numChannels, reverse):
+    numPixels = len(samples) // (numChannels + 1)
+    out = array(samples.typecode, bytes(numPixels * numChannels * samples.itemsize))
+    for channel in range(numChannels):
+        source = (numChannels - 1 - channel) if reverse else channel
+        out[channel::numChannels] = samples[source::numChannels + 1]
+    return out
+
+# RGBA to BGRA and back, the same swap both ways
+def SwapRedBlue(samples):
+    red = samples[0::4]
+    samples[0::4] = samples[2::4]
+    samples[2::4] = red
+
+def ReadImage(path, rawFormat=None):
+    fileFormat = GetFormat(path)
+    with open(path, "rb") as imageFile:
+        data = imageFile.read()
+    if fileFormat == FORMAT_PNG:
+        return DecodePNG(data)
+    if fileFormat == FORMAT_PPM:
+        return DecodePPM(data)
+    if rawFormat is None:
+        raise ValueError("Raw frames need a size, color model and depth: " + path)
+    expected = (rawFormat.size[0] * rawFormat.size[1] * GetChannelCount(rawFormat.colorModel)
+                * GetSampleSize(rawFormat.colorDepth))
+    if len(data) != expected:
+        raise ValueError("Raw frame is " + str(len(data)) + " bytes, expected " + str(expected) + ": " + path)
+    return Image(bytearray(data), rawFormat.size, rawFormat.colorModel, rawFormat.colorDepth)
+
+def WriteImage(path, image, compression=6):
+    fileFormat = GetFormat(path)
+    if fileFormat == FORMAT_PNG:
+        data = EncodePNG(image, compression)
+    elif fileFormat == FORMAT_PPM:
+        data = EncodePPM(image)
+    else:
+        data = bytes(image.data)
+    # Write to the side then swap it in so a half written frame is never left behind
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as imageFile:
+        imageFile.write(data)
+    os.replace(tempPath, path)
+
+# Only 8 and 16 bit gray, gray alpha, RGB and RGBA without interlacing
+def DecodePNG(data):
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    pos = 8
+    header = None
+    compressed = []
+    while pos + 8 <= len(data):
+        length, chunkType = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunkType == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunkType == b"IDAT":
+            compressed.append(chunk)
+        elif chunkType == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG has no header")
+    width, height, bitDepth, colorType, compression, filterMethod, interlace = header
+    channelsLUT = {0: 1, 2: 3, 4: 2, 6: 4}
+    if colorType not in channelsLUT or bitDepth not in (8, 16) or interlace != 0:
+        raise ValueError("Only 8 and 16 bit gray and RGB PNGs without a palette or interlacing are supported")
+    numChannels = channelsLUT[colorType]
+    bytesPerPixel = numChannels * (bitDepth // 8)
+    rowBytes = width * bytesPerPixel
+    filtered = zlib.decompress(b"".join(compressed))
+    if len(filtered) < height * (rowBytes + 1):
+        raise ValueError("PNG image data is truncated")
+    # Undoing the filters is byte by byte, way too slow in python
+    pixels = create_string_buffer(height * rowBytes)
+    if not GetSharedLibrary().VFXUnfilterPNG(filtered, height, rowBytes, bytesPerPixel, pixels):
+        raise ValueError("PNG image data is corrupt")
+    if bitDepth == 16:
+        samples = array("H", pixels.raw)
+        SwapBigEndian(samples)
+        colorDepth = "U16"
+        maxValue = 65535
+    else:
+        samples = array("B", pixels.raw)
+        colorDepth = "U8"
+        maxValue = 255
+    if colorType == 0:
+        samples = AddAlpha(samples, 1, False, maxValue)
+    elif colorType == 2:
+        samples = AddAlpha(samples, 3, True, maxValue)
+    elif colorType == 6:
+        SwapRedBlue(samples)
+    colorModel = "GRAYA" if colorType in (0, 4) else "RGBA"
+    return Image(bytearray(samples.tobytes()), (width, height), colorModel, colorDepth)
+
+def EncodePNG(image, compression=6):
+    if image.colorModel not in ("RGBA", "GRAYA") or image.colorDepth not in ("U8", "U16"):
+        raise ValueError("PNG can only hold 8 and 16 bit RGBA or gray images")
+    if image.colorDepth == "U16":
+        samples = array("H", bytes(image.data))
+        SwapBigEndian(samples)
+        bitDepth = 16
+    else:
+        samples = array("B", bytes(image.data))
+        bitDepth = 8
+    if image.colorModel == "RGBA":
+        SwapRedBlue(samples)
+        colorType = 6
+    else:
+        colorType = 4
+    pixels = samples.tobytes()
+    rowBytes = len(pixels) // image.size[1]
+    # Filter type 0 (none) on every row, zlib does the rest
+    rows = bytearray(image.size[1] * (rowBytes + 1))
+    for y in range(image.size[1]):
+        start = y * (rowBytes + 1)
+        rows[start + 1:start + 1 + rowBytes] = pixels[y * rowBytes:(y + 1) * rowBytes]
+
+    def Chunk(chunkType, body):
+        return (struct.pack(">I", len(body)) + chunkType + body
+                + struct.pack(">I", zlib.crc32(chunkType + body) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", image.size[0], image.size[1], bitDepth, colorType, 0, 0, 0)
+    return (PNG_SIGNATURE + Chunk(b"IHDR", header) + Chunk(b"IDAT", zlib.compress(bytes(rows), compression))
+            + Chunk(b"IEND", b""))
+
+# Binary PPM (P6) and PGM (P5), 8 or 16 bit
+def DecodePPM(data):
+    tokens = []
+    pos = 2
+    magic = data[:2]
+    if magic not in (b"P5", b"P6"):
+        raise ValueError("Only binary PPM and PGM files are supported")
+    # Header is whitespace separated, with comments, up to the max value
+    while len(tokens) < 3:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            while data[pos:pos + 1] not in (b"\n", b""):
+                pos += 1
+            continue
+        end = pos
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        tokens.append(int(data[pos:end]))
+        pos = end
+    pos += 1 # Single whitespace before the pixels
+    width, height, maxValue = tokens
+    numChannels = 3 if magic == b"P6" else 1
+    if maxValue > 255:
+        samples = array("H", data[pos:pos + (width * height * numChannels * 2)])
+        SwapBigEndian(samples)
+        colorDepth = "U16"
+        maxValue = 65535
+    else:
+        samples = array("B", data[pos:pos + (width * height * numChannels)])
+        colorDepth = "U8"
+        maxValue = 255
+    if len(samples) != width * height * numChannels:
+        raise ValueError("PPM image data is truncated")
+    samples = AddAlpha(samples, numChannels, numChannels == 3, maxValue)
+    colorModel = "RGBA" if numChannels == 3 else "GRAYA"
+    return Image(bytearray(samples.tobytes()), (width, height), colorModel, colorDepth)
+
+# Alpha is dropped, PPM has nowhere to put it
+def EncodePPM(image):
+    if image.colorModel not in ("RGBA", "GRAYA") or image.colorDepth not in ("U8", "U16"):
+        raise ValueError("PPM can only hold 8 and 16 bit RGB or gray images")
+    if image.colorDepth == "U16":
+        samples = array("H", bytes(image.data))
+        maxValue = 65535
+    else:
+        samples = array("B", bytes(image.data))
+        maxValue = 255
+    if image.colorModel == "RGBA":
+        samples = DropAlpha(samples, 3, True)
+        magic = b"P6"
+    else:
+        samples = DropAlpha(samples, 1, False)
+        magic = b"P5"
+    if image.colorDepth == "U16":
+        SwapBigEndian(samples)
+    header = magic + b"\n" + str(image.size[0]).encode() + b" " + str(image.size[1]).encode() + b"\n" + str(maxValue).encode() + b"\n"
+    return header + samples.tobytes()
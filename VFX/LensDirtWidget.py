@@ -3,19 +3,27 @@ LensDirt.py
 Adds a widget that renders random shapes to look like lens dirt
 """
 from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QWidget, QLabel, QRadioButton, QButtonGroup, QDial, QSlider, QVBoxLayout, QComboBox
+from PyQt5.QtWidgets import QWidget, QLabel, QRadioButton, QButtonGroup, QDial, QSlider, QCheckBox, QVBoxLayout, QComboBox
 from ctypes import *
-from threading import Thread
-from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, LensDirtFilterData
+from .LibHandler import GetSharedLibrary, GetLibraryName, GetBytesPerPixel, GetMaskSampleSize, Coords, LensDirtFilterData
+from .Streaming import WholeImage
+from .DirtCache import DirtCache
 from os import cpu_count
 from random import randrange
 
+# Box blur passes over the mask, three in each direction come out close to a gaussian
+MASK_BLUR_PASSES = 3
+
 # Widget for various global and seldom used settings
 class LensDirtWidget(QWidget):
     def __init__(self, parent=None):
         super(LensDirtWidget, self).__init__(parent)
 
         self.numThreads = cpu_count()
+        self.shapeData = None
+        self.cache = DirtCache()
+        self.cacheKey = None
+        self.cachedMask = None
 
         self.numShapes = 5
         self.maxSize = 100
@@ -26,6 +34,9 @@ class LensDirtWidget(QWidget):
         self.direction = 100
         self.angle = 100
         self.blur = 10
+        self.maskDirt = True
+        self.softEdges = False
+        self.seed = 0
 
         self.numInfo = QLabel("Number of Particles: 50", self)
         self.numSlide = QSlider(Qt.Horizontal, self)
@@ -90,6 +101,19 @@ class LensDirtWidget(QWidget):
         self.blurSlide.setValue(self.blur)
         self.blurSlide.valueChanged.connect(self.updateBlur)
 
+        self.maskBox = QCheckBox("Render dirt as a mask (faster, uses much less memory)", self)
+        self.maskBox.setChecked(True)
+        self.maskBox.stateChanged.connect(self.updateMaskDirt)
+
+        self.softBox = QCheckBox("Soft edged particles (skips the blur, fastest)", self)
+        self.softBox.stateChanged.connect(self.updateSoftEdges)
+
+        self.seedInfo = QLabel("Pattern Seed: Random", self)
+        self.seedSlide = QSlider(Qt.Horizontal, self)
+        self.seedSlide.setRange(0, 1000)
+        self.seedSlide.setValue(self.seed)
+        self.seedSlide.valueChanged.connect(self.updateSeed)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.numInfo)
         vbox.addWidget(self.numSlide)
@@ -110,6 +134,10 @@ class LensDirtWidget(QWidget):
         vbox.addWidget(self.theDial)
         vbox.addWidget(self.blurInfo)
         vbox.addWidget(self.blurSlide)
+        vbox.addWidget(self.maskBox)
+        vbox.addWidget(self.softBox)
+        vbox.addWidget(self.seedInfo)
+        vbox.addWidget(self.seedSlide)
 
         self.setLayout(vbox)
         self.show()
@@ -166,6 +194,25 @@ class LensDirtWidget(QWidget):
         self.blurInfo.setText("Blur Size: " + str(value / 10) + "%")
         self.blur = value
 
+    def updateMaskDirt(self, state):
+        if state == Qt.Checked:
+            self.maskDirt = True
+        else:
+            self.maskDirt = False
+
+    def updateSoftEdges(self, state):
+        if state == Qt.Checked:
+            self.softEdges = True
+        else:
+            self.softEdges = False
+
+    def updateSeed(self, value):
+        if value == 0:
+            self.seedInfo.setText("Pattern Seed: Random")
+        else:
+            self.seedInfo.setText("Pattern Seed: " + str(value))
+        self.seed = value
+
     # Required for main window to call into
     def getWindowName(self):
         return "Lens Dirt"
@@ -191,7 +238,21 @@ Particle Shape
 Direction
     Change where the shapes point to
 Blur (0-25%)
-    How much to blur the result, as a percent of image width"""
+    How much to blur the result, as a percent of image width
+Render Dirt as a Mask
+    Draw the particles as a single channel of coverage and blur
+    that, only turning it into full pixels at the end, instead
+    of blurring the whole layer with Krita's blur. Much faster
+    and uses a fraction of the memory. Blurred masks always
+    process the whole image at once
+Soft Edged Particles
+    Fade each particle out across its edge by the blur size
+    while drawing it, so no blur is needed at all. Small
+    particles stay brighter than they would when blurred
+Pattern Seed (Random, 1-1000)
+    Pick a number to get the same dirt every time it's applied
+    with the same settings and image size. Seeded patterns are
+    kept on disk, so applying one again is much faster"""
 
     def saveSettings(self, settings):
         settings.setValue("LD_numShapes", self.numShapes)
@@ -203,6 +264,17 @@ Blur (0-25%)
         settings.setValue("LD_direction", self.direction)
         settings.setValue("LD_angle", self.angle)
         settings.setValue("LD_blurSize", self.blur)
+        if self.maskDirt:
+            maskDirt = 1
+        else:
+            maskDirt = 0
+        settings.setValue("LD_maskDirt", maskDirt)
+        if self.softEdges:
+            softEdges = 1
+        else:
+            softEdges = 0
+        settings.setValue("LD_softEdges", softEdges)
+        settings.setValue("LD_seed", self.seed)
 
     def readSettings(self, settings):
         self.updateNum(int(settings.value("LD_numShapes", 5)))
@@ -212,6 +284,9 @@ Blur (0-25%)
         self.updateOpacityVar(int(settings.value("LD_opacityVar", 50)))
         self.updateShape(int(settings.value("LD_shape", 5)) - 1)
         self.updateBlur(int(settings.value("LD_blurSize", 10)))
+        self.maskDirt = int(settings.value("LD_maskDirt", 1)) == 1
+        self.softEdges = int(settings.value("LD_softEdges", 0)) == 1
+        self.updateSeed(int(settings.value("LD_seed", 0)))
         dir = int(settings.value("LD_direction", 100))
         if dir == -2:
             self.changeDir1()
@@ -221,6 +296,7 @@ Blur (0-25%)
             self.changeDir3()
             self.updateDial(dir)
         self.numThreads = int(settings.value("G_numThreads", cpu_count()))
+        self.cache = DirtCache(str(settings.value("G_dirtCacheDir", "")))
         # Update interactable UI elements
         self.shapeBox.setCurrentIndex(self.shape - 1)
         self.dirBtn1.setChecked(dir == -2)
@@ -233,57 +309,153 @@ Blur (0-25%)
         self.opacitySlide.setValue(self.maxOpacity)
         self.opacityVarSlide.setValue(self.opacityVar)
         self.blurSlide.setValue(self.blur)
+        self.maskBox.setChecked(self.maskDirt)
+        self.softBox.setChecked(self.softEdges)
+        self.seedSlide.setValue(self.seed)
 
     def getBlendMode(self):
         return "add"
 
-    def applyFilter(self, imgData, imgSize, colorData):
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        if band is None:
+            band = WholeImage(imgSize)
         dll = GetSharedLibrary()
         imgCoords = Coords(imgSize[0], imgSize[1])
-        seeds = []
-        for i in range(self.numThreads):
-            seeds.append(c_uint(randrange(65536))) # 16 bits worth of randomness is enough
-        newData = c_float * (self.numShapes * 10 * ((self.shape * 2) + 2)) 
-        shapeData = newData()
-        filterdata = LensDirtFilterData(int((self.maxSize / 1000) * imgSize[0]), self.sizeVar, self.maxOpacity,
-                                     self.opacityVar, self.shape, self.direction, self.blur)
-        threadPool = []
-        idx = 0
-        shapesPerThread = (self.numShapes * 10) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                shapesPerThread = (self.numShapes * 10) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXCreateDirtShapes, args=(idx, shapesPerThread, filterdata,
-                                    imgCoords, seeds[i], byref(shapeData),))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += shapesPerThread
-        # Join threads to finish
-        for i in range(self.numThreads):
-            threadPool[i].join()
+        filterdata = self.getFilterData(imgSize)
+        # Shapes are made once for the first band, the rest of the bands reuse them
+        if band.first == 0 and not self.createShapes(filterdata, imgSize, job):
+            return None
         # Now we have shapes, time to render them
-        newData = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXRenderLensDirt, args=(idx, numPixels, self.numShapes * 10, filterdata,
-                                    imgCoords, byref(shapeData), byref(newData), colorData))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += shapesPerThread
-        # If a crash happens, it would freeze here. User can still cancel tho
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        return bytes(newData)
-
-    def postFilter(self, app, doc, node, colorData):
+        if self.maskDirt:
+            return self.renderMask(filterdata, imgSize, colorData, job, band)
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
+        if not job.run(dll.VFXRenderLensDirt, band.numPixels(imgSize[0]), self.numThreads,
+                        (self.numShapes * 10, filterdata, imgCoords, byref(self.shapeData),
+                         band.outputPointer(newData, imgSize[0], colorData), colorData), band.start(imgSize[0])):
+            return None
+        return newData
+
+    def getFilterData(self, imgSize):
+        softEdge = 0
+        if self.softEdges:
+            softEdge = 1
+        return LensDirtFilterData(int((self.maxSize / 1000) * imgSize[0]), self.sizeVar, self.maxOpacity,
+                                  self.opacityVar, self.shape, self.direction, self.blur, softEdge)
+
+    # Make the shapes, or load them and their mask from the cache, returns False if cancelled
+    def createShapes(self, filterdata, imgSize, job):
+        dll = GetSharedLibrary()
+        newData = c_float * (self.numShapes * 10 * ((self.shape * 2) + 2))
+        self.cacheKey = None
+        self.cachedMask = None
+        cached = None
+        if self.seed > 0:
+            self.cacheKey = self.cache.makeKey(GetLibraryName(dll), self.seed, imgSize, self.numShapes * 10, filterdata)
+            with job.profiler.phase("loadCache"):
+                cached = self.cache.load(self.cacheKey)
+        if cached is not None and len(cached[0]) == sizeof(newData):
+            self.shapeData = newData.from_buffer_copy(cached[0])
+            self.cachedMask = cached[1]
+            return True
+        self.shapeData = newData()
+        if self.seed > 0:
+            # rand() is shared between threads, so only one thread gives the same shapes every time
+            seed = c_uint(self.seed)
+            numThreads = 1
+        else:
+            seed = c_uint(randrange(65536)) # 16 bits worth of randomness is enough
+            numThreads = self.numThreads
+        if not job.run(dll.VFXCreateDirtShapes, self.numShapes * 10, numThreads,
+                        (filterdata, Coords(imgSize[0], imgSize[1]), seed, byref(self.shapeData))):
+            return False
+        if self.cacheKey is not None and not self.maskDirt:
+            with job.profiler.phase("storeCache"):
+                self.cache.store(self.cacheKey, bytes(self.shapeData))
+        return True
+
+    # Render the shapes as a coverage mask, blur it, then expand it into the layer's format
+    # Only alpha varies, so the mask is a quarter of the size of 8 bit RGBA and far less for deeper colors
+    def renderMask(self, filterdata, imgSize, colorData, job, band):
+        dll = GetSharedLibrary()
+        mask = self.createMask(filterdata, imgSize, colorData, job, band)
+        if mask is None:
+            return None
+        maskData, maskPointer = mask
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
+        if not job.run(dll.VFXExpandDirtMask, band.numPixels(imgSize[0]), self.numThreads,
+                        (maskPointer, band.outputPointer(newData, imgSize[0], colorData), colorData),
+                        band.start(imgSize[0])):
+            return None
+        return newData
+
+    # The blurred coverage mask of a band, and a pointer to where its row 0 would be
+    # Returns None if cancelled
+    def createMask(self, filterdata, imgSize, colorData, job, band):
+        dll = GetSharedLibrary()
+        imgCoords = Coords(imgSize[0], imgSize[1])
+        sampleSize = GetMaskSampleSize(colorData)
+        maskData = job.allocate(band.numPixels(imgSize[0]) * sampleSize)
+        # Same trick as the band's own pointers, point at where row 0 would be
+        maskPointer = c_void_p(addressof(maskData) - (band.first * imgSize[0] * sampleSize))
+        # Only whole image masks are cached, bands are rendered every time
+        isWholeImage = band.rows == imgSize[1]
+        if isWholeImage and self.cachedMask is not None and len(self.cachedMask) == len(maskData):
+            memmove(maskData, self.cachedMask, len(maskData))
+        else:
+            if not job.run(dll.VFXRenderDirtMask, band.numPixels(imgSize[0]), self.numThreads,
+                            (self.numShapes * 10, filterdata, imgCoords, byref(self.shapeData), maskPointer, colorData),
+                            band.start(imgSize[0])):
+                return None
+            # Blurring only happens when the band is the whole image, see getBandOverlap
+            radius = self.getMaskBlurRadius(imgSize)
+            if radius > 0:
+                blurData = job.allocate(len(maskData))
+                for i in range(MASK_BLUR_PASSES):
+                    if not job.run(dll.VFXBlurDirtMask, imgSize[1], self.numThreads,
+                                    (radius, 0, imgCoords, maskData, blurData, colorData)):
+                        return None
+                    if not job.run(dll.VFXBlurDirtMask, imgSize[0], self.numThreads,
+                                    (radius, 1, imgCoords, blurData, maskData, colorData)):
+                        return None
+            if self.cacheKey is not None and band.first == 0:
+                mask = None
+                if isWholeImage:
+                    mask = bytes(maskData)
+                with job.profiler.phase("storeCache"):
+                    self.cache.store(self.cacheKey, bytes(self.shapeData), mask)
+        return maskData, maskPointer
+
+    # Radius of each box blur pass, all of them together reach as far as Krita's blur would
+    # Soft edged particles are drawn already blurred
+    def getMaskBlurRadius(self, imgSize):
+        if self.softEdges:
+            return 0
+        halfWidth = (self.blur / 100) * imgSize[0]
+        if halfWidth <= 0:
+            return 0
+        return max(1, round(halfWidth / MASK_BLUR_PASSES))
+
+    # Dirt doesn't read the image at all, but a blurred mask needs every row at once
+    def getBandOverlap(self, imgSize):
+        if self.maskDirt and self.getMaskBlurRadius(imgSize) > 0:
+            return None
+        return 0
+
+    def getNumStages(self):
+        return 1
+
+    def blursLayer(self):
+        return not (self.maskDirt or self.softEdges) and self.blur > 0
+
+    def postFilter(self, app, doc, node, colorData, job):
+        # Masks were already blurred in applyFilter, soft edges never need it
+        if self.maskDirt or self.softEdges:
+            return
         if self.blur > 0:
             blurFilter = app.filter("blur")
             blurConfig = blurFilter.configuration()
             blurConfig.setProperty("halfWidth", (self.blur / 100) * doc.width())
             blurConfig.setProperty("halfHeight", (self.blur / 100) * doc.width())
             blurFilter.setConfiguration(blurConfig)
-            blurFilter.apply(node, 0, 0, doc.width(), doc.height())
+            with job.profiler.phase("blur"):
+                blurFilter.apply(node, 0, 0, doc.width(), doc.height())
@@ -5,9 +5,32 @@ A couple of widget classes defining different lens flare effects
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QLabel, QRadioButton, QButtonGroup, QSlider, QCheckBox, QVBoxLayout
 from ctypes import *
-from threading import Thread
-from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, LensFlareFilterData, RadialFilterData
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, LensFlareFilterData, RadialFilterData, Highlight, StreakFilterData
+from .Streaming import WholeImage, StreamPixelKernel
 from os import cpu_count
+from math import log2
+
+# Most of the pixels that can be left after the highpass filter, as a fraction of the
+# image, for the pseudo flare to only work from those highlights. Past this the list of
+# highlights takes up more memory than it's worth
+SPLAT_MAX_DENSITY = 0.25
+
+# Size of each level of a mip pyramid, level 0 being the image itself
+# Must match GetMipSize in the C library
+def GetMipSizes(imgSize, numLevels):
+    sizes = [imgSize]
+    for level in range(numLevels):
+        sizes.append(((sizes[-1][0] + 1) // 2, (sizes[-1][1] + 1) // 2))
+    return sizes
+
+# How many mip levels the pseudo flare copies need
+# Copy j is the image scaled by (j * dispersal - 1), the one that shrinks the
+# image the most decides how small the pyramid has to go
+def GetGhostMipLevels(artifactCopies, artifactDispersal):
+    maxScale = 1.0
+    if artifactCopies > 0:
+        maxScale = max(maxScale, abs(((artifactCopies - 1) * artifactDispersal) - 1))
+    return int(log2(maxScale))
 
 # Widget for those long lines of lens flare
 class AnamorphicLensFlareWidget(QWidget):
@@ -18,7 +41,10 @@ class AnamorphicLensFlareWidget(QWidget):
         self.blurStrength = 0.5
         self.isHorizontal = True
         self.power = 10
+        self.expStreak = True
+        self.tilt = 0
         self.numThreads = cpu_count()
+        self.streaming = False
 
         self.threshInfo = QLabel("Threshold: 250", self)
         self.threshold = QSlider(Qt.Horizontal, self)
@@ -48,6 +74,16 @@ class AnamorphicLensFlareWidget(QWidget):
         self.powerSlide.setValue(10)
         self.powerSlide.valueChanged.connect(self.updatePower)
 
+        self.expBox = QCheckBox("Exponential streaks (faster, fades out like real flares)", self)
+        self.expBox.setChecked(True)
+        self.expBox.stateChanged.connect(self.updateExpStreak)
+
+        self.tiltInfo = QLabel("Streak tilt: 0 degrees", self)
+        self.tiltSlide = QSlider(Qt.Horizontal, self)
+        self.tiltSlide.setRange(-45, 45)
+        self.tiltSlide.setValue(0)
+        self.tiltSlide.valueChanged.connect(self.updateTilt)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.threshInfo)
         vbox.addWidget(self.threshold)
@@ -58,6 +94,9 @@ class AnamorphicLensFlareWidget(QWidget):
         vbox.addWidget(self.shapeBtn2)
         vbox.addWidget(self.powerInfo)
         vbox.addWidget(self.powerSlide)
+        vbox.addWidget(self.expBox)
+        vbox.addWidget(self.tiltInfo)
+        vbox.addWidget(self.tiltSlide)
 
         self.setLayout(vbox)
         self.show()
@@ -71,6 +110,16 @@ class AnamorphicLensFlareWidget(QWidget):
         self.blurStrength = value / 1000
         self.blurInfo.setText("Blur Strength: " + str(value / 10) + "%")
 
+    def updateExpStreak(self, state):
+        if state == Qt.Checked:
+            self.expStreak = True
+        else:
+            self.expStreak = False
+
+    def updateTilt(self, value):
+        self.tiltInfo.setText("Streak tilt: " + str(value) + " degrees")
+        self.tilt = value
+
     def changeShape1(self):
         self.isHorizontal = True
 
@@ -97,12 +146,26 @@ Blur Strength (0.1-100%)
 Blur Direction (Horizontal/Vertical)
     Which direction to stretch the blur effect
 Power (1-25)
-    Multiply the result by X to increase the effect"""
+    Multiply the result by X to increase the effect
+Exponential Streaks
+    Smear highlights with a falloff that fades smoothly like a real
+    anamorphic flare, instead of Krita's blur. Much faster for long
+    streaks. Turn off to get the flat look of older versions
+Streak Tilt (-45-45 degrees)
+    [Exponential streaks only!] Rotate the streaks away from
+    horizontal or vertical. Tilted and vertical streaks always
+    process the whole image at once"""
 
     def saveSettings(self, settings):
         settings.setValue("AF_thresh", self.thresh)
         settings.setValue("AF_blurStrength", self.blurStrength * 1000)
         settings.setValue("AF_power", self.power)
+        if self.expStreak:
+            expStreak = 1
+        else:
+            expStreak = 0
+        settings.setValue("AF_expStreak", expStreak)
+        settings.setValue("AF_tilt", self.tilt)
         if self.isHorizontal:
             horiz = 1
         else:
@@ -113,7 +176,10 @@ Power (1-25)
         self.updateThresh(int(settings.value("AF_thresh", 250)))
         self.updateBlur(int(settings.value("AF_blurStrength", 500)))
         self.updatePower(int(settings.value("AF_power", 10)))
+        self.updateTilt(int(settings.value("AF_tilt", 0)))
+        self.expStreak = int(settings.value("AF_expStreak", 1)) == 1
         self.numThreads = int(settings.value("G_numThreads", cpu_count()))
+        self.streaming = int(settings.value("G_streaming", 0)) == 1
         # Update interactable UI elements
         if int(settings.value("AF_isHorizontal", 1)) == 1:
             self.changeShape1()
@@ -126,37 +192,81 @@ Power (1-25)
         self.threshold.setValue(self.thresh)
         self.blurSlide.setValue(int(self.blurStrength * 1000))
         self.powerSlide.setValue(self.power)
+        self.expBox.setChecked(self.expStreak)
+        self.tiltSlide.setValue(self.tilt)
 
     def getBlendMode(self):
         return "add"
 
+    # Direction of the streaks in degrees from horizontal
+    def getStreakAngle(self):
+        if self.isHorizontal:
+            return self.tilt
+        return 90 + self.tilt
+
     # Call into C library to process the image
-    def applyFilter(self, imgData, imgSize, colorData):
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
         # Anamorphic Lens Flare is in 2 steps: threshold, then blur
-        newData = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
+        if band is None:
+            band = WholeImage(imgSize)
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
         dll = GetSharedLibrary()
         imgCoords = Coords(imgSize[0], imgSize[1])
         # python makes it hard to get a pointer to existing buffers for some reason
         cimgData = c_char * len(imgData)
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXHighPass, args=(idx, numPixels, self.thresh,
-                                    imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        # Join threads to finish
-        # If a crash happens, it would freeze here. User can still cancel tho
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        return bytes(newData)
+        if not job.run(dll.VFXHighPass, band.numPixels(imgSize[0]), self.numThreads,
+                        (self.thresh, imgCoords, band.inputPointer(cimgData.from_buffer(imgData), imgSize[0], colorData),
+                         band.outputPointer(newData, imgSize[0], colorData), colorData), band.start(imgSize[0])):
+            return None
+        if not self.expStreak:
+            return newData
+        # Smear the highlights into streaks here instead of blurring afterwards
+        return self.renderStreaks(newData, imgSize, colorData, job, band)
+
+    # Smear a band of highpassed pixels into exponential streaks, returns None if cancelled
+    def renderStreaks(self, highData, imgSize, colorData, job, band):
+        dll = GetSharedLibrary()
+        imgCoords = Coords(imgSize[0], imgSize[1])
+        # Streaks fade to about a third at half the blur strength, which looks about as long
+        if self.isHorizontal:
+            length = self.blurStrength * imgSize[0] / 2
+        else:
+            length = self.blurStrength * imgSize[1] / 2
+        streakFilterSettings = StreakFilterData(self.getStreakAngle(), length, self.power)
+        if band.rows == imgSize[1]:
+            lineStart = 0
+            numLines = dll.VFXGetStreakLines(imgCoords, self.getStreakAngle())
+        else:
+            # Only straight horizontal streaks are split into bands, where each row is a line
+            lineStart = band.first
+            numLines = band.rows
+        streakData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
+        if not job.run(dll.VFXStreak, numLines, self.numThreads,
+                        (streakFilterSettings, imgCoords, band.outputPointer(highData, imgSize[0], colorData),
+                         band.outputPointer(streakData, imgSize[0], colorData), colorData), lineStart):
+            return None
+        return streakData
+
+    # Thresholding only looks at one pixel at a time, and straight horizontal streaks
+    # only look along their row. Streaks in any other direction need the whole image
+    def getBandOverlap(self, imgSize):
+        if self.expStreak and not (self.isHorizontal and self.tilt == 0):
+            return None
+        return 0
+
+    # Highpass, then either streaks or power after the blur
+    def getNumStages(self):
+        return 2
+
+    # Krita's blur mixes the layer's alpha in with its colors, so empty pixels have to keep theirs
+    def blursLayer(self):
+        return not self.expStreak
 
     # Use Krita's built-in filters after everything else
-    def postFilter(self, app, doc, node, colorData):
+    def postFilter(self, app, doc, node, colorData, job):
+        # Exponential streaks were already finished in applyFilter
+        if self.expStreak:
+            return
         blurFilter = app.filter("blur")
         blurConfig = blurFilter.configuration()
         if self.isHorizontal:
@@ -164,27 +274,12 @@ Power (1-25)
         else:
             blurConfig.setProperty("halfHeight", self.blurStrength * doc.height())
         blurFilter.setConfiguration(blurConfig)
-        blurFilter.apply(node, 0, 0, doc.width(), doc.height())
+        with job.profiler.phase("blur"):
+            blurFilter.apply(node, 0, 0, doc.width(), doc.height())
         # need to remake stuff again for one last filter
         dll = GetSharedLibrary()
-        imgData = node.projectionPixelData(0, 0, doc.width(), doc.height())
-        imgSize = Coords(doc.width(), doc.height())
-        cimgData = c_char * len(imgData)
-        newData = create_string_buffer(imgSize.x * imgSize.y * GetBytesPerPixel(colorData))
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize.x * imgSize.y) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize.x * imgSize.y) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXPower, args=(idx, numPixels, self.power,
-                                    imgSize, cimgData.from_buffer(imgData), byref(newData), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        node.setPixelData(bytes(newData), 0, 0, doc.width(), doc.height())
+        StreamPixelKernel(node, (doc.width(), doc.height()), colorData, job, self.numThreads, self.streaming,
+                            dll.VFXPower, self.power)
 
 # Widget for a general fake lens flare
 class PseudoLensFlareWidget(QWidget):
@@ -199,6 +294,7 @@ class PseudoLensFlareWidget(QWidget):
         self.haloWidth = 0.25          # %  slider 1-400
         self.power = 2
         self.interpolate = False
+        self.mipGhosts = False
         self.numThreads = cpu_count()
 
         self.threshInfo = QLabel("Threshold: 250", self)
@@ -243,9 +339,12 @@ class PseudoLensFlareWidget(QWidget):
         self.powerSlide.setValue(1)
         self.powerSlide.valueChanged.connect(self.updatePower)
 
-        self.biFilter = QCheckBox("Bilinear Interpolation (slow, but smooths colors)", self)
+        self.biFilter = QCheckBox("Bilinear Interpolation (smooths colors)", self)
         self.biFilter.stateChanged.connect(self.updateInterp)
 
+        self.mipBox = QCheckBox("Render artifacts as whole image copies (faster with many copies)", self)
+        self.mipBox.stateChanged.connect(self.updateMipGhosts)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.threshInfo)
         vbox.addWidget(self.threshold)
@@ -262,6 +361,7 @@ class PseudoLensFlareWidget(QWidget):
         vbox.addWidget(self.powerInfo)
         vbox.addWidget(self.powerSlide)
         vbox.addWidget(self.biFilter)
+        vbox.addWidget(self.mipBox)
 
         self.setLayout(vbox)
         self.show()
@@ -301,6 +401,12 @@ class PseudoLensFlareWidget(QWidget):
         else:
             self.interpolate = False
 
+    def updateMipGhosts(self, state):
+        if state == Qt.Checked:
+            self.mipGhosts = True
+        else:
+            self.mipGhosts = False
+
     # Required for main window to call into
     def getWindowName(self):
         return "Pseudo Lens Flare"
@@ -324,8 +430,14 @@ Aberration Strength (0-50%)
 Power (1-10)
     Multiply the result by X to increase the effect
 Bilinear Interpolation
-    Using bilinear interpolation while sampling will yield smoother results, but take slightly
-    more time to calculate"""
+    Using bilinear interpolation while sampling will yield smoother results. It costs little
+    extra time, except with linear light blending turned on
+Render Artifacts as Whole Image Copies
+    Instead of looking up every artifact copy for each pixel, draw each copy as a scaled
+    and flipped version of the whole image. Copies that shrink the image are drawn from
+    smaller, pre-averaged versions of it, which also stops them from looking grainy.
+    Much faster with lots of artifact copies, but uses a third more memory. Images with
+    only a few bright spots don't need this, they're always drawn from just those spots"""
 
     def saveSettings(self, settings):
         settings.setValue("PF_thresh",             self.thresh)
@@ -340,6 +452,11 @@ Bilinear Interpolation
         else:
             interp = 0
         settings.setValue("PF_interpolate",        interp)
+        if self.mipGhosts:
+            mipGhosts = 1
+        else:
+            mipGhosts = 0
+        settings.setValue("PF_mipGhosts",          mipGhosts)
 
     def readSettings(self, settings):
         self.updateThresh(int(settings.value("PF_thresh", 250)))
@@ -355,6 +472,7 @@ Bilinear Interpolation
             self.interpolate = True
         else:
             self.interpolate = False
+        self.mipGhosts = int(settings.value("PF_mipGhosts", 0)) == 1
         # Update interactable UI elements
         self.threshold.setValue(self.thresh)
         self.copySlide.setValue(self.artifactCopies)
@@ -364,14 +482,14 @@ Bilinear Interpolation
         self.aberrationSlide.setValue(int(self.aberrationStrength * 1000))
         self.powerSlide.setValue(self.power)
         self.biFilter.setChecked(self.interpolate)
+        self.mipBox.setChecked(self.mipGhosts)
 
     def getBlendMode(self):
         return "add"
 
     # Call into C library to process the image
-    def applyFilter(self, imgData, imgSize, colorData):
-        newData = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
-        newData2 = create_string_buffer(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        newData = job.allocate(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
         dll = GetSharedLibrary()
         imgCoords = Coords(imgSize[0], imgSize[1])
         # python makes it hard to get a pointer to existing buffers for some reason
@@ -379,61 +497,91 @@ Bilinear Interpolation
         # since this is the one filter with an actual pipeline:
         # highpass->pseudoflare->chromatic aberration then blur afterwords
         # Do sequentially because each stage depends on the last
+        numPixels = imgSize[0] * imgSize[1]
+        # highpass
+        if not job.run(dll.VFXHighPass, numPixels, self.numThreads,
+                        (self.thresh, imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData)):
+            return None
+        # The highpassed pixels aren't needed after the flare, so the aberration can go back into them
+        if not self.renderFlare(newData, newData, imgSize, colorData, job):
+            return None
+        return newData
+
+    # Flare and aberration of highpassed pixels, written to outData which can be highData itself
+    # Returns False if cancelled
+    def renderFlare(self, highData, outData, imgSize, colorData, job):
+        newData2 = job.allocate(imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData))
+        dll = GetSharedLibrary()
+        imgCoords = Coords(imgSize[0], imgSize[1])
         interp = 0
         if self.interpolate:
                 interp = 1
         flareFilterSettings = LensFlareFilterData(self.artifactCopies, self.artifactDispersal,
                                                     int(self.haloWidth * imgSize[0]), self.power, interp)
         aberrationFilterSettings = RadialFilterData(int(self.aberrationStrength * imgSize[0]), 0, 0, interp)
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        # highpass
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXHighPass, args=(idx, numPixels, self.thresh,
-                                    imgCoords, cimgData.from_buffer(imgData), byref(newData), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        for i in range(self.numThreads):
-            threadPool[i].join()
+        numPixels = imgSize[0] * imgSize[1]
         # psuedoflare
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXPsuedoLensFlare, args=(idx, numPixels,
-                                    flareFilterSettings, imgCoords, byref(newData), byref(newData2), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        for i in range(self.numThreads):
-            threadPool[i].join()
+        # Mostly dark images only need their highlights looked at, so count them
+        # and if there are few enough, work from a list of just those
+        rowData = job.allocate((imgSize[1] + 1) * sizeof(c_longlong))
+        if not job.run(dll.VFXCountHighlights, imgSize[1], self.numThreads,
+                        (imgCoords, byref(highData), byref(rowData), colorData)):
+            return False
+        # Turn the counts for each row into where each row starts in the list
+        rowIndex = (c_longlong * (imgSize[1] + 1)).from_buffer(rowData)
+        for y in range(imgSize[1]):
+            rowIndex[y + 1] += rowIndex[y]
+        numHighlights = rowIndex[imgSize[1]]
+        if numHighlights <= numPixels * SPLAT_MAX_DENSITY:
+            highlightData = job.allocate(max(1, numHighlights) * sizeof(Highlight))
+            if not job.run(dll.VFXCollectHighlights, imgSize[1], self.numThreads,
+                            (imgCoords, byref(highData), byref(highlightData), byref(rowData), colorData)):
+                return False
+            if not job.run(dll.VFXSplatLensFlare, numPixels, self.numThreads,
+                            (flareFilterSettings, imgCoords, byref(highData), byref(highlightData),
+                             byref(rowData), byref(newData2), colorData)):
+                return False
+        elif self.mipGhosts:
+            # Build the pyramid one level at a time, each level is made from the one before
+            mipLevels = GetGhostMipLevels(self.artifactCopies, self.artifactDispersal)
+            mipSizes = GetMipSizes(imgSize, mipLevels)
+            mipPixels = sum(size[0] * size[1] for size in mipSizes[1:])
+            mipData = job.allocate(max(1, mipPixels) * GetBytesPerPixel(colorData))
+            for level in range(1, mipLevels + 1):
+                if not job.run(dll.VFXBuildMipLevel, mipSizes[level][0] * mipSizes[level][1], self.numThreads,
+                                (level, imgCoords, byref(highData), byref(mipData), colorData)):
+                    return False
+            if not job.run(dll.VFXGhostLensFlare, numPixels, self.numThreads,
+                            (flareFilterSettings, mipLevels, imgCoords, byref(highData), byref(mipData),
+                             byref(newData2), colorData)):
+                return False
+        elif not job.run(dll.VFXPsuedoLensFlare, numPixels, self.numThreads,
+                            (flareFilterSettings, imgCoords, byref(highData), byref(newData2), colorData)):
+            return False
         # chromatic aberration
-        threadPool = []
-        idx = 0
-        numPixels = (imgSize[0] * imgSize[1]) // self.numThreads
-        for i in range(self.numThreads):
-            if i == self.numThreads - 1:
-                numPixels = (imgSize[0] * imgSize[1]) - idx # Give the last thread the remainder
-            workerThread = Thread(target=dll.VFXRadialAberration, args=(idx, numPixels,
-                                    aberrationFilterSettings, imgCoords, byref(newData2), byref(newData), colorData,))
-            threadPool.append(workerThread)
-            threadPool[i].start()
-            idx += numPixels
-        for i in range(self.numThreads):
-            threadPool[i].join()
-        return bytes(newData)
+        if not job.run(dll.VFXRadialAberration, numPixels, self.numThreads,
+                        (aberrationFilterSettings, imgCoords, byref(newData2), byref(outData), colorData)):
+            return False
+        return True
+
+    # Artifacts are sampled from all over the image, so it can't be split into bands
+    def getBandOverlap(self, imgSize):
+        return None
+
+    # Highpass, flare, then aberration, plus either the list of highlights or
+    # the mip pyramid which are at most about a stage more
+    def getNumStages(self):
+        return 4
+
+    def blursLayer(self):
+        return True
 
     # Use Krita's built-in filters after everything else
-    def postFilter(self, app, doc, node, colorData):
+    def postFilter(self, app, doc, node, colorData, job):
         blurFilter = app.filter("blur")
         blurConfig = blurFilter.configuration()
         blurConfig.setProperty("halfWidth", self.blurStrength * doc.width())
         blurConfig.setProperty("halfHeight", self.blurStrength * doc.width())
         blurFilter.setConfiguration(blurConfig)
-        blurFilter.apply(node, 0, 0, doc.width(), doc.height())
+        with job.profiler.phase("blur"):
+            blurFilter.apply(node, 0, 0, doc.width(), doc.height())
@@ -0,0 +1,331 @@
+"""
+LensStackWidget.py
+Adds a widget that renders bloom, both lens flares and lens dirt onto one
+layer, thresholding the image once and sharing it between all of them
+"""
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QWidget, QLabel, QSlider, QCheckBox, QVBoxLayout
+from ctypes import *
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords
+from .Streaming import WholeImage
+from .RenderWorker import GetWidgetState, RestoreFilter
+from .BloomWidget import BloomWidget
+from .LensFlareWidget import AnamorphicLensFlareWidget, PseudoLensFlareWidget
+from .LensDirtWidget import LensDirtWidget
+from os import cpu_count
+
+# Box blur passes standing in for Krita's blur, three in each direction come out close
+STACK_BLUR_PASSES = 3
+
+# Box blur a whole layer in place, Krita's blur can only be applied to the finished
+# layer and every effect in the stack needs its own amount of it
+# Returns False if cancelled
+def BlurLayer(layerData, imgSize, colorData, halfWidth, halfHeight, job, numThreads):
+    dll = GetSharedLibrary()
+    imgCoords = Coords(imgSize[0], imgSize[1])
+    blurData = job.allocate(len(layerData))
+    source = layerData
+    target = blurData
+    for halfSize, vertical, numLines in ((halfWidth, 0, imgSize[1]), (halfHeight, 1, imgSize[0])):
+        if halfSize <= 0:
+            continue
+        radius = max(1, round(halfSize / STACK_BLUR_PASSES))
+        for i in range(STACK_BLUR_PASSES):
+            if not job.run(dll.VFXBoxBlurLines, numLines, numThreads,
+                            (radius, vertical, imgCoords, source, target, colorData)):
+                return False
+            source, target = target, source
+    # Passes go back and forth between the buffers, an odd number of them ends in the wrong one
+    if source is not layerData:
+        memmove(layerData, source, len(layerData))
+    return True
+
+# Widget for a stack of lens effects sharing one threshold
+class LensStackWidget(QWidget):
+    def __init__(self, parent=None):
+        super(LensStackWidget, self).__init__(parent)
+
+        self.thresh = 240
+        self.bloom = True
+        self.anamorphic = False
+        self.pseudo = True
+        self.dirt = True
+        self.dirtStrength = 2.0
+        self.numThreads = cpu_count()
+        # Settings of each effect, taken from its own window
+        self.bloomState = {}
+        self.anamorphicState = {}
+        self.pseudoState = {}
+        self.dirtState = {}
+
+        # Hidden copies of each effect's widget, only used to read their settings
+        self.bloomWidget = BloomWidget(self)
+        self.anamorphicWidget = AnamorphicLensFlareWidget(self)
+        self.pseudoWidget = PseudoLensFlareWidget(self)
+        self.dirtWidget = LensDirtWidget(self)
+        for widget in (self.bloomWidget, self.anamorphicWidget, self.pseudoWidget, self.dirtWidget):
+            widget.hide()
+
+        self.threshInfo = QLabel("Threshold: 240", self)
+        self.threshold = QSlider(Qt.Horizontal, self)
+        self.threshold.setRange(0, 255)
+        self.threshold.setValue(240)
+        self.threshold.valueChanged.connect(self.updateThresh)
+
+        self.bloomBox = QCheckBox("Bloom", self)
+        self.bloomBox.setChecked(True)
+        self.bloomBox.stateChanged.connect(self.updateBloom)
+
+        self.anamorphicBox = QCheckBox("Anamorphic lens flare", self)
+        self.anamorphicBox.stateChanged.connect(self.updateAnamorphic)
+
+        self.pseudoBox = QCheckBox("Pseudo lens flare", self)
+        self.pseudoBox.setChecked(True)
+        self.pseudoBox.stateChanged.connect(self.updatePseudo)
+
+        self.dirtBox = QCheckBox("Lens dirt", self)
+        self.dirtBox.setChecked(True)
+        self.dirtBox.stateChanged.connect(self.updateDirt)
+
+        self.dirtInfo = QLabel("Dirt brightness in bloom: 200%", self)
+        self.dirtSlide = QSlider(Qt.Horizontal, self)
+        self.dirtSlide.setRange(0, 1000)
+        self.dirtSlide.setValue(200)
+        self.dirtSlide.valueChanged.connect(self.updateDirtStrength)
+
+        self.noteInfo = QLabel("Everything else is set in each effect's own window", self)
+        self.noteInfo.setWordWrap(True)
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.threshInfo)
+        vbox.addWidget(self.threshold)
+        vbox.addWidget(self.bloomBox)
+        vbox.addWidget(self.anamorphicBox)
+        vbox.addWidget(self.pseudoBox)
+        vbox.addWidget(self.dirtBox)
+        vbox.addWidget(self.dirtInfo)
+        vbox.addWidget(self.dirtSlide)
+        vbox.addWidget(self.noteInfo)
+
+        self.setLayout(vbox)
+        self.show()
+
+    # Update labels and members
+    def updateThresh(self, value):
+        self.threshInfo.setText("Threshold: " + str(value))
+        self.thresh = value
+
+    def updateBloom(self, state):
+        if state == Qt.Checked:
+            self.bloom = True
+        else:
+            self.bloom = False
+
+    def updateAnamorphic(self, state):
+        if state == Qt.Checked:
+            self.anamorphic = True
+        else:
+            self.anamorphic = False
+
+    def updatePseudo(self, state):
+        if state == Qt.Checked:
+            self.pseudo = True
+        else:
+            self.pseudo = False
+
+    def updateDirt(self, state):
+        if state == Qt.Checked:
+            self.dirt = True
+        else:
+            self.dirt = False
+
+    def updateDirtStrength(self, value):
+        self.dirtInfo.setText("Dirt brightness in bloom: " + str(value) + "%")
+        self.dirtStrength = value / 100
+
+    # Required for main window to call into
+    def getWindowName(self):
+        return "Lens Stack"
+
+    def getHelpText(self):
+        return """Renders bloom, anamorphic and pseudo lens flares and lens dirt together onto one layer.
+The image is thresholded once and every effect is made from the same highlights, which is
+much faster than applying each effect to its own layer.
+
+Threshold (0-255)
+    The minimum brightness value for a color to be picked up by
+    any of the effects, used instead of each effect's own threshold
+Bloom/Anamorphic Lens Flare/Pseudo Lens Flare/Lens Dirt
+    Which effects to render. Every other option of an effect is
+    the one last used in that effect's own window
+Dirt Brightness in Bloom (0-1000%)
+    With both bloom and lens dirt on, the dirt is only seen where
+    the bloom lights it up, brightening it by this much. With bloom
+    off the dirt is added on its own
+
+Blurs are done with box blurs that come out close to Krita's blur, since Krita's
+can only blur the whole layer. Lens dirt is always rendered as a mask, and the
+stack always processes the whole image at once"""
+
+    def saveSettings(self, settings):
+        settings.setValue("LS_thresh", self.thresh)
+        if self.bloom:
+            bloom = 1
+        else:
+            bloom = 0
+        settings.setValue("LS_bloom", bloom)
+        if self.anamorphic:
+            anamorphic = 1
+        else:
+            anamorphic = 0
+        settings.setValue("LS_anamorphic", anamorphic)
+        if self.pseudo:
+            pseudo = 1
+        else:
+            pseudo = 0
+        settings.setValue("LS_pseudo", pseudo)
+        if self.dirt:
+            dirt = 1
+        else:
+            dirt = 0
+        settings.setValue("LS_dirt", dirt)
+        settings.setValue("LS_dirtStrength", self.dirtStrength * 100)
+
+    def readSettings(self, settings):
+        self.updateThresh(int(settings.value("LS_thresh", 240)))
+        self.updateDirtStrength(int(settings.value("LS_dirtStrength", 200)))
+        self.bloom = int(settings.value("LS_bloom", 1)) == 1
+        self.anamorphic = int(settings.value("LS_anamorphic", 0)) == 1
+        self.pseudo = int(settings.value("LS_pseudo", 1)) == 1
+        self.dirt = int(settings.value("LS_dirt", 1)) == 1
+        self.numThreads = int(settings.value("G_numThreads", cpu_count()))
+        # Only the plain settings are kept, so the stack can still be sent to a worker process
+        self.bloomWidget.readSettings(settings)
+        self.bloomState = GetWidgetState(self.bloomWidget)
+        self.anamorphicWidget.readSettings(settings)
+        self.anamorphicState = GetWidgetState(self.anamorphicWidget)
+        self.pseudoWidget.readSettings(settings)
+        self.pseudoState = GetWidgetState(self.pseudoWidget)
+        self.dirtWidget.readSettings(settings)
+        self.dirtState = GetWidgetState(self.dirtWidget)
+        # Update interactable UI elements
+        self.threshold.setValue(self.thresh)
+        self.bloomBox.setChecked(self.bloom)
+        self.anamorphicBox.setChecked(self.anamorphic)
+        self.pseudoBox.setChecked(self.pseudo)
+        self.dirtBox.setChecked(self.dirt)
+        self.dirtSlide.setValue(int(self.dirtStrength * 100))
+
+    def getBlendMode(self):
+        return "add"
+
+    # Add an effect's layer into the stack's layer
+    def accumulate(self, layerData, sumData, imgSize, colorData, job, gain, maskData=None, maskGain=0.0):
+        dll = GetSharedLibrary()
+        return job.run(dll.VFXAccumulateLayer, imgSize[0] * imgSize[1], self.numThreads,
+                        (float(gain), float(maskGain), Coords(imgSize[0], imgSize[1]), layerData, maskData, sumData,
+                         colorData))
+
+    # Call into C library to process the image
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        dll = GetSharedLibrary()
+        imgCoords = Coords(imgSize[0], imgSize[1])
+        numPixels = imgSize[0] * imgSize[1]
+        layerBytes = numPixels * GetBytesPerPixel(colorData)
+        # python makes it hard to get a pointer to existing buffers for some reason
+        cimgData = (c_char * len(imgData)).from_buffer(imgData)
+        # Every effect starts from the same highlights
+        highData = job.allocate(layerBytes)
+        if not job.run(dll.VFXHighPass, numPixels, self.numThreads,
+                        (self.thresh, imgCoords, cimgData, highData, colorData)):
+            return None
+        # Each effect is added in as soon as it's done so only one of them is held at a time
+        sumData = job.allocate(layerBytes)
+        maskPointer = None
+        if self.dirt:
+            dirt = RestoreFilter(LensDirtWidget, self.dirtState)
+            filterdata = dirt.getFilterData(imgSize)
+            if not dirt.createShapes(filterdata, imgSize, job):
+                return None
+            mask = dirt.createMask(filterdata, imgSize, colorData, job, WholeImage(imgSize))
+            if mask is None:
+                return None
+            maskData, maskPointer = mask
+            if not self.bloom:
+                dirtData = job.allocate(layerBytes)
+                if not job.run(dll.VFXExpandDirtMask, numPixels, self.numThreads,
+                                (maskPointer, dirtData, colorData)):
+                    return None
+                if not self.accumulate(dirtData, sumData, imgSize, colorData, job, 1):
+                    return None
+                dirtData = None
+                maskPointer = None
+        if self.bloom:
+            bloom = RestoreFilter(BloomWidget, self.bloomState)
+            if bloom.kernel == 0:
+                bloomData = job.allocate(layerBytes)
+                memmove(bloomData, highData, layerBytes)
+                halfSize = bloom.blurStrength * imgSize[0]
+                if not BlurLayer(bloomData, imgSize, colorData, halfSize, halfSize, job, self.numThreads):
+                    return None
+                gain = bloom.power
+            else:
+                bloomData = bloom.convolveHighlights(cimgData, highData, imgSize, colorData, job)
+                if bloomData is None:
+                    return None
+                gain = 1
+            # Dirt is lit up by the bloom over it
+            if not self.accumulate(bloomData, sumData, imgSize, colorData, job, gain, maskPointer, self.dirtStrength):
+                return None
+            bloomData = None
+        if self.anamorphic:
+            anamorphic = RestoreFilter(AnamorphicLensFlareWidget, self.anamorphicState)
+            if anamorphic.expStreak:
+                streakData = anamorphic.renderStreaks(highData, imgSize, colorData, job, WholeImage(imgSize))
+                if streakData is None:
+                    return None
+                gain = 1
+            else:
+                streakData = job.allocate(layerBytes)
+                memmove(streakData, highData, layerBytes)
+                if anamorphic.isHorizontal:
+                    halfWidth = anamorphic.blurStrength * imgSize[0]
+                    halfHeight = 0
+                else:
+                    halfWidth = 0
+                    halfHeight = anamorphic.blurStrength * imgSize[1]
+                if not BlurLayer(streakData, imgSize, colorData, halfWidth, halfHeight, job, self.numThreads):
+                    return None
+                gain = anamorphic.power
+            if not self.accumulate(streakData, sumData, imgSize, colorData, job, gain):
+                return None
+            streakData = None
+        if self.pseudo:
+            pseudo = RestoreFilter(PseudoLensFlareWidget, self.pseudoState)
+            # Last one to use the highlights, so the flare can go back into them
+            if not pseudo.renderFlare(highData, highData, imgSize, colorData, job):
+                return None
+            halfSize = pseudo.blurStrength * imgSize[0]
+            if not BlurLayer(highData, imgSize, colorData, halfSize, halfSize, job, self.numThreads):
+                return None
+            if not self.accumulate(highData, sumData, imgSize, colorData, job, 1):
+                return None
+        return sumData
+
+    # Flares sample from all over the image and bloom and dirt blur across it
+    def getBandOverlap(self, imgSize):
+        return None
+
+    # Highpass, the stack's layer, one effect at a time and its blur, plus either the
+    # pseudo flare's highlights or the bloom kernel's sums
+    def getNumStages(self):
+        if self.bloom and self.bloomState.get("kernel", 0) != 0:
+            return 8
+        return 5
+
+    def blursLayer(self):
+        return False
+
+    # Everything was blurred and added up in applyFilter
+    def postFilter(self, app, doc, node, colorData, job):
+        pass
@@ -11,7 +11,8 @@ import sys
 # Structures for C functions
 class ColorData(Structure):
     _fields_ = [("colorModel", c_int),
-                ("colorDepth", c_int)]
+                ("colorDepth", c_int),
+                ("linearLight", c_char)]
 
 class Coords(Structure):
     _fields_ = [("x", c_longlong),
@@ -28,6 +29,21 @@ class LinearFilterData(Structure):
                 ("direction", c_int),
                 ("biFilter", c_char)]
 
+# Must match RESAMPLE_MAX_TAPS and SPECTRUM_CHANNELS in ChromaticAberration.h
+RESAMPLE_MAX_TAPS = 8
+SPECTRUM_CHANNELS = 5
+
+class ResampleTaps(Structure):
+    _fields_ = [("first", c_longlong),
+                ("count", c_int),
+                ("weights", c_float * RESAMPLE_MAX_TAPS)]
+
+class SpectralSample(Structure):
+    _fields_ = [("scale", c_double),
+                ("red", c_double),
+                ("green", c_double),
+                ("blue", c_double)]
+
 class LensFlareFilterData(Structure):
     _fields_ = [("artifactCopies", c_int),
                 ("artifactDisplacement", c_double),
@@ -35,6 +51,11 @@ class LensFlareFilterData(Structure):
                 ("power", c_double),
                 ("bilinearFilter", c_char)]
 
+class StreakFilterData(Structure):
+    _fields_ = [("angle", c_double),
+                ("length", c_double),
+                ("power", c_double)]
+
 class LensDirtFilterData(Structure):
     _fields_ = [("size", c_int),
                 ("sizeVarience", c_int),
@@ -42,10 +63,37 @@ class LensDirtFilterData(Structure):
                 ("opacityVarience", c_int),
                 ("shape", c_char),
                 ("direction", c_int),
-                ("blur", c_int)]
+                ("blur", c_int),
+                ("softEdge", c_char)]
+
+class Highlight(Structure):
+    _fields_ = [("x", c_longlong),
+                ("r", c_float),
+                ("b", c_float),
+                ("o", c_float),
+                ("l", c_float),
+                ("a", c_float)]
+
+class BloomKernelData(Structure):
+    _fields_ = [("shape", c_char),
+                ("radius", c_int),
+                ("points", c_int),
+                ("angle", c_double)]
+
+class ConvolutionTile(Structure):
+    _fields_ = [("origin", Coords),
+                ("size", c_longlong),
+                ("fftSize", c_longlong),
+                ("radius", c_int),
+                ("pair", c_int)]
+
+class JobControl(Structure):
+    _fields_ = [("progress", c_longlong),
+                ("cancel", c_char)]
 
 # Helper function to translate color model/depth into struct
-def TranslateColorData(colorModel, colorDepth):
+# linearLight makes the C library work on linear light instead of sRGB encoded values
+def TranslateColorData(colorModel, colorDepth, linearLight=False):
     if colorModel == "A":
         mod = 0
     elif colorModel == "RGBA":
@@ -68,16 +116,37 @@ def TranslateColorData(colorModel, colorDepth):
         depth = 1
     elif colorDepth == "F32":
         depth = 2
+    elif colorDepth == "F16":
+        depth = 3
     else:
         return None
-    return ColorData(mod, depth)
+    linear = 0
+    if linearLight:
+        linear = 1
+    return ColorData(mod, depth, linear)
+
+# Krita names its linear profiles with g10 (gamma 1.0) or linear, those don't need converting
+def IsLinearProfile(profileName):
+    name = profileName.lower()
+    return "g10" in name or "linear" in name
 
 def GetBytesPerPixel(colorSpace):
     # Let's face it, this is more interesting than a pair of if/else blocks
     channelLUT = [1,4,4,4,5,2,4]
-    return (channelLUT[colorSpace.colorModel] * pow(2, colorSpace.colorDepth))
+    depthLUT = [1,2,4,2]
+    return (channelLUT[colorSpace.colorModel] * depthLUT[colorSpace.colorDepth])
+
+# Coverage masks are 8 bit for 8 bit layers and 16 bit for deeper ones, like GetMaskSampleSize in Utils.c
+def GetMaskSampleSize(colorSpace):
+    return 1 if colorSpace.colorDepth == 0 else 2
+
+# Only loaded once, the color tables only need to be built the first time
+sharedLibrary = None
 
 def GetSharedLibrary():
+    global sharedLibrary
+    if sharedLibrary is not None:
+        return sharedLibrary
     # Determine platform
     plat = sys.platform
     if plat == "win32":
@@ -97,13 +166,71 @@ def GetSharedLibrary():
         libPath += "32.so"
     else:
         libPath += "64.so"
+    try:
+        sharedLibrary = LoadSharedLibrary(libPath)
+    except (OSError, AttributeError) as error:
+        # No build of the library for this system, or an old one missing newer kernels,
+        # fall back to the much slower NumPy kernels but say why
+        sharedLibrary = LoadNumPyLibrary()
+        if sharedLibrary is None:
+            raise error
+        print("VFX: couldn't load " + libPath + " (" + str(error) + "), using the much slower NumPy kernels instead",
+              file=sys.stderr)
+    return sharedLibrary
+
+# Which kernels were loaded, the library's file name or the NumPy module's name
+def GetLibraryName(library):
+    libPath = getattr(library, "_name", None)
+    if libPath:
+        return os.path.basename(libPath)
+    return library.__name__
+
+# The library's kernels written with NumPy, None if NumPy isn't installed either
+def LoadNumPyLibrary():
+    try:
+        from . import NumPyLibrary
+    except ImportError:
+        return None
+    return NumPyLibrary
+
+# Load a build of the library from anywhere, like a reference build to compare against
+def LoadSharedLibrary(libPath):
     # Load and set argtypes
     dll = CDLL(libPath)
-    dll.VFXLinearAberration.argtypes = [c_longlong, c_longlong, LinearFilterData, Coords, c_void_p, c_void_p, ColorData]
-    dll.VFXRadialAberration.argtypes = [c_longlong, c_longlong, RadialFilterData, Coords, c_void_p, c_void_p, ColorData]
-    dll.VFXPsuedoLensFlare.argtypes = [c_longlong, c_longlong, LensFlareFilterData, Coords, c_void_p, c_void_p, ColorData]
-    dll.VFXPower.argtypes = [c_longlong, c_longlong, c_int, Coords, c_void_p, c_void_p, ColorData]
-    dll.VFXHighPass.argtypes = [c_longlong, c_longlong, c_int, Coords, c_void_p, c_void_p, ColorData]
-    dll.VFXCreateDirtShapes.argtypes = [c_longlong, c_longlong, LensDirtFilterData, Coords, c_uint, c_void_p]
-    dll.VFXRenderLensDirt.argtypes = [c_longlong, c_longlong, c_longlong, LensDirtFilterData, Coords, c_void_p, c_void_p, ColorData]
+    dll.VFXLinearAberration.argtypes = [c_longlong, c_longlong, LinearFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXRadialAberration.argtypes = [c_longlong, c_longlong, RadialFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXLoadSpectrumPixels.argtypes = [c_longlong, c_longlong, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXBuildResampleTaps.argtypes = [c_longlong, c_longlong, c_double, c_longlong, c_void_p, POINTER(JobControl)]
+    dll.VFXResampleRows.argtypes = [c_longlong, c_longlong, SpectralSample, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXAccumulateSpectralSample.argtypes = [c_longlong, c_longlong, SpectralSample, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXFinishSpectrum.argtypes = [c_longlong, c_longlong, SpectralSample, c_int, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXPsuedoLensFlare.argtypes = [c_longlong, c_longlong, LensFlareFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXBuildMipLevel.argtypes = [c_longlong, c_longlong, c_int, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXGhostLensFlare.argtypes = [c_longlong, c_longlong, LensFlareFilterData, c_int, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXSplatLensFlare.argtypes = [c_longlong, c_longlong, LensFlareFilterData, Coords, c_void_p, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXGetStreakLines.argtypes = [Coords, c_double]
+    dll.VFXGetStreakLines.restype = c_longlong
+    dll.VFXStreak.argtypes = [c_longlong, c_longlong, StreakFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXPower.argtypes = [c_longlong, c_longlong, c_int, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXHighPass.argtypes = [c_longlong, c_longlong, c_int, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXCountHighlights.argtypes = [c_longlong, c_longlong, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXCollectHighlights.argtypes = [c_longlong, c_longlong, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXCreateDirtShapes.argtypes = [c_longlong, c_longlong, LensDirtFilterData, Coords, c_uint, c_void_p, POINTER(JobControl)]
+    dll.VFXRenderLensDirt.argtypes = [c_longlong, c_longlong, c_longlong, LensDirtFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXRenderDirtMask.argtypes = [c_longlong, c_longlong, c_longlong, LensDirtFilterData, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXBlurDirtMask.argtypes = [c_longlong, c_longlong, c_int, c_char, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXExpandDirtMask.argtypes = [c_longlong, c_longlong, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXMakeBloomKernel.argtypes = [c_longlong, c_longlong, BloomKernelData, c_longlong, c_void_p, POINTER(JobControl)]
+    dll.VFXTransformColumns.argtypes = [c_longlong, c_longlong, c_longlong, c_void_p, POINTER(JobControl)]
+    dll.VFXLoadTileRows.argtypes = [c_longlong, c_longlong, ConvolutionTile, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXConvolveTileColumns.argtypes = [c_longlong, c_longlong, ConvolutionTile, c_void_p, c_void_p, POINTER(JobControl)]
+    dll.VFXAccumulateTileRows.argtypes = [c_longlong, c_longlong, ConvolutionTile, Coords, c_void_p, c_void_p, POINTER(JobControl)]
+    dll.VFXFinishConvolution.argtypes = [c_longlong, c_longlong, c_double, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXBoxBlurLines.argtypes = [c_longlong, c_longlong, c_int, c_char, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXCompositeLayer.argtypes = [c_longlong, c_longlong, c_char, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXAccumulateLayer.argtypes = [c_longlong, c_longlong, c_double, c_double, Coords, c_void_p, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXFindEmptyTiles.argtypes = [c_longlong, c_longlong, c_int, c_char, Coords, c_void_p, c_void_p, ColorData, POINTER(JobControl)]
+    dll.VFXUnfilterPNG.argtypes = [c_void_p, c_longlong, c_longlong, c_int, c_void_p]
+    dll.VFXUnfilterPNG.restype = c_byte
+    dll.VFXInitColorTables()
     return dll
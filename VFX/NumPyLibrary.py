@@ -0,0 +1,1277 @@
+"""
+NumPyLibrary.py
+The shared C library's kernels written with NumPy, for when the library
+can't be loaded on a system. Every VFX function takes the same arguments as
+the C one and works on whole blocks of pixels or lines at a time, so it's a
+lot slower than the library but still usable, and follows the reference
+build of the library (VFX_REFERENCE) closely enough to check it against
+"""
+from ctypes import *
+import math
+import numpy as np
+from .LibHandler import Coords, Highlight, ResampleTaps, RESAMPLE_MAX_TAPS, SPECTRUM_CHANNELS, GetBytesPerPixel
+
+# Pixels each block of a kernel works on, big enough that NumPy's overhead per call
+# doesn't matter and small enough that the temporary arrays don't take much memory
+PIXEL_BLOCK = 65536
+
+# Dirt shapes are looped over for every block, so those blocks are bigger
+DIRT_BLOCK = 1048576
+
+# Pixel channels, in the order of the C library's Pixel struct
+CHANNEL_R = 0
+CHANNEL_B = 1
+CHANNEL_O = 2
+CHANNEL_L = 3
+CHANNEL_A = 4
+
+# ColorModel and ColorDepth from Utils.h
+MODEL_A = 0
+MODEL_RGBA = 1
+MODEL_XYZA = 2
+MODEL_LABA = 3
+MODEL_CMYKA = 4
+MODEL_GRAYA = 5
+MODEL_YCBCRA = 6
+DEPTH_U8 = 0
+DEPTH_U16 = 1
+DEPTH_F32 = 2
+DEPTH_F16 = 3
+
+# KernelShape from Convolution.h and BlendMode from Compositing.h
+STAR_BURST = 0
+APERTURE = 1
+BLEND_ADD = 1
+BLEND_SUBTRACT = 2
+
+NUM_CHANNELS = [1, 4, 4, 4, 5, 2, 4]
+SAMPLE_TYPES = [np.uint8, np.uint16, np.float32, np.float16]
+HIGHLIGHT_TYPE = np.dtype(Highlight)
+TAPS_TYPE = np.dtype(ResampleTaps)
+
+# Stored channel each Pixel channel is read from, None if the model doesn't have it
+# CMYKA falls through to GRAYA when reading in Utils.c, so K and alpha come from C and M
+READ_ORDERS = {
+    MODEL_A: [None, None, None, None, 0],
+    MODEL_XYZA: [0, 2, 1, None, 3],
+    MODEL_LABA: [1, 2, None, 0, 3],
+    MODEL_CMYKA: [1, 0, 2, 0, 1],
+    MODEL_GRAYA: [None, None, None, 0, 1],
+    MODEL_YCBCRA: [2, 1, None, 0, 3],
+}
+
+# Pixel channel written to each stored channel
+WRITE_ORDERS = {
+    MODEL_A: [CHANNEL_A],
+    MODEL_XYZA: [CHANNEL_R, CHANNEL_O, CHANNEL_B, CHANNEL_A],
+    MODEL_LABA: [CHANNEL_L, CHANNEL_R, CHANNEL_B, CHANNEL_A],
+    MODEL_CMYKA: [CHANNEL_B, CHANNEL_R, CHANNEL_O, CHANNEL_L, CHANNEL_A],
+    MODEL_GRAYA: [CHANNEL_L, CHANNEL_A],
+    MODEL_YCBCRA: [CHANNEL_L, CHANNEL_B, CHANNEL_R, CHANNEL_A],
+}
+
+# Integer RGBA is stored BGRA, float RGBA in order like XYZA
+INT_RGBA_READ_ORDER = [2, 0, 1, None, 3]
+INT_RGBA_WRITE_ORDER = [CHANNEL_B, CHANNEL_O, CHANNEL_R, CHANNEL_A]
+
+# Arguments come in as ctypes values, structures or plain python values
+def AsInt(value):
+    value = getattr(value, "value", value)
+    if isinstance(value, bytes):
+        return value[0] if value else 0
+    return int(value)
+
+def AsFloat(value):
+    return float(getattr(value, "value", value))
+
+def AsCoords(imgSize):
+    if isinstance(imgSize, Coords):
+        return imgSize.x, imgSize.y
+    return int(imgSize[0]), int(imgSize[1])
+
+# Address of a buffer passed as an address, c_void_p, byref() or a ctypes object, 0 for NULL
+def GetAddress(pointer):
+    if pointer is None:
+        return 0
+    if isinstance(pointer, int):
+        return pointer
+    if isinstance(pointer, c_void_p):
+        return pointer.value or 0
+    if hasattr(pointer, "_obj"):
+        return addressof(pointer._obj)
+    return addressof(pointer)
+
+def IsNull(pointer):
+    if isinstance(pointer, (bytes, bytearray)):
+        return False
+    return GetAddress(pointer) == 0
+
+# Items first to first + count of a buffer as an array, without copying
+# Band buffers are passed with their address moved back to where row 0 would be,
+# like the C library, so only the part that's used can be looked at
+def GetArray(pointer, dtype, first, count):
+    dtype = np.dtype(dtype)
+    if isinstance(pointer, (bytes, bytearray)):
+        return np.frombuffer(pointer, dtype, count, first * dtype.itemsize)
+    buffer = (c_char * (count * dtype.itemsize)).from_address(GetAddress(pointer) + (first * dtype.itemsize))
+    return np.frombuffer(buffer, dtype)
+
+# The JobControl a kernel was given, through byref() or a pointer
+def GetJob(control):
+    if control is None:
+        return None
+    if hasattr(control, "_obj"):
+        return control._obj
+    if hasattr(control, "contents"):
+        return control.contents
+    return control
+
+# Report progress and check if the job was cancelled, like UpdateJob in Utils.c
+def UpdateJob(control, progress):
+    job = GetJob(control)
+    if job is None:
+        return False
+    job.progress = progress
+    return AsInt(job.cancel) != 0
+
+# Split items start to start + n into blocks, checking in with python before each
+# Stops without the final update if cancelled, like the C kernels
+def Blocks(start, n, control, blockSize):
+    for first in range(start, start + n, blockSize):
+        if UpdateJob(control, first - start):
+            return
+        yield first, min(blockSize, start + n - first)
+    UpdateJob(control, n)
+
+# Lines of a kernel that works on whole lines to put in one block
+def LineBlock(length):
+    return max(1, PIXEL_BLOCK // max(1, length))
+
+def DegreeToRadian(deg):
+    return deg * (math.acos(-1) / 180.0)
+
+def IsFloatDepth(colorData):
+    return colorData.colorDepth in (DEPTH_F32, DEPTH_F16)
+
+def GetColorSpaceMax(colorData):
+    if colorData.colorDepth == DEPTH_U8:
+        return 255.0
+    if colorData.colorDepth == DEPTH_U16:
+        return 65535.0
+    if colorData.colorModel in (MODEL_A, MODEL_RGBA, MODEL_GRAYA):
+        return 1.0
+    return 255.0
+
+def UsesLinearLight(colorData):
+    return AsInt(colorData.linearLight) != 0 and colorData.colorModel in (MODEL_RGBA, MODEL_GRAYA)
+
+# Stored channels that are sRGB encoded, alpha never is
+def GetEncodedChannels(colorData):
+    return [0, 1, 2] if colorData.colorModel == MODEL_RGBA else [0]
+
+def GetReadOrder(colorData):
+    if colorData.colorModel == MODEL_RGBA:
+        return READ_ORDERS[MODEL_XYZA] if IsFloatDepth(colorData) else INT_RGBA_READ_ORDER
+    return READ_ORDERS[colorData.colorModel]
+
+def GetWriteOrder(colorData):
+    if colorData.colorModel == MODEL_RGBA:
+        return WRITE_ORDERS[MODEL_XYZA] if IsFloatDepth(colorData) else INT_RGBA_WRITE_ORDER
+    return WRITE_ORDERS[colorData.colorModel]
+
+# Exact sRGB transfer functions on values in the range 0-max, same as the reference build
+def SRGBToLinear(values, colorMax):
+    scaled = values / colorMax
+    with np.errstate(invalid="ignore"):
+        linear = np.where(scaled <= 0.04045, scaled / 12.92, ((scaled + 0.055) / 1.055) ** 2.4)
+    return np.where(values <= 0, 0.0, linear * colorMax)
+
+def LinearToSRGB(values, colorData):
+    colorMax = GetColorSpaceMax(colorData)
+    scaled = values / colorMax
+    with np.errstate(invalid="ignore"):
+        encoded = np.where(scaled <= 0.0031308, scaled * 12.92, (1.055 * (scaled ** (1.0 / 2.4))) - 0.055) * colorMax
+    if not IsFloatDepth(colorData):
+        # Integer depths are rounded the same as the C library's tables are
+        encoded = np.where(values >= colorMax, colorMax, np.floor(encoded + 0.5))
+    return np.where(values <= 0, 0.0, encoded)
+
+# Stored channels, one row per pixel, into Pixel channels
+def ArrangeChannels(samples, colorData):
+    if UsesLinearLight(colorData):
+        encoded = GetEncodedChannels(colorData)
+        samples[..., encoded] = SRGBToLinear(samples[..., encoded], GetColorSpaceMax(colorData))
+    pixels = np.zeros(samples.shape[:-1] + (5,))
+    for channel, stored in enumerate(GetReadOrder(colorData)):
+        if stored is not None:
+            pixels[..., channel] = samples[..., stored]
+    return pixels
+
+# Pixels first to first + count of an image
+def ReadPixels(imgData, colorData, first, count):
+    numChannels = NUM_CHANNELS[colorData.colorModel]
+    samples = GetArray(imgData, SAMPLE_TYPES[colorData.colorDepth], first * numChannels, count * numChannels)
+    return ArrangeChannels(samples.reshape(count, numChannels).astype(np.float64), colorData)
+
+# Pixels at any indices of an image, only the range between the first and last is looked at
+def GatherPixels(imgData, colorData, indices):
+    if indices.size == 0:
+        return np.zeros(indices.shape + (5,))
+    numChannels = NUM_CHANNELS[colorData.colorModel]
+    low = int(indices.min())
+    high = int(indices.max())
+    samples = GetArray(imgData, SAMPLE_TYPES[colorData.colorDepth], low * numChannels, (high - low + 1) * numChannels)
+    samples = samples.reshape(-1, numChannels)[indices - low]
+    return ArrangeChannels(samples.astype(np.float64), colorData)
+
+# Pixel channels into stored channels, in the color depth's type
+def EncodePixels(pixels, colorData):
+    samples = pixels[..., GetWriteOrder(colorData)]
+    if UsesLinearLight(colorData):
+        encoded = GetEncodedChannels(colorData)
+        samples[..., encoded] = LinearToSRGB(samples[..., encoded], colorData)
+    sampleType = SAMPLE_TYPES[colorData.colorDepth]
+    if IsFloatDepth(colorData):
+        # Rounded to a float first, like the C library, then to a half
+        return samples.astype(np.float32).astype(sampleType)
+    # Truncated and wrapped around the same as the C casts
+    with np.errstate(invalid="ignore"):
+        return samples.astype(np.int64).astype(sampleType)
+
+def WritePixels(outData, colorData, first, pixels):
+    numChannels = NUM_CHANNELS[colorData.colorModel]
+    out = GetArray(outData, SAMPLE_TYPES[colorData.colorDepth], first * numChannels, len(pixels) * numChannels)
+    out[:] = EncodePixels(pixels, colorData).reshape(-1)
+
+def ScatterPixels(outData, colorData, indices, pixels):
+    if indices.size == 0:
+        return
+    numChannels = NUM_CHANNELS[colorData.colorModel]
+    low = int(indices.min())
+    high = int(indices.max())
+    out = GetArray(outData, SAMPLE_TYPES[colorData.colorDepth], low * numChannels, (high - low + 1) * numChannels)
+    out.reshape(-1, numChannels)[indices - low] = EncodePixels(pixels, colorData)
+
+# Values that aren't numbers stay that way, like ClampToColorSpace
+def Clamp(pixels, colorMax):
+    return np.clip(pixels, 0, colorMax)
+
+# Bilinear samples at any positions, clamped to the image, like SampleAt in the reference build
+def SampleAt(imgData, colorData, imgSize, x, y, interpolate):
+    width, height = imgSize
+    x = np.where(x >= width, width - 1, np.where(x < 0, 0, x))
+    y = np.where(y >= height, height - 1, np.where(y < 0, 0, y))
+    # Positions that aren't numbers would read from outside the image in C, they get the first pixel
+    x = np.nan_to_num(x)
+    y = np.nan_to_num(y)
+    x0 = np.floor(x).astype(np.int64)
+    y0 = np.floor(y).astype(np.int64)
+    base = GatherPixels(imgData, colorData, (y0 * width) + x0)
+    if not interpolate:
+        return base
+    fracX = x - x0
+    fracY = y - y0
+    blendY = (fracY > 0.00001) & (y0 < height - 1)
+    blendX = (fracX > 0.00001) & (x0 < width - 1)
+    fracY = np.where(blendY, fracY, 0.0)[:, None]
+    fracX = np.where(blendX, fracX, 0.0)[:, None]
+    y1 = np.where(blendY, y0 + 1, y0)
+    x1 = np.where(blendX, x0 + 1, x0)
+    left = (base * (1.0 - fracY)) + (GatherPixels(imgData, colorData, (y1 * width) + x0) * fracY)
+    right = ((GatherPixels(imgData, colorData, (y0 * width) + x1) * (1.0 - fracY)) +
+             (GatherPixels(imgData, colorData, (y1 * width) + x1) * fracY))
+    return (left * (1.0 - fracX)) + (right * fracX)
+
+# Positions of pixels first to first + count
+def PixelPositions(first, count, width):
+    indices = np.arange(first, first + count, dtype=np.int64)
+    return indices % width, indices // width
+
+def VFXInitColorTables():
+    # The exact curves are used, so there are no tables to fill
+    pass
+
+def VFXPower(start, n, power, imgSize, imgData, outData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    power = AsInt(power)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        pixels = ReadPixels(imgData, colorData, first, count)
+        WritePixels(outData, colorData, first, Clamp(pixels * power, colorMax))
+
+def VFXHighPass(start, n, threshold, imgSize, imgData, outData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    scaledThresh = (AsInt(threshold) / 255.0) * colorMax
+    if UsesLinearLight(colorData):
+        scaledThresh = float(SRGBToLinear(np.float64(scaledThresh), colorMax))
+    scale = colorMax / ((colorMax + 1) - scaledThresh)
+    model = colorData.colorModel
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        pixels = ReadPixels(imgData, colorData, first, count)
+        out = np.zeros_like(pixels)
+        colors = pixels[:, :CHANNEL_A]
+        if model in (MODEL_RGBA, MODEL_XYZA, MODEL_GRAYA, MODEL_CMYKA):
+            out[:, :CHANNEL_A] = np.where(colors > scaledThresh, colors - scaledThresh, 0.0) * scale
+        elif model in (MODEL_LABA, MODEL_YCBCRA):
+            out[:, :CHANNEL_A] = (colors * scaledThresh) + (scaledThresh / 2.0)
+            out[:, CHANNEL_L] = (pixels[:, CHANNEL_L] - scaledThresh) * scale
+        out[:, CHANNEL_A] = pixels[:, CHANNEL_A]
+        WritePixels(outData, colorData, first, Clamp(out, colorMax))
+
+# Highpassed pixels with no color left can't add anything to a flare
+def IsHighlight(pixels):
+    return (pixels[..., :CHANNEL_A] > 0).any(axis=-1)
+
+def VFXCountHighlights(start, n, imgSize, imgData, rowData, colorData, control):
+    width, height = AsCoords(imgSize)
+    rowIndex = GetArray(rowData, np.int64, 0, height + 1)
+    for first, count in Blocks(start, n, control, LineBlock(width)):
+        pixels = ReadPixels(imgData, colorData, first * width, count * width)
+        rowIndex[first + 1:first + count + 1] = IsHighlight(pixels).reshape(count, width).sum(axis=1)
+
+def VFXCollectHighlights(start, n, imgSize, imgData, highlightData, rowData, colorData, control):
+    width, height = AsCoords(imgSize)
+    rowIndex = GetArray(rowData, np.int64, 0, height + 1)
+    for first, count in Blocks(start, n, control, LineBlock(width)):
+        pixels = ReadPixels(imgData, colorData, first * width, count * width)
+        found = np.nonzero(IsHighlight(pixels))[0]
+        # Rows are counted in order, so the block's highlights are all together
+        highlights = GetArray(highlightData, HIGHLIGHT_TYPE, int(rowIndex[first]), len(found))
+        highlights["x"] = found % width
+        for name, channel in (("r", CHANNEL_R), ("b", CHANNEL_B), ("o", CHANNEL_O), ("l", CHANNEL_L), ("a", CHANNEL_A)):
+            highlights[name] = pixels[found, channel]
+
+# Red from vec ahead of each pixel and blue from vec behind it, like ApplyOnePixel
+def AberratePixels(x, y, vecA, vecB, imgSize, imgData, colorData, interpolate):
+    pixels = GatherPixels(imgData, colorData, (y * imgSize[0]) + x)
+    red = SampleAt(imgData, colorData, imgSize, x + vecA, y + vecB, interpolate)
+    blue = SampleAt(imgData, colorData, imgSize, x - vecA, y - vecB, interpolate)
+    pixels[:, CHANNEL_A] = (pixels[:, CHANNEL_A] + red[:, CHANNEL_A] + blue[:, CHANNEL_A]) / 3.0
+    pixels[:, CHANNEL_R] = red[:, CHANNEL_R]
+    pixels[:, CHANNEL_B] = blue[:, CHANNEL_B]
+    return pixels
+
+def VFXLinearAberration(start, n, filterData, imgSize, imgData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    rad = DegreeToRadian(filterData.direction)
+    vecA = (-1 * math.sin(rad)) * filterData.power
+    vecB = math.cos(rad) * filterData.power
+    interpolate = AsInt(filterData.biFilter)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, imgSize[0])
+        pixels = AberratePixels(x, y, vecA, vecB, imgSize, imgData, colorData, interpolate)
+        WritePixels(outData, colorData, first, Clamp(pixels, colorMax))
+
+def VFXRadialAberration(start, n, filterData, imgSize, imgData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    centerA = float((imgSize[0] - 1) // 2)
+    centerB = float((imgSize[1] - 1) // 2)
+    centerLen = math.sqrt((centerA * centerA) + (centerB * centerB))
+    deadZone = filterData.deadzone / 100.0
+    interpolate = AsInt(filterData.biFilter)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, imgSize[0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            displaceA = (x - centerA) * (1.0 / centerLen)
+            displaceB = (y - centerB) * (1.0 / centerLen)
+        length = np.sqrt((displaceA * displaceA) + (displaceB * displaceB))
+        inDeadZone = length < deadZone
+        # (1.0 / 1.0-deadZone) in the C library works out to 1 - deadZone
+        factor = (length - deadZone) * (1.0 - deadZone)
+        displaceA = displaceA * factor
+        displaceB = displaceB * factor
+        if AsInt(filterData.expFalloff) != 0:
+            length = np.sqrt((displaceA * displaceA) + (displaceB * displaceB))
+            displaceA = displaceA * length
+            displaceB = displaceB * length
+        displaceA = displaceA * filterData.power
+        displaceB = displaceB * filterData.power
+        pixels = np.empty((count, 5))
+        # The dead zone is copied without clamping
+        pixels[inDeadZone] = GatherPixels(imgData, colorData, (y[inDeadZone] * imgSize[0]) + x[inDeadZone])
+        moved = ~inDeadZone
+        pixels[moved] = Clamp(AberratePixels(x[moved], y[moved], displaceA[moved], displaceB[moved], imgSize, imgData,
+                                             colorData, interpolate), colorMax)
+        WritePixels(outData, colorData, first, pixels)
+
+# Tint of each Pixel channel for a sample, channels the color model doesn't have are 0
+def GetChannelTints(sample, colorData):
+    tints = [np.float32(sample.red), np.float32(sample.blue), np.float32(sample.green), np.float32(sample.green),
+             np.float32(1)]
+    model = colorData.colorModel
+    if model == MODEL_A:
+        tints[:CHANNEL_A] = [np.float32(0)] * CHANNEL_A
+    elif model in (MODEL_RGBA, MODEL_XYZA):
+        tints[CHANNEL_L] = np.float32(0)
+    elif model in (MODEL_LABA, MODEL_YCBCRA):
+        tints[CHANNEL_O] = np.float32(0)
+    elif model == MODEL_GRAYA:
+        tints[CHANNEL_R] = tints[CHANNEL_B] = tints[CHANNEL_O] = np.float32(0)
+    return tints
+
+def GetPlanes(floatData, imgSize):
+    width, height = imgSize
+    return GetArray(floatData, np.float32, 0, SPECTRUM_CHANNELS * width * height).reshape(SPECTRUM_CHANNELS, height,
+                                                                                          width)
+
+def VFXLoadSpectrumPixels(start, n, imgSize, imgData, floatData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    planes = GetPlanes(floatData, imgSize).reshape(SPECTRUM_CHANNELS, -1)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        planes[:, first:first + count] = ReadPixels(imgData, colorData, first, count).T
+
+def VFXBuildResampleTaps(start, n, scale, length, tapData, control):
+    scale = AsFloat(scale)
+    length = AsInt(length)
+    taps = GetArray(tapData, TAPS_TYPE, start, n)
+    center = (length - 1) / 2.0
+    # Half of the widest filter that still fits in RESAMPLE_MAX_TAPS
+    radius = min(scale if scale > 1.0 else 1.0, (RESAMPLE_MAX_TAPS - 1) / 2.0)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        source = center + ((np.arange(first, first + count) - center) * scale)
+        low = np.ceil(source - radius).astype(np.int64)
+        high = np.floor(source + radius).astype(np.int64)
+        # Pixels past the edges are the edge pixel, like SampleAt
+        firstTap = np.clip(low, 0, length - 1)
+        weights = np.zeros((count, RESAMPLE_MAX_TAPS), np.float32)
+        counts = np.zeros(count, np.int32)
+        total = np.zeros(count)
+        rows = np.arange(count)
+        for k in range(int((high - low).max()) + 1):
+            tap = low + k
+            weight = 1.0 - (np.abs(tap - source) / radius)
+            slot = np.clip(tap, 0, length - 1) - firstTap
+            used = (tap <= high) & (weight > 0) & (slot < RESAMPLE_MAX_TAPS)
+            weights[rows[used], slot[used]] += weight[used].astype(np.float32)
+            counts = np.where(used, np.maximum(counts, slot + 1), counts)
+            total += np.where(used, weight, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            normalized = (weights / total[:, None]).astype(np.float32)
+        weights = np.where(np.arange(RESAMPLE_MAX_TAPS) < counts[:, None], normalized, weights)
+        block = taps[first - start:first - start + count]
+        block["first"] = firstTap
+        block["count"] = counts
+        block["weights"] = weights
+
+def VFXResampleRows(start, n, sample, imgSize, tapData, floatData, outData, colorData, control):
+    width, height = AsCoords(imgSize)
+    taps = GetArray(tapData, TAPS_TYPE, 0, width)
+    planes = GetPlanes(floatData, (width, height))
+    outPlanes = GetPlanes(outData, (width, height))
+    # Weights past a tap's count are 0, so every column can blend the same number of taps
+    numTaps = max(1, int(taps["count"].max()))
+    columns = np.minimum(taps["first"][:, None] + np.arange(numTaps), width - 1)
+    weights = taps["weights"][:, :numTaps]
+    tints = GetChannelTints(sample, colorData)
+    for first, count in Blocks(start, n, control, LineBlock(width * numTaps)):
+        for channel in range(SPECTRUM_CHANNELS):
+            if tints[channel] == 0:
+                continue
+            rows = planes[channel, first:first + count]
+            outPlanes[channel, first:first + count] = (rows[:, columns] * weights).sum(axis=2)
+
+def VFXAccumulateSpectralSample(start, n, sample, imgSize, tapData, floatData, sumData, colorData, control):
+    width, height = AsCoords(imgSize)
+    taps = GetArray(tapData, TAPS_TYPE, 0, height)
+    planes = GetPlanes(floatData, (width, height))
+    sums = GetPlanes(sumData, (width, height))
+    tints = GetChannelTints(sample, colorData)
+    numTaps = max(1, int(taps["count"].max()))
+    for first, count in Blocks(start, n, control, LineBlock(width * numTaps)):
+        blockTaps = taps[first:first + count]
+        sourceRows = np.minimum(blockTaps["first"][:, None] + np.arange(numTaps), height - 1)
+        for channel in range(SPECTRUM_CHANNELS):
+            if tints[channel] == 0:
+                continue
+            weights = tints[channel] * blockTaps["weights"][:, :numTaps]
+            sums[channel, first:first + count] += (planes[channel][sourceRows] * weights[:, :, None]).sum(axis=1)
+
+def VFXFinishSpectrum(start, n, totals, numSamples, imgSize, sumData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    sums = GetPlanes(sumData, imgSize).reshape(SPECTRUM_CHANNELS, -1)
+    red = totals.red if totals.red > 0 else 1
+    green = totals.green if totals.green > 0 else 1
+    blue = totals.blue if totals.blue > 0 else 1
+    numSamples = AsInt(numSamples)
+    divisors = np.array([red, blue, green, green, numSamples if numSamples > 0 else 1], np.float64)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        pixels = sums[:, first:first + count].T.astype(np.float64) / divisors
+        WritePixels(outData, colorData, first, Clamp(pixels, colorMax))
+
+# Flare settings as python values
+def GetFlareSettings(filterData):
+    return (AsInt(filterData.artifactCopies), AsFloat(filterData.artifactDisplacement),
+            AsInt(filterData.haloDisplacement), AsFloat(filterData.power), AsInt(filterData.bilinearFilter))
+
+# Add the halo to the artifacts, apply power and write, the same for every version of the flare
+def FinishFlare(first, artifacts, x, y, filterData, imgSize, imgData, outData, colorData):
+    copies, displacement, haloDisplacement, power, interpolate = GetFlareSettings(filterData)
+    width, height = imgSize
+    colorMax = GetColorSpaceMax(colorData)
+    centerA = (width - 1) / 2
+    centerB = (height - 1) / 2
+    centerLen = math.sqrt((centerA * centerA) + (centerB * centerB))
+    coordA = float(width) - x - 1
+    coordB = float(height) - y - 1
+    dirA = (centerA - coordA) * displacement
+    dirB = (centerB - coordB) * displacement
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dirLen = np.sqrt((dirA * dirA) + (dirB * dirB))
+        haloA = coordA + ((dirA * (1.0 / dirLen)) * haloDisplacement)
+        haloB = coordB + ((dirB * (1.0 / dirLen)) * haloDisplacement)
+        haloWeight = (1 - (np.sqrt(((haloA - centerA) ** 2) + ((haloB - centerB) ** 2)) / centerLen)) ** 5
+    halo = SampleAt(imgData, colorData, imgSize, haloA, haloB, interpolate)
+    haloAlpha = halo[:, CHANNEL_A] / colorMax
+    pixels = artifacts + ((halo * haloWeight[:, None]) * haloAlpha[:, None])
+    pixels = Clamp(pixels * power, colorMax)
+    pixels[:, CHANNEL_A] = colorMax
+    WritePixels(outData, colorData, first, pixels)
+
+def VFXPsuedoLensFlare(start, n, filterData, imgSize, imgData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    copies, displacement, haloDisplacement, power, interpolate = GetFlareSettings(filterData)
+    colorMax = GetColorSpaceMax(colorData)
+    centerA = (imgSize[0] - 1) / 2
+    centerB = (imgSize[1] - 1) / 2
+    centerLen = math.sqrt((centerA * centerA) + (centerB * centerB))
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, imgSize[0])
+        coordA = float(imgSize[0]) - x - 1
+        coordB = float(imgSize[1]) - y - 1
+        dirA = (centerA - coordA) * displacement
+        dirB = (centerB - coordB) * displacement
+        artifacts = np.zeros((count, 5))
+        for j in range(copies):
+            offsetA = coordA + (dirA * float(j))
+            offsetB = coordB + (dirB * float(j))
+            sample = SampleAt(imgData, colorData, imgSize, offsetA, offsetB, interpolate)
+            alpha = sample[:, CHANNEL_A] / colorMax
+            weight = (1 - (np.sqrt(((offsetA - centerA) ** 2) + ((offsetB - centerB) ** 2)) / centerLen)) ** 10
+            artifacts += (sample * weight[:, None]) * alpha[:, None]
+        FinishFlare(first, artifacts, x, y, filterData, imgSize, imgData, outData, colorData)
+
+# Size of a mip level, each level is half the size of the one before, rounded up
+def GetMipSize(imgSize, level):
+    width, height = imgSize
+    for i in range(level):
+        width = (width + 1) // 2
+        height = (height + 1) // 2
+    return width, height
+
+# Where a mip level's pixels start, level 0 is the image itself
+def GetMipData(level, imgSize, imgData, mipData, colorData):
+    if level == 0:
+        return imgData
+    offset = 0
+    for i in range(1, level):
+        size = GetMipSize(imgSize, i)
+        offset += size[0] * size[1]
+    return GetAddress(mipData) + (offset * GetBytesPerPixel(colorData))
+
+def VFXBuildMipLevel(start, n, level, imgSize, imgData, mipData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    level = AsInt(level)
+    srcWidth, srcHeight = GetMipSize(imgSize, level - 1)
+    dstWidth = GetMipSize(imgSize, level)[0]
+    srcData = GetMipData(level - 1, imgSize, imgData, mipData, colorData)
+    dstData = GetMipData(level, imgSize, imgData, mipData, colorData)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, dstWidth)
+        # Odd sized levels repeat their last row or column
+        x0 = x * 2
+        y0 = y * 2
+        x1 = np.where(x0 + 1 < srcWidth, x0 + 1, x0)
+        y1 = np.where(y0 + 1 < srcHeight, y0 + 1, y0)
+        total = GatherPixels(srcData, colorData, (y0 * srcWidth) + x0)
+        total += GatherPixels(srcData, colorData, (y0 * srcWidth) + x1)
+        total += GatherPixels(srcData, colorData, (y1 * srcWidth) + x0)
+        total += GatherPixels(srcData, colorData, (y1 * srcWidth) + x1)
+        WritePixels(dstData, colorData, first, total * 0.25)
+
+def VFXGhostLensFlare(start, n, filterData, mipLevels, imgSize, imgData, mipData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    copies, displacement, haloDisplacement, power, interpolate = GetFlareSettings(filterData)
+    mipLevels = AsInt(mipLevels)
+    colorMax = GetColorSpaceMax(colorData)
+    centerA = (imgSize[0] - 1) / 2
+    centerB = (imgSize[1] - 1) / 2
+    centerLen = math.sqrt((centerA * centerA) + (centerB * centerB))
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, imgSize[0])
+        artifacts = np.zeros((count, 5))
+        for j in range(copies):
+            # Copies that shrink the image read from the mip level closest to their size
+            scale = (j * displacement) - 1.0
+            level = 0
+            while level < mipLevels and abs(scale) >= float(2 << level):
+                level += 1
+            levelData = GetMipData(level, imgSize, imgData, mipData, colorData)
+            levelScale = 1.0 / float(1 << level)
+            offsetA = (x - centerA) * scale
+            offsetB = (y - centerB) * scale
+            weight = 1 - (np.sqrt((offsetA * offsetA) + (offsetB * offsetB)) / centerLen)
+            weight2 = weight * weight
+            weight = (weight2 * weight2 * weight2 * weight2) * weight2
+            sample = SampleAt(levelData, colorData, GetMipSize(imgSize, level),
+                              ((centerA + offsetA + 0.5) * levelScale) - 0.5,
+                              ((centerB + offsetB + 0.5) * levelScale) - 0.5, interpolate)
+            alpha = sample[:, CHANNEL_A] / colorMax
+            artifacts += sample * (weight * alpha)[:, None]
+        FinishFlare(first, artifacts, x, y, filterData, imgSize, imgData, outData, colorData)
+
+# Where along one axis artifact copy j samples for pixels p, like CopyPosition
+def CopyPosition(p, size, j, displacement):
+    center = (size - 1) / 2
+    coord = float(size) - p - 1
+    return coord + (((center - coord) * displacement) * float(j))
+
+# The two source pixels a sample at s along one axis is made from and how much each
+# adds, following the same clamping and interpolation as SampleAt, like SplatWeight
+def SplatTaps(s, size, interpolate):
+    clamped = np.nan_to_num(np.where(s >= size, size - 1, np.where(s < 0, 0, s)))
+    first = np.floor(clamped).astype(np.int64)
+    if not interpolate:
+        return first, np.ones(s.shape), first, np.zeros(s.shape)
+    # The last pixel has nothing past it to blend with
+    firstWeight = np.where(first == size - 1, 1.0, 1.0 - np.abs(clamped - first))
+    dist = np.abs(clamped - (first + 1))
+    secondWeight = np.where((first + 1 < size) & (dist < 1.0), 1.0 - dist, 0.0)
+    return first, firstWeight, np.minimum(first + 1, size - 1), secondWeight
+
+def VFXSplatLensFlare(start, n, filterData, imgSize, imgData, highlightData, rowData, outData, colorData, control):
+    # Every output pixel gathers the highlights its copies land on instead, which adds up to
+    # the same, and with NumPy gathering is much faster than going through the list
+    imgSize = AsCoords(imgSize)
+    copies, displacement, haloDisplacement, power, interpolate = GetFlareSettings(filterData)
+    width, height = imgSize
+    colorMax = GetColorSpaceMax(colorData)
+    centerA = (width - 1) / 2
+    centerB = (height - 1) / 2
+    centerLen = math.sqrt((centerA * centerA) + (centerB * centerB))
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        x, y = PixelPositions(first, count, width)
+        artifacts = np.zeros((count, 5))
+        for j in range(copies):
+            sampleX = CopyPosition(x, width, j, displacement)
+            sampleY = CopyPosition(y, height, j, displacement)
+            offsetX = sampleX - centerA
+            offsetY = sampleY - centerB
+            # Fade copies out towards the edges, same as the gathering version
+            weight = 1 - (np.sqrt((offsetX * offsetX) + (offsetY * offsetY)) / centerLen)
+            weight2 = weight * weight
+            weight = (weight2 * weight2 * weight2 * weight2) * weight2
+            tapsX = SplatTaps(sampleX, width, interpolate)
+            tapsY = SplatTaps(sampleY, height, interpolate)
+            for row, weightY in (tapsY[0:2], tapsY[2:4]):
+                for column, weightX in (tapsX[0:2], tapsX[2:4]):
+                    # Highlights are listed as floats, anything else adds nothing
+                    pixels = GatherPixels(imgData, colorData, (row * width) + column)
+                    colors = np.where(IsHighlight(pixels)[:, None], pixels.astype(np.float32), 0).astype(np.float64)
+                    scale = (((weightX * weightY) * weight) * (colors[:, CHANNEL_A] / colorMax))
+                    artifacts += colors * scale[:, None]
+        FinishFlare(first, artifacts, x, y, filterData, imgSize, imgData, outData, colorData)
+
+# How far across a line has moved after some number of pixels along
+def StreakOffset(along, slope):
+    return np.floor((along * slope) + 0.5).astype(np.int64)
+
+# Lines run along the axis closest to the streak direction one pixel at a time,
+# moving across by the slope, so every pixel is on exactly one line
+# Returns whether lines run along x, the slope, the length along and across and the drift
+def GetStreakLayout(imgSize, angle):
+    rad = DegreeToRadian(angle)
+    horizontal = abs(math.cos(rad)) >= abs(math.sin(rad))
+    if horizontal:
+        slope = math.tan(rad)
+        along, across = imgSize
+    else:
+        slope = math.cos(rad) / math.sin(rad)
+        across, along = imgSize
+    drift = abs(int(StreakOffset(np.float64(along - 1), slope)))
+    return horizontal, slope, along, across, drift
+
+def VFXGetStreakLines(imgSize, angle):
+    horizontal, slope, along, across, drift = GetStreakLayout(AsCoords(imgSize), AsFloat(angle))
+    return across + drift
+
+# Running sums along axis 1 that fade by decay every step, sums[p] = colors[p] + decay * sums[p - 1]
+# Worked out as cumulative sums in blocks short enough that decay ** -length can't overflow
+def DecayScan(colors, decay):
+    if decay <= 0:
+        return colors.copy()
+    along = colors.shape[1]
+    blockLength = along if decay >= 1 else max(1, int(30.0 / -math.log(decay)))
+    sums = np.empty_like(colors)
+    carry = np.zeros((colors.shape[0],) + colors.shape[2:])
+    for begin in range(0, along, blockLength):
+        end = min(begin + blockLength, along)
+        powers = (decay ** np.arange(end - begin))[None, :, None]
+        block = np.cumsum(colors[:, begin:end] / powers, axis=1) * powers
+        block += carry[:, None] * (powers * decay)
+        sums[:, begin:end] = block
+        carry = block[:, -1]
+    return sums
+
+def VFXStreak(start, n, filterData, imgSize, imgData, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    horizontal, slope, along, across, drift = GetStreakLayout(imgSize, filterData.angle)
+    # Lines step diagonally when the streak is at an angle
+    stepLength = math.sqrt(1.0 + (slope * slope))
+    decay = math.exp(-stepLength / max(filterData.length, 0.001))
+    # Keep the total brightness the same as the original highlights
+    scale = ((1.0 - decay) / (1.0 + decay)) * filterData.power
+    positions = np.arange(along, dtype=np.int64)
+    offsets = StreakOffset(positions, slope)
+    for first, count in Blocks(start, n, control, LineBlock(along)):
+        # Lines moving across in the positive direction start above or left of the image
+        lineStarts = np.arange(first, first + count, dtype=np.int64)
+        if slope > 0:
+            lineStarts -= drift
+        acrossLine = lineStarts[:, None] + offsets[None, :]
+        inside = (acrossLine >= 0) & (acrossLine < across)
+        if horizontal:
+            indices = (acrossLine * imgSize[0]) + positions[None, :]
+        else:
+            indices = (positions[None, :] * imgSize[0]) + acrossLine
+        colors = np.zeros((count, along, 5))
+        colors[inside] = GatherPixels(imgData, colorData, indices[inside])
+        forward = DecayScan(colors, decay)
+        backward = DecayScan(colors[:, ::-1], decay)[:, ::-1]
+        # Both sums include the pixel itself, so take one copy away
+        both = forward + backward
+        pixels = np.where(both > colors, both - colors, 0.0) * scale
+        # Alpha isn't smeared, just multiplied by power like everything else
+        pixels[..., CHANNEL_A] = colors[..., CHANNEL_A] * filterData.power
+        ScatterPixels(outData, colorData, indices[inside], Clamp(pixels[inside], colorMax))
+
+# Floats per dirt shape, a pair of points per side and 2 more for other data
+def GetFloatsPerEntry(shape):
+    return (shape * 2) + 2
+
+def VFXCreateDirtShapes(start, n, filterData, imgSize, seed, outData, control):
+    width, height = AsCoords(imgSize)
+    shape = AsInt(filterData.shape)
+    floatsPerEntry = GetFloatsPerEntry(shape)
+    pi = math.acos(-1)
+    centerA = (width - 1) / 2.0
+    centerB = (height - 1) / 2.0
+    # NumPy's generator instead of rand(), so the shapes differ from the C library's for the same seed
+    # Offset by the start index so each worker gets different shapes from one seed, like the C library
+    generator = np.random.default_rng((AsInt(seed) + start) % (1 << 32))
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        entries = GetArray(outData, np.float32, first * floatsPerEntry, count * floatsPerEntry).reshape(count,
+                                                                                                      floatsPerEntry)
+        shapeA = generator.integers(0, width, count).astype(np.float64)
+        shapeB = generator.integers(0, height, count).astype(np.float64)
+        size = np.full(count, np.float32(filterData.size))
+        if filterData.sizeVarience != 0:
+            variance = generator.integers(0, abs(filterData.sizeVarience), count)
+            size = (float(filterData.size) * ((100.0 - variance) / 100.0)).astype(np.float32)
+        opacity = np.full(count, np.float32(filterData.opacity))
+        if filterData.opacityVarience != 0:
+            variance = generator.integers(0, abs(filterData.opacityVarience), count)
+            opacity = (filterData.opacity * ((100.0 - variance) / 100.0)).astype(np.float32)
+        size = size.astype(np.float64)
+        # If this is a circle, then that's all we need
+        if shape == 1:
+            entries[:, 0] = shapeA
+            entries[:, 1] = shapeB
+            entries[:, 2] = size
+            entries[:, 3] = opacity
+            continue
+        if filterData.direction == -1:
+            # Towards the center, turned a quarter like the C library
+            vecA = centerA - shapeA
+            vecB = centerB - shapeB
+            with np.errstate(divide="ignore", invalid="ignore"):
+                direction = np.arctan(vecB / vecA).astype(np.float32).astype(np.float64)
+                direction = np.where(vecA >= 0, direction + pi, direction).astype(np.float32).astype(np.float64)
+                direction = (direction + (pi / 2)).astype(np.float32).astype(np.float64)
+                factor = size / np.sqrt((vecA * vecA) + (vecB * vecB))
+            entries[:, 0] = (vecA * factor) + shapeA
+            entries[:, 1] = (vecB * factor) + shapeB
+        else:
+            if filterData.direction == -2:
+                direction = DegreeToRadian(generator.integers(0, 360, count).astype(np.float64))
+            else:
+                direction = np.full(count, DegreeToRadian(filterData.direction))
+            direction = direction.astype(np.float32).astype(np.float64)
+            entries[:, 0] = shapeA + ((-1 * np.sin(direction)) * size)
+            entries[:, 1] = shapeB + (np.cos(direction) * size)
+        if shape == 2:
+            # Line, two points and opacity
+            entries[:, 2] = shapeA - ((-1 * np.sin(direction)) * size)
+            entries[:, 3] = shapeB - (np.cos(direction) * size)
+            entries[:, 4] = opacity
+            continue
+        # Regular polygon, travel one side at a time turning by the same angle
+        sideLength = (size * 2 * math.sin(pi / shape)).astype(np.float32).astype(np.float64)
+        angle = np.float32((2 * pi) / shape)
+        startAngle = (direction + (pi / 2)).astype(np.float32)
+        for j in range(1, shape):
+            startAngle = startAngle + angle
+            entries[:, j * 2] = entries[:, (j * 2) - 2].astype(np.float64) + (sideLength * np.cos(startAngle.astype(np.float64)))
+            entries[:, (j * 2) + 1] = (entries[:, (j * 2) - 1].astype(np.float64) +
+                                       (sideLength * np.sin(startAngle.astype(np.float64))))
+        entries[:, 2 * shape] = opacity
+
+# Whether C's abs() of a double, which goes through int, is within 1
+# Values too big for an int, or not numbers, come out as INT_MIN which always is
+def IsWithinOne(values):
+    with np.errstate(invalid="ignore"):
+        return ~(np.abs(values) < 2147483648.0) | (np.abs(np.trunc(values)) <= 1)
+
+# Hard edged coverage of one shape over a grid of pixels, like DirtCoverage
+def ShapeCoverage(entry, shape, x, y):
+    opacity = float(entry[GetOpacityIndex(shape)]) / 100.0
+    point1 = (float(entry[0]), float(entry[1]))
+    if shape == 1:
+        # Circle is a simple matter of whether the pixel is in range of the center
+        dist = np.sqrt(((x - point1[0]) ** 2) + ((y - point1[1]) ** 2))
+        return np.where(dist <= entry[2], opacity, 0.0)
+    if shape == 2:
+        # Line, whether the pixel is within 1 pixel of either end or of the line
+        point2 = (float(entry[2]), float(entry[3]))
+        nearEnd = ((np.sqrt(((point1[0] - x) ** 2) + ((point1[1] - y) ** 2)) <= 1) |
+                   (np.sqrt(((point2[0] - x) ** 2) + ((point2[1] - y) ** 2)) <= 1))
+        outside = (((x > point1[0] + 1) & (x > point2[0] + 1)) | ((x < point1[0] - 1) & (x < point2[0] - 1)) |
+                   ((y > point1[1] + 1) & (y > point2[1] + 1)) | ((y < point1[1] - 1) & (y < point2[1] - 1)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lerp1 = ((y - point1[1]) / (point2[1] - point1[1])).astype(np.float32)
+            crossA = (lerp1.astype(np.float64) * (point2[0] - point1[0])) + point1[0]
+            lerp2 = ((x - point1[0]) / (point2[0] - point1[0])).astype(np.float32)
+            crossB = (lerp2.astype(np.float64) * (point2[1] - point1[1])) + point1[1]
+            near = IsWithinOne(crossA - x) | IsWithinOne(crossB - y)
+        return np.where(nearEnd | (~outside & near), opacity, 0.0)
+    # Polygon, find the two sides that cross each row the same way DirtCoverage walks them
+    # Which sides those are only depends on the row, so it's worked out once per row
+    rows = y[:, 0]
+    found = np.zeros(rows.shape, bool)
+    done = np.zeros(rows.shape, bool)
+    point1A = np.full(rows.shape, float(entry[(shape - 1) * 2]))
+    point1B = np.full(rows.shape, float(entry[((shape - 1) * 2) + 1]))
+    point2A, point2B, point3A, point3B, point4A, point4B = (np.zeros(rows.shape) for i in range(6))
+    for k in range(shape):
+        vertexA = float(entry[k * 2])
+        vertexB = float(entry[(k * 2) + 1])
+        seeking = ~found
+        crosses = ((point1B <= rows) & (vertexB > rows)) | ((point1B > rows) & (vertexB <= rows))
+        point2A = np.where(seeking, vertexA, point2A)
+        point2B = np.where(seeking, vertexB, point2B)
+        walking = found & ~done
+        crossesAgain = ((point3B <= rows) & (vertexB > rows)) | ((point3B > rows) & (vertexB <= rows))
+        point4A = np.where(walking, vertexA, point4A)
+        point4B = np.where(walking, vertexB, point4B)
+        done |= walking & crossesAgain
+        newlyFound = seeking & crosses
+        point3A = np.where(newlyFound | (walking & ~crossesAgain), vertexA, point3A)
+        point3B = np.where(newlyFound | (walking & ~crossesAgain), vertexB, point3B)
+        point1A = np.where(seeking & ~crosses, vertexA, point1A)
+        point1B = np.where(seeking & ~crosses, vertexB, point1B)
+        found |= newlyFound
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lerp1 = ((rows - point1B) / (point2B - point1B)).astype(np.float32)
+        lerp2 = ((rows - point3B) / (point4B - point3B)).astype(np.float32)
+        lerp1 = ((lerp1 * (point2A - point1A)) + point1A).astype(np.float32)[:, None]
+        lerp2 = ((lerp2 * (point4A - point3A)) + point3A).astype(np.float32)[:, None]
+    column = lambda values: values[:, None]
+    skip = (~column(found) |
+            ((column(point1A) > x) & (column(point2A) > x) & (column(point3A) > x) & (column(point4A) > x)) |
+            ((column(point1A) < x) & (column(point2A) < x) & (column(point3A) < x) & (column(point4A) < x)))
+    inside = ((lerp1 <= x) & (lerp2 > x)) | ((lerp1 > x) & (lerp2 <= x))
+    return np.where(~skip & inside, opacity, 0.0)
+
+def GetOpacityIndex(shape):
+    if shape == 1:
+        return 3
+    if shape == 2:
+        return 4
+    return 2 * shape
+
+# Distance from points to the segment between a and b
+def DistanceToSegment(x, y, pointA, pointB):
+    sideA = pointB[0] - pointA[0]
+    sideB = pointB[1] - pointA[1]
+    toA = x - pointA[0]
+    toB = y - pointA[1]
+    lenSq = (sideA * sideA) + (sideB * sideB)
+    t = 0.0
+    if lenSq > 0:
+        t = np.clip(((toA * sideA) + (toB * sideB)) / lenSq, 0, 1)
+    return np.sqrt(((toA - (sideA * t)) ** 2) + ((toB - (sideB * t)) ** 2))
+
+# Signed distance from points to the edge of a shape, negative inside it, like ShapeDistance
+def ShapeDistance(entry, shape, x, y):
+    point1 = (float(entry[0]), float(entry[1]))
+    if shape == 1:
+        return np.sqrt(((x - point1[0]) ** 2) + ((y - point1[1]) ** 2)) - entry[2]
+    if shape == 2:
+        return DistanceToSegment(x, y, point1, (float(entry[2]), float(entry[3]))) - 1
+    # Polygon, closest side gives the distance, counting crossings gives the sign
+    dist = None
+    inside = np.zeros(np.broadcast(x, y).shape, bool)
+    prev = (float(entry[(shape - 1) * 2]), float(entry[((shape - 1) * 2) + 1]))
+    for k in range(shape):
+        cur = (float(entry[k * 2]), float(entry[(k * 2) + 1]))
+        sideDist = DistanceToSegment(x, y, prev, cur)
+        dist = sideDist if dist is None else np.minimum(dist, sideDist)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossX = prev[0] + (((y - prev[1]) / (cur[1] - prev[1])) * (cur[0] - prev[0]))
+        crosses = ((prev[1] <= y) & (cur[1] > y)) | ((prev[1] > y) & (cur[1] <= y))
+        inside ^= crosses & (crossX > x)
+        prev = cur
+    return np.where(inside, -dist, dist)
+
+# Coverage of pixels first to first + count, hard edged or fading over softness pixels
+# Each shape only works on the pixels near it, in the same order as the C library adds them
+def GetCoverage(first, count, numShapes, filterData, imgSize, shapes, softness):
+    width = imgSize[0]
+    shape = AsInt(filterData.shape)
+    floatsPerEntry = GetFloatsPerEntry(shape)
+    entries = GetArray(shapes, np.float32, 0, numShapes * floatsPerEntry).reshape(numShapes, floatsPerEntry)
+    topRow = first // width
+    bottomRow = (first + count - 1) // width
+    coverage = np.zeros((bottomRow - topRow + 1, width))
+    if softness > 0:
+        reach = (filterData.size * 2) + softness
+        low = (entries[:, :2].astype(np.float64) - reach)
+        high = (entries[:, :2].astype(np.float64) + reach)
+    else:
+        # The C library checks the reach in floats
+        reach = np.float32(filterData.size * 2)
+        low = (entries[:, :2] - reach).astype(np.float64)
+        high = (entries[:, :2] + reach).astype(np.float64)
+    low = np.ceil(low)
+    high = np.floor(high)
+    # Shapes that aren't numbers, like a line pointing at the center from the center, are skipped
+    near = (np.isfinite(entries[:, :2]).all(axis=1) & (high[:, 0] >= 0) & (low[:, 0] <= width - 1) &
+            (high[:, 1] >= topRow) & (low[:, 1] <= bottomRow))
+    for j in np.nonzero(near)[0]:
+        left = int(max(low[j, 0], 0))
+        right = int(min(high[j, 0], width - 1))
+        top = int(max(low[j, 1], topRow))
+        bottom = int(min(high[j, 1], bottomRow))
+        x = np.arange(left, right + 1, dtype=np.float64)[None, :]
+        y = np.arange(top, bottom + 1, dtype=np.float64)[:, None]
+        if softness > 0:
+            dist = ShapeDistance(entries[j], shape, x, y)
+            # smoothstep from fully covered inside to nothing outside
+            t = (dist + softness) / (2 * softness)
+            fade = np.where(dist > -softness, 1 - (t * t * (3 - (2 * t))), 1.0)
+            shapeCoverage = np.where(dist < softness, fade * (float(entries[j, GetOpacityIndex(shape)]) / 100.0), 0.0)
+        else:
+            shapeCoverage = ShapeCoverage(entries[j], shape, x, y)
+        coverage[top - topRow:bottom - topRow + 1, left:right + 1] += shapeCoverage
+    offset = first - (topRow * width)
+    return coverage.reshape(-1)[offset:offset + count]
+
+# How far the edges of shapes fade, 0 for hard edges
+def GetSoftness(filterData, imgSize):
+    if AsInt(filterData.softEdge) == 0:
+        return 0
+    return (filterData.blur / 100.0) * imgSize[0]
+
+def VFXRenderLensDirt(start, n, numShapes, filterData, imgSize, shapes, outData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    softness = GetSoftness(filterData, imgSize)
+    for first, count in Blocks(start, n, control, DIRT_BLOCK):
+        pixels = np.full((count, 5), colorMax)
+        pixels[:, CHANNEL_A] = GetCoverage(first, count, AsInt(numShapes), filterData, imgSize, shapes,
+                                           softness) * colorMax
+        WritePixels(outData, colorData, first, pixels)
+
+# Coverage masks are 8 bit for 8 bit layers and 16 bit for deeper ones, like GetMaskSampleSize
+def GetMaskType(colorData):
+    return np.uint8 if colorData.colorDepth == DEPTH_U8 else np.uint16
+
+# Coverage as 0-1, clamped and rounded to the nearest step, like WriteMask
+def EncodeMask(coverage, colorData):
+    maskMax = np.iinfo(GetMaskType(colorData)).max
+    return np.floor((np.clip(coverage, 0.0, 1.0) * maskMax) + 0.5).astype(GetMaskType(colorData))
+
+def ReadMask(maskData, colorData, first, count):
+    maskType = GetMaskType(colorData)
+    return GetArray(maskData, maskType, first, count) / float(np.iinfo(maskType).max)
+
+def VFXRenderDirtMask(start, n, numShapes, filterData, imgSize, shapes, maskData, colorData, control):
+    imgSize = AsCoords(imgSize)
+    softness = GetSoftness(filterData, imgSize)
+    for first, count in Blocks(start, n, control, DIRT_BLOCK):
+        mask = GetArray(maskData, GetMaskType(colorData), first, count)
+        mask[:] = EncodeMask(GetCoverage(first, count, AsInt(numShapes), filterData, imgSize, shapes, softness), colorData)
+
+# Sums of the window radius either side of every position along axis 1 and how many
+# positions they cover, only counting positions inside the line so the edges don't fade out
+def WindowSums(values, radius, dtype=np.float64):
+    length = values.shape[1]
+    sums = np.zeros((values.shape[0], length + 1) + values.shape[2:], dtype)
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+    positions = np.arange(length)
+    low = np.maximum(positions - radius, 0)
+    high = np.minimum(positions + radius, length - 1)
+    counts = (high - low + 1).reshape((1, length) + (1,) * (values.ndim - 2))
+    return sums[:, high + 1] - sums[:, low], counts
+
+# Average of the window, like the C library's running sums
+def WindowAverage(values, radius):
+    sums, counts = WindowSums(values, radius)
+    return sums * (1.0 / counts)
+
+# Lines start to start + n of an image with one value per pixel, as rows
+def GetLines(values, start, n, vertical):
+    if vertical:
+        return values[:, start:start + n].T
+    return values[start:start + n]
+
+def VFXBlurDirtMask(start, n, radius, vertical, imgSize, maskData, outMaskData, colorData, control):
+    width, height = AsCoords(imgSize)
+    vertical = AsInt(vertical) != 0
+    length = height if vertical else width
+    maskType = GetMaskType(colorData)
+    mask = GetArray(maskData, maskType, 0, width * height).reshape(height, width)
+    outMask = GetArray(outMaskData, maskType, 0, width * height).reshape(height, width)
+    for first, count in Blocks(start, n, control, LineBlock(length)):
+        # Summed in whole steps so the average rounds the same as the C library
+        sums, counts = WindowSums(GetLines(mask, first, count, vertical), AsInt(radius), np.int64)
+        GetLines(outMask, first, count, vertical)[:] = ((2 * sums) + counts) // (2 * counts)
+
+def VFXExpandDirtMask(start, n, maskData, outData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        pixels = np.full((count, 5), colorMax)
+        pixels[:, CHANNEL_A] = ReadMask(maskData, colorData, first, count) * colorMax
+        WritePixels(outData, colorData, first, Clamp(pixels, colorMax))
+
+def VFXBoxBlurLines(start, n, radius, vertical, imgSize, imgData, outData, colorData, control):
+    width, height = AsCoords(imgSize)
+    colorMax = GetColorSpaceMax(colorData)
+    vertical = AsInt(vertical) != 0
+    length = height if vertical else width
+    positions = np.arange(length, dtype=np.int64)
+    for first, count in Blocks(start, n, control, LineBlock(length)):
+        lines = np.arange(first, first + count, dtype=np.int64)[:, None]
+        if vertical:
+            indices = (positions[None, :] * width) + lines
+        else:
+            indices = (lines * width) + positions[None, :]
+        pixels = GatherPixels(imgData, colorData, indices)
+        blurred = Clamp(WindowAverage(pixels, AsInt(radius)), colorMax)
+        ScatterPixels(outData, colorData, indices.reshape(-1), blurred.reshape(-1, 5))
+
+# Spectra are fftSize x fftSize complex numbers stored as interleaved float pairs
+def GetSpectrum(spectrum, fftSize):
+    return GetArray(spectrum, np.complex64, 0, fftSize * fftSize).reshape(fftSize, fftSize)
+
+# Offset from the kernel center for positions in a wrapped around buffer
+def Unwrap(positions, fftSize, radius):
+    return np.where(positions < fftSize - radius, positions, positions - fftSize)
+
+# Brightness of the kernel at offsets from its center, before normalizing, like KernelValue
+def KernelValues(kernelData, dx, dy):
+    radius = max(float(kernelData.radius), 1.0)
+    dist = np.sqrt(((dx * dx) + (dy * dy)).astype(np.float64))
+    rotation = DegreeToRadian(kernelData.angle)
+    pi = math.acos(-1)
+    shape = AsInt(kernelData.shape)
+    if shape == STAR_BURST:
+        # A tight glow in the middle with thin spikes fading out from it
+        values = np.exp(-12.0 * dist / radius)
+        width = 1.0 + (radius * 0.005)
+        fade = 1.0 - (dist / radius)
+        for k in range(kernelData.points):
+            spikeAngle = rotation + ((2.0 * pi * k) / kernelData.points)
+            along = (dx * math.cos(spikeAngle)) + (dy * math.sin(spikeAngle))
+            across = ((dy * math.cos(spikeAngle)) - (dx * math.sin(spikeAngle))) / width
+            values = values + np.where(along > 0, 0.5 * fade * fade * np.exp(-(across * across)), 0.0)
+    elif shape == APERTURE:
+        # Regular polygon like the blades of a lens aperture, with a soft edge
+        blades = 3 if kernelData.points < 3 else kernelData.points
+        segment = (2.0 * pi) / blades
+        theta = np.fmod(np.arctan2(dy.astype(np.float64), dx.astype(np.float64)) - rotation, segment)
+        theta = np.where(theta < 0, theta + segment, theta)
+        edge = (radius * math.cos(pi / blades)) / np.cos(theta - (pi / blades))
+        values = np.clip(edge - dist + 0.5, 0, 1)
+    else:
+        values = np.zeros(dist.shape)
+    return np.where(dist > radius, 0.0, values)
+
+def VFXMakeBloomKernel(start, n, kernelData, fftSize, spectrum, control):
+    fftSize = AsInt(fftSize)
+    data = GetSpectrum(spectrum, fftSize)
+    dx = Unwrap(np.arange(fftSize, dtype=np.int64), fftSize, kernelData.radius)[None, :]
+    for first, count in Blocks(start, n, control, LineBlock(fftSize)):
+        dy = Unwrap(np.arange(first, first + count, dtype=np.int64), fftSize, kernelData.radius)[:, None]
+        values = KernelValues(kernelData, dx, dy).astype(np.float32)
+        data[first:first + count] = np.fft.fft(values, axis=1)
+
+def VFXTransformColumns(start, n, fftSize, spectrum, control):
+    fftSize = AsInt(fftSize)
+    data = GetSpectrum(spectrum, fftSize)
+    for first, count in Blocks(start, n, control, LineBlock(fftSize)):
+        data[:, first:first + count] = np.fft.fft(data[:, first:first + count], axis=0)
+
+def VFXLoadTileRows(start, n, tile, imgSize, imgData, tileSpectrum, colorData, control):
+    width, height = AsCoords(imgSize)
+    data = GetSpectrum(tileSpectrum, tile.fftSize)
+    # Columns of the tile inside the image, the rest are 0
+    numColumns = max(0, min(tile.size, width - tile.origin.x, tile.fftSize))
+    channels = (CHANNEL_R, CHANNEL_B) if tile.pair == 0 else (CHANNEL_O, CHANNEL_L)
+    for first, count in Blocks(start, n, control, LineBlock(tile.fftSize)):
+        rows = np.arange(first, first + count, dtype=np.int64)
+        imgY = tile.origin.y + rows
+        loaded = (rows < tile.size) & (imgY < height)
+        values = np.zeros((count, tile.fftSize), np.complex64)
+        if loaded.any() and numColumns > 0:
+            indices = (imgY[loaded][:, None] * width) + tile.origin.x + np.arange(numColumns)[None, :]
+            pixels = GatherPixels(imgData, colorData, indices).astype(np.float32)
+            rowValues = np.zeros((len(indices), tile.fftSize), np.complex64)
+            rowValues.real[:, :numColumns] = pixels[..., channels[0]]
+            rowValues.imag[:, :numColumns] = pixels[..., channels[1]]
+            # Rows outside the tile are all zero, and so is their transform
+            values[loaded] = np.fft.fft(rowValues, axis=1)
+        data[first:first + count] = values
+
+def VFXConvolveTileColumns(start, n, tile, tileSpectrum, kernelSpectrum, control):
+    fftSize = tile.fftSize
+    data = GetSpectrum(tileSpectrum, fftSize)
+    kernel = GetSpectrum(kernelSpectrum, fftSize)
+    # The kernel's first value is the sum of the whole kernel, dividing by it keeps
+    # the total brightness the same
+    kernelSum = float(kernel[0, 0].real)
+    if kernelSum <= 0:
+        kernelSum = 1
+    for first, count in Blocks(start, n, control, LineBlock(fftSize)):
+        columns = np.fft.fft(data[:, first:first + count].astype(np.complex128), axis=0)
+        columns *= kernel[:, first:first + count] / kernelSum
+        # The inverse is left unscaled like the C library's, AccumulateTileRows scales it
+        data[:, first:first + count] = np.fft.ifft(columns, axis=0) * fftSize
+
+def VFXAccumulateTileRows(start, n, tile, imgSize, tileSpectrum, sumData, control):
+    width, height = AsCoords(imgSize)
+    fftSize = tile.fftSize
+    data = GetSpectrum(tileSpectrum, fftSize)
+    sums = GetArray(sumData, np.float32, 0, width * height * 4).reshape(height, width, 4)
+    scale = 1.0 / (float(fftSize) * float(fftSize))
+    # Anything past the tile plus the kernel's reach is just rounding noise
+    offsetX = Unwrap(np.arange(fftSize, dtype=np.int64), fftSize, tile.radius)
+    imgX = tile.origin.x + offsetX
+    keepX = (offsetX < tile.size + tile.radius) & (imgX >= 0) & (imgX < width)
+    for first, count in Blocks(start, n, control, LineBlock(fftSize)):
+        offsetY = Unwrap(np.arange(first, first + count, dtype=np.int64), fftSize, tile.radius)
+        imgY = tile.origin.y + offsetY
+        keepY = (offsetY < tile.size + tile.radius) & (imgY >= 0) & (imgY < height)
+        if not keepY.any():
+            continue
+        rows = np.fft.ifft(data[first:first + count][keepY].astype(np.complex128), axis=1) * fftSize
+        rows = rows[:, keepX]
+        targetY = imgY[keepY][:, None]
+        targetX = imgX[keepX][None, :]
+        # Rounding in the FFT can leave tiny negative values where it should be dark
+        for part, values in enumerate((rows.real, rows.imag)):
+            channel = (2 * tile.pair) + part
+            sums[targetY, targetX, channel] += np.where(values > 0, (values * scale).astype(np.float32), 0)
+
+def VFXFinishConvolution(start, n, power, imgSize, imgData, sumData, outData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    power = AsFloat(power)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        pixels = np.empty((count, 5))
+        pixels[:, :CHANNEL_A] = GetArray(sumData, np.float32, first * 4, count * 4).reshape(count, 4)
+        pixels[:, CHANNEL_A] = ReadPixels(imgData, colorData, first, count)[:, CHANNEL_A]
+        WritePixels(outData, colorData, first, Clamp(pixels * power, colorMax))
+
+def VFXCompositeLayer(start, n, blendMode, imgSize, baseData, layerData, outData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    blendMode = AsInt(blendMode)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        base = ReadPixels(baseData, colorData, first, count)
+        layer = ReadPixels(layerData, colorData, first, count)
+        opacity = layer[:, CHANNEL_A] / colorMax
+        scaled = layer * opacity[:, None]
+        if blendMode == BLEND_ADD:
+            pixels = base + scaled
+        elif blendMode == BLEND_SUBTRACT:
+            pixels = np.where(base > scaled, base - scaled, 0.0)
+        else:
+            pixels = scaled + (base * (1.0 - opacity)[:, None])
+        # Coverage adds up the same way whatever the blend mode
+        pixels[:, CHANNEL_A] = base[:, CHANNEL_A] + (layer[:, CHANNEL_A] * (1.0 - (base[:, CHANNEL_A] / colorMax)))
+        WritePixels(outData, colorData, first, Clamp(pixels, colorMax))
+
+def VFXAccumulateLayer(start, n, gain, maskGain, imgSize, layerData, maskData, sumData, colorData, control):
+    colorMax = GetColorSpaceMax(colorData)
+    gain = AsFloat(gain)
+    maskGain = AsFloat(maskGain)
+    hasMask = not IsNull(maskData)
+    for first, count in Blocks(start, n, control, PIXEL_BLOCK):
+        # Scaled and clamped the same as a layer that had its power applied on its own
+        layer = Clamp(ReadPixels(layerData, colorData, first, count) * gain, colorMax)
+        opacity = layer[:, CHANNEL_A] / colorMax
+        if hasMask:
+            mask = ReadMask(maskData, colorData, first, count)
+            layer = Clamp(layer * (1.0 + (maskGain * mask))[:, None], colorMax)
+        total = ReadPixels(sumData, colorData, first, count) + (layer * opacity[:, None])
+        total[:, CHANNEL_A] = colorMax
+        WritePixels(sumData, colorData, first, Clamp(total, colorMax))
+
+def VFXFindEmptyTiles(start, n, tileSize, ignoreAlpha, imgSize, imgData, tileData, colorData, control):
+    width, height = AsCoords(imgSize)
+    tileSize = AsInt(tileSize)
+    bytesPerPixel = GetBytesPerPixel(colorData)
+    # Alpha is the last channel of every color model, in both byte orders
+    colorBytes = bytesPerPixel
+    if AsInt(ignoreAlpha) != 0 and colorData.colorModel != MODEL_A:
+        colorBytes -= np.dtype(SAMPLE_TYPES[colorData.colorDepth]).itemsize
+    tilesAcross = (width + tileSize - 1) // tileSize
+    tiles = GetArray(tileData, np.int8, 0, start + n)
+    for first, count in Blocks(start, n, control, tilesAcross):
+        # Every tile in a row of tiles is checked in one pass over its pixel rows
+        for tileRow in range(first // tilesAcross, ((first + count - 1) // tilesAcross) + 1):
+            top = tileRow * tileSize
+            bottom = min(top + tileSize, height)
+            pixels = GetArray(imgData, np.uint8, top * width * bytesPerPixel, (bottom - top) * width * bytesPerPixel)
+            columns = pixels.reshape(bottom - top, width, bytesPerPixel)[:, :, :colorBytes].any(axis=(0, 2))
+            filled = np.logical_or.reduceat(columns, np.arange(0, width, tileSize))
+            tileIds = (tileRow * tilesAcross) + np.arange(tilesAcross)
+            wanted = (tileIds >= first) & (tileIds < first + count)
+            tiles[tileIds[wanted]] = ~filled[wanted]
+
+def VFXUnfilterPNG(data, rows, rowBytes, bytesPerPixel, outData):
+    rows = AsInt(rows)
+    rowBytes = AsInt(rowBytes)
+    bytesPerPixel = AsInt(bytesPerPixel)
+    filtered = GetArray(data, np.uint8, 0, rows * (rowBytes + 1)).reshape(rows, rowBytes + 1)
+    filters = filtered[:, 0].astype(np.int16)
+    # Unlike the C library, nothing is written when a row has an unknown filter
+    if (filters > 4).any():
+        return 0
+    # Every byte depends on the one left of it, above it and above left of it, so bytes along
+    # each anti-diagonal of pixels can be worked out together. Row -1 and pixel -1 are zeros
+    numPixels = (rowBytes + bytesPerPixel - 1) // bytesPerPixel
+    source = np.zeros((rows, numPixels * bytesPerPixel), np.int16)
+    source[:, :rowBytes] = filtered[:, 1:]
+    source = source.reshape(rows, numPixels, bytesPerPixel)
+    pixels = np.zeros((rows + 1, numPixels + 1, bytesPerPixel), np.int16)
+    for diagonal in range(rows + numPixels - 1):
+        y = np.arange(max(0, diagonal - numPixels + 1), min(rows - 1, diagonal) + 1)
+        x = diagonal - y
+        left = pixels[y + 1, x]
+        up = pixels[y, x + 1]
+        upLeft = pixels[y, x]
+        # Paeth predictor, whichever neighbor is closest to left + up - upLeft
+        p = left + up - upLeft
+        pa = np.abs(p - left)
+        pb = np.abs(p - up)
+        pc = np.abs(p - upLeft)
+        paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upLeft))
+        rowFilters = filters[y][:, None]
+        predictor = np.select([rowFilters == 1, rowFilters == 2, rowFilters == 3, rowFilters == 4],
+                              [left, up, (left + up) // 2, paeth], 0)
+        pixels[y + 1, x + 1] = (source[y, x] + predictor) & 255
+    out = GetArray(outData, np.uint8, 0, rows * rowBytes).reshape(rows, rowBytes)
+    out[:] = pixels[1:, 1:].reshape(rows, -1)[:, :rowBytes]
+    return 1
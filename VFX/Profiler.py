@@ -0,0 +1,74 @@
+"""
+Profiler.py
+Opt-in timing of every stage of a filter, from C kernels to Krita's own
+calls, with a summary after each apply and a Chrome trace for later
+"""
+from contextlib import contextmanager
+from threading import get_ident
+from time import perf_counter
+import json
+
+# Collects timed events for one apply of a filter
+class Profiler(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.origin = perf_counter()
+        self.events = []
+
+    # Time a block of python code, numBytes is how much pixel data it copied
+    @contextmanager
+    def phase(self, name, numBytes=0):
+        if not self.enabled:
+            yield
+            return
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append({"name": name, "begin": begin, "wall": perf_counter() - begin,
+                                "thread": get_ident(), "bytes": numBytes, "workers": []})
+
+    # Record a kernel run across worker threads
+    # workers is a list of (thread, begin, wall, cpu) for each worker
+    def addStage(self, name, begin, wall, workers, numPixels):
+        if not self.enabled:
+            return
+        self.events.append({"name": name, "begin": begin, "wall": wall, "thread": get_ident(),
+                            "bytes": 0, "pixels": numPixels, "workers": workers})
+
+    # Human readable table of every event in order
+    def summary(self, title):
+        lines = ["VFX profile - " + title]
+        total = 0
+        for event in sorted(self.events, key=lambda e: e["begin"]):
+            line = "  {:<28}{:>10.1f} ms".format(event["name"], event["wall"] * 1000)
+            if event["bytes"]:
+                line += "  {:>10.1f} MB copied".format(event["bytes"] / (1024 * 1024))
+            if event["workers"]:
+                cpu = sum(worker[3] for worker in event["workers"])
+                slowest = max(worker[2] for worker in event["workers"])
+                line += "  {} threads, {:.1f} ms cpu, slowest {:.1f} ms, {} px".format(
+                    len(event["workers"]), cpu * 1000, slowest * 1000, event["pixels"])
+            lines.append(line)
+        if self.events:
+            first = min(event["begin"] for event in self.events)
+            total = max(event["begin"] + event["wall"] for event in self.events) - first
+        lines.append("  {:<28}{:>10.1f} ms".format("total", total * 1000))
+        return "\n".join(lines)
+
+    # Write the events in Chrome's trace event format, open with chrome://tracing or Perfetto
+    def writeTrace(self, path):
+        traceEvents = []
+        for event in self.events:
+            args = {"bytes": event["bytes"]}
+            if "pixels" in event:
+                args["pixels"] = event["pixels"]
+            traceEvents.append({"name": event["name"], "ph": "X", "pid": 1, "tid": event["thread"],
+                                "ts": (event["begin"] - self.origin) * 1e6, "dur": event["wall"] * 1e6,
+                                "args": args})
+            for worker in event["workers"]:
+                traceEvents.append({"name": event["name"], "ph": "X", "pid": 1, "tid": worker[0],
+                                    "ts": (worker[1] - self.origin) * 1e6, "dur": worker[2] * 1e6,
+                                    "args": {"cpu_ms": worker[3] * 1000}})
+        with open(path, "w") as traceFile:
+            json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, traceFile)
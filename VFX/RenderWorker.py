@@ -0,0 +1,225 @@
+"""
+RenderWorker.py
+Runs a filter's applyFilter in a separate process so a crash in the C
+library can't take Krita down with it, and a cancel can always stop it.
+Pixels go through shared memory, only the filter's settings are pickled
+"""
+from ctypes import *
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from threading import current_thread, main_thread
+from time import perf_counter
+import importlib
+import os
+import pickle
+import sys
+from .LibHandler import GetBytesPerPixel
+from .FilterJob import FilterJob
+from .ScratchBuffer import ScratchAllocator
+from .Streaming import WholeImage
+
+# How long a cancelled worker gets to stop on its own before it's killed, in seconds
+CANCEL_GRACE = 2.0
+
+# Progress is sent back as a fraction out of this
+PROGRESS_SCALE = 1000000
+
+# Slots in the shared status array
+STATUS_STAGE = 0
+STATUS_PROGRESS = 1
+STATUS_CANCEL = 2
+STATUS_SIZE = 3
+
+# Plain settings of a filter widget that can be sent to another process
+# Qt objects can't be pickled, and the filter never needs them to run
+def GetWidgetState(widget):
+    state = {}
+    for name, value in vars(widget).items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        state[name] = value
+    return state
+
+# Rebuild a filter from its plain settings without any of its Qt parts
+def RestoreFilter(filterClass, state):
+    filterWidget = filterClass.__new__(filterClass)
+    filterWidget.__dict__.update(state)
+    return filterWidget
+
+# Spawned workers run the executable with python's own arguments, so it has to be a python
+# and not an application embedding one, like Krita
+def IsPythonExecutable(path):
+    if not path or not os.path.isfile(path):
+        return False
+    return os.path.basename(path).lower().startswith("python")
+
+# Shared memory opened by the worker belongs to the parent, so the worker must not
+# clean it up when it exits
+def AttachSharedMemory(name):
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python before 3.13 always tracks it, but with the tracker it shares with the
+        # parent, and the parent unlinks it anyway
+        return SharedMemory(name=name)
+
+# Runs in the worker process
+# Rebuilds the filter from its settings without any of its Qt parts, then applies
+# it to every band the parent sends until told to stop
+def WorkerMain(connection, status, moduleName, className, state, useFiles, scratchDir, tuning):
+    filterWidget = RestoreFilter(getattr(importlib.import_module(moduleName), className), state)
+    job = FilterJob()
+    job.scratch = ScratchAllocator()
+    job.scratch.useFiles = useFiles
+    job.scratch.directory = scratchDir
+    job.tuning = tuning
+
+    # Called while the kernels run, share progress and pick up cancels
+    def publish():
+        status[STATUS_STAGE] = job.stage
+        status[STATUS_PROGRESS] = int(job.progress() * PROGRESS_SCALE)
+        if status[STATUS_CANCEL]:
+            job.cancel()
+
+    job.waitCallback = publish
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        inName, inSize, outName, imgSize, colorData, band = message
+        inMemory = AttachSharedMemory(inName)
+        outMemory = AttachSharedMemory(outName)
+        imgData = inMemory.buf[:inSize]
+        try:
+            result = filterWidget.applyFilter(imgData, imgSize, colorData, job, band)
+        except Exception as error:
+            job.fail(error)
+            result = None
+        publish()
+        if job.error is not None:
+            # Errors go back as text, the parent shows them
+            connection.send(str(job.error))
+        elif result is None or job.cancelled:
+            connection.send(None)
+        else:
+            outMemory.buf[:len(result)] = memoryview(result).cast("B")
+            connection.send(len(result))
+        # Views into the buffers have to go before they can be closed
+        del imgData
+        del result
+        for memory in (inMemory, outMemory):
+            try:
+                memory.close()
+            except BufferError:
+                pass
+    job.scratch.release()
+
+# Stands in for a filter widget's applyFilter, sending the work to a worker process
+# Everything else about the filter (post filters, settings) stays in Krita's process
+class RenderWorker(object):
+    def __init__(self, filterWidget, pythonPath=""):
+        self.filterWidget = filterWidget
+        self.pythonPath = pythonPath
+        self.process = None
+        self.connection = None
+        self.status = None
+        self.error = None
+
+    def start(self, job):
+        context = get_context("spawn")
+        # Inside Krita the running executable is Krita itself, so the worker may need
+        # to be pointed at a real python
+        if self.pythonPath:
+            if not os.path.isfile(self.pythonPath):
+                raise RuntimeError("Python for the worker process wasn't found at " + self.pythonPath)
+            context.set_executable(self.pythonPath)
+        elif not IsPythonExecutable(sys.executable):
+            raise RuntimeError("Krita isn't running from a python that can start the worker process ("
+                               + str(sys.executable) + "), set Python for the Worker Process in VFX - Settings")
+        self.status = context.Array(c_longlong, STATUS_SIZE, lock=False)
+        self.connection, childConnection = context.Pipe()
+        filterClass = type(self.filterWidget)
+        self.process = context.Process(target=WorkerMain, daemon=True,
+                                        args=(childConnection, self.status, filterClass.__module__, filterClass.__name__,
+                                              GetWidgetState(self.filterWidget), job.scratch.useFiles,
+                                              job.scratch.directory, job.tuning))
+        self.process.start()
+        childConnection.close()
+
+    # Same as the widget's applyFilter, returns None if cancelled or if the worker died
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
+        if band is None:
+            band = WholeImage(imgSize)
+        if self.process is None:
+            self.start(job)
+        inMemory = SharedMemory(create=True, size=max(1, len(imgData)))
+        outSize = band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData)
+        outMemory = SharedMemory(create=True, size=max(1, outSize))
+        try:
+            inMemory.buf[:len(imgData)] = memoryview(imgData).cast("B")
+            try:
+                self.connection.send((inMemory.name, len(imgData), outMemory.name, imgSize, colorData, band))
+            except OSError:
+                # The worker never started or already died, waiting on it says which
+                pass
+            resultSize = self.wait(job)
+            if resultSize is None:
+                return None
+            if isinstance(resultSize, str):
+                self.error = resultSize
+                job.fail(RuntimeError(self.error))
+                return None
+            return bytes(outMemory.buf[:resultSize])
+        finally:
+            for memory in (inMemory, outMemory):
+                memory.close()
+                memory.unlink()
+
+    # Wait for the worker to answer, passing its progress on to the job
+    def wait(self, job):
+        isMainThread = current_thread() is main_thread()
+        cancelTime = None
+        while True:
+            try:
+                if self.connection.poll(0.05):
+                    return self.connection.recv()
+            except (EOFError, OSError):
+                pass
+            job.track(self.status[STATUS_STAGE], self.status[STATUS_PROGRESS], PROGRESS_SCALE)
+            if job.waitCallback and isMainThread:
+                job.waitCallback()
+            if not self.process.is_alive():
+                # Crashed, most likely in the C library
+                self.error = "VFX worker process stopped unexpectedly (exit code " + str(self.process.exitcode) + ")"
+                job.fail(RuntimeError(self.error))
+                return None
+            if job.cancelled:
+                self.status[STATUS_CANCEL] = 1
+                if cancelTime is None:
+                    cancelTime = perf_counter()
+                elif perf_counter() - cancelTime > CANCEL_GRACE:
+                    self.process.kill()
+                    self.process.join()
+                    return None
+
+    # Bands and the post filter work the same as the widget itself
+    def getBandOverlap(self, imgSize):
+        return self.filterWidget.getBandOverlap(imgSize)
+
+    # Tell the worker to finish up, or kill it if it won't
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(CANCEL_GRACE)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self.connection.close()
+        self.process = None
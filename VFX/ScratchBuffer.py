@@ -0,0 +1,45 @@
+"""
+ScratchBuffer.py
+Allocates the buffers filters pass between stages, backing them with
+memory-mapped temporary files when an image is too big to comfortably
+keep every stage in memory at once
+"""
+from ctypes import *
+import mmap
+import tempfile
+
+# Working set size before switching to memory-mapped files, in megabytes
+DEFAULT_THRESHOLD_MB = 2048
+
+# Hands out buffers for one apply of a filter
+class ScratchAllocator(object):
+    def __init__(self, workingSet=0, thresholdMB=DEFAULT_THRESHOLD_MB, directory=""):
+        # A threshold of 0 means never use files
+        self.useFiles = thresholdMB > 0 and workingSet > thresholdMB * 1024 * 1024
+        self.directory = directory if directory else None
+        self.maps = []
+
+    # Get a zeroed buffer of size bytes that can be passed straight to the C library
+    def allocate(self, size):
+        if not self.useFiles or size <= 0:
+            return create_string_buffer(size)
+        # The file is deleted as soon as it's closed, or when Krita exits
+        scratchFile = tempfile.TemporaryFile(dir=self.directory)
+        scratchFile.truncate(size)
+        scratchMap = mmap.mmap(scratchFile.fileno(), size)
+        # Kernels run front to back, so let the OS read ahead and drop pages behind
+        # madvise isn't available on Windows
+        if hasattr(scratchMap, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            scratchMap.madvise(mmap.MADV_SEQUENTIAL)
+        self.maps.append((scratchFile, scratchMap))
+        return (c_char * size).from_buffer(scratchMap)
+
+    # Close all the files, buffers that are still in use get closed when collected
+    def release(self):
+        for scratchFile, scratchMap in self.maps:
+            try:
+                scratchMap.close()
+            except BufferError:
+                pass
+            scratchFile.close()
+        self.maps = []
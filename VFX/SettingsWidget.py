@@ -3,8 +3,11 @@ SettingsWidget.py
 Adds a widget for less-used and global settings to make them easy to change and de-clutter the UI
 Experimental settings may be added here in the future
 """
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QWidget, QLabel, QSlider, QVBoxLayout
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QWidget, QLabel, QSlider, QCheckBox, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout
+from .ScratchBuffer import DEFAULT_THRESHOLD_MB
+from .Tuning import Calibrate, DescribeTuning, ReadTuning, SaveTuning
+from threading import Thread
 from os import cpu_count
 
 # Widget for various global and seldom used settings
@@ -20,9 +23,85 @@ class SettingsWidget(QWidget):
         self.workThreads.setValue(self.numThreads)
         self.workThreads.valueChanged.connect(self.updateThread)
 
+        self.streaming = False
+        self.streamBox = QCheckBox("Process images in bands (slower, but uses much less memory)", self)
+        self.streamBox.stateChanged.connect(self.updateStreaming)
+
+        self.scratchThreshold = DEFAULT_THRESHOLD_MB
+        self.scratchInfo = QLabel("Use Scratch Files Above: 2.0 GB", self)
+        self.scratchSlide = QSlider(Qt.Horizontal, self)
+        self.scratchSlide.setRange(0, 128)
+        self.scratchSlide.setValue(self.scratchThreshold // 256)
+        self.scratchSlide.valueChanged.connect(self.updateScratch)
+
+        self.scratchDir = ""
+        self.scratchDirInfo = QLabel("Scratch File Folder:", self)
+        self.scratchDirEdit = QLineEdit(self)
+        self.scratchDirEdit.setPlaceholderText("System temporary folder")
+        self.scratchDirEdit.textChanged.connect(self.updateScratchDir)
+
+        self.dirtCacheDir = ""
+        self.dirtCacheDirInfo = QLabel("Lens Dirt Cache Folder:", self)
+        self.dirtCacheDirEdit = QLineEdit(self)
+        self.dirtCacheDirEdit.setPlaceholderText("User cache folder")
+        self.dirtCacheDirEdit.textChanged.connect(self.updateDirtCacheDir)
+
+        self.sparseWrites = True
+        self.sparseBox = QCheckBox("Skip writing empty tiles (less memory for sparse effects)", self)
+        self.sparseBox.setChecked(True)
+        self.sparseBox.stateChanged.connect(self.updateSparseWrites)
+
+        self.linearLight = False
+        self.linearBox = QCheckBox("Blend light in linear space (more natural bloom and flares)", self)
+        self.linearBox.stateChanged.connect(self.updateLinear)
+
+        self.workerProcess = False
+        self.workerBox = QCheckBox("Run filters in a separate process (Krita survives crashes)", self)
+        self.workerBox.stateChanged.connect(self.updateWorkerProcess)
+
+        self.workerPython = ""
+        self.workerPythonInfo = QLabel("Python for the Worker Process:", self)
+        self.workerPythonEdit = QLineEdit(self)
+        self.workerPythonEdit.setPlaceholderText("Same as Krita")
+        self.workerPythonEdit.textChanged.connect(self.updateWorkerPython)
+
+        self.profile = False
+        self.profileBox = QCheckBox("Profile filters (prints timings and saves a trace file)", self)
+        self.profileBox.stateChanged.connect(self.updateProfile)
+
+        self.tuning = {}
+        self.tuningInfo = QLabel("Not calibrated, every stage uses the thread count above", self)
+        self.tuningInfo.setWordWrap(True)
+        self.calibrateButton = QPushButton("Calibrate", self)
+        self.calibrateButton.clicked.connect(self.calibrate)
+        self.resetTuningButton = QPushButton("Reset", self)
+        self.resetTuningButton.clicked.connect(self.resetTuning)
+        self.calibrateThread = None
+        self.calibrateResult = None
+        self.calibrateTimer = QTimer(self)
+        self.calibrateTimer.timeout.connect(self.checkCalibration)
+        tuningButtons = QHBoxLayout()
+        tuningButtons.addWidget(self.calibrateButton)
+        tuningButtons.addWidget(self.resetTuningButton)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.threadInfo)
         vbox.addWidget(self.workThreads)
+        vbox.addWidget(self.tuningInfo)
+        vbox.addLayout(tuningButtons)
+        vbox.addWidget(self.streamBox)
+        vbox.addWidget(self.sparseBox)
+        vbox.addWidget(self.linearBox)
+        vbox.addWidget(self.scratchInfo)
+        vbox.addWidget(self.scratchSlide)
+        vbox.addWidget(self.scratchDirInfo)
+        vbox.addWidget(self.scratchDirEdit)
+        vbox.addWidget(self.dirtCacheDirInfo)
+        vbox.addWidget(self.dirtCacheDirEdit)
+        vbox.addWidget(self.workerBox)
+        vbox.addWidget(self.workerPythonInfo)
+        vbox.addWidget(self.workerPythonEdit)
+        vbox.addWidget(self.profileBox)
 
         self.setLayout(vbox)
         self.show()
@@ -32,6 +111,95 @@ class SettingsWidget(QWidget):
         self.threadInfo.setText("Number of Worker CPU Threads (FOR ADVANCED USERS): " + str(value))
         self.numThreads = value
 
+    # Time the kernels on this machine in the background so Krita stays responsive,
+    # the window can't be closed until it's done
+    def calibrate(self):
+        self.calibrateButton.setEnabled(False)
+        self.resetTuningButton.setEnabled(False)
+        self.tuningInfo.setText("Calibrating, this takes a few seconds...")
+        self.calibrateResult = None
+        self.calibrateThread = Thread(target=self.runCalibration, daemon=True)
+        self.calibrateThread.start()
+        self.calibrateTimer.start(100)
+
+    # Runs on the calibration thread
+    def runCalibration(self):
+        self.calibrateResult = Calibrate()
+
+    def checkCalibration(self):
+        if self.calibrateThread.is_alive():
+            return
+        self.calibrateTimer.stop()
+        self.calibrateThread = None
+        if self.calibrateResult is not None:
+            tuning, timings = self.calibrateResult
+            self.updateTuning(tuning)
+        else:
+            self.tuningInfo.setText("Calibrating failed, every stage uses the thread count above")
+        self.calibrateButton.setEnabled(True)
+        self.resetTuningButton.setEnabled(True)
+
+    # Busy while calibrating, the controller won't apply or close until it's done
+    def isBusy(self):
+        return self.calibrateThread is not None
+
+    def resetTuning(self):
+        self.updateTuning({})
+
+    def updateTuning(self, tuning):
+        self.tuning = tuning
+        if tuning:
+            self.tuningInfo.setText("Calibrated - " + ", ".join(DescribeTuning(tuning)))
+        else:
+            self.tuningInfo.setText("Not calibrated, every stage uses the thread count above")
+
+    def updateStreaming(self, state):
+        if state == Qt.Checked:
+            self.streaming = True
+        else:
+            self.streaming = False
+
+    def updateSparseWrites(self, state):
+        if state == Qt.Checked:
+            self.sparseWrites = True
+        else:
+            self.sparseWrites = False
+
+    # Slider is in steps of 256MB, 0 turns scratch files off
+    def updateScratch(self, value):
+        if value == 0:
+            self.scratchInfo.setText("Use Scratch Files Above: Never")
+        else:
+            self.scratchInfo.setText("Use Scratch Files Above: " + str(value / 4) + " GB")
+        self.scratchThreshold = value * 256
+
+    def updateScratchDir(self, text):
+        self.scratchDir = text
+
+    def updateDirtCacheDir(self, text):
+        self.dirtCacheDir = text
+
+    def updateLinear(self, state):
+        if state == Qt.Checked:
+            self.linearLight = True
+        else:
+            self.linearLight = False
+
+    def updateWorkerProcess(self, state):
+        if state == Qt.Checked:
+            self.workerProcess = True
+        else:
+            self.workerProcess = False
+
+    def updateWorkerPython(self, text):
+        self.workerPython = text
+
+    def updateProfile(self, state):
+        if state == Qt.Checked:
+            self.profile = True
+        else:
+            self.profile = False
+
     # Required for main window to call into
     def getWindowName(self):
         return "Settings"
@@ -44,22 +212,132 @@ Number of Worker CPU Threads (1-64)
     calculations. By default this is set to the number of
     logical processors in your system. For best results set
     to the maximum number of parallel threads your CPU
-    can handle"""
+    can handle
+Calibrate
+    Time every kind of filter stage on this computer with
+    different numbers of threads and chunk sizes, and use the
+    fastest from then on. Stages that only read and write memory
+    often run best with fewer threads than the CPU has, stages
+    that sample around the image or draw dirt shapes with more,
+    split into smaller chunks. Calibrated stages ignore the
+    number of threads above, Reset goes back to using it. Run
+    it again after changing hardware
+Process Images in Bands
+    Read, filter and write the layer a band of rows at a time
+    instead of all at once. Use this for very large images that
+    would otherwise run out of memory. Pseudo lens flare samples
+    the whole image so it is always processed in one go
+Skip Writing Empty Tiles
+    Effects are written to a new, empty layer, and parts of it
+    the effect left completely empty aren't written at all.
+    Krita only stores the parts of a layer that were written,
+    so effects like bloom or flares on a mostly dark image take
+    far less memory and are quicker to add
+Blend Light in Linear Space
+    Convert RGB and grayscale layers from sRGB to linear light
+    before adding and scaling colors, and back again afterwards.
+    Bright areas spread and add up the way real light does, so
+    lower power settings are needed. Layers that already use a
+    linear profile are left as they are
+Use Scratch Files Above (Never, 0.25-32 GB)
+    When a filter would need more memory than this for the
+    image and its in-between stages, those stages are kept in
+    temporary files instead of memory
+Scratch File Folder
+    Where to put the temporary files, leave empty to use the
+    system's temporary folder. A fast drive with plenty of free
+    space works best
+Lens Dirt Cache Folder
+    Where lens dirt with a pattern seed is kept so applying it
+    again only loads it, leave empty to use your user cache
+    folder. Old patterns are deleted once it grows past 256 MB
+Run Filters in a Separate Process
+    Apply filters in a worker process, passing pixels through
+    shared memory. If the filter crashes only the worker is
+    lost, and cancelling always stops it within a couple of
+    seconds. Starting the worker adds a short delay
+Python for the Worker Process
+    The python interpreter to start the worker with, leave
+    empty to use the same one as Krita. Set this if the worker
+    fails to start, it needs to be able to import PyQt5
+Profile Filters
+    Time every stage of a filter, including Krita's own reads,
+    writes and blurs, then print a summary to Krita's log and
+    save a trace (open it in chrome://tracing or
+    ui.perfetto.dev) to the system's temporary folder"""
 
     def saveSettings(self, settings):
         settings.setValue("G_numThreads", self.numThreads)
+        if self.streaming:
+            streaming = 1
+        else:
+            streaming = 0
+        settings.setValue("G_streaming", streaming)
+        if self.sparseWrites:
+            sparseWrites = 1
+        else:
+            sparseWrites = 0
+        settings.setValue("G_sparseWrites", sparseWrites)
+        if self.linearLight:
+            linear = 1
+        else:
+            linear = 0
+        settings.setValue("G_linearLight", linear)
+        settings.setValue("G_scratchThreshold", self.scratchThreshold)
+        settings.setValue("G_scratchDir", self.scratchDir)
+        settings.setValue("G_dirtCacheDir", self.dirtCacheDir)
+        if self.workerProcess:
+            workerProcess = 1
+        else:
+            workerProcess = 0
+        settings.setValue("G_workerProcess", workerProcess)
+        settings.setValue("G_workerPython", self.workerPython)
+        if self.profile:
+            profile = 1
+        else:
+            profile = 0
+        settings.setValue("G_profile", profile)
+        SaveTuning(settings, self.tuning)
 
     def readSettings(self, settings):
         self.updateThread(int(settings.value("G_numThreads", cpu_count())))
+        self.streaming = int(settings.value("G_streaming", 0)) == 1
+        self.sparseWrites = int(settings.value("G_sparseWrites", 1)) == 1
+        self.linearLight = int(settings.value("G_linearLight", 0)) == 1
+        self.updateScratch(int(settings.value("G_scratchThreshold", DEFAULT_THRESHOLD_MB)) // 256)
+        self.updateScratchDir(str(settings.value("G_scratchDir", "")))
+        self.updateDirtCacheDir(str(settings.value("G_dirtCacheDir", "")))
+        self.workerProcess = int(settings.value("G_workerProcess", 0)) == 1
+        self.updateWorkerPython(str(settings.value("G_workerPython", "")))
+        self.profile = int(settings.value("G_profile", 0)) == 1
+        self.updateTuning(ReadTuning(settings))
         # Update interactable UI elements
         self.workThreads.setValue(self.numThreads)
+        self.streamBox.setChecked(self.streaming)
+        self.sparseBox.setChecked(self.sparseWrites)
+        self.linearBox.setChecked(self.linearLight)
+        self.scratchSlide.setValue(self.scratchThreshold // 256)
+        self.scratchDirEdit.setText(self.scratchDir)
+        self.dirtCacheDirEdit.setText(self.dirtCacheDir)
+        self.workerBox.setChecked(self.workerProcess)
+        self.workerPythonEdit.setText(self.workerPython)
+        self.profileBox.setChecked(self.profile)
 
     # No filter, should not be called
     def getBlendMode(self):
         return "normal"
 
-    def applyFilter(self, imgData, imgSize, colorData):
+    def applyFilter(self, imgData, imgSize, colorData, job, band=None):
         return None
 
-    def postFilter(self, app, doc, node, colorData):
+    def getBandOverlap(self, imgSize):
+        return None
+
+    def getNumStages(self):
+        return 0
+
+    def blursLayer(self):
+        return False
+
+    def postFilter(self, app, doc, node, colorData, job):
         pass
@@ -0,0 +1,164 @@
+"""
+Streaming.py
+Helpers for processing a layer a band of rows at a time, so only a small
+part of a large image has to be held in memory at once
+"""
+from ctypes import *
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords
+
+# Roughly how much memory each band of output should take up
+BAND_BYTES = 64 * 1024 * 1024
+
+# Krita keeps layers in square tiles this many pixels across
+TILE_SIZE = 64
+
+# Results are handed to Krita in blocks of about this many bytes, so a result kept in
+# a scratch file is never copied into memory all at once
+WRITE_BLOCK_BYTES = 16 * 1024 * 1024
+
+# A run of rows being processed on their own
+# top/bottom are the rows held in the input buffer, including any overlap needed for sampling,
+# first/rows are the rows this band is responsible for writing out
+class Band(object):
+    def __init__(self, top, bottom, first, rows):
+        self.top = top
+        self.bottom = bottom
+        self.first = first
+        self.rows = rows
+
+    # The C library always works in whole image coordinates, so point it at where
+    # row 0 would be if the buffer were the whole image. Only rows held in the
+    # buffer will ever be touched by a kernel that respects the band's overlap
+    def inputPointer(self, buffer, imgWidth, colorData):
+        return c_void_p(addressof(buffer) - (self.top * imgWidth * GetBytesPerPixel(colorData)))
+
+    def outputPointer(self, buffer, imgWidth, colorData):
+        return c_void_p(addressof(buffer) - (self.first * imgWidth * GetBytesPerPixel(colorData)))
+
+    # Index of the first pixel to write, and how many to write
+    def start(self, imgWidth):
+        return self.first * imgWidth
+
+    def numPixels(self, imgWidth):
+        return self.rows * imgWidth
+
+# The whole image as a single band
+def WholeImage(imgSize):
+    return Band(0, imgSize[1], 0, imgSize[1])
+
+# Split the image into bands, each with radius rows of overlap above and below
+# A radius of None means the filter needs the whole image at once
+def SplitIntoBands(imgSize, colorData, radius):
+    if radius is None:
+        return [WholeImage(imgSize)]
+    rowBytes = imgSize[0] * GetBytesPerPixel(colorData)
+    bandRows = max(16, BAND_BYTES // rowBytes)
+    bands = []
+    for first in range(0, imgSize[1], bandRows):
+        rows = min(bandRows, imgSize[1] - first)
+        top = max(0, first - radius)
+        bottom = min(imgSize[1], first + rows + radius)
+        bands.append(Band(top, bottom, first, rows))
+    return bands
+
+# Write rows first to first + rows of a layer from a filter's result, a block of whole
+# tile rows at a time. Slicing the result only copies the block being written
+def WriteRows(node, data, imgSize, first, rows, colorData):
+    rowBytes = imgSize[0] * GetBytesPerPixel(colorData)
+    blockRows = max(1, WRITE_BLOCK_BYTES // (rowBytes * TILE_SIZE)) * TILE_SIZE
+    for top in range(0, rows, blockRows):
+        height = min(blockRows, rows - top)
+        node.setPixelData(data[top * rowBytes:(top + height) * rowBytes], 0, first + top, imgSize[0], height)
+
+# Write rows first to first + rows of a new, empty layer, leaving out tiles that are entirely
+# zero since an empty layer already holds those, so Krita never has to make them
+# With ignoreAlpha tiles only need no color to be left out, see GetIgnoreAlpha
+# Neighbouring tiles that aren't empty are written together in one call
+# Returns False if the job was cancelled
+def WriteSparse(node, data, imgSize, first, rows, colorData, job, numThreads, ignoreAlpha=False):
+    dll = GetSharedLibrary()
+    bytesPerPixel = GetBytesPerPixel(colorData)
+    tilesAcross = (imgSize[0] + TILE_SIZE - 1) // TILE_SIZE
+    tilesDown = (rows + TILE_SIZE - 1) // TILE_SIZE
+    tileData = create_string_buffer(tilesAcross * tilesDown)
+    if not job.run(dll.VFXFindEmptyTiles, tilesAcross * tilesDown, numThreads,
+                    (TILE_SIZE, 1 if ignoreAlpha else 0, Coords(imgSize[0], rows), data, tileData, colorData)):
+        return False
+    emptyTiles = tileData.raw
+    # Dense results go out in one piece, the same as writing them directly
+    if emptyTiles.count(0) == len(emptyTiles):
+        WriteRows(node, data, imgSize, first, rows, colorData)
+        return True
+    rowBytes = imgSize[0] * bytesPerPixel
+    for tileRow in range(tilesDown):
+        top = tileRow * TILE_SIZE
+        height = min(TILE_SIZE, rows - top)
+        x = 0
+        while x < tilesAcross:
+            if emptyTiles[tileRow * tilesAcross + x]:
+                x += 1
+                continue
+            end = x
+            while end < tilesAcross and not emptyTiles[tileRow * tilesAcross + end]:
+                end += 1
+            left = x * TILE_SIZE
+            right = min(end * TILE_SIZE, imgSize[0])
+            if left == 0 and right == imgSize[0]:
+                block = data[top * rowBytes:(top + height) * rowBytes]
+            else:
+                block = b"".join(data[((top + y) * rowBytes) + (left * bytesPerPixel):((top + y) * rowBytes) + (right * bytesPerPixel)]
+                                 for y in range(height))
+            node.setPixelData(block, left, first + top, right - left, height)
+            x = end
+    return True
+
+# Pixels with no color change nothing on an added layer, whatever their alpha, as long as
+# nothing blurs the layer afterwards and mixes that alpha into its neighbours
+def GetIgnoreAlpha(filterWidget):
+    return filterWidget.getBlendMode() == "add" and not filterWidget.blursLayer()
+
+# Read, filter and write the layer one band at a time
+# Reads come from srcNode and writes go to dstNode so overlap rows are never read back
+# after they've been overwritten. With sparse, dstNode must be a new layer and empty tiles
+# are left out. Returns False if the job was cancelled
+def StreamFilter(filterWidget, srcNode, dstNode, imgSize, colorData, job, sparse=False, numThreads=1,
+                 ignoreAlpha=False):
+    for band in SplitIntoBands(imgSize, colorData, filterWidget.getBandOverlap(imgSize)):
+        bandBytes = (band.bottom - band.top) * imgSize[0] * GetBytesPerPixel(colorData)
+        with job.profiler.phase("projectionPixelData", bandBytes):
+            imgData = srcNode.projectionPixelData(0, band.top, imgSize[0], band.bottom - band.top)
+        with job.profiler.phase("applyFilter"):
+            resultData = filterWidget.applyFilter(imgData, imgSize, colorData, job, band)
+        if resultData is None or job.cancelled:
+            return False
+        with job.profiler.phase("setPixelData", len(resultData)):
+            if sparse:
+                if not WriteSparse(dstNode, resultData, imgSize, band.first, band.rows, colorData, job, numThreads,
+                                   ignoreAlpha):
+                    return False
+            else:
+                WriteRows(dstNode, resultData, imgSize, band.first, band.rows, colorData)
+    return True
+
+# Run a per-pixel kernel like VFXPower over a node in place, a band at a time if streaming
+# The kernel is called as kernel(start, n, param, imgSize, imgData, outData, colorData, JobControl*)
+# Returns False if the job was cancelled
+def StreamPixelKernel(node, imgSize, colorData, job, numThreads, streaming, kernel, param):
+    if streaming:
+        bands = SplitIntoBands(imgSize, colorData, 0)
+    else:
+        bands = [WholeImage(imgSize)]
+    imgCoords = Coords(imgSize[0], imgSize[1])
+    for band in bands:
+        bandBytes = (band.bottom - band.top) * imgSize[0] * GetBytesPerPixel(colorData)
+        with job.profiler.phase("projectionPixelData", bandBytes):
+            imgData = node.projectionPixelData(0, band.top, imgSize[0], band.bottom - band.top)
+        cimgData = c_char * len(imgData)
+        newData = job.allocate(band.numPixels(imgSize[0]) * GetBytesPerPixel(colorData))
+        if not job.run(kernel, band.numPixels(imgSize[0]), numThreads,
+                        (param, imgCoords, band.inputPointer(cimgData.from_buffer(imgData), imgSize[0], colorData),
+                         band.outputPointer(newData, imgSize[0], colorData), colorData), band.start(imgSize[0])):
+            return False
+        with job.profiler.phase("setPixelData", len(newData)):
+            WriteRows(node, newData, imgSize, band.first, band.rows, colorData)
+    return True
@@ -0,0 +1,214 @@
+"""
+Sweep.py
+Renders many settings of an effect at once on a small proxy of the image
+and lays them out side by side on a contact sheet, sharing the stages the
+variants have in common instead of running them again for every one
+"""
+from ctypes import *
+from threading import Thread, Lock
+from itertools import product
+from os import cpu_count
+import hashlib
+from .LibHandler import GetSharedLibrary, GetBytesPerPixel, Coords, TranslateColorData
+from .LensFlareWidget import GetMipSizes
+from .Headless import PresetSettings, CreateFilterWidget, RenderEffect, CompositeEffect
+from .RenderWorker import GetWidgetState, RestoreFilter
+from .ImageFiles import Image
+from .FilterJob import FilterJob
+from .ScratchBuffer import ScratchAllocator
+
+# Largest width or height of the proxy the variants are rendered on
+DEFAULT_PROXY_SIZE = 512
+
+# Empty pixels between the variants on the contact sheet
+SHEET_GUTTER = 4
+
+# Stages that only depend on their settings and one input layer, and where in their
+# arguments the input and output layers are. Every variant thresholds the same proxy,
+# and variants with the same threshold blur the same highlights
+SHARED_STAGES = {
+    "VFXHighPass": (2, 3),
+    "VFXBoxBlurLines": (3, 4),
+}
+
+# Sweeps are given as KEY=VALUE,VALUE,... with the same setting names Krita saves
+def ParseSweep(text):
+    if "=" not in text:
+        raise ValueError("Sweeps are set as KEY=VALUE,VALUE,..., got " + text)
+    key, values = text.split("=", 1)
+    values = [value.strip() for value in values.split(",") if value.strip()]
+    if not values:
+        raise ValueError("No values to sweep " + key.strip() + " over")
+    return key.strip(), values
+
+# Every combination of the swept values, the last setting changing fastest
+def GetVariants(sweeps):
+    keys = [key for key, values in sweeps]
+    return [dict(zip(keys, combination)) for combination in product(*[values for key, values in sweeps])]
+
+def DescribeVariant(variant):
+    return " ".join(key + "=" + str(value) for key, value in variant.items())
+
+# Where a kernel argument points, however it was passed
+def GetAddress(pointer):
+    if isinstance(pointer, c_void_p):
+        return pointer.value or 0
+    if hasattr(pointer, "_obj"):
+        return addressof(pointer._obj)
+    return addressof(pointer)
+
+# Plain values of the settings a kernel is run with, structures field by field
+def GetArgumentKey(value):
+    if isinstance(value, Structure):
+        return tuple(GetArgumentKey(getattr(value, name)) for name, fieldType in value._fields_)
+    return value
+
+# Outputs of shared stages, looked up by the kernel, its settings and what its input held
+# Variants running at the same time wait on each other instead of running a stage twice
+class StageCache(object):
+    def __init__(self, layerBytes):
+        self.layerBytes = layerBytes
+        self.results = {}
+        self.locks = {}
+        self.lock = Lock()
+        self.runs = {}
+        self.shared = {}
+
+    def getLock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, Lock())
+
+    def makeKey(self, name, start, numItems, args, inputIndex, outputIndex):
+        settings = tuple(GetArgumentKey(value) for index, value in enumerate(args) if index not in (inputIndex, outputIndex))
+        digest = hashlib.sha1(string_at(GetAddress(args[inputIndex]), self.layerBytes)).digest()
+        return (name, start, numItems, settings, digest)
+
+    def count(self, counts, name):
+        with self.lock:
+            counts[name] = counts.get(name, 0) + 1
+
+# A job that takes shared stages from the cache when another variant already ran them
+class SweepJob(FilterJob):
+    def __init__(self, cache):
+        super(SweepJob, self).__init__()
+        self.cache = cache
+
+    def run(self, kernel, numItems, numThreads, args, start=0):
+        name = getattr(kernel, "__name__", "")
+        if name not in SHARED_STAGES or self.cancelled:
+            return super(SweepJob, self).run(kernel, numItems, numThreads, args, start)
+        inputIndex, outputIndex = SHARED_STAGES[name]
+        key = self.cache.makeKey(name, start, numItems, args, inputIndex, outputIndex)
+        with self.cache.getLock(key):
+            result = self.cache.results.get(key)
+            if result is None:
+                if not super(SweepJob, self).run(kernel, numItems, numThreads, args, start):
+                    return False
+                self.cache.results[key] = string_at(GetAddress(args[outputIndex]), self.cache.layerBytes)
+                self.cache.count(self.cache.runs, name)
+                return True
+        self.stage += 1
+        memmove(GetAddress(args[outputIndex]), result, self.cache.layerBytes)
+        self.cache.count(self.cache.shared, name)
+        return True
+
+# Shrink the image by halves until it fits in maxSize, averaging the stored values
+# like Krita does when zoomed out
+def MakeProxy(image, maxSize, numThreads):
+    size = image.size
+    numLevels = 0
+    while max(size) > maxSize and min(size) > 1:
+        numLevels += 1
+        size = GetMipSizes(image.size, numLevels)[-1]
+    if numLevels == 0:
+        return Image(bytearray(image.data), image.size, image.colorModel, image.colorDepth)
+    dll = GetSharedLibrary()
+    colorData = TranslateColorData(image.colorModel, image.colorDepth)
+    bytesPerPixel = GetBytesPerPixel(colorData)
+    mipSizes = GetMipSizes(image.size, numLevels)
+    mipData = create_string_buffer(sum(level[0] * level[1] for level in mipSizes[1:]) * bytesPerPixel)
+    imgData = (c_char * len(image.data)).from_buffer(bytearray(image.data))
+    job = FilterJob()
+    for level in range(1, numLevels + 1):
+        job.run(dll.VFXBuildMipLevel, mipSizes[level][0] * mipSizes[level][1], numThreads,
+                (level, Coords(image.size[0], image.size[1]), imgData, mipData, colorData))
+    # Only the smallest level is kept, it's the last one in the pyramid
+    proxyBytes = size[0] * size[1] * bytesPerPixel
+    return Image(bytearray(mipData.raw[len(mipData) - proxyBytes:]), size, image.colorModel, image.colorDepth)
+
+# Lay the variants out in rows of columns, in the order they were rendered
+def BuildContactSheet(images, columns, gutter=SHEET_GUTTER):
+    first = images[0]
+    bytesPerPixel = GetBytesPerPixel(TranslateColorData(first.colorModel, first.colorDepth))
+    cellWidth, cellHeight = first.size
+    columns = max(1, min(columns, len(images)))
+    rows = (len(images) + columns - 1) // columns
+    sheetSize = (columns * cellWidth + (columns - 1) * gutter, rows * cellHeight + (rows - 1) * gutter)
+    sheetRowBytes = sheetSize[0] * bytesPerPixel
+    cellRowBytes = cellWidth * bytesPerPixel
+    sheetData = bytearray(sheetRowBytes * sheetSize[1])
+    for index, image in enumerate(images):
+        left = (index % columns) * (cellWidth + gutter) * bytesPerPixel
+        top = (index // columns) * (cellHeight + gutter)
+        for y in range(cellHeight):
+            offset = (top + y) * sheetRowBytes + left
+            sheetData[offset:offset + cellRowBytes] = image.data[y * cellRowBytes:(y + 1) * cellRowBytes]
+    return Image(sheetData, sheetSize, first.colorModel, first.colorDepth)
+
+# Render one variant of the effect, blended onto the proxy unless only the layer was asked for
+def RenderVariant(filterRunner, proxy, settings, cache, layerOnly):
+    job = SweepJob(cache)
+    job.scratch = ScratchAllocator()
+    node = RenderEffect(filterRunner, proxy, settings, job)
+    if node is None:
+        raise RuntimeError("The filter failed")
+    if layerOnly:
+        outData = node.data
+    else:
+        outData = CompositeEffect(proxy, node, int(settings.value("G_numThreads", cpu_count())), job)
+    job.scratch.release()
+    return Image(outData, proxy.size, proxy.colorModel, proxy.colorDepth)
+
+# Each worker takes the next variant until there are none left
+def RenderVariants(tasks, taskLock, proxy, cache, layerOnly, images, errors):
+    while True:
+        with taskLock:
+            task = next(tasks, None)
+        if task is None:
+            break
+        index, filterRunner, settings = task
+        try:
+            images[index] = RenderVariant(filterRunner, proxy, settings, cache, layerOnly)
+        except Exception as error:
+            errors[index] = str(error)
+
+# Render every variant of an effect on a proxy of the image, numWorkers at a time
+# Each variant is settings with its own values on top, and gets G_numThreads threads
+# Returns the rendered proxies in the same order, the stage cache, and an error or None for each
+def RenderSweep(effect, settings, image, variants, numWorkers=1, proxySize=DEFAULT_PROXY_SIZE, layerOnly=False):
+    numThreads = int(settings.value("G_numThreads", cpu_count()))
+    proxy = MakeProxy(image, proxySize, max(1, numThreads * numWorkers))
+    linearLight = int(settings.value("G_linearLight", 0)) == 1
+    colorData = TranslateColorData(proxy.colorModel, proxy.colorDepth, linearLight)
+    cache = StageCache(proxy.size[0] * proxy.size[1] * GetBytesPerPixel(colorData))
+    # Widgets are Qt objects, so each variant's settings are read on this thread and the
+    # workers get plain copies of the filter, like a worker process would
+    filterWidget = CreateFilterWidget(effect, settings)
+    tasks = []
+    for index, variant in enumerate(variants):
+        variantSettings = PresetSettings(settings.values)
+        for key, value in variant.items():
+            variantSettings.setValue(key, value)
+        filterWidget.readSettings(variantSettings)
+        tasks.append((index, RestoreFilter(type(filterWidget), GetWidgetState(filterWidget)), variantSettings))
+    images = [None] * len(variants)
+    errors = [None] * len(variants)
+    taskLock = Lock()
+    taskIterator = iter(tasks)
+    workers = [Thread(target=RenderVariants, args=(taskIterator, taskLock, proxy, cache, layerOnly, images, errors))
+               for i in range(max(1, min(numWorkers, len(tasks))))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return images, cache, errors
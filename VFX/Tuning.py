@@ -0,0 +1,146 @@
+"""
+Tuning.py
+Calibrates the filters for the machine they run on, timing each kind of
+kernel on a synthetic image with different thread counts and chunk sizes,
+and keeps the fastest for the filters to use from then on
+"""
+from ctypes import *
+from os import cpu_count
+from time import perf_counter
+import json
+import random
+from .LibHandler import GetSharedLibrary, TranslateColorData, GetBytesPerPixel, Coords, RadialFilterData, LensDirtFilterData
+from .FilterJob import FilterJob
+
+# Size of the synthetic image the kernels are timed on
+CALIBRATION_SIZE = (1024, 1024)
+
+# Every setting is timed this many times, the fastest counts
+CALIBRATION_RUNS = 3
+
+# Same dirt shapes every time so every calibration times the same work
+CALIBRATION_SEED = 1
+
+# Each benchmark is called as benchmark(dll, imgSize, imgData, outData, colorData, shapes)
+# and returns the kernel and the number of items and arguments it's run with
+def PixelBenchmark(dll, imgSize, imgData, outData, colorData, shapes):
+    return dll.VFXHighPass, imgSize[0] * imgSize[1], (180, Coords(*imgSize), imgData, outData, colorData)
+
+def SamplingBenchmark(dll, imgSize, imgData, outData, colorData, shapes):
+    settings = RadialFilterData(int(0.02 * imgSize[0]), 10, 0, 1)
+    return dll.VFXRadialAberration, imgSize[0] * imgSize[1], (settings, Coords(*imgSize), imgData, outData, colorData)
+
+def LinesBenchmark(dll, imgSize, imgData, outData, colorData, shapes):
+    return dll.VFXBoxBlurLines, imgSize[1], (16, 0, Coords(*imgSize), imgData, outData, colorData)
+
+def ShapesBenchmark(dll, imgSize, imgData, outData, colorData, shapes):
+    settings, shapeData, numShapes = shapes
+    return dll.VFXRenderLensDirt, imgSize[0] * imgSize[1], (numShapes, settings, Coords(*imgSize), byref(shapeData),
+                                                            outData, colorData)
+
+# Kernels grouped by how they use the CPU, every kernel in a class is given the same settings
+# Chunk sizes are in the items the class' kernels count, pixels or lines, 0 splits the work
+# evenly with one chunk per thread like an uncalibrated filter
+# Kernels that need a set split, like counting highlights per thread or seeded dirt shapes, are left out
+KERNEL_CLASSES = {
+    # Memory bound math on each pixel on its own
+    "Per pixel": (["VFXHighPass", "VFXPower", "VFXExpandDirtMask", "VFXCompositeLayer", "VFXFinishConvolution",
+                   "VFXBuildMipLevel", "VFXAccumulateLayer",
+                   "VFXLoadSpectrumPixels", "VFXFinishSpectrum"], [0, 16384, 131072], PixelBenchmark),
+    # Gathers from all over the image, cost depends on where a pixel is
+    "Sampling": (["VFXLinearAberration", "VFXRadialAberration", "VFXPsuedoLensFlare", "VFXGhostLensFlare"],
+                 [0, 4096, 32768], SamplingBenchmark),
+    # Runs along whole rows or columns
+    "Lines": (["VFXStreak", "VFXBoxBlurLines", "VFXBlurDirtMask", "VFXResampleRows", "VFXAccumulateSpectralSample"], [0, 8, 32], LinesBenchmark),
+    # Compute bound, every pixel checks every dirt shape
+    "Shapes": (["VFXRenderLensDirt", "VFXRenderDirtMask"], [0, 4096, 32768], ShapesBenchmark),
+}
+
+# Powers of two up to the number of logical processors, and half of it for CPUs with two threads per core
+def GetThreadCandidates(maxThreads=None):
+    maxThreads = maxThreads or cpu_count() or 1
+    candidates = {1, maxThreads, max(1, maxThreads // 2)}
+    numThreads = 2
+    while numThreads < maxThreads:
+        candidates.add(numThreads)
+        numThreads *= 2
+    return sorted(candidates)
+
+# Fastest of a few runs of a kernel with the given settings, or None if cancelled
+def TimeKernel(kernel, numItems, args, numThreads, chunkSize, waitCallback):
+    best = None
+    for i in range(CALIBRATION_RUNS):
+        job = FilterJob()
+        job.waitCallback = waitCallback
+        job.tuning = {kernel.__name__: [numThreads, chunkSize]}
+        begin = perf_counter()
+        if not job.run(kernel, numItems, numThreads, args):
+            return None
+        elapsed = perf_counter() - begin
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# Time every kernel class at every thread count and chunk size, returns the tuning for
+# FilterJob and the fastest time of each class
+# waitCallback is called between runs and while they wait, like a job's
+def Calibrate(waitCallback=None, maxThreads=None):
+    dll = GetSharedLibrary()
+    imgSize = CALIBRATION_SIZE
+    colorData = TranslateColorData("RGBA", "U8")
+    size = imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData)
+    generator = random.Random(CALIBRATION_SEED)
+    imgData = create_string_buffer(bytes(value if value >= 250 else value // 3 for value in generator.randbytes(size)), size)
+    outData = create_string_buffer(size)
+    numShapes = 10 * 10
+    shapeSettings = LensDirtFilterData(int(0.1 * imgSize[0]), 50, 50, 50, 5, 100, 0, 0)
+    shapeData = (c_float * (numShapes * 12))()
+    FilterJob().run(dll.VFXCreateDirtShapes, numShapes, 1, (shapeSettings, Coords(*imgSize), c_uint(CALIBRATION_SEED),
+                                                             byref(shapeData)))
+    shapes = (shapeSettings, shapeData, numShapes)
+
+    tuning = {}
+    timings = {}
+    for className, (kernelNames, chunkSizes, benchmark) in KERNEL_CLASSES.items():
+        kernel, numItems, args = benchmark(dll, imgSize, imgData, outData, colorData, shapes)
+        best = None
+        for numThreads in GetThreadCandidates(maxThreads):
+            for chunkSize in chunkSizes:
+                elapsed = TimeKernel(kernel, numItems, args, numThreads, chunkSize, waitCallback)
+                if elapsed is not None and (best is None or elapsed < best[0]):
+                    best = (elapsed, numThreads, chunkSize)
+                if waitCallback:
+                    waitCallback()
+        for kernelName in kernelNames:
+            tuning[kernelName] = [best[1], best[2]]
+        timings[className] = best[0]
+    return tuning, timings
+
+# One line for each kernel class, for showing the user what was picked
+def DescribeTuning(tuning):
+    lines = []
+    for className, (kernelNames, chunkSizes, benchmark) in KERNEL_CLASSES.items():
+        if kernelNames[0] not in tuning:
+            continue
+        numThreads, chunkSize = tuning[kernelNames[0]]
+        line = className + ": " + str(numThreads) + (" thread" if numThreads == 1 else " threads")
+        if chunkSize > 0:
+            line += ", chunks of " + str(chunkSize)
+        lines.append(line)
+    return lines
+
+# Settings keep the tuning as json text, an empty or broken one means not calibrated
+def ReadTuning(settings):
+    text = settings.value("G_tuning", "")
+    if not text:
+        return {}
+    try:
+        tuning = json.loads(str(text))
+    except ValueError:
+        return {}
+    if not isinstance(tuning, dict):
+        return {}
+    return {name: [int(value[0]), int(value[1])] for name, value in tuning.items()}
+
+def SaveTuning(settings, tuning):
+    settings.setValue("G_tuning", json.dumps(tuning, sort_keys=True))
@@ -1,12 +1,21 @@
 """
 Class that controls the UI model for the plugin
 """
-from VFX.LibHandler import TranslateColorData
+from VFX.LibHandler import TranslateColorData, GetBytesPerPixel, IsLinearProfile
 from krita import *
-from PyQt5.QtCore import Qt, QRect
-from PyQt5.QtWidgets import QDialog, QLabel, QDialogButtonBox, QVBoxLayout, QMessageBox
-from . import ChromaticAberrationWidget, BloomWidget, LensFlareWidget, SettingsWidget, LensDirtWidget
+from PyQt5.QtCore import Qt, QRect, QTimer
+from PyQt5.QtWidgets import QApplication, QDialog, QLabel, QDialogButtonBox, QVBoxLayout, QMessageBox, QProgressBar
+from .FilterJob import FilterJob
+from .Streaming import StreamFilter, SplitIntoBands, WriteSparse, WriteRows, GetIgnoreAlpha
+from .ScratchBuffer import ScratchAllocator, DEFAULT_THRESHOLD_MB
+from .Profiler import Profiler
+from .Tuning import ReadTuning
+from threading import Thread
+from importlib import import_module
 from enum import Enum
+import os
+import tempfile
+import time
 
 # Types of possible windows
 class WindowTypes(Enum):
@@ -16,24 +25,43 @@ class WindowTypes(Enum):
     PSEUDO_FLARE = 3
     ANAMORPHIC_FLARE = 4
     LENS_DIRT = 5
+    LENS_STACK = 6
 
 # Best fit window heights
 def GetWindowSize(type):
     if  type == WindowTypes.SETTINGS:
-        return 200
+        return 560
     elif type == WindowTypes.CHROMATIC_ABERRATION:
-        return 465
+        return 540
     elif type == WindowTypes.BLOOM:
-        return 225
+        return 380
     elif type == WindowTypes.PSEUDO_FLARE:
-        return 475
+        return 500
     elif type == WindowTypes.ANAMORPHIC_FLARE:
-        return 300
+        return 380
     elif type == WindowTypes.LENS_DIRT:
-        return 600
+        return 675
+    elif type == WindowTypes.LENS_STACK:
+        return 330
     else:
         return 400
 
+# Module and class of the widget for each window, a module is only imported the
+# first time one of its windows is opened
+FILTER_WIDGETS = {
+    WindowTypes.SETTINGS: ("SettingsWidget", "SettingsWidget"),
+    WindowTypes.CHROMATIC_ABERRATION: ("ChromaticAberrationWidget", "ChromAbWidget"),
+    WindowTypes.BLOOM: ("BloomWidget", "BloomWidget"),
+    WindowTypes.PSEUDO_FLARE: ("LensFlareWidget", "PseudoLensFlareWidget"),
+    WindowTypes.ANAMORPHIC_FLARE: ("LensFlareWidget", "AnamorphicLensFlareWidget"),
+    WindowTypes.LENS_DIRT: ("LensDirtWidget", "LensDirtWidget"),
+    WindowTypes.LENS_STACK: ("LensStackWidget", "LensStackWidget"),
+}
+
+def CreateWidget(type):
+    moduleName, className = FILTER_WIDGETS[type]
+    return getattr(import_module("." + moduleName, __package__), className)()
+
 # Prefixes for settings
 def GetPrefix(type):
     if  type == WindowTypes.SETTINGS:
@@ -48,6 +76,8 @@ def GetPrefix(type):
         return 'AF'
     elif type == WindowTypes.LENS_DIRT:
         return 'LD'
+    elif type == WindowTypes.LENS_STACK:
+        return 'LS'
     else:
         return ""
 
@@ -58,9 +88,25 @@ class MainDialog(QDialog):
         self.uiController = uiController
 
     def closeEvent(self, event):
+        if self.uiController.isBusy():
+            event.ignore()
+            return
+        # Don't close out from under a running filter, stop it first
+        if self.uiController.isRunning():
+            self.uiController.cancelChanges()
+            event.ignore()
+            return
         self.uiController.saveSettings()
         event.accept()
 
+    def reject(self):
+        if self.uiController.isBusy():
+            return
+        if self.uiController.isRunning():
+            self.uiController.cancelChanges()
+            return
+        super(MainDialog, self).reject()
+
 class UIController(object):
     def __init__(self):
         self.mainWidget = MainDialog(self)
@@ -68,14 +114,24 @@ class UIController(object):
         self.helpWindow = QMessageBox()
         self.doNotSave = False
         self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Help | QDialogButtonBox.Cancel, self.mainWidget)
+        self.progressBar = QProgressBar()
+        self.progressTimer = QTimer()
         self.mainWidget.setWindowModality(Qt.WindowModal)
         self.windowType = 0
+        self.job = None
+        self.workerThread = None
+        self.renderWorker = None
+        self.pending = None
+        self.result = None
+        self.sparseWrites = True
+        self.numThreads = 1
 
     def initialize(self, parent, widgetType):
         self.parent = parent
         self.buttonBox.accepted.connect(self.applyChanges)
         self.buttonBox.rejected.connect(self.mainWidget.reject)
         self.buttonBox.helpRequested.connect(self.showHelp)
+        self.progressTimer.timeout.connect(self.checkProgress)
 
         vbox = QVBoxLayout(self.mainWidget)
 
@@ -84,26 +140,13 @@ class UIController(object):
             self.warningWidget.setText("You need to have a document open to use this script!")
             vbox.addWidget(self.warningWidget)
             self.doNotSave = True
-        elif doc.activeNode().colorDepth() == "F16":
-            self.warningWidget.setText("F16 color depth is not supported!")
-            vbox.addWidget(self.warningWidget)
-            self.doNotSave = True
         else:
-            self.doNotSave = False
-            if widgetType == WindowTypes.CHROMATIC_ABERRATION:
-                self.filterWidget = ChromaticAberrationWidget.ChromAbWidget()
-            elif widgetType == WindowTypes.BLOOM:
-                self.filterWidget = BloomWidget.BloomWidget()
-            elif widgetType == WindowTypes.PSEUDO_FLARE:
-                self.filterWidget = LensFlareWidget.PseudoLensFlareWidget()
-            elif widgetType == WindowTypes.ANAMORPHIC_FLARE:
-                self.filterWidget = LensFlareWidget.AnamorphicLensFlareWidget()
-            elif widgetType == WindowTypes.LENS_DIRT:
-                self.filterWidget = LensDirtWidget.LensDirtWidget()
-            elif widgetType == WindowTypes.SETTINGS:
-                self.filterWidget = SettingsWidget.SettingsWidget()
-                self.doNotSave = True
+            self.filterWidget = CreateWidget(widgetType)
+            self.doNotSave = widgetType == WindowTypes.SETTINGS
             vbox.addWidget(self.filterWidget)
+        self.progressBar.setRange(0, 100)
+        self.progressBar.hide()
+        vbox.addWidget(self.progressBar)
         vbox.addWidget(self.buttonBox)
         self.windowType = widgetType
 
@@ -116,28 +159,171 @@ class UIController(object):
         self.mainWidget.activateWindow()
 
     def applyChanges(self):
+        if self.isBusy():
+            return
         if not self.doNotSave:
             self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(False)
             self.buttonBox.button(QDialogButtonBox.Ok).repaint()
             app = Krita.instance()
             doc = app.activeDocument()
-            curNode = doc.activeNode().duplicate()
-            curNode.setName(curNode.name() + " - duplicate")
-            colorData = TranslateColorData(curNode.colorModel(), curNode.colorDepth())
+            profiler = Profiler(int(self.parent.settings.value("G_profile", 0)) == 1)
+            srcNode = doc.activeNode()
+            # Every pixel of the new layer is written by the filter, so start from an empty
+            # layer instead of copying the source just to overwrite it
+            with profiler.phase("createNode"):
+                curNode = doc.createNode(srcNode.name() + " - duplicate", "paintlayer")
+                if (curNode.colorModel() != srcNode.colorModel() or curNode.colorDepth() != srcNode.colorDepth()
+                        or curNode.colorProfile() != srcNode.colorProfile()):
+                    curNode.setColorSpace(srcNode.colorModel(), srcNode.colorDepth(), srcNode.colorProfile())
+            # Linear light only makes sense if the layer isn't linear already
+            linearLight = (int(self.parent.settings.value("G_linearLight", 0)) == 1
+                            and not IsLinearProfile(curNode.colorProfile()))
+            colorData = TranslateColorData(curNode.colorModel(), curNode.colorDepth(), linearLight)
             if colorData:
-                resultData = self.filterWidget.applyFilter(curNode.projectionPixelData(0, 0, doc.width(), doc.height()), (doc.width(), doc.height()), colorData)
-                curNode.setPixelData(resultData, 0, 0, doc.width(), doc.height())
-                blendMode = self.filterWidget.getBlendMode()
-                if blendMode == "add" and curNode.colorModel() == "CMYKA":
-                    blendMode = "subtract" # CMYKA is special, lower = darker
+                imgSize = (doc.width(), doc.height())
+                self.pending = (app, doc, curNode, colorData)
+                self.result = None
+                streaming = int(self.parent.settings.value("G_streaming", 0)) == 1
+                self.sparseWrites = int(self.parent.settings.value("G_sparseWrites", 1)) == 1
+                self.numThreads = int(self.parent.settings.value("G_numThreads", os.cpu_count()))
+                self.job = FilterJob()
+                self.job.waitCallback = QApplication.processEvents
+                self.job.profiler = profiler
+                self.job.scratch = self.createScratch(imgSize, colorData, streaming)
+                self.job.tuning = ReadTuning(self.parent.settings)
+                # The worker process stands in for the widget when applying, it still does everything else
+                filterRunner = self.filterWidget
+                if int(self.parent.settings.value("G_workerProcess", 0)) == 1:
+                    # Pulls in multiprocessing, only worth loading when it's turned on
+                    from .RenderWorker import RenderWorker
+                    self.renderWorker = RenderWorker(self.filterWidget, str(self.parent.settings.value("G_workerPython", "")))
+                    filterRunner = self.renderWorker
+                self.progressBar.setValue(0)
+                self.progressBar.show()
+                self.progressTimer.start(100)
+                if streaming:
+                    # Bands are read and written through Krita's API, which isn't thread safe,
+                    # so stay on the UI thread and let the job keep events flowing while it waits
+                    try:
+                        StreamFilter(filterRunner, srcNode, curNode, imgSize, colorData, self.job, self.sparseWrites,
+                                     self.numThreads, GetIgnoreAlpha(self.filterWidget))
+                    except Exception as error:
+                        self.job.fail(error)
+                    self.finishChanges()
+                    return
+                # Run the filter in the background so Krita stays responsive, then
+                # finish up on the UI thread since Krita's API isn't thread safe
+                with profiler.phase("projectionPixelData", imgSize[0] * imgSize[1] * GetBytesPerPixel(colorData)):
+                    imgData = srcNode.projectionPixelData(0, 0, doc.width(), doc.height())
+                self.workerThread = Thread(target=self.runFilter, args=(filterRunner, imgData, imgSize, colorData))
+                self.workerThread.start()
+                return
+        self.mainWidget.accept()
+
+    # Decide if this apply needs file backed scratch buffers, based on the input
+    # plus one buffer per stage, for the largest band being processed at once
+    def createScratch(self, imgSize, colorData, streaming):
+        rows = imgSize[1]
+        if streaming:
+            bands = SplitIntoBands(imgSize, colorData, self.filterWidget.getBandOverlap(imgSize))
+            rows = max(band.bottom - band.top for band in bands)
+        workingSet = GetBytesPerPixel(colorData) * imgSize[0] * rows * (self.filterWidget.getNumStages() + 1)
+        thresholdMB = int(self.parent.settings.value("G_scratchThreshold", DEFAULT_THRESHOLD_MB))
+        directory = str(self.parent.settings.value("G_scratchDir", ""))
+        return ScratchAllocator(workingSet, thresholdMB, directory)
+
+    # Runs on the worker thread, an error cancels the job so no layer is added
+    def runFilter(self, filterRunner, imgData, imgSize, colorData):
+        try:
+            with self.job.profiler.phase("applyFilter"):
+                self.result = filterRunner.applyFilter(imgData, imgSize, colorData, self.job)
+        except Exception as error:
+            self.job.fail(error)
+
+    def isRunning(self):
+        return self.job is not None
+
+    # A widget can be working on its own, like the settings calibrating, and can't be closed then
+    def isBusy(self):
+        filterWidget = getattr(self, "filterWidget", None)
+        return filterWidget is not None and hasattr(filterWidget, "isBusy") and filterWidget.isBusy()
+
+    def cancelChanges(self):
+        if self.job:
+            self.job.cancel()
+            self.progressBar.setFormat("Cancelling...")
+
+    # Update the progress bar, and once the worker is done write out the result
+    def checkProgress(self):
+        if not self.job.cancelled:
+            self.progressBar.setFormat("Stage " + str(self.job.stage) + ": %p%")
+        self.progressBar.setValue(int(self.job.progress() * 100))
+        # Nothing else to do until the worker is done, or if already finishing up
+        if self.workerThread is None or self.workerThread.is_alive():
+            return
+        self.workerThread = None
+        app, doc, curNode, colorData = self.pending
+        if self.result is not None:
+            with self.job.profiler.phase("setPixelData", len(self.result)):
+                if self.sparseWrites:
+                    WriteSparse(curNode, self.result, (doc.width(), doc.height()), 0, doc.height(), colorData, self.job,
+                                self.numThreads, GetIgnoreAlpha(self.filterWidget))
+                else:
+                    WriteRows(curNode, self.result, (doc.width(), doc.height()), 0, doc.height(), colorData)
+        self.finishChanges()
+
+    # Runs the post filter and adds the new layer, unless the job was cancelled
+    def finishChanges(self):
+        app, doc, curNode, colorData = self.pending
+        if self.renderWorker:
+            self.renderWorker.close()
+            self.renderWorker = None
+        if not self.job.cancelled:
+            blendMode = self.filterWidget.getBlendMode()
+            if blendMode == "add" and curNode.colorModel() == "CMYKA":
+                blendMode = "subtract" # CMYKA is special, lower = darker
+            with self.job.profiler.phase("setBlendingMode"):
                 curNode.setBlendingMode(blendMode)
-                # This will be no-op if there's nothing to do
-                self.filterWidget.postFilter(app, doc, curNode, colorData)
-                doc.activeNode().parentNode().addChildNode(curNode, doc.activeNode())
-                doc.refreshProjection()
-                self.saveSettings()
+            # This will be no-op if there's nothing to do
+            # Still on the UI thread here, the job keeps events flowing while it waits
+            try:
+                with self.job.profiler.phase("postFilter"):
+                    self.filterWidget.postFilter(app, doc, curNode, colorData, self.job)
+            except Exception as error:
+                self.job.fail(error)
+        self.progressTimer.stop()
+        # The result can be a scratch file's buffer, let go of it before the files are closed
+        self.result = None
+        self.job.scratch.release()
+        profiler = self.job.profiler
+        cancelled = self.job.cancelled
+        error = self.job.error
+        self.job = None
+        self.pending = None
+        if cancelled:
+            if error is not None:
+                QMessageBox.critical(self.mainWidget, "VFX - " + self.filterWidget.getWindowName(),
+                                     "The filter failed and no layer was added:\n" + str(error))
+            self.mainWidget.reject()
+            return
+        with profiler.phase("addChildNode"):
+            doc.activeNode().parentNode().addChildNode(curNode, doc.activeNode())
+        with profiler.phase("refreshProjection"):
+            doc.refreshProjection()
+        self.reportProfile(profiler)
+        self.saveSettings()
         self.mainWidget.accept()
 
+    # Print a summary of where the time went and save a trace that can be opened
+    # in chrome://tracing or ui.perfetto.dev
+    def reportProfile(self, profiler):
+        if not profiler.enabled:
+            return
+        print(profiler.summary(self.filterWidget.getWindowName()))
+        tracePath = os.path.join(tempfile.gettempdir(), "vfx_trace_" + time.strftime("%Y%m%d_%H%M%S") + ".json")
+        profiler.writeTrace(tracePath)
+        print("VFX profile trace written to " + tracePath)
+
     def showHelp(self):
         if self.filterWidget:
             self.helpWindow.setText("VFX - " + self.filterWidget.getWindowName())
@@ -1,6 +1,5 @@
 from krita import *
 from PyQt5.QtCore import QSettings, QStandardPaths
-from .UIController import UIController, WindowTypes
 
 class VFX(Extension):
     def __init__(self, parent):
@@ -9,41 +8,35 @@ class VFX(Extension):
     def setup(self):
         pass
 
-    def SettingsWindow(self):
+    # The controller, the filter widgets and the C library are only loaded once a
+    # window is first opened, so they cost nothing at Krita's startup
+    def openWindow(self, windowName):
+        from .UIController import UIController, WindowTypes
         configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
         self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
         self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.SETTINGS)
+        self.uiController.initialize(self, WindowTypes[windowName])
+
+    def SettingsWindow(self):
+        self.openWindow("SETTINGS")
 
     def ChromaticAberrationWindow(self):
-        configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
-        self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
-        self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.CHROMATIC_ABERRATION)
+        self.openWindow("CHROMATIC_ABERRATION")
 
     def BloomWindow(self):
-        configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
-        self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
-        self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.BLOOM)
+        self.openWindow("BLOOM")
 
     def PseudoFlareWindow(self):
-        configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
-        self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
-        self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.PSEUDO_FLARE)
+        self.openWindow("PSEUDO_FLARE")
 
     def AnamorphicFlareWindow(self):
-        configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
-        self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
-        self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.ANAMORPHIC_FLARE)
+        self.openWindow("ANAMORPHIC_FLARE")
 
     def LensDirtWindow(self):
-        configPath = QStandardPaths.writableLocation(QStandardPaths.GenericConfigLocation)
-        self.settings = QSettings(configPath + '/krita-scripterrc', QSettings.IniFormat)
-        self.uiController = UIController()
-        self.uiController.initialize(self, WindowTypes.LENS_DIRT)
+        self.openWindow("LENS_DIRT")
+
+    def LensStackWindow(self):
+        self.openWindow("LENS_STACK")
 
     def createActions(self, window):
         settingsAction = window.createAction("OpenVFXSettings", "VFX - Settings")
@@ -58,5 +51,7 @@ class VFX(Extension):
         anamorphicFlareAction.triggered.connect(self.AnamorphicFlareWindow)
         lensDirtAction = window.createAction("OpenLensDirt", "VFX - Render Lens Dirt")
         lensDirtAction.triggered.connect(self.LensDirtWindow)
+        lensStackAction = window.createAction("OpenLensStack", "VFX - Lens Stack")
+        lensStackAction.triggered.connect(self.LensStackWindow)
 
 Krita.instance().addExtension(VFX(Krita.instance()))
@@ -1 +1,9 @@
-from .VFX import *
\ No newline at end of file
+# Only register the extension inside Krita, so the filters themselves can also be
+# imported by other processes like the render worker
+try:
+    import krita
+except ImportError:
+    krita = None
+
+if krita is not None:
+    from .VFX import *
@@ -0,0 +1,6 @@
+# python -m VFX renders files from the command line, see Batch.py
+import sys
+from .Batch import Main
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -42,7 +42,8 @@ void ApplyLinearAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
     // Calculate vector to use for every pixel
     Vect2 vec;
@@ -56,6 +57,8 @@ void ApplyLinearAberration(
     long long y = start / imgSize.x;
     for (long long i = start; i < start + n; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         // Build coordinates
         Coords xy;
         xy.x = x;
@@ -80,6 +83,7 @@ void ApplyLinearAberration(
         }
         if (y >= imgSize.y) break;
     }
+    UpdateJob(control, n);
 }
 
 // Applies a radial aberration over n pixels
@@ -90,7 +94,8 @@ void ApplyRadialAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
     long long x = start % imgSize.x;
     long long y = start / imgSize.x;
@@ -100,6 +105,8 @@ void ApplyRadialAberration(
     center.b = (imgSize.y - 1) / 2;
     for (long long i = start; i < start + n; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         Vect2 displace;
         displace.a = x - center.a;
         displace.b = y - center.b;
@@ -147,4 +154,246 @@ void ApplyRadialAberration(
         }
         if (y >= imgSize.y) break;
     }
+    UpdateJob(control, n);
+}
+
+// Tint of each channel for a sample, in Pixel order
+// Channels the color model doesn't have are 0 so they're skipped
+static void GetChannelTints(SpectralSample sample, ColorData colorData, float* tints)
+{
+    tints[0] = (float)sample.red;
+    tints[1] = (float)sample.blue;
+    tints[2] = (float)sample.green;
+    tints[3] = (float)sample.green;
+    tints[4] = 1;
+    switch (colorData.colorModel)
+    {
+        case A:
+            tints[0] = 0;
+            tints[1] = 0;
+            tints[2] = 0;
+            tints[3] = 0;
+            break;
+        case RGBA:
+        case XYZA:
+            tints[3] = 0;
+            break;
+        case LABA:
+        case YCbCrA:
+            tints[2] = 0;
+            break;
+        case GRAYA:
+            tints[0] = 0;
+            tints[1] = 0;
+            tints[2] = 0;
+            break;
+        default:
+            break;
+    }
+}
+
+// Read pixels start to start + n into floats
+// Reading and converting every pixel once is far cheaper than in every resample pass
+void LoadSpectrumPixels(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* floatData,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* data = (float*)floatData;
+    long long planeSize = imgSize.x * imgSize.y;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel color = GetColorAtIdx(i, imgSize.x, imgData, colorData);
+        data[i] = (float)color.r;
+        data[planeSize + i] = (float)color.b;
+        data[(2 * planeSize) + i] = (float)color.o;
+        data[(3 * planeSize) + i] = (float)color.l;
+        data[(4 * planeSize) + i] = (float)color.a;
+    }
+    UpdateJob(control, n);
+}
+
+// Work out the taps of output pixels start to start + n of a line length pixels long
+// Output pixel i takes its color from center + (i - center) * scale, through a tent filter
+// that widens when shrinking so no source pixel is skipped
+void BuildResampleTaps(
+    long long start,
+    long long n,
+    double scale,
+    long long length,
+    void* tapData,
+    JobControl* control)
+{
+    ResampleTaps* taps = (ResampleTaps*)tapData;
+    double center = (length - 1) / 2.0;
+    // Half of the widest filter that still fits in RESAMPLE_MAX_TAPS
+    double radius = scale > 1.0 ? scale : 1.0;
+    if (radius > (RESAMPLE_MAX_TAPS - 1) / 2.0) radius = (RESAMPLE_MAX_TAPS - 1) / 2.0;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        double source = center + ((i - center) * scale);
+        long long low = (long long)ceil(source - radius);
+        long long high = (long long)floor(source + radius);
+        // Pixels past the edges are the edge pixel, like SampleAt
+        long long first = low < 0 ? 0 : (low >= length ? length - 1 : low);
+        ResampleTaps tap;
+        tap.first = first;
+        tap.count = 0;
+        double total = 0;
+        for (int j = 0; j < RESAMPLE_MAX_TAPS; j++)
+        {
+            tap.weights[j] = 0;
+        }
+        for (long long k = low; k <= high; k++)
+        {
+            double weight = 1.0 - (fabs(k - source) / radius);
+            if (weight <= 0) continue;
+            long long idx = k < 0 ? 0 : (k >= length ? length - 1 : k);
+            int slot = (int)(idx - first);
+            if (slot >= RESAMPLE_MAX_TAPS) break;
+            tap.weights[slot] += (float)weight;
+            if (slot >= tap.count) tap.count = slot + 1;
+            total += weight;
+        }
+        for (int j = 0; j < tap.count; j++)
+        {
+            tap.weights[j] = (float)(tap.weights[j] / total);
+        }
+        taps[i] = tap;
+    }
+    UpdateJob(control, n);
+}
+
+// Resample rows start to start + n of the loaded pixels along x
+// Only the channels the sample adds to are resampled
+void ResampleRows(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ResampleTaps* taps = (ResampleTaps*)tapData;
+    float* data = (float*)floatData;
+    float* outRows = (float*)outData;
+    long long planeSize = imgSize.x * imgSize.y;
+    float tints[SPECTRUM_CHANNELS];
+    GetChannelTints(sample, colorData, tints);
+    for (long long y = start; y < start + n; y++)
+    {
+        // Rows are big enough to check in after every one
+        if (UpdateJob(control, y - start)) return;
+        for (int c = 0; c < SPECTRUM_CHANNELS; c++)
+        {
+            if (tints[c] == 0) continue;
+            float* row = data + (c * planeSize) + (y * imgSize.x);
+            float* out = outRows + (c * planeSize) + (y * imgSize.x);
+            for (long long x = 0; x < imgSize.x; x++)
+            {
+                ResampleTaps* tap = taps + x;
+                float* source = row + tap->first;
+                // Scales close to 1 only ever blend 2 or 3 pixels, weights past count are 0
+                float sum = (tap->weights[0] * source[0]) + (tap->weights[1] * source[tap->count > 1 ? 1 : 0]);
+                for (int j = 2; j < tap->count; j++)
+                {
+                    sum += tap->weights[j] * source[j];
+                }
+                out[x] = sum;
+            }
+        }
+    }
+    UpdateJob(control, n);
+}
+
+// Resample rows start to start + n of the row resampled pixels along y and add them to the sums
+// Every output row is a weighted sum of whole source rows, so the inner loop runs straight
+// along memory. r and b are tinted by the red and blue of the sample, o and l by the green
+// so they stay put like the classic aberration keeps them, and alpha counts every sample the same
+void AccumulateSpectralSample(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ResampleTaps* taps = (ResampleTaps*)tapData;
+    float* data = (float*)floatData;
+    float* sums = (float*)sumData;
+    long long planeSize = imgSize.x * imgSize.y;
+    float tints[SPECTRUM_CHANNELS];
+    GetChannelTints(sample, colorData, tints);
+    for (long long y = start; y < start + n; y++)
+    {
+        // Rows are big enough to check in after every one
+        if (UpdateJob(control, y - start)) return;
+        ResampleTaps* tap = taps + y;
+        for (int c = 0; c < SPECTRUM_CHANNELS; c++)
+        {
+            if (tints[c] == 0) continue;
+            float* plane = data + (c * planeSize);
+            float* out = sums + (c * planeSize) + (y * imgSize.x);
+            for (int j = 0; j < tap->count; j++)
+            {
+                float weight = tints[c] * tap->weights[j];
+                float* source = plane + ((tap->first + j) * imgSize.x);
+                for (long long x = 0; x < imgSize.x; x++)
+                {
+                    out[x] += weight * source[x];
+                }
+            }
+        }
+    }
+    UpdateJob(control, n);
+}
+
+// Write out pixels start to start + n from the sums
+// Each color is divided by how much of it the samples added up to, so a
+// plain white image stays white
+void FinishSpectrum(
+    long long start,
+    long long n,
+    SpectralSample totals,
+    int numSamples,
+    Coords imgSize,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* sums = (float*)sumData;
+    long long planeSize = imgSize.x * imgSize.y;
+    double red = totals.red > 0 ? totals.red : 1;
+    double green = totals.green > 0 ? totals.green : 1;
+    double blue = totals.blue > 0 ? totals.blue : 1;
+    double alpha = numSamples > 0 ? numSamples : 1;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel color;
+        color.r = sums[i] / red;
+        color.b = sums[planeSize + i] / blue;
+        color.o = sums[(2 * planeSize) + i] / green;
+        color.l = sums[(3 * planeSize) + i] / green;
+        color.a = sums[(4 * planeSize) + i] / alpha;
+        color = ClampToColorSpace(color, colorData);
+        WritePixel(i, color, outData, colorData);
+    }
+    UpdateJob(control, n);
 }
@@ -24,6 +24,31 @@ typedef struct
     char biFilter;
 } LinearFilterData;
 
+// Most source pixels one output pixel of a resample pass blends together
+#define RESAMPLE_MAX_TAPS 8
+
+// Planes of floats kept between the spectral passes, one for each Pixel channel in order
+#define SPECTRUM_CHANNELS 5
+
+// Which source pixels along a row or column make up one output pixel, and how much of each
+// Taps run from first to first + count - 1, already clamped to the image
+typedef struct
+{
+    long long first;
+    int count;
+    float weights[RESAMPLE_MAX_TAPS];
+} ResampleTaps;
+
+// One wavelength of a spectral aberration
+// The image is scaled around its center by scale and tinted by red, green and blue
+typedef struct
+{
+    double scale;
+    double red;
+    double green;
+    double blue;
+} SpectralSample;
+
 void ApplyLinearAberration(
     long long start,
     long long n,
@@ -31,7 +56,8 @@ void ApplyLinearAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
 
 void ApplyRadialAberration(
     long long start,
@@ -40,6 +66,66 @@ void ApplyRadialAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
+
+// Read pixels start to start + n into floats, one plane of width * height floats per channel
+void LoadSpectrumPixels(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* floatData,
+    ColorData colorData,
+    JobControl* control);
+
+// Work out the taps of output pixels start to start + n of a line length pixels long
+// when it's scaled by scale around its center
+void BuildResampleTaps(
+    long long start,
+    long long n,
+    double scale,
+    long long length,
+    void* tapData,
+    JobControl* control);
+
+// Resample rows start to start + n of the loaded pixels along x, with one ResampleTaps
+// for every column
+void ResampleRows(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+// Resample rows start to start + n of the row resampled pixels along y, with one
+// ResampleTaps for every row, and add them to the sums tinted by the sample
+void AccumulateSpectralSample(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control);
+
+// Write out pixels start to start + n from the sums, divided by how much of each color
+// all the samples added up to. totals.scale is unused
+void FinishSpectrum(
+    long long start,
+    long long n,
+    SpectralSample totals,
+    int numSamples,
+    Coords imgSize,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
 
 #endif // ifndef _CHROMATICABERRATION_H_
@@ -0,0 +1,251 @@
+/**
+ * Compositing.c
+ * Stand-ins for the parts of Krita the filters lean on, blurring layers
+ * and blending them onto the image, for running outside of Krita
+ **/
+
+#include <stdlib.h>
+#include "Compositing.h"
+
+void BoxBlurLines(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    // Walk along a row, or down a column
+    long long length = vertical ? imgSize.y : imgSize.x;
+    long long step = vertical ? imgSize.x : 1;
+    for (long long line = start; line < start + n; line++)
+    {
+        // Lines are big enough to check in after every one
+        if (UpdateJob(control, line - start)) return;
+        long long first = vertical ? line : line * imgSize.x;
+        // Running sum of the window, only counting pixels inside the image so
+        // the edges don't fade out
+        Pixel sum = {0, 0, 0, 0, 0};
+        long long count = 0;
+        for (long long k = 0; k < radius && k < length; k++)
+        {
+            sum = AddPixel(sum, GetColorAtIdx(first + (k * step), imgSize.x, imgData, colorData));
+            count++;
+        }
+        for (long long k = 0; k < length; k++)
+        {
+            long long enter = k + radius;
+            long long leave = k - radius - 1;
+            if (enter < length)
+            {
+                sum = AddPixel(sum, GetColorAtIdx(first + (enter * step), imgSize.x, imgData, colorData));
+                count++;
+            }
+            if (leave >= 0)
+            {
+                sum = SubPixel(sum, GetColorAtIdx(first + (leave * step), imgSize.x, imgData, colorData));
+                count--;
+            }
+            Pixel outColor = ClampToColorSpace(ScalePixel(sum, 1.0 / count), colorData);
+            WritePixel(first + (k * step), outColor, outData, colorData);
+        }
+    }
+    UpdateJob(control, n);
+}
+
+void CompositeLayer(
+    long long start,
+    long long n,
+    char blendMode,
+    Coords imgSize,
+    void* baseData,
+    void* layerData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    double max = GetColorSpaceMax(colorData);
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel base = GetColorAtIdx(i, imgSize.x, baseData, colorData);
+        Pixel layer = GetColorAtIdx(i, imgSize.x, layerData, colorData);
+        double opacity = layer.a / max;
+        Pixel outColor = base;
+        switch (blendMode)
+        {
+            case BLEND_ADD:
+                outColor = AddPixel(base, ScalePixel(layer, opacity));
+                break;
+            case BLEND_SUBTRACT:
+                outColor = SubPixel(base, ScalePixel(layer, opacity));
+                break;
+            default:
+                outColor = AddPixel(ScalePixel(layer, opacity), ScalePixel(base, 1.0 - opacity));
+                break;
+        }
+        // Coverage adds up the same way whatever the blend mode
+        outColor.a = base.a + (layer.a * (1.0 - (base.a / max)));
+        outColor = ClampToColorSpace(outColor, colorData);
+        WritePixel(i, outColor, outData, colorData);
+    }
+    UpdateJob(control, n);
+}
+
+void AccumulateLayer(
+    long long start,
+    long long n,
+    double gain,
+    double maskGain,
+    Coords imgSize,
+    void* layerData,
+    void* maskData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control)
+{
+    double max = GetColorSpaceMax(colorData);
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        // Scaled and clamped the same as a layer that had its power applied on its own
+        Pixel layer = GetColorAtIdx(i, imgSize.x, layerData, colorData);
+        layer = ClampToColorSpace(ScalePixel(layer, gain), colorData);
+        double opacity = layer.a / max;
+        if (maskData != NULL)
+        {
+            layer = ClampToColorSpace(ScalePixel(layer, 1.0 + (maskGain * ReadMask(i, maskData, colorData))), colorData);
+        }
+        Pixel sum = GetColorAtIdx(i, imgSize.x, sumData, colorData);
+        sum = AddPixel(sum, ScalePixel(layer, opacity));
+        sum.a = max;
+        sum = ClampToColorSpace(sum, colorData);
+        WritePixel(i, sum, sumData, colorData);
+    }
+    UpdateJob(control, n);
+}
+
+void FindEmptyTiles(
+    long long start,
+    long long n,
+    int tileSize,
+    char ignoreAlpha,
+    Coords imgSize,
+    void* imgData,
+    void* tileData,
+    ColorData colorData,
+    JobControl* control)
+{
+    unsigned char* img = (unsigned char*) imgData;
+    char* tiles = (char*) tileData;
+    long long bytesPerPixel = GetBytesPerPixel(colorData);
+    // Alpha is the last channel of every color model, in both byte orders
+    long long colorBytes = bytesPerPixel;
+    if (ignoreAlpha != 0 && colorData.colorModel != A)
+    {
+        switch (colorData.colorDepth)
+        {
+            case U16:
+            case F16:
+                colorBytes -= 2;
+                break;
+            case F32:
+                colorBytes -= 4;
+                break;
+            default:
+                colorBytes -= 1;
+                break;
+        }
+    }
+    long long tilesAcross = (imgSize.x + tileSize - 1) / tileSize;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Tiles are big enough to check in after every one
+        if (UpdateJob(control, i - start)) return;
+        long long left = (i % tilesAcross) * tileSize;
+        long long top = (i / tilesAcross) * tileSize;
+        long long right = (left + tileSize < imgSize.x) ? left + tileSize : imgSize.x;
+        long long bottom = (top + tileSize < imgSize.y) ? top + tileSize : imgSize.y;
+        char empty = 1;
+        for (long long y = top; y < bottom && empty; y++)
+        {
+            unsigned char* row = img + (((y * imgSize.x) + left) * bytesPerPixel);
+            for (long long x = 0; x < right - left && empty; x++)
+            {
+                unsigned char* pixel = row + (x * bytesPerPixel);
+                for (long long k = 0; k < colorBytes; k++)
+                {
+                    if (pixel[k] != 0)
+                    {
+                        empty = 0;
+                        break;
+                    }
+                }
+            }
+        }
+        tiles[i] = empty;
+    }
+    UpdateJob(control, n);
+}
+
+// Predictor from the PNG spec, whichever neighbor is closest to a + b - c
+static unsigned char Paeth(unsigned char a, unsigned char b, unsigned char c)
+{
+    int p = (int)a + (int)b - (int)c;
+    int pa = abs(p - (int)a);
+    int pb = abs(p - (int)b);
+    int pc = abs(p - (int)c);
+    if (pa <= pb && pa <= pc) return a;
+    if (pb <= pc) return b;
+    return c;
+}
+
+char UnfilterPNG(
+    void* data,
+    long long rows,
+    long long rowBytes,
+    int bytesPerPixel,
+    void* outData)
+{
+    unsigned char* in = (unsigned char*)data;
+    unsigned char* out = (unsigned char*)outData;
+    for (long long y = 0; y < rows; y++)
+    {
+        unsigned char filter = in[y * (rowBytes + 1)];
+        unsigned char* src = in + (y * (rowBytes + 1)) + 1;
+        unsigned char* row = out + (y * rowBytes);
+        unsigned char* above = (y > 0) ? row - rowBytes : NULL;
+        for (long long x = 0; x < rowBytes; x++)
+        {
+            unsigned char left = (x >= bytesPerPixel) ? row[x - bytesPerPixel] : 0;
+            unsigned char up = above ? above[x] : 0;
+            unsigned char upLeft = (above && x >= bytesPerPixel) ? above[x - bytesPerPixel] : 0;
+            switch (filter)
+            {
+                case 0:
+                    row[x] = src[x];
+                    break;
+                case 1:
+                    row[x] = src[x] + left;
+                    break;
+                case 2:
+                    row[x] = src[x] + up;
+                    break;
+                case 3:
+                    row[x] = src[x] + (unsigned char)(((int)left + (int)up) / 2);
+                    break;
+                case 4:
+                    row[x] = src[x] + Paeth(left, up, upLeft);
+                    break;
+                default:
+                    return 0;
+            }
+        }
+    }
+    return 1;
+}
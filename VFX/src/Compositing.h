@@ -0,0 +1,88 @@
+/**
+ * Compositing.h
+ * Stand-ins for the parts of Krita the filters lean on, blurring layers
+ * and blending them onto the image, for running outside of Krita
+ **/
+
+#ifndef _COMPOSITING_H_
+#define _COMPOSITING_H_
+
+#include "Utils.h"
+
+// Ways a layer can be blended onto the image below it
+typedef enum
+{
+    BLEND_NORMAL = 0,
+    BLEND_ADD = 1,
+    BLEND_SUBTRACT = 2
+} BlendMode;
+
+// Box blur lines start to start + n of an image, rows or columns if vertical
+// Several passes in both directions come out close to Krita's blur
+void BoxBlurLines(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+// Blend pixels start to start + n of a layer onto the base image
+void CompositeLayer(
+    long long start,
+    long long n,
+    char blendMode,
+    Coords imgSize,
+    void* baseData,
+    void* layerData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+// Add pixels start to start + n of an effect layer into a sum of effect layers
+// The layer is scaled by gain, and by 1 + maskGain * mask where maskData isn't NULL,
+// with the mask's samples sized for the layer like the lens dirt mask (GetMaskSampleSize),
+// then weighted by its alpha the way blending it in add mode would be
+// The sum is left opaque so adding it once adds the same as adding every layer
+void AccumulateLayer(
+    long long start,
+    long long n,
+    double gain,
+    double maskGain,
+    Coords imgSize,
+    void* layerData,
+    void* maskData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control);
+
+// Flag tiles start to start + n of an image, in rows of tiles, that are entirely zero
+// A zeroed tile is what an empty Krita layer already holds, so it doesn't need writing
+// With ignoreAlpha only the color channels have to be zero, for layers that are added
+// or subtracted where a pixel with no color changes nothing
+// tileData gets one char per tile, non-zero if the tile is empty
+void FindEmptyTiles(
+    long long start,
+    long long n,
+    int tileSize,
+    char ignoreAlpha,
+    Coords imgSize,
+    void* imgData,
+    void* tileData,
+    ColorData colorData,
+    JobControl* control);
+
+// Undo the per row filters of decompressed PNG data, returns 0 if a row is corrupt
+// data holds rows of rowBytes + 1 bytes, the first being the filter type
+// Rows depend on the ones above them so this can't be split across threads
+char UnfilterPNG(
+    void* data,
+    long long rows,
+    long long rowBytes,
+    int bytesPerPixel,
+    void* outData);
+
+#endif // ifndef _COMPOSITING_H_
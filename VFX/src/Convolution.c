@@ -0,0 +1,311 @@
+/**
+ * Convolution.c
+ * FFT based convolution for bloom kernels too large to apply directly
+ **/
+
+#include <stdlib.h>
+#include <math.h>
+#include "Convolution.h"
+
+/**
+ * The image is split into square tiles which are convolved one at a time and
+ * added together (overlap-add), so the FFT only has to be as big as a tile plus
+ * the kernel. Each 2D FFT is done as a pass over the rows then a pass over the
+ * columns, and python runs each pass across worker threads. Every buffer is
+ * allocated by python, spectra are interleaved float pairs of real and imaginary
+ **/
+
+// In place radix 2 FFT of n complex numbers, stride complex numbers apart
+// The inverse isn't scaled, the caller divides by n afterwards
+static void FFT(float* data, long long n, long long stride, char inverse)
+{
+    // Put everything in bit reversed order first
+    long long j = 0;
+    for (long long i = 1; i < n; i++)
+    {
+        long long bit = n >> 1;
+        for (; j & bit; bit >>= 1)
+        {
+            j ^= bit;
+        }
+        j ^= bit;
+        if (i < j)
+        {
+            float* a = data + (2 * i * stride);
+            float* b = data + (2 * j * stride);
+            float re = a[0];
+            float im = a[1];
+            a[0] = b[0];
+            a[1] = b[1];
+            b[0] = re;
+            b[1] = im;
+        }
+    }
+    // Then combine into larger and larger transforms
+    for (long long len = 2; len <= n; len <<= 1)
+    {
+        double angle = (2.0 * acos(-1) / len) * (inverse ? 1 : -1);
+        double stepRe = cos(angle);
+        double stepIm = sin(angle);
+        for (long long i = 0; i < n; i += len)
+        {
+            double twiddleRe = 1.0;
+            double twiddleIm = 0.0;
+            for (long long k = 0; k < len / 2; k++)
+            {
+                float* a = data + (2 * (i + k) * stride);
+                float* b = data + (2 * (i + k + (len / 2)) * stride);
+                double re = (b[0] * twiddleRe) - (b[1] * twiddleIm);
+                double im = (b[0] * twiddleIm) + (b[1] * twiddleRe);
+                b[0] = (float)(a[0] - re);
+                b[1] = (float)(a[1] - im);
+                a[0] = (float)(a[0] + re);
+                a[1] = (float)(a[1] + im);
+                double nextRe = (twiddleRe * stepRe) - (twiddleIm * stepIm);
+                twiddleIm = (twiddleRe * stepIm) + (twiddleIm * stepRe);
+                twiddleRe = nextRe;
+            }
+        }
+    }
+}
+
+// Offset from the kernel center for a position in a wrapped around buffer
+static long long Unwrap(long long pos, long long fftSize, long long radius)
+{
+    if (pos < fftSize - radius) return pos;
+    return pos - fftSize;
+}
+
+// Brightness of the kernel at an offset from its center, before normalizing
+static double KernelValue(BloomKernelData kernelData, long long dx, long long dy)
+{
+    double radius = Max(kernelData.radius, 1);
+    double dist = sqrt((double)((dx * dx) + (dy * dy)));
+    if (dist > radius) return 0;
+    double rotation = DegreeToRadian(kernelData.angle);
+    double pi = acos(-1);
+    switch (kernelData.shape)
+    {
+        case STAR_BURST:
+        {
+            // A tight glow in the middle with thin spikes fading out from it
+            double value = exp(-12.0 * dist / radius);
+            double width = 1.0 + (radius * 0.005);
+            double fade = 1.0 - (dist / radius);
+            for (int k = 0; k < kernelData.points; k++)
+            {
+                double spikeAngle = rotation + ((2.0 * pi * k) / kernelData.points);
+                double along = (dx * cos(spikeAngle)) + (dy * sin(spikeAngle));
+                if (along <= 0) continue;
+                double across = (dy * cos(spikeAngle)) - (dx * sin(spikeAngle));
+                across /= width;
+                value += 0.5 * fade * fade * exp(-(across * across));
+            }
+            return value;
+        }
+        case APERTURE:
+        {
+            // Regular polygon like the blades of a lens aperture, with a soft edge
+            int blades = (kernelData.points < 3) ? 3 : kernelData.points;
+            double segment = (2.0 * pi) / blades;
+            double theta = atan2((double)dy, (double)dx) - rotation;
+            theta = fmod(theta, segment);
+            if (theta < 0) theta += segment;
+            double edge = (radius * cos(pi / blades)) / cos(theta - (pi / blades));
+            double value = edge - dist + 0.5;
+            if (value < 0) return 0;
+            if (value > 1) return 1;
+            return value;
+        }
+        default:
+            return 0;
+    }
+}
+
+// Render rows start to start + n of the kernel into a spectrum buffer and FFT them
+void MakeBloomKernel(
+    long long start,
+    long long n,
+    BloomKernelData kernelData,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control)
+{
+    float* data = (float*)spectrum;
+    for (long long y = start; y < start + n; y++)
+    {
+        // Rows are big enough to check in after every one
+        if (UpdateJob(control, y - start)) return;
+        float* row = data + (2 * y * fftSize);
+        long long dy = Unwrap(y, fftSize, kernelData.radius);
+        for (long long x = 0; x < fftSize; x++)
+        {
+            long long dx = Unwrap(x, fftSize, kernelData.radius);
+            row[2 * x] = (float)KernelValue(kernelData, dx, dy);
+            row[(2 * x) + 1] = 0;
+        }
+        FFT(row, fftSize, 1, 0);
+    }
+    UpdateJob(control, n);
+}
+
+// FFT columns start to start + n of a spectrum that already had its rows done
+void TransformColumns(
+    long long start,
+    long long n,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control)
+{
+    float* data = (float*)spectrum;
+    for (long long x = start; x < start + n; x++)
+    {
+        if (UpdateJob(control, x - start)) return;
+        FFT(data + (2 * x), fftSize, fftSize, 0);
+    }
+    UpdateJob(control, n);
+}
+
+// Copy rows start to start + n of a tile into the tile spectrum and FFT them
+void LoadTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* imgData,
+    void* tileSpectrum,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* data = (float*)tileSpectrum;
+    for (long long y = start; y < start + n; y++)
+    {
+        if (UpdateJob(control, y - start)) return;
+        float* row = data + (2 * y * tile.fftSize);
+        long long imgY = tile.origin.y + y;
+        char empty = (y >= tile.size || imgY >= imgSize.y);
+        for (long long x = 0; x < tile.fftSize; x++)
+        {
+            long long imgX = tile.origin.x + x;
+            if (empty || x >= tile.size || imgX >= imgSize.x)
+            {
+                row[2 * x] = 0;
+                row[(2 * x) + 1] = 0;
+                continue;
+            }
+            Pixel color = GetColorAt(imgX, imgY, imgSize.x, imgData, colorData);
+            if (tile.pair == 0)
+            {
+                row[2 * x] = (float)color.r;
+                row[(2 * x) + 1] = (float)color.b;
+            }
+            else
+            {
+                row[2 * x] = (float)color.o;
+                row[(2 * x) + 1] = (float)color.l;
+            }
+        }
+        // Rows outside the tile are all zero, and so is their transform
+        if (!empty) FFT(row, tile.fftSize, 1, 0);
+    }
+    UpdateJob(control, n);
+}
+
+// FFT columns start to start + n of the tile, multiply by the kernel, then
+// inverse FFT them back again
+// The kernel's first value is the sum of the whole kernel, dividing by it keeps
+// the total brightness the same
+void ConvolveTileColumns(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    void* tileSpectrum,
+    void* kernelSpectrum,
+    JobControl* control)
+{
+    float* data = (float*)tileSpectrum;
+    float* kernel = (float*)kernelSpectrum;
+    double kernelSum = kernel[0];
+    if (kernelSum <= 0) kernelSum = 1;
+    for (long long x = start; x < start + n; x++)
+    {
+        if (UpdateJob(control, x - start)) return;
+        FFT(data + (2 * x), tile.fftSize, tile.fftSize, 0);
+        for (long long y = 0; y < tile.fftSize; y++)
+        {
+            float* a = data + (2 * ((y * tile.fftSize) + x));
+            float* b = kernel + (2 * ((y * tile.fftSize) + x));
+            double re = ((a[0] * b[0]) - (a[1] * b[1])) / kernelSum;
+            double im = ((a[0] * b[1]) + (a[1] * b[0])) / kernelSum;
+            a[0] = (float)re;
+            a[1] = (float)im;
+        }
+        FFT(data + (2 * x), tile.fftSize, tile.fftSize, 1);
+    }
+    UpdateJob(control, n);
+}
+
+// Inverse FFT rows start to start + n of the tile and add them into the sums
+// Since the kernel is real, the real part of the result is the first channel of
+// the pair and the imaginary part is the second
+void AccumulateTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* tileSpectrum,
+    void* sumData,
+    JobControl* control)
+{
+    float* data = (float*)tileSpectrum;
+    float* sums = (float*)sumData;
+    // Both inverse passes were left unscaled
+    double scale = 1.0 / ((double)tile.fftSize * (double)tile.fftSize);
+    for (long long y = start; y < start + n; y++)
+    {
+        if (UpdateJob(control, y - start)) return;
+        // Anything past the tile plus the kernel's reach is just rounding noise
+        long long offsetY = Unwrap(y, tile.fftSize, tile.radius);
+        long long imgY = tile.origin.y + offsetY;
+        if (offsetY >= tile.size + tile.radius || imgY < 0 || imgY >= imgSize.y) continue;
+        float* row = data + (2 * y * tile.fftSize);
+        FFT(row, tile.fftSize, 1, 1);
+        for (long long x = 0; x < tile.fftSize; x++)
+        {
+            long long offsetX = Unwrap(x, tile.fftSize, tile.radius);
+            long long imgX = tile.origin.x + offsetX;
+            if (offsetX >= tile.size + tile.radius || imgX < 0 || imgX >= imgSize.x) continue;
+            float* sum = sums + (4 * ((imgY * imgSize.x) + imgX)) + (2 * tile.pair);
+            // Rounding in the FFT can leave tiny negative values where it should be dark
+            if (row[2 * x] > 0) sum[0] += (float)(row[2 * x] * scale);
+            if (row[(2 * x) + 1] > 0) sum[1] += (float)(row[(2 * x) + 1] * scale);
+        }
+    }
+    UpdateJob(control, n);
+}
+
+// Write out pixels start to start + n from the sums, multiplied by power
+void FinishConvolution(
+    long long start,
+    long long n,
+    double power,
+    Coords imgSize,
+    void* imgData,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* sums = (float*)sumData;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel color = GetColorAtIdx(i, imgSize.x, imgData, colorData);
+        Pixel outColor = {sums[4 * i], sums[(4 * i) + 1], sums[(4 * i) + 2], sums[(4 * i) + 3], color.a};
+        outColor = ScalePixel(outColor, power);
+        outColor = ClampToColorSpace(outColor, colorData);
+        WritePixel(i, outColor, outData, colorData);
+    }
+    UpdateJob(control, n);
+}
@@ -0,0 +1,102 @@
+/**
+ * Convolution.h
+ * FFT based convolution for bloom kernels too large to apply directly
+ **/
+
+#ifndef _CONVOLUTION_H_
+#define _CONVOLUTION_H_
+
+#include "Utils.h"
+
+// Shapes of kernel that can be generated
+typedef enum
+{
+    STAR_BURST = 0,
+    APERTURE = 1
+} KernelShape;
+
+// Data structure for kernel settings
+typedef struct
+{
+    char shape;  // One of KernelShape
+    int radius;  // Kernel reaches this many pixels from its center
+    int points;  // Number of spikes for a star, or blades for an aperture
+    double angle; // Rotation of the spikes or blades in degrees
+} BloomKernelData;
+
+// Where a tile of the image sits and how big its FFT is
+// Spectra are fftSize x fftSize complex numbers stored as interleaved float pairs
+typedef struct
+{
+    Coords origin;     // Top left of the tile in the image
+    long long size;    // Width and height of the tile in the image
+    long long fftSize; // Must be a power of 2, at least size + 2 * radius
+    int radius;        // Radius of the kernel
+    int pair;          // 0 for the r and b channels, 1 for the o and l channels
+} ConvolutionTile;
+
+// Render rows start to start + n of the kernel into a spectrum buffer and FFT them
+// The kernel is centered on (0, 0), wrapping around to the other edges
+void MakeBloomKernel(
+    long long start,
+    long long n,
+    BloomKernelData kernelData,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control);
+
+// FFT columns start to start + n of a spectrum that already had its rows done
+void TransformColumns(
+    long long start,
+    long long n,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control);
+
+// Copy rows start to start + n of a tile into the tile spectrum and FFT them
+// Two channels go in at once, one as the real part and one as the imaginary part
+void LoadTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* imgData,
+    void* tileSpectrum,
+    ColorData colorData,
+    JobControl* control);
+
+// FFT columns start to start + n of the tile, multiply by the kernel, then
+// inverse FFT them back again
+void ConvolveTileColumns(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    void* tileSpectrum,
+    void* kernelSpectrum,
+    JobControl* control);
+
+// Inverse FFT rows start to start + n of the tile and add them into the sums
+// sumData holds 4 floats per pixel, for the r, b, o and l channels
+void AccumulateTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* tileSpectrum,
+    void* sumData,
+    JobControl* control);
+
+// Write out pixels start to start + n from the sums, multiplied by power
+// Alpha is kept from imgData
+void FinishConvolution(
+    long long start,
+    long long n,
+    double power,
+    Coords imgSize,
+    void* imgData,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+#endif // ifndef _CONVOLUTION_H_
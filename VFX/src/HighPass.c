@@ -13,15 +13,19 @@ void ApplyPower(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
     for (long long i = start; i < start + n; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         Pixel outColor = GetColorAtIdx(i, imgSize.x, imgData, colorData);
         outColor = ScalePixel(outColor, power);
         outColor = ClampToColorSpace(outColor, colorData);
         WritePixel(i, outColor, outData, colorData);
     }
+    UpdateJob(control, n);
 }
 
 void ApplyHighPass(
@@ -31,11 +35,14 @@ void ApplyHighPass(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
     Pixel outVec = {0, 0, 0, 0, 0};
     double max = GetColorSpaceMax(colorData);
     double scaledThresh = ((double)threshold / 255.0) * max;
+    // Threshold is picked on the encoded image, so compare in the same terms
+    if (UsesLinearLight(colorData)) scaledThresh = SRGBToLinear(scaledThresh, colorData);
     double scale = max / ((max + 1) - scaledThresh);
     double halfThresh = scaledThresh / 2.0;
     Pixel threshVect = {scaledThresh, scaledThresh, scaledThresh, scaledThresh, 0};
@@ -43,6 +50,8 @@ void ApplyHighPass(
 
     for (long long i = start; i < start + n; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         // nothing technical, subtract threshold from each color channel,
         // scale, clamp, then write to output
         Pixel originalVect = GetColorAtIdx(i, imgSize.x, imgData, colorData);
@@ -69,4 +78,69 @@ void ApplyHighPass(
         outVec = ClampToColorSpace(outVec, colorData);
         WritePixel(i, outVec, outData, colorData);
     }
+    UpdateJob(control, n);
+}
+
+// Highpassed pixels with no color left can't add anything to a flare
+static char IsHighlight(Pixel pix)
+{
+    return (pix.r > 0 || pix.b > 0 || pix.o > 0 || pix.l > 0);
+}
+
+// Count the highlights in rows start to start + n of a highpassed image
+void CountHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control)
+{
+    long long* rowIndex = (long long*)rowData;
+    for (long long y = start; y < start + n; y++)
+    {
+        // Rows are big enough to check in after every one
+        if (UpdateJob(control, y - start)) return;
+        long long count = 0;
+        for (long long x = 0; x < imgSize.x; x++)
+        {
+            if (IsHighlight(GetColorAt(x, y, imgSize.x, imgData, colorData))) count++;
+        }
+        rowIndex[y + 1] = count;
+    }
+    UpdateJob(control, n);
+}
+
+// Copy the highlights in rows start to start + n into a packed list
+void CollectHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control)
+{
+    Highlight* highlights = (Highlight*)highlightData;
+    long long* rowIndex = (long long*)rowData;
+    for (long long y = start; y < start + n; y++)
+    {
+        if (UpdateJob(control, y - start)) return;
+        long long idx = rowIndex[y];
+        for (long long x = 0; x < imgSize.x; x++)
+        {
+            Pixel pix = GetColorAt(x, y, imgSize.x, imgData, colorData);
+            if (!IsHighlight(pix)) continue;
+            highlights[idx].x = x;
+            highlights[idx].r = (float)pix.r;
+            highlights[idx].b = (float)pix.b;
+            highlights[idx].o = (float)pix.o;
+            highlights[idx].l = (float)pix.l;
+            highlights[idx].a = (float)pix.a;
+            idx++;
+        }
+    }
+    UpdateJob(control, n);
 }
@@ -17,7 +17,8 @@ void ApplyPower(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
 
 void ApplyHighPass(
     long long start,
@@ -26,6 +27,44 @@ void ApplyHighPass(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
+
+// A single pixel left with some color after the highpass filter
+// Highlights are kept in rows, with a row index saying where each row starts,
+// so only the x coordinate is stored
+typedef struct
+{
+    long long x;
+    float r;
+    float b;
+    float o;
+    float l;
+    float a;
+} Highlight;
+
+// Count the highlights in rows start to start + n of a highpassed image
+// Row y's count is written to rowData[y + 1], ready to be turned into the row index
+void CountHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control);
+
+// Copy the highlights in rows start to start + n into a packed list
+// rowData[y] must hold the index of the first highlight in row y,
+// and rowData[imgSize.y] the total number of highlights
+void CollectHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control);
 
 #endif // ifndef _HIGHPASS_H_
@@ -13,7 +13,8 @@ void CreateDirtShapes(
     LensDirtFilterData filterData,  // what shapes to generate
     Coords imgSize,                 // Size of the image
     unsigned int seed,              // random seed, not time because granularity is in seconds
-    void* outData)                  // list of floats (allocated by python)
+    void* outData,                  // list of floats (allocated by python)
+    JobControl* control)            // progress and cancel state (allocated by python)
 {
     // Generating thousands of numbers is faster in C, that's why this is here
     float* out = (float*) outData;
@@ -23,9 +24,12 @@ void CreateDirtShapes(
     double pi = acos(-1);
     // srand/rand is not thread safe in C because it's state is shared across threads
     // but I don't care about that so :P
-    srand(seed);
+    // Offset by the start index so each worker gets different shapes from one seed
+    srand(seed + (unsigned int)start);
     for (long long i = start; i < n + start; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         Vect2 vec = {0,0};
         Vect2 shapeCenter = {0,0};
         float size = filterData.size;
@@ -96,140 +100,354 @@ void CreateDirtShapes(
             out[(i * floatsPerEntry) + (2 * filterData.shape)] = opacity;
         }
     }
+    UpdateJob(control, n);
 }
 
-void RenderLensDirt(
-    long long start,
-    long long n,
+// Sum of the opacities of every shape covering pixel (x, y), 1 being fully opaque
+static double DirtCoverage(
+    long long x,
+    long long y,
     long long numShapes,
     LensDirtFilterData filterData,
-    Coords imgSize,
-    void* shapes,
-    void* outData,
-    ColorData colorData)
+    float* shapeArray)
 {
-    float* shapeArray = (float*) shapes;
     unsigned int floatsPerEntry = (filterData.shape * 2) + 2; // pair of points per side + 2 for other data
-    double colorMax = GetColorSpaceMax(colorData);
-    for (long long i = start; i < n + start; i++)
+    double coverage = 0;
+    for (long long j = 0; j < numShapes; j++)
     {
-        Pixel color = {colorMax,colorMax,colorMax,colorMax,0};
-        long long x = i % imgSize.x;
-        long long y = i / imgSize.x;
-        for (long long j = 0; j < numShapes; j++)
-        {
-            // Get index for shape
-            long long shapeIdx = j * floatsPerEntry;
-            Vect2 xpoint1 = {shapeArray[shapeIdx],shapeArray[shapeIdx + 1]};
-            Vect2 xpoint2 = {0,0};
-            Vect2 xpoint3 = {0,0};
-            Vect2 xpoint4 = {0,0};
-            char point1found = 0;
-            float lerp1 = 0;
-            float lerp2 = 0;
-            // Quick sanity check to see if the shape is anywhere near this pixel
-            if (shapeArray[shapeIdx] + (filterData.size * 2) < x
-                || shapeArray[shapeIdx] - (filterData.size * 2) > x
-                || shapeArray[shapeIdx + 1] + (filterData.size * 2) < y
-                || shapeArray[shapeIdx + 1] - (filterData.size * 2) > y)
+        // Get index for shape
+        long long shapeIdx = j * floatsPerEntry;
+        Vect2 xpoint1 = {shapeArray[shapeIdx],shapeArray[shapeIdx + 1]};
+        Vect2 xpoint2 = {0,0};
+        Vect2 xpoint3 = {0,0};
+        Vect2 xpoint4 = {0,0};
+        char point1found = 0;
+        float lerp1 = 0;
+        float lerp2 = 0;
+        // Quick sanity check to see if the shape is anywhere near this pixel
+        if (shapeArray[shapeIdx] + (filterData.size * 2) < x
+            || shapeArray[shapeIdx] - (filterData.size * 2) > x
+            || shapeArray[shapeIdx + 1] + (filterData.size * 2) < y
+            || shapeArray[shapeIdx + 1] - (filterData.size * 2) > y)
+        {
+            continue;
+        }
+        if (filterData.shape == 1) // circle is a simple manner of if point is in range of the center
+        {
+            xpoint2.a = x;
+            xpoint2.b = y;
+            xpoint2 = SubVect2(xpoint2, xpoint1);
+            if (LenVect(xpoint2) <= shapeArray[shapeIdx + 2])
             {
-                continue;
+                coverage += shapeArray[shapeIdx + 3] / 100.0;
             }
-            if (filterData.shape == 1) // circle is a simple manner of if point is in range of the center
+        }
+        else if (filterData.shape == 2) // line, see if point is within 1 pixel of the line
+        {
+            xpoint2.a = shapeArray[shapeIdx + 2];
+            xpoint2.b = shapeArray[shapeIdx + 3];
+            xpoint3.a = x;
+            xpoint3.b = y;
+            // Check if this pixel is close to either end point
+            if (LenVect(SubVect2(xpoint1, xpoint3)) <= 1 || LenVect(SubVect2(xpoint2, xpoint3)) <= 1)
             {
-                xpoint2.a = x;
-                xpoint2.b = y;
-                xpoint2 = SubVect2(xpoint2, xpoint1);
-                if (LenVect(xpoint2) <= shapeArray[shapeIdx + 2])
-                {
-                    color.a += (shapeArray[shapeIdx + 3] / 100.0) * colorMax;
-                }
+                coverage += shapeArray[shapeIdx + 4] / 100.0;
+                continue;
             }
-            else if (filterData.shape == 2) // line, see if point is within 1 pixel of the line
+            // Else see how close to the line it is
+            // Skip if pixel not in the rectangle formed by the line as a diagonal
+            if ((x > xpoint1.a + 1 && x > xpoint2.a + 1)
+                || (x < xpoint1.a - 1 && x < xpoint2.a - 1)
+                || (y > xpoint1.b + 1 && y > xpoint2.b + 1)
+                || (y < xpoint1.b - 1 && y < xpoint2.b - 1)) continue;
+            // Now we know there will be an x intercept and y intercept
+            lerp1 = ((double)y - xpoint1.b) / (xpoint2.b - xpoint1.b);
+            xpoint4.a = (lerp1 * (xpoint2.a - xpoint1.a)) + xpoint1.a; // X coord of Y intercept
+            lerp2 = ((double)x - xpoint1.a) / (xpoint2.a - xpoint1.a);
+            xpoint4.b = (lerp2 * (xpoint2.b - xpoint1.b)) + xpoint1.b; // Y coord of X intercept
+            if (abs(xpoint4.a - x) <= 1 || abs(xpoint4.b - y) <= 1)
             {
-                xpoint2.a = shapeArray[shapeIdx + 2];
-                xpoint2.b = shapeArray[shapeIdx + 3];
-                xpoint3.a = x;
-                xpoint3.b = y;
-                // Check if this pixel is close to either end point
-                if (LenVect(SubVect2(xpoint1, xpoint3)) <= 1 || LenVect(SubVect2(xpoint2, xpoint3)) <= 1)
-                {
-                    color.a += (shapeArray[shapeIdx + 4] / 100.0) * colorMax;
-                    continue;
-                }
-                // Else see how close to the line it is
-                // Skip if pixel not in the rectangle formed by the line as a diagonal
-                if ((x > xpoint1.a + 1 && x > xpoint2.a + 1)
-                    || (x < xpoint1.a - 1 && x < xpoint2.a - 1)
-                    || (y > xpoint1.b + 1 && y > xpoint2.b + 1)
-                    || (y < xpoint1.b - 1 && y < xpoint2.b - 1)) continue;
-                // Now we know there will be an x intercept and y intercept
-                lerp1 = ((double)y - xpoint1.b) / (xpoint2.b - xpoint1.b);
-                xpoint4.a = (lerp1 * (xpoint2.a - xpoint1.a)) + xpoint1.a; // X coord of Y intercept
-                lerp2 = ((double)x - xpoint1.a) / (xpoint2.a - xpoint1.a);
-                xpoint4.b = (lerp2 * (xpoint2.b - xpoint1.b)) + xpoint1.b; // Y coord of X intercept
-                if (abs(xpoint4.a - x) <= 1 || abs(xpoint4.b - y) <= 1)
-                {
-                    color.a += (shapeArray[shapeIdx + 4] / 100.0) * colorMax;
-                }
+                coverage += shapeArray[shapeIdx + 4] / 100.0;
             }
-            else
+        }
+        else
+        {
+            // for each side, check if y height of point is crossed
+            xpoint1.a = shapeArray[shapeIdx + ((filterData.shape - 1) * 2)];
+            xpoint1.b = shapeArray[shapeIdx + ((filterData.shape - 1) * 2) + 1];
+            for (unsigned int k = 0; k < filterData.shape; k++)
             {
-                // for each side, check if y height of point is crossed
-                xpoint1.a = shapeArray[shapeIdx + ((filterData.shape - 1) * 2)];
-                xpoint1.b = shapeArray[shapeIdx + ((filterData.shape - 1) * 2) + 1];
-                for (unsigned int k = 0; k < filterData.shape; k++)
+                if (point1found == 0)
                 {
-                    if (point1found == 0)
+                    xpoint2.a = shapeArray[shapeIdx + (k * 2)];
+                    xpoint2.b = shapeArray[shapeIdx + (k * 2) + 1];
+                    if ((xpoint1.b <= y && xpoint2.b > y) || (xpoint1.b > y && xpoint2.b <= y)) // This is one of the cross points
                     {
-                        xpoint2.a = shapeArray[shapeIdx + (k * 2)];
-                        xpoint2.b = shapeArray[shapeIdx + (k * 2) + 1];
-                        if ((xpoint1.b <= y && xpoint2.b > y) || (xpoint1.b > y && xpoint2.b <= y)) // This is one of the cross points
-                        {
-                            xpoint3.a = xpoint2.a;
-                            xpoint3.b = xpoint2.b;
-                            point1found = 1;
-                        }
-                        else
-                        {
-                            xpoint1.a = xpoint2.a;
-                            xpoint1.b = xpoint2.b;
-                        }
+                        xpoint3.a = xpoint2.a;
+                        xpoint3.b = xpoint2.b;
+                        point1found = 1;
                     }
                     else
                     {
-                        xpoint4.a = shapeArray[shapeIdx + (k * 2)];
-                        xpoint4.b = shapeArray[shapeIdx + (k * 2) + 1];
-                        if ((xpoint3.b <= y && xpoint4.b > y) || (xpoint3.b > y && xpoint4.b <= y)) // This is the other cross point
-                        {
-                            break;
-                        }
-                        else
-                        {
-                            xpoint3.a = xpoint4.a;
-                            xpoint3.b = xpoint4.b;
-                        }
+                        xpoint1.a = xpoint2.a;
+                        xpoint1.b = xpoint2.b;
                     }
                 }
-                // no sides that cross the point's y value means no intersect
-                // both sides left or right of point means no intersect
-                if (point1found == 0
-                    || (xpoint1.a > x && xpoint2.a > x && xpoint3.a > x && xpoint4.a > x)
-                    || (xpoint1.a < x && xpoint2.a < x && xpoint3.a < x && xpoint4.a < x))
-                {
-                    continue;
-                }
-                // Proving that the pixel is inside the shape
-                lerp1 = ((double)y - xpoint1.b) / (xpoint2.b - xpoint1.b);
-                lerp2 = ((double)y - xpoint3.b) / (xpoint4.b - xpoint3.b);
-                lerp1 = (lerp1 * (xpoint2.a - xpoint1.a)) + xpoint1.a;
-                lerp2 = (lerp2 * (xpoint4.a - xpoint3.a)) + xpoint3.a;
-                if ((lerp1 <= x && lerp2 > x) || (lerp1 > x && lerp2 <= x)) // Congrats, we found it!
+                else
                 {
-                    color.a += (shapeArray[shapeIdx + (2 * filterData.shape)] / 100.0) * colorMax;
+                    xpoint4.a = shapeArray[shapeIdx + (k * 2)];
+                    xpoint4.b = shapeArray[shapeIdx + (k * 2) + 1];
+                    if ((xpoint3.b <= y && xpoint4.b > y) || (xpoint3.b > y && xpoint4.b <= y)) // This is the other cross point
+                    {
+                        break;
+                    }
+                    else
+                    {
+                        xpoint3.a = xpoint4.a;
+                        xpoint3.b = xpoint4.b;
+                    }
                 }
             }
+            // no sides that cross the point's y value means no intersect
+            // both sides left or right of point means no intersect
+            if (point1found == 0
+                || (xpoint1.a > x && xpoint2.a > x && xpoint3.a > x && xpoint4.a > x)
+                || (xpoint1.a < x && xpoint2.a < x && xpoint3.a < x && xpoint4.a < x))
+            {
+                continue;
+            }
+            // Proving that the pixel is inside the shape
+            lerp1 = ((double)y - xpoint1.b) / (xpoint2.b - xpoint1.b);
+            lerp2 = ((double)y - xpoint3.b) / (xpoint4.b - xpoint3.b);
+            lerp1 = (lerp1 * (xpoint2.a - xpoint1.a)) + xpoint1.a;
+            lerp2 = (lerp2 * (xpoint4.a - xpoint3.a)) + xpoint3.a;
+            if ((lerp1 <= x && lerp2 > x) || (lerp1 > x && lerp2 <= x)) // Congrats, we found it!
+            {
+                coverage += shapeArray[shapeIdx + (2 * filterData.shape)] / 100.0;
+            }
+        }
+    }
+    return coverage;
+}
+
+// Distance from p to the segment between a and b
+static double DistanceToSegment(Vect2 p, Vect2 a, Vect2 b)
+{
+    Vect2 side = SubVect2(b, a);
+    Vect2 toP = SubVect2(p, a);
+    double lenSq = (side.a * side.a) + (side.b * side.b);
+    double t = 0;
+    if (lenSq > 0) t = ((toP.a * side.a) + (toP.b * side.b)) / lenSq;
+    if (t < 0) t = 0;
+    if (t > 1) t = 1;
+    return LenVect(SubVect2(toP, ScaleVect2(side, t)));
+}
+
+// Signed distance from p to the edge of a shape, negative inside it
+static double ShapeDistance(Vect2 p, float* shapeEntry, char shape)
+{
+    Vect2 point1 = {shapeEntry[0], shapeEntry[1]};
+    if (shape == 1) // circle, distance to the center minus the radius
+    {
+        return LenVect(SubVect2(p, point1)) - shapeEntry[2];
+    }
+    if (shape == 2) // line, drawn 1 pixel either side of the segment
+    {
+        Vect2 point2 = {shapeEntry[2], shapeEntry[3]};
+        return DistanceToSegment(p, point1, point2) - 1;
+    }
+    // polygon, closest side gives the distance, counting crossings gives the sign
+    double dist = -1;
+    char inside = 0;
+    Vect2 prev = {shapeEntry[(shape - 1) * 2], shapeEntry[((shape - 1) * 2) + 1]};
+    for (int k = 0; k < shape; k++)
+    {
+        Vect2 cur = {shapeEntry[k * 2], shapeEntry[(k * 2) + 1]};
+        double sideDist = DistanceToSegment(p, prev, cur);
+        if (dist < 0 || sideDist < dist) dist = sideDist;
+        if ((prev.b <= p.b && cur.b > p.b) || (prev.b > p.b && cur.b <= p.b))
+        {
+            double crossX = prev.a + (((p.b - prev.b) / (cur.b - prev.b)) * (cur.a - prev.a));
+            if (crossX > p.a) inside = !inside;
+        }
+        prev = cur;
+    }
+    return inside ? -dist : dist;
+}
+
+// Like DirtCoverage, but each shape fades out over softness pixels either side of
+// its edge, which looks like the shapes were blurred without having to blur them
+static double SoftDirtCoverage(
+    long long x,
+    long long y,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    float* shapeArray,
+    double softness)
+{
+    unsigned int floatsPerEntry = (filterData.shape * 2) + 2; // pair of points per side + 2 for other data
+    unsigned int opacityIdx = (filterData.shape == 1) ? 3 : ((filterData.shape == 2) ? 4 : (2 * filterData.shape));
+    double reach = (filterData.size * 2) + softness;
+    double coverage = 0;
+    Vect2 p = {x, y};
+    for (long long j = 0; j < numShapes; j++)
+    {
+        float* shapeEntry = shapeArray + (j * floatsPerEntry);
+        // Quick sanity check to see if the shape is anywhere near this pixel
+        if (shapeEntry[0] + reach < x || shapeEntry[0] - reach > x
+            || shapeEntry[1] + reach < y || shapeEntry[1] - reach > y)
+        {
+            continue;
+        }
+        double dist = ShapeDistance(p, shapeEntry, filterData.shape);
+        if (dist >= softness) continue;
+        double fade = 1;
+        if (dist > -softness)
+        {
+            // smoothstep from fully covered inside to nothing outside
+            double t = (dist + softness) / (2 * softness);
+            fade = 1 - (t * t * (3 - (2 * t)));
+        }
+        coverage += fade * (shapeEntry[opacityIdx] / 100.0);
+    }
+    return coverage;
+}
+
+// How far the edges of shapes fade, 0 for hard edges
+static double GetSoftness(LensDirtFilterData filterData, Coords imgSize)
+{
+    if (!filterData.softEdge) return 0;
+    return (filterData.blur / 100.0) * imgSize.x;
+}
+
+// Coverage of a pixel with hard or soft edges
+static double GetCoverage(
+    long long x,
+    long long y,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    float* shapeArray,
+    double softness)
+{
+    if (softness > 0) return SoftDirtCoverage(x, y, numShapes, filterData, shapeArray, softness);
+    return DirtCoverage(x, y, numShapes, filterData, shapeArray);
+}
+
+void RenderLensDirt(
+    long long start,
+    long long n,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    Coords imgSize,
+    void* shapes,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* shapeArray = (float*) shapes;
+    double colorMax = GetColorSpaceMax(colorData);
+    double softness = GetSoftness(filterData, imgSize);
+    for (long long i = start; i < n + start; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel color = {colorMax,colorMax,colorMax,colorMax,0};
+        long long x = i % imgSize.x;
+        long long y = i / imgSize.x;
+        color.a = GetCoverage(x, y, numShapes, filterData, shapeArray, softness) * colorMax;
+        WritePixel(i, color, outData, colorData);
+    }
+    UpdateJob(control, n);
+}
+
+void RenderDirtMask(
+    long long start,
+    long long n,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    Coords imgSize,
+    void* shapes,
+    void* maskData,
+    ColorData colorData,
+    JobControl* control)
+{
+    float* shapeArray = (float*) shapes;
+    double softness = GetSoftness(filterData, imgSize);
+    for (long long i = start; i < n + start; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        double coverage = GetCoverage(i % imgSize.x, i / imgSize.x, numShapes, filterData, shapeArray, softness);
+        WriteMask(i, coverage, maskData, colorData);
+    }
+    UpdateJob(control, n);
+}
+
+void BlurDirtMask(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* maskData,
+    void* outMaskData,
+    ColorData colorData,
+    JobControl* control)
+{
+    // Walk along a row, or down a column
+    long long length = vertical ? imgSize.y : imgSize.x;
+    long long step = vertical ? imgSize.x : 1;
+    for (long long line = start; line < start + n; line++)
+    {
+        // Lines are big enough to check in after every one
+        if (UpdateJob(control, line - start)) return;
+        long long first = vertical ? line : line * imgSize.x;
+        // Running sum of the window's samples, only counting pixels inside the image so
+        // the edges don't fade out. Kept in whole steps so the average rounds exactly
+        long long sum = 0;
+        long long count = 0;
+        for (long long k = 0; k < radius && k < length; k++)
+        {
+            sum += ReadMaskSample(first + (k * step), maskData, colorData);
+            count++;
+        }
+        for (long long k = 0; k < length; k++)
+        {
+            long long enter = k + radius;
+            long long leave = k - radius - 1;
+            if (enter < length)
+            {
+                sum += ReadMaskSample(first + (enter * step), maskData, colorData);
+                count++;
+            }
+            if (leave >= 0)
+            {
+                sum -= ReadMaskSample(first + (leave * step), maskData, colorData);
+                count--;
+            }
+            WriteMaskSample(first + (k * step), (unsigned int)(((2 * sum) + count) / (2 * count)), outMaskData, colorData);
         }
+    }
+    UpdateJob(control, n);
+}
+
+void ExpandDirtMask(
+    long long start,
+    long long n,
+    void* maskData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    double colorMax = GetColorSpaceMax(colorData);
+    for (long long i = start; i < n + start; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        Pixel color = {colorMax,colorMax,colorMax,colorMax,0};
+        color.a = ReadMask(i, maskData, colorData) * colorMax;
+        color = ClampToColorSpace(color, colorData);
         WritePixel(i, color, outData, colorData);
     }
+    UpdateJob(control, n);
 }
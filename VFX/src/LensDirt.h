@@ -18,6 +18,7 @@ typedef struct
     char shape;
     int direction;
     int blur;
+    char softEdge; // Non-zero to fade the edges of shapes by the blur size instead of blurring after
 } LensDirtFilterData;
 
 void CreateDirtShapes(
@@ -26,7 +27,8 @@ void CreateDirtShapes(
     LensDirtFilterData filterData,
     Coords imgSize,
     unsigned int seed,
-    void* outData);
+    void* outData,
+    JobControl* control);
 
 void RenderLensDirt(
     long long start,
@@ -36,6 +38,43 @@ void RenderLensDirt(
     Coords imgSize,
     void* shapes,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
+
+// Render the shapes into a coverage mask of one sample per pixel instead of
+// whole pixels, only alpha changes so nothing else needs to be stored
+// The mask's samples are sized for the layer, see GetMaskSampleSize
+void RenderDirtMask(
+    long long start,
+    long long n,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    Coords imgSize,
+    void* shapes,
+    void* maskData,
+    ColorData colorData,
+    JobControl* control);
+
+// Box blur lines start to start + n of a mask, rows or columns if vertical
+// Several passes in both directions come out close to a gaussian blur
+void BlurDirtMask(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* maskData,
+    void* outMaskData,
+    ColorData colorData,
+    JobControl* control);
+
+// Turn pixels start to start + n of a mask into the layer's color format
+void ExpandDirtMask(
+    long long start,
+    long long n,
+    void* maskData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
 
 #endif // ifndef _LENSDIRT_H_
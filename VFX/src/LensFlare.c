@@ -7,6 +7,10 @@
 #include <math.h>
 #include "LensFlare.h"
 
+// How many pixels of a row the mip version of the flare works on at once
+// Small enough to keep the running totals on the stack
+#define GHOST_RUN_LENGTH 256
+
 // Helper function for wrapping vectors around edges
 void WrapVector(
     Vect2 vec,
@@ -30,6 +34,37 @@ void WrapVector(
     }
 }
 
+// Sample the halo for a pixel, coordVec is the flipped pixel position and
+// centerDirVec points from it towards the center of the image
+static Pixel SampleHalo(
+    Vect2 coordVec,
+    Vect2 centerDirVec,
+    LensFlareFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    ColorData colorData)
+{
+    Vect2 centerPosVec;
+    Vect2 scratchVec;
+    centerPosVec.a = (double)(imgSize.x - 1) / 2;
+    centerPosVec.b = (double)(imgSize.y - 1) / 2;
+    Vect2 haloVec;
+    haloVec = ScaleVect2(centerDirVec, 1.0 / LenVect(centerDirVec));
+    haloVec = ScaleVect2(haloVec, filterData.haloDisplacement);
+    haloVec = AddVect2(coordVec, haloVec);
+    WrapVector(haloVec, imgSize);
+    scratchVec = SubVect2(haloVec, centerPosVec);
+    double haloWeight = LenVect(scratchVec) / LenVect(centerPosVec);
+    haloWeight = 1 - haloWeight;
+    haloWeight = pow(haloWeight, 5);
+    Pixel haloSample = {0, 0, 0, 0, 0};
+    haloSample = SampleAt(haloVec.a, haloVec.b, imgSize, imgData, colorData, filterData.bilinearFilter);
+    double haloAlpha = haloSample.a / GetColorSpaceMax(colorData);
+    haloSample = ScalePixel(haloSample, haloWeight);
+    haloSample = ScalePixel(haloSample, haloAlpha);
+    return haloSample;
+}
+
 // Apply pseudo lens flare to a section of an image
 // Assumes the image has already been through a highpass filter
 void ApplyPsuedoLensFlare(
@@ -39,13 +74,16 @@ void ApplyPsuedoLensFlare(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
     long long x = start % imgSize.x;
     long long y = start / imgSize.x;
 
     for (long long i = start; i < start + n; i++)
     {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
         Pixel baseColor = {0, 0, 0, 0, 0};
         Vect2 centerPosVec; // From (0,0) to center of image
         Vect2 centerDirVec; // From coordVec to center of image
@@ -77,21 +115,7 @@ void ApplyPsuedoLensFlare(
             baseColor = AddPixel(baseColor, newSample);
         }
         // Sample halo effect
-        Vect2 haloVec;
-        haloVec = ScaleVect2(centerDirVec, 1.0 / LenVect(centerDirVec));
-        haloVec = ScaleVect2(haloVec, filterData.haloDisplacement);
-        haloVec = AddVect2(coordVec, haloVec);
-        WrapVector(haloVec, imgSize);
-        scratchVec = SubVect2(haloVec, centerPosVec);
-        double haloWeight = LenVect(scratchVec) / LenVect(centerPosVec);
-        haloWeight = 1 - haloWeight;
-        haloWeight = pow(haloWeight, 5);
-        Pixel haloSample = {0, 0, 0, 0, 0};
-        haloSample = SampleAt(haloVec.a, haloVec.b, imgSize, imgData, colorData, filterData.bilinearFilter);
-        double haloAlpha = haloSample.a / GetColorSpaceMax(colorData);
-        haloSample = ScalePixel(haloSample, haloWeight);
-        haloSample = ScalePixel(haloSample, haloAlpha);
-        baseColor = AddPixel(baseColor, haloSample);
+        baseColor = AddPixel(baseColor, SampleHalo(coordVec, centerDirVec, filterData, imgSize, imgData, colorData));
         // Power, clamp, then return
         baseColor = ScalePixel(baseColor, filterData.power);
         baseColor = ClampToColorSpace(baseColor, colorData);
@@ -106,4 +130,464 @@ void ApplyPsuedoLensFlare(
         }
         if (y >= imgSize.y) break;
     }
+    UpdateJob(control, n);
+}
+
+// Size of a mip level, each level is half the size of the one before, rounded up
+Coords GetMipSize(Coords imgSize, int level)
+{
+    Coords size = imgSize;
+    for (int i = 0; i < level; i++)
+    {
+        size.x = (size.x + 1) / 2;
+        size.y = (size.y + 1) / 2;
+    }
+    return size;
+}
+
+// Find where a mip level's pixels start, level 0 is the image itself
+static void* GetMipData(
+    int level,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    ColorData colorData)
+{
+    if (level == 0) return imgData;
+    long long offset = 0;
+    for (int i = 1; i < level; i++)
+    {
+        Coords size = GetMipSize(imgSize, i);
+        offset += size.x * size.y;
+    }
+    return (char*)mipData + (offset * GetBytesPerPixel(colorData));
+}
+
+// Build one level of a mip pyramid by averaging 2x2 blocks of the level before
+void BuildMipLevel(
+    long long start,
+    long long n,
+    int level,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    ColorData colorData,
+    JobControl* control)
+{
+    Coords srcSize = GetMipSize(imgSize, level - 1);
+    Coords dstSize = GetMipSize(imgSize, level);
+    void* srcData = GetMipData(level - 1, imgSize, imgData, mipData, colorData);
+    void* dstData = GetMipData(level, imgSize, imgData, mipData, colorData);
+    long long x = start % dstSize.x;
+    long long y = start / dstSize.x;
+    for (long long i = start; i < start + n; i++)
+    {
+        // Check in with python every so often, stop if cancelled
+        if ((i - start) % JOB_CHECK_INTERVAL == 0 && UpdateJob(control, i - start)) return;
+        // Odd sized levels repeat their last row or column
+        long long x0 = x * 2;
+        long long y0 = y * 2;
+        long long x1 = (x0 + 1 < srcSize.x) ? x0 + 1 : x0;
+        long long y1 = (y0 + 1 < srcSize.y) ? y0 + 1 : y0;
+        Pixel sum = {0, 0, 0, 0, 0};
+        sum = AddPixel(sum, GetColorAt(x0, y0, srcSize.x, srcData, colorData));
+        sum = AddPixel(sum, GetColorAt(x1, y0, srcSize.x, srcData, colorData));
+        sum = AddPixel(sum, GetColorAt(x0, y1, srcSize.x, srcData, colorData));
+        sum = AddPixel(sum, GetColorAt(x1, y1, srcSize.x, srcData, colorData));
+        WritePixel(i, ScalePixel(sum, 0.25), dstData, colorData);
+
+        x++;
+        if (x >= dstSize.x)
+        {
+            x = 0;
+            y++;
+        }
+        if (y >= dstSize.y) break;
+    }
+    UpdateJob(control, n);
+}
+
+// Apply pseudo lens flare to a section of an image, a run of pixels at a time
+// Every artifact copy j is the image scaled about the center by (j * displacement - 1),
+// so instead of gathering all the copies for each pixel, each copy is added to a whole
+// run of a row in turn. Reads walk along a row of the source, and copies that shrink
+// the image read from a smaller mip level so they don't alias
+// Assumes the image has already been through a highpass filter
+void ApplyGhostLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    int mipLevels,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    Pixel run[GHOST_RUN_LENGTH];
+    Vect2 centerPosVec;
+    centerPosVec.a = (double)(imgSize.x - 1) / 2;
+    centerPosVec.b = (double)(imgSize.y - 1) / 2;
+    double centerLen = LenVect(centerPosVec);
+    double colorMax = GetColorSpaceMax(colorData);
+    long long i = start;
+    while (i < start + n)
+    {
+        // Check in with python every run, stop if cancelled
+        if (UpdateJob(control, i - start)) return;
+        long long x = i % imgSize.x;
+        long long y = i / imgSize.x;
+        if (y >= imgSize.y) break;
+        // Runs stop at the end of a row, so every pixel shares y
+        long long runLength = imgSize.x - x;
+        if (runLength > GHOST_RUN_LENGTH) runLength = GHOST_RUN_LENGTH;
+        if (runLength > start + n - i) runLength = start + n - i;
+        for (long long k = 0; k < runLength; k++)
+        {
+            Pixel empty = {0, 0, 0, 0, 0};
+            run[k] = empty;
+        }
+        for (int j = 0; j < filterData.artifactCopies; j++)
+        {
+            double scale = (j * filterData.artifactDisplacement) - 1.0;
+            // Each level halves the size, use the largest one that's still at least
+            // as small as the copy so every output pixel covers about one source pixel
+            int level = 0;
+            while (level < mipLevels && fabs(scale) >= (double)(2LL << level)) level++;
+            Coords levelSize = GetMipSize(imgSize, level);
+            void* levelData = GetMipData(level, imgSize, imgData, mipData, colorData);
+            double levelScale = 1.0 / (double)(1LL << level);
+            double offsetY = (y - centerPosVec.b) * scale;
+            double sampleY = ((centerPosVec.b + offsetY + 0.5) * levelScale) - 0.5;
+            for (long long k = 0; k < runLength; k++)
+            {
+                double offsetX = ((x + k) - centerPosVec.a) * scale;
+                // Fade copies out towards the edges, same as the gathering version
+                double weight = 1 - (sqrt((offsetX * offsetX) + (offsetY * offsetY)) / centerLen);
+                double weight2 = weight * weight;
+                double weight8 = weight2 * weight2 * weight2 * weight2;
+                weight = weight8 * weight2;
+                Pixel newSample = SampleAt(((centerPosVec.a + offsetX + 0.5) * levelScale) - 0.5, sampleY,
+                                           levelSize, levelData, colorData, filterData.bilinearFilter);
+                double alpha = newSample.a / colorMax;
+                run[k] = AddPixel(run[k], ScalePixel(newSample, weight * alpha));
+            }
+        }
+        for (long long k = 0; k < runLength; k++)
+        {
+            Vect2 coordVec;
+            Vect2 centerDirVec;
+            coordVec.a = (double)imgSize.x - (x + k) - 1;
+            coordVec.b = (double)imgSize.y - y - 1;
+            centerDirVec = SubVect2(centerPosVec, coordVec);
+            centerDirVec = ScaleVect2(centerDirVec, filterData.artifactDisplacement);
+            Pixel baseColor = AddPixel(run[k], SampleHalo(coordVec, centerDirVec, filterData, imgSize, imgData, colorData));
+            // Power, clamp, then write
+            baseColor = ScalePixel(baseColor, filterData.power);
+            baseColor = ClampToColorSpace(baseColor, colorData);
+            baseColor.a = colorMax;
+            WritePixel(i + k, baseColor, outData, colorData);
+        }
+        i += runLength;
+    }
+    UpdateJob(control, n);
+}
+
+// How much a source pixel q adds to a sample taken at s along one axis, following
+// the same clamping and interpolation as SampleAt
+static double SplatWeight(
+    double s,
+    long long q,
+    long long size,
+    char interpolate)
+{
+    if (s >= size) s = size - 1;
+    else if (s < 0) s = 0;
+    if (interpolate == 0) return ((long long)s == q) ? 1.0 : 0.0;
+    // The last pixel has nothing past it to blend with
+    if (q == size - 1 && s >= q) return 1.0;
+    double dist = fabs(s - q);
+    if (dist >= 1.0) return 0.0;
+    return 1.0 - dist;
+}
+
+// Where along one axis artifact copy j samples for output pixel p
+// Done in the same steps as ApplyPsuedoLensFlare so samples land on the same pixels
+static double CopyPosition(
+    long long p,
+    long long size,
+    int j,
+    double displacement)
+{
+    double center = (double)(size - 1) / 2;
+    double coord = (double)size - p - 1;
+    return coord + (((center - coord) * displacement) * (double)j);
+}
+
+// Index of the first highlight in [first, last) with an x of at least minX
+static long long FindHighlight(
+    Highlight* highlights,
+    long long first,
+    long long last,
+    long long minX)
+{
+    while (first < last)
+    {
+        long long mid = first + ((last - first) / 2);
+        if (highlights[mid].x < minX) first = mid + 1;
+        else last = mid;
+    }
+    return first;
+}
+
+// Apply pseudo lens flare to a section of an image using only its highlights
+// Works on runs of a row like ApplyGhostLensFlare. For each artifact copy the run
+// reads from one or two source rows, and only the highlights in the part of those
+// rows the run reads from are looked at, so dark areas cost next to nothing
+void ApplySplatLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    Highlight* highlights = (Highlight*)highlightData;
+    long long* rowIndex = (long long*)rowData;
+    Pixel run[GHOST_RUN_LENGTH];
+    Vect2 centerPosVec;
+    centerPosVec.a = (double)(imgSize.x - 1) / 2;
+    centerPosVec.b = (double)(imgSize.y - 1) / 2;
+    double centerLen = LenVect(centerPosVec);
+    double colorMax = GetColorSpaceMax(colorData);
+    long long i = start;
+    while (i < start + n)
+    {
+        // Check in with python every run, stop if cancelled
+        if (UpdateJob(control, i - start)) return;
+        long long x = i % imgSize.x;
+        long long y = i / imgSize.x;
+        if (y >= imgSize.y) break;
+        long long runLength = imgSize.x - x;
+        if (runLength > GHOST_RUN_LENGTH) runLength = GHOST_RUN_LENGTH;
+        if (runLength > start + n - i) runLength = start + n - i;
+        for (long long k = 0; k < runLength; k++)
+        {
+            Pixel empty = {0, 0, 0, 0, 0};
+            run[k] = empty;
+        }
+        for (int j = 0; j < filterData.artifactCopies; j++)
+        {
+            double scale = (j * filterData.artifactDisplacement) - 1.0;
+            double sampleY = CopyPosition(y, imgSize.y, j, filterData.artifactDisplacement);
+            double offsetY = sampleY - centerPosVec.b;
+            // Range of source columns this run reads from, padded for interpolation
+            double firstX = CopyPosition(x, imgSize.x, j, filterData.artifactDisplacement);
+            double lastX = CopyPosition(x + runLength - 1, imgSize.x, j, filterData.artifactDisplacement);
+            long long minX = (long long)floor((firstX < lastX) ? firstX : lastX) - 1;
+            long long maxX = (long long)floor((firstX < lastX) ? lastX : firstX) + 1;
+            // Samples past the edges are clamped onto the edge pixels
+            if (minX < 0) minX = 0;
+            else if (minX > imgSize.x - 1) minX = imgSize.x - 1;
+            if (maxX > imgSize.x - 1) maxX = imgSize.x - 1;
+            else if (maxX < 0) maxX = 0;
+            // At most two source rows, the second only when interpolating
+            double clampedY = sampleY;
+            if (clampedY >= imgSize.y) clampedY = imgSize.y - 1;
+            else if (clampedY < 0) clampedY = 0;
+            long long firstRow = (long long)clampedY;
+            for (long long row = firstRow; row <= firstRow + 1 && row < imgSize.y; row++)
+            {
+                double weightY = SplatWeight(sampleY, row, imgSize.y, filterData.bilinearFilter);
+                if (weightY <= 0) continue;
+                long long h = FindHighlight(highlights, rowIndex[row], rowIndex[row + 1], minX);
+                for (; h < rowIndex[row + 1] && highlights[h].x <= maxX; h++)
+                {
+                    Highlight light = highlights[h];
+                    // Pixels of the run whose sample lands within a pixel of the highlight,
+                    // the edge pixels also cover every sample clamped onto them
+                    long long firstK = 0;
+                    long long lastK = runLength - 1;
+                    if (scale != 0 && light.x > 0 && light.x < imgSize.x - 1)
+                    {
+                        double edgeA = centerPosVec.a + (((light.x - 1) - centerPosVec.a) / scale) - x;
+                        double edgeB = centerPosVec.a + (((light.x + 1) - centerPosVec.a) / scale) - x;
+                        firstK = (long long)floor((edgeA < edgeB) ? edgeA : edgeB) - 1;
+                        lastK = (long long)ceil((edgeA < edgeB) ? edgeB : edgeA) + 1;
+                        if (firstK < 0) firstK = 0;
+                        if (lastK > runLength - 1) lastK = runLength - 1;
+                    }
+                    Pixel color = {light.r, light.b, light.o, light.l, light.a};
+                    double alpha = light.a / colorMax;
+                    for (long long k = firstK; k <= lastK; k++)
+                    {
+                        double sampleX = CopyPosition(x + k, imgSize.x, j, filterData.artifactDisplacement);
+                        double weightX = SplatWeight(sampleX, light.x, imgSize.x, filterData.bilinearFilter);
+                        double offsetX = sampleX - centerPosVec.a;
+                        if (weightX <= 0) continue;
+                        // Fade copies out towards the edges, same as the gathering version
+                        double weight = 1 - (sqrt((offsetX * offsetX) + (offsetY * offsetY)) / centerLen);
+                        double weight2 = weight * weight;
+                        double weight8 = weight2 * weight2 * weight2 * weight2;
+                        weight = weight8 * weight2;
+                        run[k] = AddPixel(run[k], ScalePixel(color, weightX * weightY * weight * alpha));
+                    }
+                }
+            }
+        }
+        for (long long k = 0; k < runLength; k++)
+        {
+            Vect2 coordVec;
+            Vect2 centerDirVec;
+            coordVec.a = (double)imgSize.x - (x + k) - 1;
+            coordVec.b = (double)imgSize.y - y - 1;
+            centerDirVec = SubVect2(centerPosVec, coordVec);
+            centerDirVec = ScaleVect2(centerDirVec, filterData.artifactDisplacement);
+            Pixel baseColor = AddPixel(run[k], SampleHalo(coordVec, centerDirVec, filterData, imgSize, imgData, colorData));
+            // Power, clamp, then write
+            baseColor = ScalePixel(baseColor, filterData.power);
+            baseColor = ClampToColorSpace(baseColor, colorData);
+            baseColor.a = colorMax;
+            WritePixel(i + k, baseColor, outData, colorData);
+        }
+        i += runLength;
+    }
+    UpdateJob(control, n);
+}
+
+// How the lines of a streak are laid out over the image
+// Lines run along the axis closest to the streak direction one pixel at a time,
+// moving across by the slope, so every pixel is on exactly one line
+typedef struct
+{
+    char horizontal;  // Lines run along x if set, along y if not
+    double slope;     // How far across each line moves per pixel along
+    long long along;  // Length of the image along the lines
+    long long across; // Length of the image across the lines
+    long long drift;  // How many pixels across a line moves from end to end
+} StreakLayout;
+
+// How far across a line has moved after some number of pixels along
+static long long StreakOffset(long long along, double slope)
+{
+    return (long long)floor((along * slope) + 0.5);
+}
+
+static StreakLayout GetStreakLayout(Coords imgSize, double angle)
+{
+    StreakLayout layout;
+    double rad = DegreeToRadian(angle);
+    layout.horizontal = (fabs(cos(rad)) >= fabs(sin(rad)));
+    if (layout.horizontal)
+    {
+        layout.slope = tan(rad);
+        layout.along = imgSize.x;
+        layout.across = imgSize.y;
+    }
+    else
+    {
+        layout.slope = cos(rad) / sin(rad);
+        layout.along = imgSize.y;
+        layout.across = imgSize.x;
+    }
+    layout.drift = StreakOffset(layout.along - 1, layout.slope);
+    if (layout.drift < 0) layout.drift = -layout.drift;
+    return layout;
+}
+
+// Number of lines ApplyStreak works on for an image and streak angle
+long long GetStreakLines(Coords imgSize, double angle)
+{
+    StreakLayout layout = GetStreakLayout(imgSize, angle);
+    return layout.across + layout.drift;
+}
+
+// Index of the pixel at a point along a line
+static long long StreakIndex(StreakLayout layout, long long lineStart, long long along, Coords imgSize)
+{
+    long long across = lineStart + StreakOffset(along, layout.slope);
+    if (layout.horizontal) return (across * imgSize.x) + along;
+    return (along * imgSize.x) + across;
+}
+
+// Smear every pixel along lines at the streak angle with an exponential falloff
+// Each output pixel is the sum of every pixel on its line, weighted by decay^distance.
+// A forward pass sums everything before a pixel and a backward pass everything after,
+// the backward sums for a line are kept on the heap since lines can be any length.
+// If they can't be allocated the job is cancelled, so python can report it
+void ApplyStreak(
+    long long start,
+    long long n,
+    StreakFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    StreakLayout layout = GetStreakLayout(imgSize, filterData.angle);
+    Pixel* backward = (Pixel*)malloc(sizeof(Pixel) * layout.along);
+    if (backward == NULL)
+    {
+        if (control != NULL) control->cancel = 1;
+        return;
+    }
+    // Lines step diagonally when the streak is at an angle
+    double stepLength = sqrt(1.0 + (layout.slope * layout.slope));
+    double decay = exp(-stepLength / Max(filterData.length, 0.001));
+    // Keep the total brightness the same as the original highlights
+    double scale = ((1.0 - decay) / (1.0 + decay)) * filterData.power;
+    for (long long line = start; line < start + n; line++)
+    {
+        // Lines are big enough to check in after every one
+        if (UpdateJob(control, line - start)) break;
+        // Lines moving across in the positive direction start above or left of the image
+        long long lineStart = line;
+        if (layout.slope > 0) lineStart -= layout.drift;
+        // Find the part of the line inside the image, it's always in one piece
+        long long first = 0;
+        while (first < layout.along)
+        {
+            long long across = lineStart + StreakOffset(first, layout.slope);
+            if (across >= 0 && across < layout.across) break;
+            first++;
+        }
+        long long last = first;
+        while (last + 1 < layout.along)
+        {
+            long long across = lineStart + StreakOffset(last + 1, layout.slope);
+            if (across < 0 || across >= layout.across) break;
+            last++;
+        }
+        if (first >= layout.along) continue;
+        Pixel back = {0, 0, 0, 0, 0};
+        for (long long p = last; p >= first; p--)
+        {
+            Pixel color = GetColorAtIdx(StreakIndex(layout, lineStart, p, imgSize), imgSize.x, imgData, colorData);
+            back = AddPixel(color, ScalePixel(back, decay));
+            backward[p] = back;
+        }
+        Pixel forward = {0, 0, 0, 0, 0};
+        for (long long p = first; p <= last; p++)
+        {
+            long long idx = StreakIndex(layout, lineStart, p, imgSize);
+            Pixel color = GetColorAtIdx(idx, imgSize.x, imgData, colorData);
+            forward = AddPixel(color, ScalePixel(forward, decay));
+            // Both sums include this pixel, so take one copy away
+            Pixel outColor = SubPixel(AddPixel(forward, backward[p]), color);
+            outColor = ScalePixel(outColor, scale);
+            // Alpha isn't smeared, just multiplied by power like everything else
+            outColor.a = color.a * filterData.power;
+            outColor = ClampToColorSpace(outColor, colorData);
+            WritePixel(idx, outColor, outData, colorData);
+        }
+    }
+    free(backward);
+    if (control != NULL && control->cancel) return;
+    UpdateJob(control, n);
 }
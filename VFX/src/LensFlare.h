@@ -7,6 +7,7 @@
 #define _LENSFLARE_H_
 
 #include "Utils.h"
+#include "HighPass.h"
 
 // Data structure for filter settings
 typedef struct
@@ -25,6 +26,77 @@ void ApplyPsuedoLensFlare(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData);
+    ColorData colorData,
+    JobControl* control);
+
+// Data structure for anamorphic streak settings
+typedef struct
+{
+    double angle;  // Degrees from horizontal
+    double length; // How many pixels it takes a streak to fade to about a third
+    double power;
+} StreakFilterData;
+
+// Size of a mip level, each level is half the size of the one before, rounded up
+Coords GetMipSize(Coords imgSize, int level);
+
+// Build one level of a mip pyramid by averaging 2x2 blocks of the level before
+// mipData holds levels 1 and up back to back, level 0 is imgData itself
+// n <= number of pixels in the level being built
+void BuildMipLevel(
+    long long start,
+    long long n,
+    int level,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    ColorData colorData,
+    JobControl* control);
+
+// Same effect as ApplyPsuedoLensFlare, but renders each artifact copy as a scaled
+// and flipped copy of the whole image, read from the mip level closest to its scale
+// mipLevels is how many levels past 0 were built with BuildMipLevel
+void ApplyGhostLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    int mipLevels,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+// Same effect as ApplyPsuedoLensFlare, but works from the list of highlights made by
+// CollectHighlights instead of the whole image, much faster when few pixels are bright
+// imgData is still needed for the halo
+void ApplySplatLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
+
+// Number of lines ApplyStreak works on for an image and streak angle
+long long GetStreakLines(Coords imgSize, double angle);
+
+// Smear every pixel along lines at the streak angle with an exponential falloff,
+// then multiply by power. Works on lines start to start + n, see GetStreakLines
+// Uses a forward and a backward recursive pass, so any length costs the same
+void ApplyStreak(
+    long long start,
+    long long n,
+    StreakFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control);
 
 #endif // ifndef _LENSFLARE_H_
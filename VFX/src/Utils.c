@@ -4,15 +4,50 @@
  */
 
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
 #include "Utils.h"
 
+// GCC and clang can build the F16C conversions on x86 without -mf16c and check the CPU
+// for them when the tables are made, so every build uses them on CPUs that have them
+#if !defined(VFX_REFERENCE) && (defined(__GNUC__) || defined(__clang__)) && (defined(__x86_64__) || defined(__i386__))
+#define VFX_F16C_DISPATCH
+#include <immintrin.h>
+#endif
+
 /** 
  * Python ctypes states that any memory allocated in the C library must be
  * freed by the C library. As such, no dynamic memory allocation occurs here.
  * Only automatic allocation that is freed when out of scope. 
  **/
 
+// Lookup tables for sRGB <-> linear conversion
+// Decoding indexes by the encoded value, encoding by the linear value
+// 8 bit encoding uses 12 bits of linear precision so dark values don't band
+// Float tables cover 0-1 and are interpolated, one extra entry for the end point
+#define ENCODE8_SIZE 4096
+#define FLOAT_TABLE_SIZE 4096
+static float decodeTable8[256];
+static float decodeTable16[65536];
+static unsigned char encodeTable8[ENCODE8_SIZE];
+static unsigned short encodeTable16[65536];
+static float decodeTableF[FLOAT_TABLE_SIZE + 1];
+static float encodeTableF[FLOAT_TABLE_SIZE + 1];
+
+// Lookup tables for half float conversion, only used without the F16C instructions
+// Decoding indexes by the half's bits, encoding by the float's sign and exponent,
+// which give the half's sign and exponent bits, how far to shift the float's mantissa
+// and what to add to it first so it rounds to the nearest half
+static float halfToFloatTable[65536];
+static unsigned short halfBaseTable[512];
+static unsigned char halfShiftTable[512];
+static unsigned int halfRoundTable[512];
+
+#ifdef VFX_F16C_DISPATCH
+// Set by InitColorTables when the CPU has the F16C instructions
+static char useF16C = 0;
+#endif
+
 // Scale a 2 dimensional vector
 Vect2 ScaleVect2(Vect2 vec, double scalar)
 {
@@ -123,6 +158,202 @@ int GetNumChannels(ColorModel colorModel)
     };
 }
 
+// Return the number of bytes a single pixel takes up
+int GetBytesPerPixel(ColorData colorData)
+{
+    switch (colorData.colorDepth)
+    {
+        case U8:
+            return GetNumChannels(colorData.colorModel);
+        case U16:
+            return GetNumChannels(colorData.colorModel) * 2;
+        case F32:
+            return GetNumChannels(colorData.colorModel) * 4;
+        case F16:
+            return GetNumChannels(colorData.colorModel) * 2;
+        default:
+            return 0;
+    }
+}
+
+// Check if a color depth is floating point, float depths store RGBA in order
+char IsFloatDepth(ColorData colorData)
+{
+    return (colorData.colorDepth == F32 || colorData.colorDepth == F16);
+}
+
+// Bytes in one sample of a coverage mask for a layer
+int GetMaskSampleSize(ColorData colorData)
+{
+    return (colorData.colorDepth == U8) ? 1 : 2;
+}
+
+// Value of full coverage in a mask for a layer
+unsigned int GetMaskMax(ColorData colorData)
+{
+    return (colorData.colorDepth == U8) ? 255 : 65535;
+}
+
+unsigned int ReadMaskSample(long long idx, void* maskData, ColorData colorData)
+{
+    if (colorData.colorDepth == U8) return ((unsigned char*)maskData)[idx];
+    return ((unsigned short*)maskData)[idx];
+}
+
+void WriteMaskSample(long long idx, unsigned int value, void* maskData, ColorData colorData)
+{
+    if (colorData.colorDepth == U8)
+    {
+        ((unsigned char*)maskData)[idx] = (unsigned char)value;
+        return;
+    }
+    ((unsigned short*)maskData)[idx] = (unsigned short)value;
+}
+
+double ReadMask(long long idx, void* maskData, ColorData colorData)
+{
+    return ReadMaskSample(idx, maskData, colorData) / (double)GetMaskMax(colorData);
+}
+
+void WriteMask(long long idx, double value, void* maskData, ColorData colorData)
+{
+    if (value < 0) value = 0;
+    if (value > 1) value = 1;
+    WriteMaskSample(idx, (unsigned int)floor((value * GetMaskMax(colorData)) + 0.5), maskData, colorData);
+}
+
+// Exact half float conversions, decoding builds the table and both are used by the reference build
+static float ExactHalfToFloat(unsigned short value)
+{
+    int exponent = (value >> 10) & 0x1f;
+    int mantissa = value & 0x3ff;
+    float out = 0;
+    if (exponent == 0)
+    {
+        out = ldexpf((float)mantissa, -24);
+    }
+    else if (exponent == 31)
+    {
+        out = (mantissa == 0) ? INFINITY : NAN;
+    }
+    else
+    {
+        out = ldexpf((float)(mantissa | 0x400), exponent - 25);
+    }
+    return (value & 0x8000) ? -out : out;
+}
+
+#ifdef VFX_REFERENCE
+// Floats exactly between two halves round away from zero, like the encoding tables.
+// F16C rounds them to the nearest even half instead, so CPUs that have it can differ by one step
+static unsigned short ExactFloatToHalf(float value)
+{
+    unsigned short sign = signbit(value) ? 0x8000 : 0;
+    double magnitude = fabs(value);
+    double mantissa = 0;
+    int exponent = 0;
+    if (isnan(value)) return sign | 0x7e00;
+    // Halfway between the largest half and the next power of two rounds to infinity
+    if (magnitude >= 65520.0) return sign | 0x7c00;
+    // Subnormal halves count in steps of 2^-24
+    if (magnitude < ldexp(1.0, -14)) return sign | (unsigned short)floor((magnitude * 16777216.0) + 0.5);
+    // Normal halves keep 10 bits after the leading one, rounding up to 2048 carries into the exponent
+    frexp(magnitude, &exponent);
+    mantissa = floor(ldexp(magnitude, 11 - exponent) + 0.5);
+    return sign | (unsigned short)(((exponent + 14) << 10) + (long long)mantissa - 1024);
+}
+#endif
+
+#ifdef VFX_F16C_DISPATCH
+// Convert count samples four at a time with F16C, which rounds to the nearest even half
+__attribute__((target("f16c")))
+static void F16CHalvesToFloats(const unsigned short* halves, float* floats, int count)
+{
+    int i = 0;
+    for (; i + 4 <= count; i += 4)
+    {
+        _mm_storeu_ps(floats + i, _mm_cvtph_ps(_mm_loadl_epi64((const __m128i*)(halves + i))));
+    }
+    for (; i < count; i++)
+    {
+        floats[i] = _cvtsh_ss(halves[i]);
+    }
+}
+
+__attribute__((target("f16c")))
+static void F16CFloatsToHalves(const float* floats, unsigned short* halves, int count)
+{
+    int i = 0;
+    for (; i + 4 <= count; i += 4)
+    {
+        _mm_storel_epi64((__m128i*)(halves + i), _mm_cvtps_ph(_mm_loadu_ps(floats + i), 0));
+    }
+    for (; i < count; i++)
+    {
+        halves[i] = _cvtss_sh(floats[i], 0);
+    }
+}
+#endif
+
+// Convert count half floats, stored as their bits, to floats
+static inline void HalvesToFloats(const unsigned short* halves, float* floats, int count)
+{
+#if defined(VFX_REFERENCE)
+    for (int i = 0; i < count; i++) floats[i] = ExactHalfToFloat(halves[i]);
+#else
+#ifdef VFX_F16C_DISPATCH
+    if (useF16C)
+    {
+        F16CHalvesToFloats(halves, floats, count);
+        return;
+    }
+#endif
+    for (int i = 0; i < count; i++) floats[i] = halfToFloatTable[halves[i]];
+#endif
+}
+
+// Convert count floats to the bits of the nearest half floats
+// Values past the largest half become infinity
+static inline void FloatsToHalves(const float* floats, unsigned short* halves, int count)
+{
+#if defined(VFX_REFERENCE)
+    for (int i = 0; i < count; i++) halves[i] = ExactFloatToHalf(floats[i]);
+#else
+#ifdef VFX_F16C_DISPATCH
+    if (useF16C)
+    {
+        F16CFloatsToHalves(floats, halves, count);
+        return;
+    }
+#endif
+    for (int i = 0; i < count; i++)
+    {
+        unsigned int bits = 0;
+        unsigned int index = 0;
+        memcpy(&bits, &floats[i], sizeof(bits));
+        index = bits >> 23;
+        halves[i] = (unsigned short)(halfBaseTable[index] +
+                                     (((bits & 0x7fffff) + halfRoundTable[index]) >> halfShiftTable[index]));
+    }
+#endif
+}
+
+// Convert a half float, stored as its bits, to a float
+float HalfToFloat(unsigned short value)
+{
+    float out = 0;
+    HalvesToFloats(&value, &out, 1);
+    return out;
+}
+
+// Convert a float to the bits of the nearest half float
+unsigned short FloatToHalf(float value)
+{
+    unsigned short out = 0;
+    FloatsToHalves(&value, &out, 1);
+    return out;
+}
+
 // Returns the color at a certain point in the image data
 Pixel GetColorAt(
     long long x,
@@ -135,10 +366,10 @@ Pixel GetColorAt(
     return GetColorAtIdx(idx, imgWidth, imgData, colorData);
 }
 
-// Returns the color at a certain index in the image data
-Pixel GetColorAtIdx(
-    long long idx,
-    long long imgWidth,
+// Reads the channels of a pixel in the order they're stored
+// Index is of the first channel, not the pixel
+static Pixel ReadChannels(
+    long long index,
     void* imgData,
     ColorData colorData)
 {
@@ -147,7 +378,6 @@ Pixel GetColorAtIdx(
     unsigned char* uCharData = (unsigned char*)imgData;
     unsigned short* uShortData = (unsigned short*)imgData;
     float* floatData = (float*)imgData;
-    long long index = idx * GetNumChannels(colorData.colorModel);
     switch (colorData.colorDepth)
     {
         case U8:
@@ -171,12 +401,46 @@ Pixel GetColorAtIdx(
                                    scratch.l = (double)floatData[index + 3];}
             if (numChannels == 5) {scratch.a = (double)floatData[index + 4];}
             break;
+        case F16:
+        {
+            // The whole pixel at once so F16C converts it in one go
+            float halfData[5] = {0, 0, 0, 0, 0};
+            HalvesToFloats(&uShortData[index], halfData, numChannels);
+            if (numChannels >= 1) {scratch.r = (double)halfData[0];}
+            if (numChannels >= 2) {scratch.b = (double)halfData[1];}
+            if (numChannels >= 4) {scratch.o = (double)halfData[2];
+                                   scratch.l = (double)halfData[3];}
+            if (numChannels == 5) {scratch.a = (double)halfData[4];}
+            break;
+        }
         default:
             // Unknown color depth, do not convert anything
             break;
     }
-    // Arrange the data into the correct channels
+    return scratch;
+}
+
+// Arrange channels read in storage order into the correct channels
+static Pixel ArrangeChannels(Pixel scratch, ColorData colorData)
+{
     Pixel out = {0, 0, 0, 0, 0};
+    if (UsesLinearLight(colorData))
+    {
+        // Only the color channels are encoded, alpha is always linear
+        switch (colorData.colorModel)
+        {
+            case RGBA:
+                scratch.r = SRGBToLinear(scratch.r, colorData);
+                scratch.b = SRGBToLinear(scratch.b, colorData);
+                scratch.o = SRGBToLinear(scratch.o, colorData);
+                break;
+            case GRAYA:
+                scratch.r = SRGBToLinear(scratch.r, colorData);
+                break;
+            default:
+                break;
+        }
+    }
     switch (colorData.colorModel)
     {
         case A:
@@ -184,7 +448,7 @@ Pixel GetColorAtIdx(
             break;
         case RGBA:
             // Order = RGBA if float, BGRA if int
-            if (colorData.colorDepth != F32)
+            if (!IsFloatDepth(colorData))
             {
                 out.b = scratch.r;
                 out.o = scratch.b;
@@ -227,6 +491,118 @@ Pixel GetColorAtIdx(
     return out;
 }
 
+// Returns the color at a certain index in the image data
+Pixel GetColorAtIdx(
+    long long idx,
+    long long imgWidth,
+    void* imgData,
+    ColorData colorData)
+{
+    long long index = idx * GetNumChannels(colorData.colorModel);
+    return ArrangeChannels(ReadChannels(index, imgData, colorData), colorData);
+}
+
+#ifndef VFX_REFERENCE
+// Blend four neighbouring pixels on their stored channel values
+// Integer depths use 8 bit fixed point weights that add up to 1 << 16, so even
+// a full U16 channel times the total weight fits in 32 bits
+// xy is the top left pixel, fracX and fracY how far the sample is past it
+static Pixel BlendFourTaps(
+    Coords xy,
+    double fracX,
+    double fracY,
+    Coords imgSize,
+    void* imgData,
+    ColorData colorData)
+{
+    Pixel out = {0, 0, 0, 0, 0};
+    double channels[5] = {0, 0, 0, 0, 0};
+    int numChannels = GetNumChannels(colorData.colorModel);
+    long long x0 = xy.x;
+    long long y0 = xy.y;
+    long long x1 = (x0 < imgSize.x - 1) ? x0 + 1 : x0;
+    long long y1 = (y0 < imgSize.y - 1) ? y0 + 1 : y0;
+    long long i00 = ((y0 * imgSize.x) + x0) * numChannels;
+    long long i10 = ((y0 * imgSize.x) + x1) * numChannels;
+    long long i01 = ((y1 * imgSize.x) + x0) * numChannels;
+    long long i11 = ((y1 * imgSize.x) + x1) * numChannels;
+    switch (colorData.colorDepth)
+    {
+        case U8:
+        case U16:
+        {
+            unsigned int fx = (unsigned int)((fracX * 256.0) + 0.5);
+            unsigned int fy = (unsigned int)((fracY * 256.0) + 0.5);
+            unsigned int w00 = (256 - fx) * (256 - fy);
+            unsigned int w10 = fx * (256 - fy);
+            unsigned int w01 = (256 - fx) * fy;
+            unsigned int w11 = fx * fy;
+            if (colorData.colorDepth == U8)
+            {
+                unsigned char* data = (unsigned char*)imgData;
+                for (int c = 0; c < numChannels; c++)
+                {
+                    channels[c] = (double)(((data[i00 + c] * w00) + (data[i10 + c] * w10) +
+                                            (data[i01 + c] * w01) + (data[i11 + c] * w11) + 32768) >> 16);
+                }
+            }
+            else
+            {
+                unsigned short* data = (unsigned short*)imgData;
+                for (int c = 0; c < numChannels; c++)
+                {
+                    channels[c] = (double)(((data[i00 + c] * w00) + (data[i10 + c] * w10) +
+                                            (data[i01 + c] * w01) + (data[i11 + c] * w11) + 32768) >> 16);
+                }
+            }
+            break;
+        }
+        case F32:
+        case F16:
+        {
+            float fx = (float)fracX;
+            float fy = (float)fracY;
+            float w00 = (1.0f - fx) * (1.0f - fy);
+            float w10 = fx * (1.0f - fy);
+            float w01 = (1.0f - fx) * fy;
+            float w11 = fx * fy;
+            if (colorData.colorDepth == F32)
+            {
+                float* data = (float*)imgData;
+                for (int c = 0; c < numChannels; c++)
+                {
+                    channels[c] = (data[i00 + c] * w00) + (data[i10 + c] * w10) +
+                                  (data[i01 + c] * w01) + (data[i11 + c] * w11);
+                }
+            }
+            else
+            {
+                unsigned short* data = (unsigned short*)imgData;
+                float p00[5], p10[5], p01[5], p11[5];
+                HalvesToFloats(&data[i00], p00, numChannels);
+                HalvesToFloats(&data[i10], p10, numChannels);
+                HalvesToFloats(&data[i01], p01, numChannels);
+                HalvesToFloats(&data[i11], p11, numChannels);
+                for (int c = 0; c < numChannels; c++)
+                {
+                    channels[c] = (p00[c] * w00) + (p10[c] * w10) + (p01[c] * w01) + (p11[c] * w11);
+                }
+            }
+            break;
+        }
+        default:
+            // Unknown color depth, do not convert anything
+            return out;
+    }
+    out.r = channels[0];
+    out.b = channels[1];
+    out.o = channels[2];
+    out.l = channels[3];
+    out.a = channels[4];
+    return ArrangeChannels(out, colorData);
+}
+#endif
+
 // Get a sample at the specified coordinates
 // Performs bounds clamping and bilinear interpolation
 Pixel SampleAt(
@@ -252,6 +628,14 @@ Pixel SampleAt(
     xy.y = (long long)floor(realY);
     realX = (realX - xy.x);
     realY = (realY - xy.y);
+#ifndef VFX_REFERENCE
+    // Encoded values have to be decoded before they can be blended, so linear
+    // light takes the slower path through GetColorAt for each neighbour
+    if (interpolate != 0 && !UsesLinearLight(colorData))
+    {
+        return BlendFourTaps(xy, realX, realY, imgSize, imgData, colorData);
+    }
+#endif
     baseColor = GetColorAt(xy.x, xy.y, imgSize.x, imgData, colorData);
     if (interpolate != 0)
     {
@@ -307,7 +691,7 @@ void WritePixel(
             break;
         case RGBA:
             // Order = RGBA if float, BGRA if int
-            if (colorData.colorDepth != F32)
+            if (!IsFloatDepth(colorData))
             {
                 scratch.r = pixelOut.b;
                 scratch.b = pixelOut.o;
@@ -354,6 +738,22 @@ void WritePixel(
             // Unknown color model
             break;
     }
+    if (UsesLinearLight(colorData))
+    {
+        switch (colorData.colorModel)
+        {
+            case RGBA:
+                scratch.r = LinearToSRGB(scratch.r, colorData);
+                scratch.b = LinearToSRGB(scratch.b, colorData);
+                scratch.o = LinearToSRGB(scratch.o, colorData);
+                break;
+            case GRAYA:
+                scratch.r = LinearToSRGB(scratch.r, colorData);
+                break;
+            default:
+                break;
+        }
+    }
     switch (colorData.colorDepth)
     {
         case U8:
@@ -377,6 +777,12 @@ void WritePixel(
                                    floatData[index + 3] = (float)scratch.l;}
             if (numChannels == 5) {floatData[index + 4] = (float)scratch.a;}
             break;
+        case F16:
+        {
+            float halfData[5] = {(float)scratch.r, (float)scratch.b, (float)scratch.o, (float)scratch.l, (float)scratch.a};
+            FloatsToHalves(halfData, &uShortData[index], numChannels);
+            break;
+        }
         default:
             // Unknown color depth, do not write anything
             break;
@@ -393,6 +799,7 @@ double GetColorSpaceMax(ColorData colorData)
         case U16:
             return 65535;
         case F32:
+        case F16:
             // Here is where it becomes guesswork
             // For some color profiles, it's 0-1
             // For others it goes to some arbitrary number that's channel dependant
@@ -436,3 +843,183 @@ Pixel ClampToColorSpace(Pixel pix, ColorData colorData)
     else if (out.a > max) out.a = max;
     return out;
 }
+
+// Report progress for a worker and check if it was cancelled
+char UpdateJob(JobControl* control, long long progress)
+{
+    if (control == NULL)
+    {
+        return 0;
+    }
+    control->progress = progress;
+    return control->cancel;
+}
+
+// Check if values should be converted to linear light for this color data
+// Only RGB and grayscale are sRGB encoded, other models are left alone
+char UsesLinearLight(ColorData colorData)
+{
+    if (colorData.linearLight == 0) return 0;
+    return (colorData.colorModel == RGBA || colorData.colorModel == GRAYA);
+}
+
+// Exact sRGB transfer functions for values from 0-1, only used to build tables
+static double ExactSRGBToLinear(double value)
+{
+    if (value <= 0.04045) return value / 12.92;
+    return pow((value + 0.055) / 1.055, 2.4);
+}
+
+static double ExactLinearToSRGB(double value)
+{
+    if (value <= 0.0031308) return value * 12.92;
+    return (1.055 * pow(value, 1.0 / 2.4)) - 0.055;
+}
+
+// Fill the sRGB <-> linear lookup tables
+void InitColorTables()
+{
+    for (int i = 0; i < 256; i++)
+    {
+        decodeTable8[i] = (float)(ExactSRGBToLinear(i / 255.0) * 255.0);
+    }
+    for (int i = 0; i < 65536; i++)
+    {
+        decodeTable16[i] = (float)(ExactSRGBToLinear(i / 65535.0) * 65535.0);
+        encodeTable16[i] = (unsigned short)((ExactLinearToSRGB(i / 65535.0) * 65535.0) + 0.5);
+    }
+    for (int i = 0; i < ENCODE8_SIZE; i++)
+    {
+        encodeTable8[i] = (unsigned char)((ExactLinearToSRGB(i / (double)(ENCODE8_SIZE - 1)) * 255.0) + 0.5);
+    }
+    for (int i = 0; i <= FLOAT_TABLE_SIZE; i++)
+    {
+        decodeTableF[i] = (float)ExactSRGBToLinear(i / (double)FLOAT_TABLE_SIZE);
+        encodeTableF[i] = (float)ExactLinearToSRGB(i / (double)FLOAT_TABLE_SIZE);
+    }
+    for (int i = 0; i < 65536; i++)
+    {
+        halfToFloatTable[i] = ExactHalfToFloat((unsigned short)i);
+    }
+    for (int i = 0; i < 256; i++)
+    {
+        int exponent = i - 127;
+        unsigned short base = 0;
+        unsigned char shift = 24;
+        unsigned int round = 0;
+        if (exponent == -25)
+        {
+            // Only the hidden leading one is left, at least half the smallest half so it rounds up to it
+            round = 1u << 24;
+        }
+        else if (exponent > -25 && exponent < -14)
+        {
+            // Subnormal, the hidden leading one becomes part of the mantissa
+            base = 0x0400 >> (-exponent - 14);
+            shift = (unsigned char)(-exponent - 1);
+            round = 1u << (shift - 1);
+        }
+        else if (exponent >= -14 && exponent <= 15)
+        {
+            base = (unsigned short)((exponent + 15) << 10);
+            shift = 13;
+            round = 1u << 12;
+        }
+        else if (exponent > 15 && exponent < 128)
+        {
+            // Too large, becomes infinity
+            base = 0x7c00;
+        }
+        else if (exponent == 128)
+        {
+            // Infinity and NaN keep the top of their mantissa
+            base = 0x7c00;
+            shift = 13;
+        }
+        halfBaseTable[i] = base;
+        halfBaseTable[i | 0x100] = base | 0x8000;
+        halfShiftTable[i] = shift;
+        halfShiftTable[i | 0x100] = shift;
+        halfRoundTable[i] = round;
+        halfRoundTable[i | 0x100] = round;
+    }
+#ifdef VFX_F16C_DISPATCH
+    // F16C instructions are VEX encoded, so they need the AVX state saved by the OS too
+    __builtin_cpu_init();
+    useF16C = __builtin_cpu_supports("avx") && __builtin_cpu_supports("f16c");
+#endif
+}
+
+// Linearly interpolate one of the float tables, value must be in 0-1
+static double LerpTable(float* table, double value)
+{
+    double pos = value * FLOAT_TABLE_SIZE;
+    long long idx = (long long)pos;
+    if (idx >= FLOAT_TABLE_SIZE) return table[FLOAT_TABLE_SIZE];
+    pos -= idx;
+    return (table[idx] * (1.0 - pos)) + (table[idx + 1] * pos);
+}
+
+// Convert an sRGB encoded value in the range 0-max to linear light
+double SRGBToLinear(double value, ColorData colorData)
+{
+#ifdef VFX_REFERENCE
+    double max = GetColorSpaceMax(colorData);
+    if (value <= 0) return 0;
+    return ExactSRGBToLinear(value / max) * max;
+#endif
+    long long idx = (long long)value;
+    switch (colorData.colorDepth)
+    {
+        case U8:
+            if (idx < 0) idx = 0;
+            else if (idx > 255) idx = 255;
+            return decodeTable8[idx];
+        case U16:
+            if (idx < 0) idx = 0;
+            else if (idx > 65535) idx = 65535;
+            return decodeTable16[idx];
+        case F32:
+        case F16:
+            // HDR values past 1 are rare enough to use the exact curve
+            if (value <= 0) return 0;
+            if (value > 1) return ExactSRGBToLinear(value);
+            return LerpTable(decodeTableF, value);
+        default:
+            return value;
+    }
+}
+
+// Convert a linear light value in the range 0-max back to sRGB encoding
+double LinearToSRGB(double value, ColorData colorData)
+{
+#ifdef VFX_REFERENCE
+    double max = GetColorSpaceMax(colorData);
+    if (value <= 0) return 0;
+    if (IsFloatDepth(colorData)) return ExactLinearToSRGB(value / max) * max;
+    // Integer depths are rounded the same as the tables are
+    if (value >= max) return max;
+    return floor((ExactLinearToSRGB(value / max) * max) + 0.5);
+#endif
+    long long idx = 0;
+    switch (colorData.colorDepth)
+    {
+        case U8:
+            idx = (long long)(((value / 255.0) * (ENCODE8_SIZE - 1)) + 0.5);
+            if (idx < 0) idx = 0;
+            else if (idx >= ENCODE8_SIZE) idx = ENCODE8_SIZE - 1;
+            return encodeTable8[idx];
+        case U16:
+            idx = (long long)(value + 0.5);
+            if (idx < 0) idx = 0;
+            else if (idx > 65535) idx = 65535;
+            return encodeTable16[idx];
+        case F32:
+        case F16:
+            if (value <= 0) return 0;
+            if (value > 1) return ExactLinearToSRGB(value);
+            return LerpTable(encodeTableF, value);
+        default:
+            return value;
+    }
+}
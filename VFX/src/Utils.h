@@ -19,11 +19,13 @@ typedef enum
 } ColorModel;
 
 // How many bytes and of what type
+// F16 is IEEE half float, converted to float on read and back on write
 typedef enum
 {
     U8 = 0,
-    U16 = 1, // Krita also has F16 depth sometimes, but that's weird and not
-    F32 = 2  // standard, so it's not supported for now
+    U16 = 1,
+    F32 = 2,
+    F16 = 3
 } ColorDepth;
 
 // Combined color data
@@ -31,6 +33,7 @@ typedef struct
 {
     ColorModel colorModel;
     ColorDepth colorDepth;
+    char linearLight; // Non-zero to convert sRGB encoded color to linear light on read, and back on write
 } ColorData;
 
 // Coordinates, 64 bit for each direction
@@ -40,6 +43,21 @@ typedef struct
     long long y;
 } Coords;
 
+// Progress and cancellation state for a single worker thread
+// Allocated by python and polled by python while the kernel runs
+typedef struct
+{
+    volatile long long progress; // Number of items finished so far
+    volatile char cancel;        // Set to non-zero by python to stop early
+} JobControl;
+
+// How many items to process between progress updates and cancel checks
+#define JOB_CHECK_INTERVAL 4096
+
+// Building with -DVFX_REFERENCE keeps the plain scalar paths instead of the faster
+// approximations (fixed point bilinear sampling, sRGB lookup tables), so the
+// results of the fast paths can be checked against it
+
 // 2 dimensional vector of doubles
 typedef struct
 {
@@ -88,6 +106,31 @@ double DegreeToRadian(double deg);
 
 double Max(double a, double b);
 
+// Return the number of channels used for a color model
+int GetNumChannels(ColorModel colorModel);
+
+// Return the number of bytes a single pixel takes up
+int GetBytesPerPixel(ColorData colorData);
+
+// Check if a color depth is floating point, float depths store RGBA in order
+char IsFloatDepth(ColorData colorData);
+
+// Coverage masks keep one sample per pixel, 8 bit for 8 bit layers and 16 bit for
+// deeper ones so soft edges don't band. Samples count steps of 1 / GetMaskMax
+int GetMaskSampleSize(ColorData colorData);
+unsigned int GetMaskMax(ColorData colorData);
+unsigned int ReadMaskSample(long long idx, void* maskData, ColorData colorData);
+void WriteMaskSample(long long idx, unsigned int value, void* maskData, ColorData colorData);
+
+// Coverage as 0-1, clamped to that and rounded to the nearest step when written
+double ReadMask(long long idx, void* maskData, ColorData colorData);
+void WriteMask(long long idx, double value, void* maskData, ColorData colorData);
+
+// Convert between half and single precision floats
+// Uses the F16C instructions when the CPU has them, lookup tables otherwise
+float HalfToFloat(unsigned short value);
+unsigned short FloatToHalf(float value);
+
 // Returns the color at a certain point in the image data
 Pixel GetColorAt(
     long long x,
@@ -126,4 +169,19 @@ double GetColorSpaceMax(ColorData colorData);
 // Clamp a vector to the current color space
 Pixel ClampToColorSpace(Pixel pix, ColorData colorData);
 
+// Fill the sRGB <-> linear and half float lookup tables, must be called once
+// before any kernel is run with linearLight set or on F16 data
+void InitColorTables();
+
+// Check if values should be converted to linear light for this color data
+char UsesLinearLight(ColorData colorData);
+
+// Convert a value in the range 0-max between sRGB encoding and linear light
+double SRGBToLinear(double value, ColorData colorData);
+double LinearToSRGB(double value, ColorData colorData);
+
+// Report progress for a worker and check if it was cancelled
+// Returns non-zero if the kernel should stop, control may be NULL
+char UpdateJob(JobControl* control, long long progress);
+
 #endif // ifndef _UTILS_H_
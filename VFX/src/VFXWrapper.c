@@ -5,10 +5,17 @@
 
 #include "Utils.h"
 #include "ChromaticAberration.h"
+#include "Compositing.h"
+#include "Convolution.h"
 #include "HighPass.h"
 #include "LensDirt.h"
 #include "LensFlare.h"
 
+void VFXInitColorTables()
+{
+    InitColorTables();
+}
+
 void VFXLinearAberration(
     long long start,
     long long n,
@@ -16,9 +23,10 @@ void VFXLinearAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
-    ApplyLinearAberration(start, n, filterData, imgSize, imgData, outData, colorData);
+    ApplyLinearAberration(start, n, filterData, imgSize, imgData, outData, colorData, control);
 }
 
 void VFXRadialAberration(
@@ -28,9 +36,75 @@ void VFXRadialAberration(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
+{
+    ApplyRadialAberration(start, n, filterData, imgSize, imgData, outData, colorData, control);
+}
+
+void VFXLoadSpectrumPixels(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* floatData,
+    ColorData colorData,
+    JobControl* control)
 {
-    ApplyRadialAberration(start, n, filterData, imgSize, imgData, outData, colorData);
+    LoadSpectrumPixels(start, n, imgSize, imgData, floatData, colorData, control);
+}
+
+void VFXBuildResampleTaps(
+    long long start,
+    long long n,
+    double scale,
+    long long length,
+    void* tapData,
+    JobControl* control)
+{
+    BuildResampleTaps(start, n, scale, length, tapData, control);
+}
+
+void VFXResampleRows(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ResampleRows(start, n, sample, imgSize, tapData, floatData, outData, colorData, control);
+}
+
+void VFXAccumulateSpectralSample(
+    long long start,
+    long long n,
+    SpectralSample sample,
+    Coords imgSize,
+    void* tapData,
+    void* floatData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control)
+{
+    AccumulateSpectralSample(start, n, sample, imgSize, tapData, floatData, sumData, colorData, control);
+}
+
+void VFXFinishSpectrum(
+    long long start,
+    long long n,
+    SpectralSample totals,
+    int numSamples,
+    Coords imgSize,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    FinishSpectrum(start, n, totals, numSamples, imgSize, sumData, outData, colorData, control);
 }
 
 void VFXPsuedoLensFlare(
@@ -40,9 +114,73 @@ void VFXPsuedoLensFlare(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
-    ApplyPsuedoLensFlare(start, n, filterData, imgSize, imgData, outData, colorData);
+    ApplyPsuedoLensFlare(start, n, filterData, imgSize, imgData, outData, colorData, control);
+}
+
+void VFXBuildMipLevel(
+    long long start,
+    long long n,
+    int level,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    ColorData colorData,
+    JobControl* control)
+{
+    BuildMipLevel(start, n, level, imgSize, imgData, mipData, colorData, control);
+}
+
+void VFXGhostLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    int mipLevels,
+    Coords imgSize,
+    void* imgData,
+    void* mipData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ApplyGhostLensFlare(start, n, filterData, mipLevels, imgSize, imgData, mipData, outData, colorData, control);
+}
+
+void VFXSplatLensFlare(
+    long long start,
+    long long n,
+    LensFlareFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ApplySplatLensFlare(start, n, filterData, imgSize, imgData, highlightData, rowData, outData, colorData, control);
+}
+
+long long VFXGetStreakLines(
+    Coords imgSize,
+    double angle)
+{
+    return GetStreakLines(imgSize, angle);
+}
+
+void VFXStreak(
+    long long start,
+    long long n,
+    StreakFilterData filterData,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ApplyStreak(start, n, filterData, imgSize, imgData, outData, colorData, control);
 }
 
 void VFXPower(
@@ -52,9 +190,10 @@ void VFXPower(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
 {
-    ApplyPower(start, n, power, imgSize, imgData, outData, colorData);
+    ApplyPower(start, n, power, imgSize, imgData, outData, colorData, control);
 }
 
 void VFXHighPass(
@@ -64,9 +203,35 @@ void VFXHighPass(
     Coords imgSize,
     void* imgData,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
+{
+    ApplyHighPass(start, n, threshold, imgSize, imgData, outData, colorData, control);
+}
+
+void VFXCountHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control)
 {
-    ApplyHighPass(start, n, threshold, imgSize, imgData, outData, colorData);
+    CountHighlights(start, n, imgSize, imgData, rowData, colorData, control);
+}
+
+void VFXCollectHighlights(
+    long long start,
+    long long n,
+    Coords imgSize,
+    void* imgData,
+    void* highlightData,
+    void* rowData,
+    ColorData colorData,
+    JobControl* control)
+{
+    CollectHighlights(start, n, imgSize, imgData, highlightData, rowData, colorData, control);
 }
 
 void VFXCreateDirtShapes(
@@ -75,9 +240,10 @@ void VFXCreateDirtShapes(
     LensDirtFilterData filterData,
     Coords imgSize,
     unsigned int seed,
-    void* outData)
+    void* outData,
+    JobControl* control)
 {
-    CreateDirtShapes(start, n, filterData, imgSize, seed, outData);
+    CreateDirtShapes(start, n, filterData, imgSize, seed, outData, control);
 }
 
 void VFXRenderLensDirt(
@@ -88,7 +254,185 @@ void VFXRenderLensDirt(
     Coords imgSize,
     void* shapes,
     void* outData,
-    ColorData colorData)
+    ColorData colorData,
+    JobControl* control)
+{
+    RenderLensDirt(start, n, numShapes, filterData, imgSize, shapes, outData, colorData, control);
+}
+
+void VFXRenderDirtMask(
+    long long start,
+    long long n,
+    long long numShapes,
+    LensDirtFilterData filterData,
+    Coords imgSize,
+    void* shapes,
+    void* maskData,
+    ColorData colorData,
+    JobControl* control)
+{
+    RenderDirtMask(start, n, numShapes, filterData, imgSize, shapes, maskData, colorData, control);
+}
+
+void VFXBlurDirtMask(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* maskData,
+    void* outMaskData,
+    ColorData colorData,
+    JobControl* control)
+{
+    BlurDirtMask(start, n, radius, vertical, imgSize, maskData, outMaskData, colorData, control);
+}
+
+void VFXExpandDirtMask(
+    long long start,
+    long long n,
+    void* maskData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    ExpandDirtMask(start, n, maskData, outData, colorData, control);
+}
+
+void VFXMakeBloomKernel(
+    long long start,
+    long long n,
+    BloomKernelData kernelData,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control)
+{
+    MakeBloomKernel(start, n, kernelData, fftSize, spectrum, control);
+}
+
+void VFXTransformColumns(
+    long long start,
+    long long n,
+    long long fftSize,
+    void* spectrum,
+    JobControl* control)
+{
+    TransformColumns(start, n, fftSize, spectrum, control);
+}
+
+void VFXLoadTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* imgData,
+    void* tileSpectrum,
+    ColorData colorData,
+    JobControl* control)
+{
+    LoadTileRows(start, n, tile, imgSize, imgData, tileSpectrum, colorData, control);
+}
+
+void VFXConvolveTileColumns(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    void* tileSpectrum,
+    void* kernelSpectrum,
+    JobControl* control)
+{
+    ConvolveTileColumns(start, n, tile, tileSpectrum, kernelSpectrum, control);
+}
+
+void VFXAccumulateTileRows(
+    long long start,
+    long long n,
+    ConvolutionTile tile,
+    Coords imgSize,
+    void* tileSpectrum,
+    void* sumData,
+    JobControl* control)
+{
+    AccumulateTileRows(start, n, tile, imgSize, tileSpectrum, sumData, control);
+}
+
+void VFXFinishConvolution(
+    long long start,
+    long long n,
+    double power,
+    Coords imgSize,
+    void* imgData,
+    void* sumData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    FinishConvolution(start, n, power, imgSize, imgData, sumData, outData, colorData, control);
+}
+
+void VFXBoxBlurLines(
+    long long start,
+    long long n,
+    int radius,
+    char vertical,
+    Coords imgSize,
+    void* imgData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    BoxBlurLines(start, n, radius, vertical, imgSize, imgData, outData, colorData, control);
+}
+
+void VFXAccumulateLayer(
+    long long start,
+    long long n,
+    double gain,
+    double maskGain,
+    Coords imgSize,
+    void* layerData,
+    void* maskData,
+    void* sumData,
+    ColorData colorData,
+    JobControl* control)
+{
+    AccumulateLayer(start, n, gain, maskGain, imgSize, layerData, maskData, sumData, colorData, control);
+}
+
+void VFXFindEmptyTiles(
+    long long start,
+    long long n,
+    int tileSize,
+    char ignoreAlpha,
+    Coords imgSize,
+    void* imgData,
+    void* tileData,
+    ColorData colorData,
+    JobControl* control)
+{
+    FindEmptyTiles(start, n, tileSize, ignoreAlpha, imgSize, imgData, tileData, colorData, control);
+}
+
+void VFXCompositeLayer(
+    long long start,
+    long long n,
+    char blendMode,
+    Coords imgSize,
+    void* baseData,
+    void* layerData,
+    void* outData,
+    ColorData colorData,
+    JobControl* control)
+{
+    CompositeLayer(start, n, blendMode, imgSize, baseData, layerData, outData, colorData, control);
+}
+
+char VFXUnfilterPNG(
+    void* data,
+    long long rows,
+    long long rowBytes,
+    int bytesPerPixel,
+    void* outData)
 {
-    RenderLensDirt(start, n, numShapes, filterData, imgSize, shapes, outData, colorData);
+    return UnfilterPNG(data, rows, rowBytes, bytesPerPixel, outData);
 }
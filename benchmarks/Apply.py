@@ -0,0 +1,132 @@
+"""
+Apply.py
+End to end benchmark of applying every effect the way Krita does, through
+UIController and each widget's applyFilter and postFilter, with the
+stand-in krita module next to this file. Reports the time spent in every
+phase, from creating the layer to refreshing the projection. PyQt5 has
+to be installed, it runs without a display
+"""
+from array import array
+import argparse
+import os
+import random
+import struct
+import sys
+
+# Effect names match the command line renderer's
+WINDOWS = {
+    "chromatic-aberration": "CHROMATIC_ABERRATION",
+    "bloom": "BLOOM",
+    "pseudo-flare": "PSEUDO_FLARE",
+    "anamorphic-flare": "ANAMORPHIC_FLARE",
+    "lens-dirt": "LENS_DIRT",
+    "lens-stack": "LENS_STACK",
+}
+
+def ParseArguments(argv):
+    parser = argparse.ArgumentParser(description="Time every phase of applying the effects through UIController")
+    parser.add_argument("--effects", nargs="+", choices=sorted(WINDOWS), default=sorted(WINDOWS))
+    parser.add_argument("--size", default="2048x2048", metavar="WxH", help="Size of the document")
+    parser.add_argument("--model", default="RGBA", help="Color model of the layer")
+    parser.add_argument("--depth", default="U8", help="Color depth of the layer")
+    parser.add_argument("--repeat", type=int, default=3, help="Applies per effect, the median of each phase is shown")
+    parser.add_argument("--copy-cost", type=float, default=0.0, metavar="MS",
+                        help="Extra milliseconds per MB copied to or from a layer, standing in for Krita's tiles")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Plugin setting to apply with, like G_numThreads=4 or G_streaming=1")
+    return parser.parse_args(argv)
+
+# Bright spots on a dark background, so every effect has something to pick up
+def CreateLayerData(size, numChannels, colorDepth, seed=1):
+    generator = random.Random(seed)
+    spots = bytes(255 if value >= 252 else value // 4 for value in range(256))
+    samples = generator.randbytes(size[0] * size[1] * numChannels).translate(spots)
+    if colorDepth == "U16":
+        return bytearray(array("H", (value * 257 for value in samples)).tobytes())
+    if colorDepth == "F32":
+        return bytearray(array("f", (value / 255 for value in samples)).tobytes())
+    if colorDepth == "F16":
+        # array has no half floats, struct does
+        return bytearray(struct.pack(str(len(samples)) + "e", *(value / 255 for value in samples)))
+    return bytearray(samples)
+
+def Median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+# Apply one effect through a fresh UIController, returns its profiler
+def ApplyOnce(app, extension, windowType, settings, size, model, depth, data):
+    from VFX.UIController import UIController
+    document = app.createDocument(size[0], size[1], "benchmark", model, depth, data=data)
+    app.setActiveDocument(document)
+    extension.settings = settings
+    controller = UIController()
+    profiles = []
+    # Keep the profile instead of printing it and writing a trace
+    controller.reportProfile = profiles.append
+    controller.initialize(extension, windowType)
+    controller.applyChanges()
+    while controller.isRunning():
+        if controller.workerThread is not None:
+            controller.workerThread.join()
+        controller.checkProgress()
+    return profiles[0] if profiles else None
+
+def Main(argv=None):
+    args = ParseArguments(sys.argv[1:] if argv is None else argv)
+    # The plugin is in the folder above this one, the krita stand-in is in this one
+    sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    qtApp = QApplication.instance() or QApplication([])
+    import krita
+    import VFX
+    from VFX.UIController import WindowTypes
+    from VFX.Headless import PresetSettings
+    from VFX.LibHandler import GetBytesPerPixel, TranslateColorData
+    from VFX.ImageFiles import GetSampleSize
+    krita.SetCopyCost(args.copy_cost)
+    app = krita.Krita.instance()
+    extension = app.extensions()[0]
+    width, height = args.size.lower().split("x")
+    size = (int(width), int(height))
+    colorData = TranslateColorData(args.model, args.depth)
+    if colorData is None:
+        print("Unsupported color model or depth " + args.model + " " + args.depth)
+        return 2
+    data = CreateLayerData(size, GetBytesPerPixel(colorData) // GetSampleSize(args.depth), args.depth)
+    values = {"G_profile": 1}
+    for override in args.set:
+        key, value = override.split("=", 1)
+        values[key.strip()] = value.strip()
+
+    print("{}x{} {} {}, {} ms per MB copied, median of {}".format(size[0], size[1], args.model, args.depth,
+                                                                   args.copy_cost, args.repeat))
+    for effect in args.effects:
+        phases = {}
+        order = []
+        for i in range(args.repeat):
+            profiler = ApplyOnce(app, extension, WindowTypes[WINDOWS[effect]], PresetSettings(values), size,
+                                 args.model, args.depth, data)
+            if profiler is None:
+                print(effect + ": the apply failed")
+                return 1
+            # Phases that run more than once, like per band reads, are added up
+            totals = {}
+            for event in sorted(profiler.events, key=lambda e: e["begin"]):
+                if event["name"] not in totals:
+                    totals[event["name"]] = 0
+                    if event["name"] not in order:
+                        order.append(event["name"])
+                totals[event["name"]] += event["wall"]
+            first = min(event["begin"] for event in profiler.events)
+            totals["total"] = max(event["begin"] + event["wall"] for event in profiler.events) - first
+            for name, wall in totals.items():
+                phases.setdefault(name, []).append(wall)
+        print(effect)
+        for name in order + ["total"]:
+            print("  {:<28}{:>10.1f} ms".format(name, Median(phases[name]) * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -0,0 +1,421 @@
+"""
+Regression.py
+Checks the library's optimized kernels against a reference build of the
+same sources, with the faster approximations turned off (VFX_REFERENCE), on
+seeded synthetic images in every color model and depth at several thread
+counts. Reports the largest and mean error of every channel, as a fraction
+of the channel's full range, and fails if any are over the tolerance
+"""
+from array import array
+from ctypes import *
+import argparse
+import glob
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+
+MODELS = ["A", "RGBA", "XYZA", "LABA", "CMYKA", "GRAYA", "YCbCrA"]
+DEPTHS = ["U8", "U16", "F16", "F32"]
+
+# Same as the README's build, and the plain scalar build everything is checked against
+OPTIMIZED_FLAGS = ["-Ofast"]
+REFERENCE_FLAGS = ["-O0", "-DVFX_REFERENCE"]
+
+# Largest error allowed, as a fraction of a channel's range
+# Fixed point bilinear weights are rounded to 1/256, which is where most of the error comes from,
+# and effects that add two samples together can be off by 2 in 8 bit
+DEFAULT_TOLERANCE = 0.01
+
+SEED = 1
+
+# The krita stand-in next to this file would load the whole plugin, only the library is needed
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from VFX.LibHandler import (LoadSharedLibrary, LoadNumPyLibrary, TranslateColorData, GetBytesPerPixel, GetMaskSampleSize, Coords, RadialFilterData,
+                            LinearFilterData, LensFlareFilterData, StreakFilterData, LensDirtFilterData,
+                            ResampleTaps, SpectralSample, SPECTRUM_CHANNELS, Highlight, BloomKernelData,
+                            ConvolutionTile)
+from VFX.FilterJob import FilterJob
+from VFX.Convolution import PlanTiles, GetChannelPairs
+from VFX.ImageFiles import GetSampleSize
+
+def ParseArguments(argv):
+    parser = argparse.ArgumentParser(description="Compare the optimized kernels against the reference build")
+    parser.add_argument("--size", default="96x64", metavar="WxH", help="Size of the synthetic images")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="Thread counts to run at")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.add_argument("--depths", nargs="+", choices=DEPTHS, default=DEPTHS)
+    parser.add_argument("--linear", action="store_true", help="Work in linear light, only changes RGBA and GRAYA")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--reference", help="Reference library to use instead of building one")
+    parser.add_argument("--optimized", help="Optimized library to use instead of building one")
+    parser.add_argument("--numpy", action="store_true", help="Check the NumPy kernels instead of the optimized build")
+    parser.add_argument("--compiler", default="gcc")
+    return parser.parse_args(argv)
+
+def BuildLibrary(compiler, flags, outPath):
+    srcDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "VFX", "src")
+    sources = sorted(glob.glob(os.path.join(srcDir, "*.c")))
+    subprocess.check_call([compiler, "-shared", "-fPIC"] + flags + ["-o", outPath] + sources + ["-lm"])
+    return outPath
+
+# Full range of a channel, the same guess as GetColorSpaceMax in Utils.c
+def GetChannelMax(colorModel, colorDepth):
+    if colorDepth == "U8":
+        return 255
+    if colorDepth == "U16":
+        return 65535
+    if colorModel in ("A", "RGBA", "GRAYA"):
+        return 1.0
+    return 255.0
+
+def GetTypeCode(colorDepth):
+    return {"U8": "B", "U16": "H", "F16": "e", "F32": "f"}[colorDepth]
+
+# Dim noise with a few bright spots, so thresholds and flares have something to pick up
+def CreateImage(size, colorModel, colorDepth, seed):
+    generator = random.Random(seed)
+    colorData = TranslateColorData(colorModel, colorDepth)
+    numSamples = size[0] * size[1] * GetBytesPerPixel(colorData) // GetSampleSize(colorDepth)
+    spots = bytes(255 if value >= 250 else value // 3 for value in range(256))
+    samples = generator.randbytes(numSamples).translate(spots)
+    maxValue = GetChannelMax(colorModel, colorDepth)
+    if colorDepth == "U8":
+        return bytearray(samples)
+    if colorDepth == "U16":
+        return bytearray(array("H", (value * 257 for value in samples)).tobytes())
+    if colorDepth == "F16":
+        # array has no half floats, struct does
+        return bytearray(struct.pack(str(numSamples) + "e", *(value / 255 * maxValue for value in samples)))
+    return bytearray(array("f", (value / 255 * maxValue for value in samples)).tobytes())
+
+# Every case is called as case(dll, job, imgSize, imgData, colorData, numThreads, shapes)
+# and returns the rendered buffer, or None if it couldn't run
+def RunPixelKernel(dll, job, kernel, settings, imgSize, imgData, colorData, numThreads):
+    outData = create_string_buffer(len(imgData))
+    numPixels = imgSize[0] * imgSize[1]
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    if not job.run(kernel, numPixels, numThreads, (settings, Coords(*imgSize), inData, outData, colorData)):
+        return None
+    return outData.raw
+
+def HighPassCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    return RunPixelKernel(dll, job, dll.VFXHighPass, 180, imgSize, imgData, colorData, numThreads)
+
+def PowerCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    return RunPixelKernel(dll, job, dll.VFXPower, 2, imgSize, imgData, colorData, numThreads)
+
+def LinearAberrationCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings = LinearFilterData(int(0.05 * imgSize[0]), 30, 1)
+    return RunPixelKernel(dll, job, dll.VFXLinearAberration, settings, imgSize, imgData, colorData, numThreads)
+
+def RadialAberrationCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings = RadialFilterData(int(0.05 * imgSize[0]), 10, 0, 1)
+    return RunPixelKernel(dll, job, dll.VFXRadialAberration, settings, imgSize, imgData, colorData, numThreads)
+
+def ExpRadialAberrationCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings = RadialFilterData(int(0.05 * imgSize[0]), 0, 1, 1)
+    return RunPixelKernel(dll, job, dll.VFXRadialAberration, settings, imgSize, imgData, colorData, numThreads)
+
+def PseudoFlareCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings = LensFlareFilterData(4, 0.4, int(0.25 * imgSize[0]), 2, 1)
+    return RunPixelKernel(dll, job, dll.VFXPsuedoLensFlare, settings, imgSize, imgData, colorData, numThreads)
+
+def StreakCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    angle = 15.0
+    settings = StreakFilterData(angle, 0.25 * imgSize[0], 2)
+    outData = create_string_buffer(len(imgData))
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    numLines = dll.VFXGetStreakLines(Coords(*imgSize), angle)
+    if not job.run(dll.VFXStreak, numLines, numThreads, (settings, Coords(*imgSize), inData, outData, colorData)):
+        return None
+    return outData.raw
+
+def LensDirtCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings, shapeData, numShapes = shapes
+    outData = create_string_buffer(len(imgData))
+    if not job.run(dll.VFXRenderLensDirt, imgSize[0] * imgSize[1], numThreads,
+                   (numShapes, settings, Coords(*imgSize), byref(shapeData), outData, colorData)):
+        return None
+    return outData.raw
+
+# Added twice, the second time lit up through a mask like bloom under lens dirt
+def AccumulateCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    numPixels = imgSize[0] * imgSize[1]
+    sumData = create_string_buffer(len(imgData))
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    # Sixteen levels of coverage, in 8 or 16 bit steps like a lens dirt mask
+    maskType = "B" if GetMaskSampleSize(colorData) == 1 else "H"
+    step = 17 if maskType == "B" else 4369
+    maskSamples = array(maskType, (((i * 7) % 16) * step for i in range(numPixels)))
+    maskData = create_string_buffer(maskSamples.tobytes(), len(maskSamples) * maskSamples.itemsize)
+    for maskPointer in (None, maskData):
+        if not job.run(dll.VFXAccumulateLayer, numPixels, numThreads,
+                       (2.0, 1.5, Coords(*imgSize), inData, maskPointer, sumData, colorData)):
+            return None
+    return sumData.raw
+
+# Eight wavelengths scaled from 5% out to 5% in, tinted red to green to blue
+def SpectralAberrationCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    numPixels = imgSize[0] * imgSize[1]
+    imgCoords = Coords(*imgSize)
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    loadData = (c_float * (numPixels * SPECTRUM_CHANNELS))()
+    rowData = (c_float * (numPixels * SPECTRUM_CHANNELS))()
+    sumData = (c_float * (numPixels * SPECTRUM_CHANNELS))()
+    outData = create_string_buffer(len(imgData))
+    if not job.run(dll.VFXLoadSpectrumPixels, numPixels, numThreads, (imgCoords, inData, loadData, colorData)):
+        return None
+    numSamples = 8
+    totals = SpectralSample(0, 0, 0, 0)
+    for k in range(numSamples):
+        t = k / (numSamples - 1)
+        sample = SpectralSample(1 + ((1 - 2 * t) * 0.05), max(0.0, 1 - 2 * t), 1 - abs(2 * t - 1), max(0.0, 2 * t - 1))
+        totals.red += sample.red
+        totals.green += sample.green
+        totals.blue += sample.blue
+        rowTaps = (ResampleTaps * imgSize[0])()
+        columnTaps = (ResampleTaps * imgSize[1])()
+        if not (job.run(dll.VFXBuildResampleTaps, imgSize[0], 1, (sample.scale, imgSize[0], byref(rowTaps))) and
+                job.run(dll.VFXBuildResampleTaps, imgSize[1], 1, (sample.scale, imgSize[1], byref(columnTaps))) and
+                job.run(dll.VFXResampleRows, imgSize[1], numThreads,
+                        (sample, imgCoords, byref(rowTaps), loadData, rowData, colorData)) and
+                job.run(dll.VFXAccumulateSpectralSample, imgSize[1], numThreads,
+                        (sample, imgCoords, byref(columnTaps), rowData, sumData, colorData))):
+            return None
+    if not job.run(dll.VFXFinishSpectrum, numPixels, numThreads,
+                   (totals, numSamples, imgCoords, sumData, outData, colorData)):
+        return None
+    return outData.raw
+
+# Highpassed first so the flare only comes from the brightest pixels, like the lens flare effect
+def HighPassImage(dll, job, imgSize, imgData, colorData, numThreads):
+    highData = RunPixelKernel(dll, job, dll.VFXHighPass, 180, imgSize, imgData, colorData, numThreads)
+    return None if highData is None else bytearray(highData)
+
+# Copies sampled from a pyramid of halved images, the last copy is scaled by 2 so it reads from the first level
+# Copies scaled further fade in again past the corners, and grow any rounding differences far past the tolerance
+def GhostFlareCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings = LensFlareFilterData(4, 1.0, int(0.25 * imgSize[0]), 2, 1)
+    mipLevels = 1
+    mipSizes = [imgSize]
+    for level in range(mipLevels):
+        mipSizes.append(((mipSizes[-1][0] + 1) // 2, (mipSizes[-1][1] + 1) // 2))
+    mipData = create_string_buffer(sum(size[0] * size[1] for size in mipSizes[1:]) * GetBytesPerPixel(colorData))
+    outData = create_string_buffer(len(imgData))
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    for level in range(1, mipLevels + 1):
+        if not job.run(dll.VFXBuildMipLevel, mipSizes[level][0] * mipSizes[level][1], numThreads,
+                       (level, Coords(*imgSize), inData, mipData, colorData)):
+            return None
+    if not job.run(dll.VFXGhostLensFlare, imgSize[0] * imgSize[1], numThreads,
+                   (settings, mipLevels, Coords(*imgSize), inData, mipData, outData, colorData)):
+        return None
+    return outData.raw
+
+# Highlights listed row by row, then splatted into every pixel's copies
+def SplatFlareCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    highData = HighPassImage(dll, job, imgSize, imgData, colorData, numThreads)
+    if highData is None:
+        return None
+    settings = LensFlareFilterData(4, 0.4, int(0.25 * imgSize[0]), 2, 1)
+    inData = (c_char * len(highData)).from_buffer(highData)
+    rowIndex = (c_longlong * (imgSize[1] + 1))()
+    if not job.run(dll.VFXCountHighlights, imgSize[1], numThreads, (Coords(*imgSize), inData, rowIndex, colorData)):
+        return None
+    for y in range(imgSize[1]):
+        rowIndex[y + 1] += rowIndex[y]
+    highlights = (Highlight * max(1, rowIndex[imgSize[1]]))()
+    outData = create_string_buffer(len(imgData))
+    if not (job.run(dll.VFXCollectHighlights, imgSize[1], numThreads,
+                    (Coords(*imgSize), inData, highlights, rowIndex, colorData)) and
+            job.run(dll.VFXSplatLensFlare, imgSize[0] * imgSize[1], numThreads,
+                    (settings, Coords(*imgSize), inData, highlights, rowIndex, outData, colorData))):
+        return None
+    return outData.raw
+
+# Same steps as ConvolveImage, the kernels reach past the edges of the tiles so they overlap
+def BloomCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    highData = HighPassImage(dll, job, imgSize, imgData, colorData, numThreads)
+    if highData is None:
+        return None
+    imgCoords = Coords(*imgSize)
+    inData = (c_char * len(highData)).from_buffer(highData)
+    outData = create_string_buffer(len(imgData))
+    sumData = (c_float * (imgSize[0] * imgSize[1] * 4))()
+    for kernelData in (BloomKernelData(0, int(0.4 * imgSize[0]), 6, 15.0), BloomKernelData(1, 12, 5, 0.0)):
+        fftSize, tileSize = PlanTiles(imgSize, kernelData.radius)
+        kernelSpectrum = (c_float * (fftSize * fftSize * 2))()
+        tileSpectrum = (c_float * (fftSize * fftSize * 2))()
+        if not (job.run(dll.VFXMakeBloomKernel, fftSize, numThreads, (kernelData, fftSize, kernelSpectrum)) and
+                job.run(dll.VFXTransformColumns, fftSize, numThreads, (fftSize, kernelSpectrum))):
+            return None
+        for pair in GetChannelPairs(colorData):
+            for tileY in range(0, imgSize[1], tileSize):
+                for tileX in range(0, imgSize[0], tileSize):
+                    tile = ConvolutionTile(Coords(tileX, tileY), tileSize, fftSize, kernelData.radius, pair)
+                    if not (job.run(dll.VFXLoadTileRows, fftSize, numThreads,
+                                    (tile, imgCoords, inData, tileSpectrum, colorData)) and
+                            job.run(dll.VFXConvolveTileColumns, fftSize, numThreads,
+                                    (tile, tileSpectrum, kernelSpectrum)) and
+                            job.run(dll.VFXAccumulateTileRows, fftSize, numThreads,
+                                    (tile, imgCoords, tileSpectrum, sumData))):
+                        return None
+    if not job.run(dll.VFXFinishConvolution, imgSize[0] * imgSize[1], numThreads,
+                   (2.0, imgCoords, (c_char * len(imgData)).from_buffer(imgData), sumData, outData, colorData)):
+        return None
+    return outData.raw
+
+# Soft edged shapes rendered to a mask, blurred both ways and turned back into a layer
+def DirtMaskCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    settings, shapeData, numShapes = shapes
+    settings = LensDirtFilterData(settings.size, settings.sizeVarience, settings.opacity, settings.opacityVarience,
+                                  settings.shape, settings.direction, 5, 1)
+    numPixels = imgSize[0] * imgSize[1]
+    maskData = create_string_buffer(numPixels * GetMaskSampleSize(colorData))
+    blurData = create_string_buffer(len(maskData))
+    outData = create_string_buffer(len(imgData))
+    radius = int(0.05 * imgSize[0])
+    if not (job.run(dll.VFXRenderDirtMask, numPixels, numThreads,
+                    (numShapes, settings, Coords(*imgSize), byref(shapeData), maskData, colorData)) and
+            job.run(dll.VFXBlurDirtMask, imgSize[1], numThreads,
+                    (radius, 0, Coords(*imgSize), maskData, blurData, colorData)) and
+            job.run(dll.VFXBlurDirtMask, imgSize[0], numThreads,
+                    (radius, 1, Coords(*imgSize), blurData, maskData, colorData)) and
+            job.run(dll.VFXExpandDirtMask, numPixels, numThreads, (maskData, outData, colorData))):
+        return None
+    return outData.raw
+
+# Rows then columns, like the blur used outside of Krita
+def BoxBlurCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    inData = (c_char * len(imgData)).from_buffer(imgData)
+    rowData = create_string_buffer(len(imgData))
+    outData = create_string_buffer(len(imgData))
+    radius = int(0.1 * imgSize[0])
+    if not (job.run(dll.VFXBoxBlurLines, imgSize[1], numThreads,
+                    (radius, 0, Coords(*imgSize), inData, rowData, colorData)) and
+            job.run(dll.VFXBoxBlurLines, imgSize[0], numThreads,
+                    (radius, 1, Coords(*imgSize), rowData, outData, colorData))):
+        return None
+    return outData.raw
+
+# Image blended onto its own reverse in each blend mode, one after the other
+def CompositeCase(dll, job, imgSize, imgData, colorData, numThreads, shapes):
+    bytesPerPixel = GetBytesPerPixel(colorData)
+    pixels = [imgData[i:i + bytesPerPixel] for i in range(0, len(imgData), bytesPerPixel)]
+    layerData = bytearray(b"".join(reversed(pixels)))
+    baseData = bytearray(imgData)
+    outData = create_string_buffer(len(imgData))
+    for blendMode in (0, 1, 2):
+        if not job.run(dll.VFXCompositeLayer, imgSize[0] * imgSize[1], numThreads,
+                       (blendMode, Coords(*imgSize), (c_char * len(baseData)).from_buffer(baseData),
+                        (c_char * len(layerData)).from_buffer(layerData), outData, colorData)):
+            return None
+        baseData = bytearray(outData.raw)
+    return outData.raw
+
+CASES = {
+    "highpass": HighPassCase,
+    "power": PowerCase,
+    "linear-aberration": LinearAberrationCase,
+    "radial-aberration": RadialAberrationCase,
+    "radial-aberration-exp": ExpRadialAberrationCase,
+    "pseudo-flare": PseudoFlareCase,
+    "streak": StreakCase,
+    "lens-dirt": LensDirtCase,
+    "accumulate": AccumulateCase,
+    "spectral-aberration": SpectralAberrationCase,
+    "ghost-flare": GhostFlareCase,
+    "splat-flare": SplatFlareCase,
+    "bloom": BloomCase,
+    "dirt-mask": DirtMaskCase,
+    "box-blur": BoxBlurCase,
+    "composite": CompositeCase,
+}
+
+# Dirt shapes come from rand(), so they're made once on one thread and shared by both builds
+def CreateDirtShapes(dll, imgSize):
+    numShapes = 10 * 10
+    shape = 5
+    settings = LensDirtFilterData(int(0.1 * imgSize[0]), 50, 50, 50, shape, 100, 0, 0)
+    shapeData = (c_float * (numShapes * ((shape * 2) + 2)))()
+    FilterJob().run(dll.VFXCreateDirtShapes, numShapes, 1, (settings, Coords(*imgSize), c_uint(SEED), byref(shapeData)))
+    return settings, shapeData, numShapes
+
+# Largest and mean error of every channel between two renders, as a fraction of the range
+def CompareChannels(expected, actual, numChannels, colorModel, colorDepth):
+    typeCode = GetTypeCode(colorDepth)
+    numSamples = len(expected) // GetSampleSize(colorDepth)
+    # struct instead of array, for the half floats
+    expectedSamples = struct.unpack(str(numSamples) + typeCode, expected)
+    actualSamples = struct.unpack(str(numSamples) + typeCode, actual)
+    maxValue = GetChannelMax(colorModel, colorDepth)
+    maxErrors = []
+    meanErrors = []
+    for channel in range(numChannels):
+        errors = [abs(a - b) / maxValue if a == a and b == b else (0.0 if a != a and b != b else float("inf"))
+                  for a, b in zip(expectedSamples[channel::numChannels], actualSamples[channel::numChannels])]
+        maxErrors.append(max(errors))
+        meanErrors.append(sum(errors) / len(errors))
+    return maxErrors, meanErrors
+
+def FormatErrors(errors):
+    return " ".join("{:.5f}".format(error) for error in errors)
+
+def Main(argv=None):
+    args = ParseArguments(sys.argv[1:] if argv is None else argv)
+    width, height = args.size.lower().split("x")
+    imgSize = (int(width), int(height))
+    buildDir = tempfile.mkdtemp(prefix="vfx_regression_")
+    referencePath = args.reference or BuildLibrary(args.compiler, REFERENCE_FLAGS, os.path.join(buildDir, "reference.so"))
+    reference = LoadSharedLibrary(referencePath)
+    if args.numpy:
+        optimized = LoadNumPyLibrary()
+    else:
+        optimizedPath = args.optimized or BuildLibrary(args.compiler, OPTIMIZED_FLAGS,
+                                                       os.path.join(buildDir, "optimized.so"))
+        optimized = LoadSharedLibrary(optimizedPath)
+    shapes = CreateDirtShapes(reference, imgSize)
+
+    print("{}x{}, threads {}, tolerance {}{}".format(imgSize[0], imgSize[1], args.threads, args.tolerance,
+                                                     ", linear light" if args.linear else ""))
+    print("{:<22}{:<8}{:<5}{:>8}  {:<44}{}".format("case", "model", "depth", "result", "max error per channel",
+                                                    "mean error per channel"))
+    failures = 0
+    for caseName in args.cases:
+        case = CASES[caseName]
+        for colorModel in args.models:
+            for colorDepth in args.depths:
+                colorData = TranslateColorData(colorModel, colorDepth, args.linear)
+                numChannels = GetBytesPerPixel(colorData) // GetSampleSize(colorDepth)
+                imgData = CreateImage(imgSize, colorModel, colorDepth, SEED)
+                expected = case(reference, FilterJob(), imgSize, imgData, colorData, 1, shapes)
+                maxErrors = [0.0] * numChannels
+                meanErrors = [0.0] * numChannels
+                result = "ok"
+                renders = []
+                for numThreads in args.threads:
+                    if case(reference, FilterJob(), imgSize, imgData, colorData, numThreads, shapes) != expected:
+                        result = "THREADS"
+                    actual = case(optimized, FilterJob(), imgSize, imgData, colorData, numThreads, shapes)
+                    renders.append(actual)
+                    caseMax, caseMean = CompareChannels(expected, actual, numChannels, colorModel, colorDepth)
+                    maxErrors = [max(a, b) for a, b in zip(maxErrors, caseMax)]
+                    meanErrors = [max(a, b) for a, b in zip(meanErrors, caseMean)]
+                # Every build has to give the same answer no matter how the work is split
+                if any(render != renders[0] for render in renders):
+                    result = "THREADS"
+                if max(maxErrors) > args.tolerance:
+                    result = "ERROR"
+                if result != "ok":
+                    failures += 1
+                print("{:<22}{:<8}{:<5}{:>8}  {:<44}{}".format(caseName, colorModel, colorDepth, result,
+                                                                FormatErrors(maxErrors), FormatErrors(meanErrors)))
+    print(str(failures) + " failed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -0,0 +1,66 @@
+"""
+Startup.py
+Measures what loading the plugin costs Krita at startup: importing it and
+registering its actions. Every run is a fresh python so nothing is cached,
+with the stand-in krita module next to this file. PyQt5 has to be installed
+"""
+import json
+import os
+import subprocess
+import sys
+
+# Importing and registering the actions should stay under this, in milliseconds
+IMPORT_BUDGET_MS = 50
+
+RUNS = 5
+
+# Runs in the fresh python, reports its timings and which of the plugin's modules it loaded
+CHILD_SCRIPT = """
+import sys, time, json
+begin = time.perf_counter()
+import VFX
+import krita
+window = krita.Window()
+for extension in krita.Krita.instance().extensions():
+    extension.createActions(window)
+startup = time.perf_counter() - begin
+loaded = sorted(name for name in sys.modules if name.startswith("VFX."))
+import VFX.LibHandler
+libraryLoaded = VFX.LibHandler.sharedLibrary is not None
+begin = time.perf_counter()
+import VFX.UIController, VFX.BloomWidget
+firstOpen = time.perf_counter() - begin
+print(json.dumps({"startup": startup, "firstOpen": firstOpen, "loaded": loaded,
+                  "actions": len(window.actions), "libraryLoaded": libraryLoaded}))
+"""
+
+def RunOnce():
+    benchDir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([benchDir, os.path.dirname(benchDir), env.get("PYTHONPATH", "")])
+    output = subprocess.check_output([sys.executable, "-c", CHILD_SCRIPT], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def Main():
+    runs = [RunOnce() for i in range(RUNS)]
+    startup = sorted(run["startup"] * 1000 for run in runs)[RUNS // 2]
+    firstOpen = sorted(run["firstOpen"] * 1000 for run in runs)[RUNS // 2]
+    loaded = runs[0]["loaded"]
+    print("Startup (import + createActions): " + format(startup, ".1f") + " ms, budget " + str(IMPORT_BUDGET_MS) + " ms")
+    print("First window opened (controller + bloom widget): " + format(firstOpen, ".1f") + " ms")
+    print("Actions registered: " + str(runs[0]["actions"]))
+    print("Plugin modules loaded at startup: " + ", ".join(loaded))
+    failed = False
+    if startup > IMPORT_BUDGET_MS:
+        print("FAILED: startup is over budget")
+        failed = True
+    if loaded != ["VFX.VFX"]:
+        print("FAILED: only VFX.VFX should be loaded at startup")
+        failed = True
+    if runs[0]["libraryLoaded"]:
+        print("FAILED: the C library was loaded at startup")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -0,0 +1,256 @@
+"""
+krita.py
+Stand-in for Krita's python module, enough of it for the plugin to be loaded,
+its actions registered and its filters applied outside of Krita by the
+benchmarks here. Layers are plain in-memory buffers, and copying pixels in
+or out of Krita can be given an extra cost to stand in for Krita's tiles
+"""
+from os import cpu_count
+import time
+
+# Extra time taken for every MB of pixels copied to or from a layer, in milliseconds
+copyCost = 0.0
+
+def SetCopyCost(msPerMB):
+    global copyCost
+    copyCost = msPerMB
+
+def SimulateCopy(numBytes):
+    if copyCost > 0:
+        time.sleep(numBytes / (1024 * 1024) * copyCost / 1000)
+
+# Qt style signal that calls whatever is connected to it
+class Signal(object):
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+class Action(object):
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.triggered = Signal()
+
+    def trigger(self):
+        self.triggered.emit()
+
+class Window(object):
+    def __init__(self):
+        self.actions = {}
+
+    def createAction(self, name, text, menuLocation="tools/scripts"):
+        action = Action(name, text)
+        self.actions[name] = action
+        return action
+
+class Extension(object):
+    def __init__(self, parent):
+        self.parent = parent
+
+class InfoObject(object):
+    def __init__(self):
+        self.properties = {}
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def property(self, name):
+        return self.properties.get(name)
+
+# A layer, or the document's root when it has no pixels of its own
+# The plugin's modules are imported where they're used, loading them is part of what's measured
+class Node(object):
+    def __init__(self, name, data, size, colorModel, colorDepth, nodeType="paintlayer"):
+        self.nodeName = name
+        self.data = bytearray(data)
+        self.size = size
+        self.model = colorModel
+        self.depth = colorDepth
+        self.blendMode = "normal"
+        self.nodeType = nodeType
+        self.parent = None
+        self.children = []
+        self.writes = 0
+
+    def colorModel(self):
+        return self.model
+
+    def colorDepth(self):
+        return self.depth
+
+    def colorProfile(self):
+        return "sRGB-elle-V2-srgbtrc.icc"
+
+    def getBytesPerPixel(self):
+        from VFX.LibHandler import GetBytesPerPixel, TranslateColorData
+        return GetBytesPerPixel(TranslateColorData(self.model, self.depth))
+
+    def setBlendingMode(self, blendMode):
+        self.blendMode = blendMode
+
+    def name(self):
+        return self.nodeName
+
+    def setName(self, name):
+        self.nodeName = name
+
+    def type(self):
+        return self.nodeType
+
+    def blendingMode(self):
+        return self.blendMode
+
+    def parentNode(self):
+        return self.parent
+
+    def childNodes(self):
+        return list(self.children)
+
+    def addChildNode(self, child, above):
+        child.parent = self
+        if above in self.children:
+            self.children.insert(self.children.index(above) + 1, child)
+        else:
+            self.children.append(child)
+        return True
+
+    # Only empty layers are ever converted, so there are no pixels to convert
+    def setColorSpace(self, colorModel, colorDepth, colorProfile):
+        self.model = colorModel
+        self.depth = colorDepth
+        self.data = bytearray(self.size[0] * self.size[1] * self.getBytesPerPixel())
+        return True
+
+    def duplicate(self):
+        SimulateCopy(len(self.data))
+        copy = Node(self.nodeName, self.data, self.size, self.model, self.depth, self.nodeType)
+        copy.blendMode = self.blendMode
+        return copy
+
+    # Only whole rows are ever asked for
+    def projectionPixelData(self, x, y, w, h):
+        rowBytes = self.size[0] * self.getBytesPerPixel()
+        SimulateCopy(h * rowBytes)
+        return bytearray(self.data[y * rowBytes:(y + h) * rowBytes])
+
+    def pixelData(self, x, y, w, h):
+        return self.projectionPixelData(x, y, w, h)
+
+    def setPixelData(self, data, x, y, w, h):
+        bytesPerPixel = self.getBytesPerPixel()
+        rowBytes = self.size[0] * bytesPerPixel
+        SimulateCopy(len(data))
+        self.writes += 1
+        if x == 0 and w == self.size[0]:
+            self.data[y * rowBytes:(y + h) * rowBytes] = data
+            return
+        for row in range(h):
+            begin = ((y + row) * rowBytes) + (x * bytesPerPixel)
+            self.data[begin:begin + (w * bytesPerPixel)] = data[row * w * bytesPerPixel:(row + 1) * w * bytesPerPixel]
+
+class Document(object):
+    def __init__(self, width, height, name, colorModel, colorDepth):
+        self.size = (width, height)
+        self.documentName = name
+        self.model = colorModel
+        self.depth = colorDepth
+        self.root = Node("root", b"", self.size, colorModel, colorDepth, "grouplayer")
+        self.active = None
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def name(self):
+        return self.documentName
+
+    def rootNode(self):
+        return self.root
+
+    def activeNode(self):
+        return self.active
+
+    # A new, empty layer in the document's color space, not yet added to it
+    def createNode(self, name, nodeType):
+        return Node(name, bytearray(self.size[0] * self.size[1] * self.root.getBytesPerPixel()), self.size,
+                    self.model, self.depth, nodeType)
+
+    def setActiveNode(self, node):
+        self.active = node
+
+    # Every layer is blended again, which costs about a copy of each of them
+    def refreshProjection(self):
+        for node in self.root.children:
+            SimulateCopy(len(node.data))
+
+# Only the blur filter the effects use, approximated with box blurs
+class Filter(object):
+    def __init__(self, name):
+        self.filterName = name
+        self.config = InfoObject()
+
+    def name(self):
+        return self.filterName
+
+    def configuration(self):
+        return self.config
+
+    def setConfiguration(self, config):
+        self.config = config
+
+    def apply(self, node, x, y, w, h):
+        from VFX.Headless import HeadlessBlurFilter
+        from VFX.FilterJob import FilterJob
+        SimulateCopy(len(node.data) * 2)
+        blurFilter = HeadlessBlurFilter(cpu_count(), FilterJob())
+        blurFilter.setConfiguration(self.config)
+        blurFilter.apply(node, x, y, w, h)
+        return True
+
+class Krita(object):
+    app = None
+
+    def __init__(self):
+        self.extensionList = []
+        self.document = None
+
+    @staticmethod
+    def instance():
+        if Krita.app is None:
+            Krita.app = Krita()
+        return Krita.app
+
+    def addExtension(self, extension):
+        self.extensionList.append(extension)
+        extension.setup()
+
+    def extensions(self):
+        return self.extensionList
+
+    def activeDocument(self):
+        return self.document
+
+    def setActiveDocument(self, document):
+        self.document = document
+
+    # A document with one paint layer, filled with data or left transparent
+    def createDocument(self, width, height, name, colorModel, colorDepth, profile="", resolution=300.0, data=None):
+        document = Document(width, height, name, colorModel, colorDepth)
+        layer = Node("Background", b"", document.size, colorModel, colorDepth)
+        layer.data = bytearray(data) if data is not None else bytearray(width * height * layer.getBytesPerPixel())
+        document.root.addChildNode(layer, None)
+        document.setActiveNode(layer)
+        return document
+
+    def filter(self, name):
+        if name != "blur":
+            raise ValueError("Krita filter " + name + " has no stand-in")
+        return Filter(name)